@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 from rlgym.api import (
@@ -16,7 +16,7 @@ from rlgym_learn_backend import EnvAction
 from torch import Tensor, as_tensor
 
 from rlgym_learn.api import AgentController, DerivedAgentControllerConfig, StateMetrics
-from rlgym_learn.experience import Timestep
+from rlgym_learn.experience import Timestep, TimestepBatch
 
 from ..learning_coordinator_config import LearningCoordinatorConfigModel
 
@@ -55,6 +55,10 @@ class AgentManager(
         self.agent_controllers_list = list(agent_controllers.values())
         self.n_agent_controllers = len(agent_controllers)
         self.rust_agent_manager = RustAgentManager(agent_controllers)
+        # Set when the agent controllers are loaded
+        self.agent_controller_receives_timestep_batches_list = [
+            False
+        ] * self.n_agent_controllers
         assert (
             self.n_agent_controllers > 0
         ), "There must be at least one agent controller!"
@@ -64,15 +68,50 @@ class AgentManager(
         timestep_data: Dict[
             str,
             Tuple[
-                List[Timestep],
+                Union[List[Timestep], Optional[TimestepBatch]],
                 Optional[Tensor],
                 Optional[StateMetrics],
                 Optional[StateType],
             ],
         ],
     ):
+        """
+        :param timestep_data: Timestep data as returned by the env process interface, which contains TimestepBatches
+        if receives_timestep_batches returns true, and lists of Timesteps otherwise. It is converted for the agent controllers which
+        receive the other format.
+        """
+        converted_timestep_data = None
+        for agent_controller, receives_timestep_batches in zip(
+            self.agent_controllers_list,
+            self.agent_controller_receives_timestep_batches_list,
+        ):
+            if receives_timestep_batches == self.receives_timestep_batches():
+                agent_controller.process_timestep_data(timestep_data)
+                continue
+            if converted_timestep_data is None:
+                # Only batches are ever converted, since lists are only used if no agent controller receives batches
+                converted_timestep_data = {
+                    env_id: (
+                        timesteps.to_timesteps() if timesteps is not None else [],
+                        *rest,
+                    )
+                    for env_id, (timesteps, *rest) in timestep_data.items()
+                }
+            agent_controller.process_timestep_data(converted_timestep_data)
+
+    def receives_timestep_batches(self) -> bool:
+        """
+        :return: True if any agent controller receives TimestepBatches, in which case timestep data should be collected as TimestepBatches.
+        """
+        return any(self.agent_controller_receives_timestep_batches_list)
+
+    def process_dropped_envs(self, env_ids: List[str]):
         for agent_controller in self.agent_controllers_list:
-            agent_controller.process_timestep_data(timestep_data)
+            agent_controller.process_dropped_envs(env_ids)
+
+    def process_env_process_metrics(self, metrics: Dict[str, Any]):
+        for agent_controller in self.agent_controllers_list:
+            agent_controller.process_env_process_metrics(metrics)
 
     def get_env_actions(
         self,
@@ -94,6 +133,30 @@ class AgentManager(
         """
         return self.rust_agent_manager.get_env_actions(env_obs_data_dict, state_info)
 
+    def get_env_actions_batched(
+        self,
+        obs_batch: np.ndarray,
+        env_obs_index_dict: Dict[str, Tuple[List[AgentID], int, int]],
+        state_info: Dict[
+            str,
+            Tuple[
+                Optional[StateType],
+                Optional[Dict[AgentID, bool]],
+                Optional[Dict[AgentID, bool]],
+            ],
+        ],
+    ) -> Dict[str, EnvAction]:
+        """
+        Function to get env actions from the agent controllers, using a batch of observations.
+        :param obs_batch: Array with the observations of all agents in all environments along the first dimension.
+        :param env_obs_index_dict: Dictionary with environment ids as keys and tuples of the list of Agent IDs and the start and stop rows of obs_batch containing their observations as values.
+        :param state_info: Dictionary with environment ids as keys and state information as values, to be passed to agent controllers to decide the env action.
+        :return: Dictionary with environment ids as keys and EnvAction instances as values
+        """
+        return self.rust_agent_manager.get_env_actions_batched(
+            obs_batch, env_obs_index_dict, state_info
+        )
+
     def set_space_types(self, obs_space: ObsSpaceType, action_space: ActionSpaceType):
         for agent_controller in self.agent_controllers_list:
             agent_controller.set_space_types(obs_space, action_space)
@@ -125,6 +188,10 @@ class AgentManager(
                     ),
                 )
             )
+        self.agent_controller_receives_timestep_batches_list = [
+            agent_controller.receives_timestep_batches()
+            for agent_controller in self.agent_controllers_list
+        ]
 
     def save_agent_controllers(self):
         for agent_controller in self.agent_controllers_list:
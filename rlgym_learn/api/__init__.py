@@ -1,3 +1,5 @@
+from rlgym_learn_backend import LazyState
+
 from .agent_controller import (
     AgentController,
     AgentControllerData,
@@ -10,16 +12,22 @@ from .serdes import (
     TypeSerde,
     bool_serde,
     bytes_serde,
+    compile_serde,
     complex_serde,
+    describe_quantized_numpy_serde,
     dict_serde,
     dynamic_serde,
     float_serde,
     int_serde,
     list_serde,
     numpy_serde,
+    numpy_static_serde,
     pickle_serde,
+    quantized_numpy_serde,
     set_serde,
     string_serde,
+    struct_serde,
     tuple_serde,
 )
+from .state_metrics_reducer import ReducedStateMetrics, StateMetricsReducer
 from .typing import AgentControllerConfig, AgentControllerData, StateMetrics
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 from rlgym.api import (
     ActionSpaceType,
     ActionType,
@@ -13,7 +14,7 @@ from rlgym.api import (
 from rlgym_learn_backend import EnvActionResponse
 from torch import Tensor, as_tensor, device
 
-from rlgym_learn.experience import Timestep
+from rlgym_learn.experience import Timestep, TimestepBatch
 
 from ..learning_coordinator_config import BaseConfigModel, ProcessConfigModel
 from .typing import AgentControllerConfig, AgentControllerData, StateMetrics
@@ -68,12 +69,34 @@ class AgentController(
         """
         return ([], as_tensor([]))
 
+    def get_actions_batched(
+        self,
+        agent_id_list: List[AgentID],
+        obs_batch: np.ndarray,
+    ) -> Tuple[Iterable[ActionType], Tensor]:
+        """
+        Function to get an action and the log of its probability from the policy given a batch of observations. Used instead of get_actions when batched_obs is true in BaseConfig.
+        By default, this calls get_actions with the rows of the batch as the observation list. Override this to use the batch directly.
+        :param agent_id_list: List of AgentIDs for which to produce actions. AgentIDs may not be unique here. Parallel with the first dimension of obs_batch.
+        :param obs_batch: Array of observations with shape (n, *obs_shape). Parallel with agent_id_list.
+        :return: Tuple of a list of chosen actions and Tensor of shape (n,), with the action list and the first (only) dimension of the tensor parallel with the first dimension of obs_batch.
+        """
+        return self.get_actions(agent_id_list, list(obs_batch))
+
+    def receives_timestep_batches(self) -> bool:
+        """
+        Function to determine whether process_timestep_data receives the timesteps of each environment as a TimestepBatch
+        instead of a list of Timesteps. Called after load.
+        :return: True to receive TimestepBatches, false otherwise
+        """
+        return False
+
     def process_timestep_data(
         self,
         timestep_data: Dict[
             str,
             Tuple[
-                List[Timestep],
+                Union[List[Timestep], Optional[TimestepBatch]],
                 Optional[Tensor],
                 Optional[StateMetrics],
                 Optional[StateType],
@@ -83,10 +106,27 @@ class AgentController(
         """
         Function to handle processing of timesteps.
         :param timestep_data: Dictionary with environment ids as keys and tuples of
-        timesteps from the environment (the order of agent ids in this list is fixed until a reset or set_state env action is taken)
+        timesteps from the environment (the order of agent ids in this list is fixed until a reset or set_state env action is taken),
+        or a TimestepBatch of them (None if no timesteps exist for the environment) if receives_timestep_batches returns true,
         log probs for the timesteps from the environment (parallel to the timestep list, and None if no timesteps exist for the environment),
-        StateMetrics for the state (if calculated in the env process),
-        and the state (if send_state_to_agent_controllers is true in BaseConfig)
+        StateMetrics for the state (if calculated in the env process, and only every few steps as a partial aggregate if a state metrics reducer is used),
+        and the state (if send_state_to_agent_controllers is true in BaseConfig, as a LazyState if lazy_state is also true)
+        """
+        pass
+
+    def process_dropped_envs(self, env_ids: List[str]):
+        """
+        Function to handle environments being dropped because the process hosting them died. No more timesteps will be received for the
+        in-progress episodes of these environments, so any data kept for them should be discarded. The replacement process hosts environments with new ids.
+        :param env_ids: List of ids of the dropped environments.
+        """
+        pass
+
+    def process_env_process_metrics(self, metrics: Dict[str, Any]):
+        """
+        Function to handle metrics about env process and inference timing, such as the current min_process_steps_per_inference.
+        Called with fresh metrics every few seconds of collection.
+        :param metrics: Dictionary with metric names as keys and metric values as values.
         """
         pass
 
@@ -103,7 +143,7 @@ class AgentController(
     ) -> Dict[str, Optional[EnvActionResponse]]:
         """
         Function to choose EnvActionResponse per environment based on environment information. Called after process_timestep_data.
-        :param state_info: Dictionary with environment ids as keys and tuples of StateType (if send_state_to_agent_controllers is true in BaseConfig), the present terminated dict for the env (None if env was just reset), and the present truncated dict for the env (None if env was just reset).
+        :param state_info: Dictionary with environment ids as keys and tuples of StateType (if send_state_to_agent_controllers is true in BaseConfig, as a LazyState if lazy_state is also true, which must be unwrapped using get() before being used as a desired state), the present terminated dict for the env (None if env was just reset), and the present truncated dict for the env (None if env was just reset).
         :return: Dictionary with environment ids as keys and EnvActionResponse as values. If STEP_RESPONSE is sent for an environment (and the agent manager agrees to use step as the env action for that environment),
         then choose_agents and get_actions will be called asking for the actions for the agents in those environments.
         If None is used as a value in the returned dict, or an environment id key from the state_info dict is not present in the returned dict, the agent manager will ask the other agent controllers for the env action for that environment.
@@ -1,8 +1,20 @@
 from __future__ import annotations
 
+import dataclasses
 from abc import abstractmethod
 from enum import Enum
-from typing import Generic, List, TypeVar, Union
+from typing import (
+    Dict,
+    Generic,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import numpy as np
 from rlgym_learn_backend import PyAnySerdeFactory
@@ -40,6 +52,12 @@ def bytes_serde() -> RustSerde:
     return PyAnySerdeFactory.bytes_serde()
 
 
+# Compiles a nested list / set / tuple / dict RustSerde into a flat plan, which writes the same data with less
+# per-object overhead. Other serdes are returned unchanged.
+def compile_serde(serde: RustSerde) -> RustSerde:
+    return PyAnySerdeFactory.compile_serde(serde)
+
+
 def complex_serde() -> RustSerde:
     return PyAnySerdeFactory.complex_serde()
 
@@ -81,10 +99,47 @@ def numpy_serde(dtype: np.dtype):
     return PyAnySerdeFactory.numpy_dynamic_shape_serde(np.dtype(dtype))
 
 
+# Faster than numpy_serde for arrays which always have the same shape, since only the data of the array is sent
+def numpy_static_serde(dtype: np.dtype, shape: Tuple[int, ...]) -> RustSerde:
+    return PyAnySerdeFactory.numpy_static_serde(np.dtype(dtype), list(shape))
+
+
 def pickle_serde() -> RustSerde:
     return PyAnySerdeFactory.pickle_serde()
 
 
+# Sends float32 / float64 arrays at reduced precision: float16, bfloat16, or int8 with a per-feature affine mapping of
+# [low, high] (one entry per element of the last axis) onto [-127, 127]. Arrays are converted back to dtype when
+# retrieved. Use describe_quantized_numpy_serde to see the size and error bounds of an encoding.
+def quantized_numpy_serde(
+    dtype: np.dtype,
+    encoding: Literal["float16", "bfloat16", "int8"] = "float16",
+    low: Optional[Sequence[float]] = None,
+    high: Optional[Sequence[float]] = None,
+) -> RustSerde:
+    return PyAnySerdeFactory.quantized_numpy_serde(
+        np.dtype(dtype),
+        encoding,
+        None if low is None else [float(v) for v in low],
+        None if high is None else [float(v) for v in high],
+    )
+
+
+# Returns a description of the size and error bounds of the quantized_numpy_serde created with the same arguments
+def describe_quantized_numpy_serde(
+    dtype: np.dtype,
+    encoding: Literal["float16", "bfloat16", "int8"] = "float16",
+    low: Optional[Sequence[float]] = None,
+    high: Optional[Sequence[float]] = None,
+) -> str:
+    return PyAnySerdeFactory.describe_quantized_numpy_serde(
+        np.dtype(dtype),
+        encoding,
+        None if low is None else [float(v) for v in low],
+        None if high is None else [float(v) for v in high],
+    )
+
+
 # TODO: add option for TypeSerde
 def set_serde(items_serde: RustSerde) -> RustSerde:
     return PyAnySerdeFactory.set_serde(items_serde)
@@ -94,6 +149,24 @@ def string_serde() -> RustSerde:
     return PyAnySerdeFactory.string_serde()
 
 
+# Serializes instances of a dataclass or __slots__ class field by field, in the order of field_serdes, without field names.
+# Instances are rebuilt without calling __init__. The class must be importable from the top level of its module.
+def struct_serde(cls: Type, field_serdes: Dict[str, RustSerde]) -> RustSerde:
+    if dataclasses.is_dataclass(cls):
+        missing_fields = [
+            field.name
+            for field in dataclasses.fields(cls)
+            if field.name not in field_serdes
+        ]
+        if missing_fields:
+            raise ValueError(
+                f"struct_serde for {cls.__qualname__} is missing serdes for fields {missing_fields}"
+            )
+    return PyAnySerdeFactory.struct_serde(
+        cls, list(field_serdes.keys()), list(field_serdes.values())
+    )
+
+
 # TODO: add option for TypeSerde
 def tuple_serde(*item_serdes: List[RustSerde]):
     return PyAnySerdeFactory.tuple_serde(item_serdes)
@@ -0,0 +1,41 @@
+from abc import abstractmethod
+from typing import Generic, List, Optional, TypeVar
+
+from .typing import StateMetrics
+
+ReducedStateMetrics = TypeVar("ReducedStateMetrics")
+
+
+class StateMetricsReducer(Generic[StateMetrics, ReducedStateMetrics]):
+    """
+    Reduces the state metrics of an env inside the env process, so that only partial aggregates are sent to the coordinator.
+    One instance is built per env. The partial aggregates are what the agent controllers receive as state metrics, so
+    state_metrics_serde needs to be able to serialize ReducedStateMetrics.
+    """
+
+    @abstractmethod
+    def add(self, state_metrics: StateMetrics):
+        """
+        Function to add the state metrics of a step to the current aggregate.
+        :param state_metrics: StateMetrics returned by collect_state_metrics_fn.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def flush(self) -> Optional[ReducedStateMetrics]:
+        """
+        Function to take the current aggregate and start a new one. Called every state_metrics_flush_interval steps and at the end of every episode.
+        :return: Aggregate of the state metrics added since the last flush, or None if nothing needs to be sent.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def merge(
+        self, reduced_state_metrics_list: List[ReducedStateMetrics]
+    ) -> ReducedStateMetrics:
+        """
+        Function to merge partial aggregates, used on the coordinator.
+        :param reduced_state_metrics_list: List of partial aggregates returned by flush.
+        :return: Aggregate of all the state metrics in the partial aggregates.
+        """
+        raise NotImplementedError
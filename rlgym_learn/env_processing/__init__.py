@@ -1 +1,2 @@
 from .env_process_interface import EnvProcessInterface
+from .remote_worker import run_remote_worker
@@ -1 +1,44 @@
+import socket
+import struct
+
 EVENT_STRING = b"0"
+
+# Frames sent between remote env workers and the coordinator, see src/remote.rs
+FRAME_HEADER = struct.Struct("<BQ")
+FRAME_HELLO = 0
+# Largest Hello frame a remote worker accepts
+MAX_HELLO_SIZE = 2**20
+
+
+def parse_address(address: str):
+    """
+    :param address: Address in the form host:port.
+    :return: Tuple of host and port.
+    """
+    host, port = address.rsplit(":", 1)
+    return (host, int(port))
+
+
+def recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Remote connection was closed by the other side")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_frame(sock: socket.socket, kind: int, max_payload_len: int) -> bytes:
+    (received_kind, payload_len) = FRAME_HEADER.unpack(
+        recv_exact(sock, FRAME_HEADER.size)
+    )
+    if received_kind != kind:
+        raise ConnectionError(
+            f"Expected frame of kind {kind} from remote connection but got kind {received_kind}"
+        )
+    if payload_len > max_payload_len:
+        raise ConnectionError(
+            f"Received a frame of {payload_len} bytes from remote connection, which exceeds the maximum of {max_payload_len} bytes"
+        )
+    return recv_exact(sock, payload_len)
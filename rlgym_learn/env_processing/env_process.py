@@ -1,6 +1,6 @@
 import socket
 from datetime import timedelta
-from typing import Callable, Dict, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 
 from rlgym.api import (
     ActionSpaceType,
@@ -13,9 +13,11 @@ from rlgym.api import (
     RLGym,
     StateType,
 )
+from rlgym_learn_backend import DEFAULT_NOTIFICATION_BACKEND
 from rlgym_learn_backend import env_process as rust_env_process
 
-from rlgym_learn.api import RustSerde, StateMetrics, TypeSerde
+from rlgym_learn.api import RustSerde, StateMetrics, StateMetricsReducer, TypeSerde
+from rlgym_learn.util.cpu_affinity import set_cpu_affinity
 
 from .communication import EVENT_STRING
 
@@ -54,7 +56,21 @@ def env_process(
     render_this_proc: bool,
     render_delay: Optional[float],
     recalculate_agent_id_every_step: bool,
+    envs_per_process: int = 1,
+    notification_backend: str = DEFAULT_NOTIFICATION_BACKEND,
+    notify_id: Optional[str] = None,
+    shm_buffer_max_size: int = 2**26,
+    cpu_affinity: Optional[List[int]] = None,
+    intern_agent_ids: bool = False,
+    build_state_metrics_reducer_fn: Optional[Callable[[], StateMetricsReducer]] = None,
+    state_metrics_flush_interval: int = 1,
+    collect_timings: bool = False,
+    state_delta_keyframe_interval: int = 0,
 ):
+    # Pin before anything is allocated, so that memory is allocated on the NUMA node of these CPUs
+    if cpu_affinity is not None:
+        set_cpu_affinity(cpu_affinity)
+
     child_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     child_end.bind(("127.0.0.1", 0))
 
@@ -121,6 +137,15 @@ def env_process(
         collect_state_metrics_fn,
         send_state_to_agent_controllers,
         render_this_proc,
-        timedelta(seconds=render_delay),
+        timedelta(seconds=render_delay) if render_delay is not None else None,
         recalculate_agent_id_every_step,
+        envs_per_process,
+        notification_backend,
+        notify_id,
+        shm_buffer_max_size,
+        intern_agent_ids,
+        build_state_metrics_reducer_fn,
+        state_metrics_flush_interval,
+        collect_timings,
+        state_delta_keyframe_interval,
     )
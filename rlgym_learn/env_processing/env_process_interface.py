@@ -1,3 +1,4 @@
+import json
 import multiprocessing as mp
 import os
 import random
@@ -14,10 +15,10 @@ except ImportError:
 
 
 import selectors
-import time
 from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, Union, cast
 from uuid import uuid4
 
+import numpy as np
 import torch
 from rlgym.api import (
     ActionSpaceType,
@@ -30,15 +31,16 @@ from rlgym.api import (
     RLGym,
     StateType,
 )
-from rlgym_learn_backend import EnvAction
+from rlgym_learn_backend import DEFAULT_NOTIFICATION_BACKEND, EnvAction
 from rlgym_learn_backend import EnvProcessInterface as RustEnvProcessInterface
 from torch import Tensor
 
-from rlgym_learn.api import RustSerde, StateMetrics, TypeSerde
+from rlgym_learn.api import RustSerde, StateMetrics, StateMetricsReducer, TypeSerde
+from rlgym_learn.env_processing.communication import parse_address
 from rlgym_learn.env_processing.env_process import env_process
-from rlgym_learn.experience import Timestep
-
-from .communication import EVENT_STRING
+from rlgym_learn.env_processing.remote_env_process import remote_env_processes
+from rlgym_learn.experience import Timestep, TimestepBatch
+from rlgym_learn.util.cpu_affinity import CpuPlacement, print_cpu_placement
 
 
 class EnvProcessInterface(
@@ -86,6 +88,22 @@ class EnvProcessInterface(
         shm_buffer_size: int,
         seed: int,
         recalculate_agent_id_every_step: bool,
+        envs_per_process: int = 1,
+        notification_backend: str = DEFAULT_NOTIFICATION_BACKEND,
+        zero_copy_obs: bool = False,
+        batched_obs: bool = False,
+        shm_buffer_max_size: int = 2**26,
+        autotune_min_process_steps_per_inference: bool = False,
+        cpu_placement: Optional[CpuPlacement] = None,
+        intern_agent_ids: bool = False,
+        remote_workers: Optional[List[str]] = None,
+        build_state_metrics_reducer_fn: Optional[
+            Callable[[], StateMetricsReducer]
+        ] = None,
+        state_metrics_flush_interval: int = 1,
+        lazy_state: bool = False,
+        collect_env_process_timings: bool = False,
+        state_delta_keyframe_interval: int = 0,
     ):
         self.build_env_fn = build_env_fn
         self.agent_id_serde = agent_id_serde
@@ -97,12 +115,39 @@ class EnvProcessInterface(
         self.state_serde = state_serde
         self.state_metrics_serde = state_metrics_serde
         self.collect_state_metrics_fn = collect_state_metrics_fn
+        # If provided, each env process reduces the state metrics of its envs and only sends partial aggregates,
+        # every state_metrics_flush_interval steps and at the end of every episode
+        self.build_state_metrics_reducer_fn = build_state_metrics_reducer_fn
+        self.state_metrics_flush_interval = state_metrics_flush_interval
+        # If true, each env process writes timing stats which are aggregated in get_metrics
+        self.collect_env_process_timings = collect_env_process_timings
         self.send_state_to_agent_controllers = send_state_to_agent_controllers
+        # If greater than 0, each env process only sends the parts of the states of its envs which changed, with a
+        # keyframe every state_delta_keyframe_interval states
+        self.state_delta_keyframe_interval = state_delta_keyframe_interval
         self.flinks_folder = flinks_folder
         self.shm_buffer_size = shm_buffer_size
         self.seed = seed
         self.recalculate_agent_id_every_step = recalculate_agent_id_every_step
+        self.intern_agent_ids = intern_agent_ids
+        self.envs_per_process = envs_per_process
+        self.notification_backend = notification_backend
+        self.shm_buffer_max_size = shm_buffer_max_size
+        # If provided, each env process is pinned to the CPUs the placement assigns to it
+        self.cpu_placement = cpu_placement
+        # If provided, env processes are started by these remote workers instead, and this process only runs relays for them
+        self.remote_worker_addresses = [
+            parse_address(address) for address in (remote_workers or [])
+        ]
+        # The shm_event notification backend uses an event in a shared memory segment owned by this process
+        self.notify_id = (
+            f"epi-{uuid4()}" if notification_backend == "shm_event" else None
+        )
         self.n_procs = 0
+        # Used to give every started process a different seed
+        self.n_procs_started = 0
+        self.dropped_env_ids: List[str] = []
+        self.processes: Dict[str, Tuple[Any, socket.socket]] = {}
 
         agent_id_type_serde = None
         action_type_serde = None
@@ -169,12 +214,21 @@ class EnvProcessInterface(
             flinks_folder,
             min_process_steps_per_inference,
             send_state_to_agent_controllers,
+            envs_per_process,
+            notification_backend,
+            self.notify_id,
+            zero_copy_obs,
+            batched_obs,
+            autotune_min_process_steps_per_inference,
+            intern_agent_ids,
+            lazy_state,
+            send_state_to_agent_controllers and state_delta_keyframe_interval > 0,
         )
 
     def init_processes(
         self,
         n_processes: int,
-        spawn_delay=None,
+        launch_concurrency: Optional[int] = None,
         render=False,
         render_delay: Optional[float] = None,
     ) -> Tuple[
@@ -191,84 +245,32 @@ class EnvProcessInterface(
         ActionSpaceType,
     ]:
         """
-        Initialize and spawn environment processes.
+        Initialize and spawn environment processes. The processes are initialized concurrently, and this returns once all of them have sent their initial obs.
         :param n_processes: Number of processes to spawn.
-        :param collect_metrics_fn: A user-defined function that the environment processes will use to collect metrics
-               about the environment at each timestep.
-        :param spawn_delay: Delay between spawning environment instances. Defaults to None.
-        :param render: Whether an environment should be rendered while collecting timesteps.
+        :param launch_concurrency: Maximum number of processes building their environments at the same time. Defaults to None, which lets all processes build their environments at once.
+        :param render: Whether an environment should be rendered while collecting timesteps. Only the first env of the first process is rendered.
         :param render_delay: A period in seconds to delay a process between frames while rendering.
         :return: A tuple containing parallel lists of agent ids and observations for inference (per environment), state info (per environment), observation space type, and action space type.
+        Each process hosts envs_per_process environments. If envs_per_process is greater than 1, the id of each environment is the id of its process followed by the index of the environment within the process (e.g. "<proc_id>-0").
         """
-
-        can_fork = "forkserver" in mp.get_all_start_methods()
-        start_method = "forkserver" if can_fork else "spawn"
-        context = mp.get_context(start_method)
         self.n_procs = n_processes
-
-        self.processes = [
-            None for i in range(n_processes)
-        ]  # TODO: is there a reason to have this in self after migrating it to rust backend?
+        self.n_procs_started = n_processes
 
         # Spawn child processes
         print("Spawning processes...")
-        for proc_idx in tqdm(range(n_processes)):
-            proc_id = str(uuid4())
-
-            render_this_proc = proc_idx == 0 and render
-
-            # Create socket to communicate with child
-            parent_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            parent_end.bind(("127.0.0.1", 0))
-
-            process = context.Process(
-                target=env_process,
-                args=(
-                    proc_id,
-                    parent_end.getsockname(),
-                    self.build_env_fn,
-                    self.agent_id_serde,
-                    self.action_serde,
-                    self.obs_serde,
-                    self.reward_serde,
-                    self.obs_space_serde,
-                    self.action_space_serde,
-                    self.state_serde,
-                    self.state_metrics_serde,
-                    self.collect_state_metrics_fn,
-                    self.send_state_to_agent_controllers,
-                    self.flinks_folder,
-                    self.shm_buffer_size,
-                    self.seed + proc_idx,
-                    render_this_proc,
-                    render_delay,
-                    self.recalculate_agent_id_every_step,
-                ),
-            )
-            process.start()
-
-            self.processes[proc_idx] = (process, parent_end, None, proc_id)
+        if self.remote_worker_addresses:
+            proc_package_defs = self._start_remote_processes(list(range(n_processes)))
+        else:
+            proc_package_defs = [
+                self._start_process(proc_idx, proc_idx == 0 and render, render_delay)
+                for proc_idx in tqdm(range(n_processes))
+            ]
 
         # Initialize child processes
         print("Initializing processes...")
-        for pid_idx in tqdm(range(n_processes)):
-            process, parent_end, _, proc_id = self.processes[pid_idx]
-
-            # Get child endpoint
-            _, child_sockname = parent_end.recvfrom(1)
-            parent_end.sendto(EVENT_STRING, child_sockname)
-
-            if spawn_delay is not None:
-                time.sleep(spawn_delay)
-
-            self.processes[pid_idx] = (
-                process,
-                parent_end,
-                child_sockname,
-                proc_id,
-            )
-
-        return self.rust_env_process_interface.init_processes(self.processes)
+        return self.rust_env_process_interface.init_processes(
+            proc_package_defs, launch_concurrency
+        )
 
     def increase_min_process_steps_per_inference(self) -> int:
         return (
@@ -280,16 +282,74 @@ class EnvProcessInterface(
             self.rust_env_process_interface.decrease_min_process_steps_per_inference()
         )
 
-    def add_process(self):
-        self.n_procs += 1
+    def set_autotune_min_process_steps_per_inference(self, enabled: bool):
+        self.rust_env_process_interface.set_autotune_min_process_steps_per_inference(
+            enabled
+        )
+
+    def get_autotune_min_process_steps_per_inference(self) -> bool:
+        return (
+            self.rust_env_process_interface.get_autotune_min_process_steps_per_inference()
+        )
+
+    def set_timestep_batches(self, enabled: bool):
+        """
+        :param enabled: If True, the timesteps of each env are returned by collect_step_data as a TimestepBatch (None if there are no timesteps) instead of a list of Timesteps.
+        """
+        self.rust_env_process_interface.set_timestep_batches(enabled)
+
+    def get_agent_id_table(self, env_id: str) -> List[AgentID]:
+        """
+        Only available if intern_agent_ids is True.
+        :param env_id: Id of the environment.
+        :return: The agent id table of the current episode of the environment. The agent_slot of each timestep of this episode is the index of its agent_id in this list.
+        """
+        return self.rust_env_process_interface.get_agent_id_table(env_id)
+
+    def print_cpu_placement(self):
+        """
+        Print the CPUs and NUMA node the coordinator and each env process are actually running on. Does nothing if no CPU placement was provided.
+        """
+        if self.cpu_placement is None:
+            return
+        pids = {"coordinator": os.getpid()}
+        for proc_id, (process, _) in self.processes.items():
+            pids[proc_id] = process.pid
+        print_cpu_placement(self.cpu_placement, pids)
+
+    def get_metrics(self) -> Optional[Dict[str, Any]]:
+        """
+        :return: Dictionary of env process and inference timing metrics measured over the last few seconds, including the current min_process_steps_per_inference and, if collect_env_process_timings is true, the fraction of time the env processes spent in each phase of their loop, or None if these have not been updated since the last call.
+        """
+        return self.rust_env_process_interface.get_metrics()
+
+    def _start_process(
+        self,
+        proc_idx: int,
+        render_this_proc: bool = False,
+        render_delay: Optional[float] = None,
+    ) -> Tuple[Any, socket.socket, str]:
+        """
+        Start a new environment process without waiting for it. The backend takes care of the rest of its initialization.
+        :param proc_idx: Index of the new process among all processes started so far, used for its seed, CPU placement and remote worker.
+        :param render_this_proc: Whether the first env of the new process should be rendered.
+        :param render_delay: A period in seconds to delay the process between frames while rendering.
+        :return: The proc package definition of the new process.
+        """
+        if self.remote_worker_addresses:
+            return self._start_remote_processes([proc_idx])[0]
+
         can_fork = "forkserver" in mp.get_all_start_methods()
         start_method = "forkserver" if can_fork else "spawn"
         context = mp.get_context(start_method)
 
-        self.processes.append(None)
-
         # Set up process
-        proc_id = uuid4()
+        proc_id = str(uuid4())
+        cpu_affinity = (
+            self.cpu_placement.get_env_process_cpus(proc_idx)
+            if self.cpu_placement is not None
+            else None
+        )
         parent_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         parent_end.bind(("127.0.0.1", 0))
         process = context.Process(
@@ -310,25 +370,171 @@ class EnvProcessInterface(
                 self.send_state_to_agent_controllers,
                 self.flinks_folder,
                 self.shm_buffer_size,
-                self.seed + proc_id,
-                False,
-                None,
+                self.seed + proc_idx,
+                render_this_proc,
+                render_delay,
                 self.recalculate_agent_id_every_step,
+                self.envs_per_process,
+                self.notification_backend,
+                self.notify_id,
+                self.shm_buffer_max_size,
+                cpu_affinity,
+                self.intern_agent_ids,
+                self.build_state_metrics_reducer_fn,
+                self.state_metrics_flush_interval,
+                self.collect_env_process_timings,
+                self.state_delta_keyframe_interval,
             ),
         )
 
         process.start()
-        _, child_sockname = parent_end.recvfrom(1)
-        parent_end.sendto(EVENT_STRING, child_sockname)
-
-        self.rust_env_process_interface.add_process(
-            (
-                process,
-                parent_end,
-                child_sockname,
-                proc_id,
+        self.processes[proc_id] = (process, parent_end)
+
+        return (process, parent_end, proc_id)
+
+    def _start_remote_processes(
+        self, proc_idx_list: List[int]
+    ) -> List[Tuple[Any, socket.socket, str]]:
+        """
+        Start new environment processes on the remote workers without waiting for them. The processes started on the same
+        remote worker share one relay process and connection, so their requests and responses are sent together.
+        :param proc_idx_list: Indices of the new processes among all processes started so far, used for their seeds and remote worker.
+        :return: The proc package definitions of the new processes.
+        """
+        can_fork = "forkserver" in mp.get_all_start_methods()
+        start_method = "forkserver" if can_fork else "spawn"
+        context = mp.get_context(start_method)
+
+        worker_proc_idx_lists: Dict[int, List[int]] = {}
+        for proc_idx in proc_idx_list:
+            worker_proc_idx_lists.setdefault(
+                proc_idx % len(self.remote_worker_addresses), []
+            ).append(proc_idx)
+        proc_package_defs = []
+        for worker_idx, worker_proc_idx_list in worker_proc_idx_lists.items():
+            proc_ids = [str(uuid4()) for _ in worker_proc_idx_list]
+            parent_ends = []
+            for _ in worker_proc_idx_list:
+                parent_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                parent_end.bind(("127.0.0.1", 0))
+                parent_ends.append(parent_end)
+            process = context.Process(
+                target=remote_env_processes,
+                args=(
+                    proc_ids,
+                    [parent_end.getsockname() for parent_end in parent_ends],
+                    self.remote_worker_addresses[worker_idx],
+                    self._get_remote_hello(
+                        [self.seed + proc_idx for proc_idx in worker_proc_idx_list]
+                    ),
+                    self.flinks_folder,
+                    self.shm_buffer_size,
+                    self.notification_backend,
+                    self.notify_id,
+                    self.shm_buffer_max_size,
+                ),
             )
+            process.start()
+            for proc_id, parent_end in zip(proc_ids, parent_ends):
+                self.processes[proc_id] = (process, parent_end)
+                proc_package_defs.append((process, parent_end, proc_id))
+
+        return proc_package_defs
+
+    def _get_remote_hello(self, seeds: List[int]) -> bytes:
+        """
+        :param seeds: Seeds of the env processes, one per env process.
+        :return: The config sent to a remote worker to start env processes, which must match the config of this EPI.
+        """
+        return json.dumps(
+            {
+                "seeds": seeds,
+                "envs_per_process": self.envs_per_process,
+                "send_state_to_agent_controllers": self.send_state_to_agent_controllers,
+                "recalculate_agent_id_every_step": self.recalculate_agent_id_every_step,
+                "intern_agent_ids": self.intern_agent_ids,
+                "collect_state_metrics": self.collect_state_metrics_fn is not None,
+                "reduce_state_metrics": self.build_state_metrics_reducer_fn
+                is not None,
+                "state_metrics_flush_interval": self.state_metrics_flush_interval,
+                "shm_buffer_size": self.shm_buffer_size,
+                "shm_buffer_max_size": self.shm_buffer_max_size,
+                "state_delta_keyframe_interval": self.state_delta_keyframe_interval,
+            }
+        ).encode()
+
+    def _stop_process(self, proc_id: str):
+        """
+        Join a process which has been stopped or has died, and close its connection.
+        :param proc_id: Id of the process.
+        """
+        (process, parent_end) = self.processes.pop(proc_id)
+        # Remote processes started together share a relay process, which only exits once all of them have been stopped
+        if all(
+            other_process is not process for other_process, _ in self.processes.values()
+        ):
+            try:
+                process.join()
+            except Exception:
+                print("Unable to join process")
+                traceback.print_exc()
+
+        try:
+            parent_end.close()
+        except Exception:
+            print("Unable to close parent connection")
+            traceback.print_exc()
+
+    def add_process(self):
+        """
+        Start a new environment process without waiting for it to build its environments. Its environments are
+        included in the data returned by collect_step_data once they have been built and reset.
+        """
+        self.n_procs += 1
+        proc_package_def = self._start_process(self.n_procs_started)
+        self.n_procs_started += 1
+        self.rust_env_process_interface.add_process(proc_package_def)
+
+    def _replace_dead_processes(self):
+        """
+        Replace any processes which have died with newly started processes. The envs hosted by a dead process are dropped,
+        and their ids are stored to be retrieved using take_dropped_env_ids.
+        """
+        dead_processes = self.rust_env_process_interface.take_dead_processes()
+        if not dead_processes:
+            return
+        for _, proc_id, _ in dead_processes:
+            process, _ = self.processes[proc_id]
+            print(
+                f"Env process {proc_id} died with exit code {process.exitcode}, starting a replacement..."
+            )
+        # All the replacements are started at once, so that the ones on the same remote worker share a relay process
+        replacement_proc_idx_list = list(
+            range(self.n_procs_started, self.n_procs_started + len(dead_processes))
         )
+        if self.remote_worker_addresses:
+            proc_package_defs = self._start_remote_processes(replacement_proc_idx_list)
+        else:
+            proc_package_defs = [
+                self._start_process(proc_idx) for proc_idx in replacement_proc_idx_list
+            ]
+        self.n_procs_started += len(dead_processes)
+        for (pid_idx, proc_id, env_ids), proc_package_def in zip(
+            dead_processes, proc_package_defs
+        ):
+            self.rust_env_process_interface.replace_process(pid_idx, proc_package_def)
+            self._stop_process(proc_id)
+            self.dropped_env_ids += env_ids
+            print(f"Env process {proc_id} replaced by {proc_package_def[2]}")
+
+    def take_dropped_env_ids(self) -> List[str]:
+        """
+        :return: The ids of the environments which have been dropped because their process died since the last call.
+        The in-progress episodes of these environments will never be continued.
+        """
+        dropped_env_ids = self.dropped_env_ids
+        self.dropped_env_ids = []
+        return dropped_env_ids
 
     def delete_process(self):
         """
@@ -336,23 +542,14 @@ class EnvProcessInterface(
         """
         self.n_procs -= 1
         try:
-            self.rust_env_process_interface.delete_process()
+            stopped_proc_ids = self.rust_env_process_interface.delete_process()
         except Exception:
             print("Failed to send stop signal to child process!")
             traceback.print_exc()
-        (process, parent_end, _, _) = self.processes.pop()
+            return
 
-        try:
-            process.join()
-        except Exception:
-            print("Unable to join process")
-            traceback.print_exc()
-
-        try:
-            parent_end.close()
-        except Exception:
-            print("Unable to close parent connection")
-            traceback.print_exc()
+        for proc_id in stopped_proc_ids:
+            self._stop_process(proc_id)
 
     def send_env_actions(self, env_actions: Dict[str, EnvAction]):
         """
@@ -364,11 +561,14 @@ class EnvProcessInterface(
         self,
     ) -> Tuple[
         int,
-        Dict[str, Tuple[List[AgentID], List[ObsType]]],
+        Union[
+            Dict[str, Tuple[List[AgentID], List[ObsType]]],
+            Tuple[np.ndarray, Dict[str, Tuple[List[AgentID], int, int]]],
+        ],
         Dict[
             str,
             Tuple[
-                List[Timestep],
+                Union[List[Timestep], Optional[TimestepBatch]],
                 Optional[Tensor],
                 Optional[StateMetrics],
                 Optional[StateType],
@@ -378,25 +578,19 @@ class EnvProcessInterface(
     ]:
         """
         :return: Total timesteps collected, parallel lists of AgentID and ObsType for inference (per environment), a dict of timesteps and related data (per environment), and a dict of state info (per environment).
+        If set_timestep_batches has been enabled, the timesteps of each environment are a TimestepBatch instead of a list.
+        If batched_obs is true, the second element is instead a tuple of one array with the obs of all environments along the first dimension and a dict of the list of AgentID and the start and stop rows of their obs in the array (per environment).
+        Processes which have died are replaced after collecting, and the ids of the environments they hosted can be retrieved using take_dropped_env_ids.
+        The environments of processes which have been added or started as replacements are included once they have sent their initial obs.
         """
-        return self.rust_env_process_interface.collect_step_data()
+        step_data = self.rust_env_process_interface.collect_step_data()
+        self._replace_dead_processes()
+        return step_data
 
     def cleanup(self):
         """
         Clean up resources and terminate processes.
         """
         self.rust_env_process_interface.cleanup()
-        for _ in range(len(self.processes)):
-            (process, parent_end, _, _) = self.processes.pop()
-
-            try:
-                process.join()
-            except Exception:
-                print("Unable to join process")
-                traceback.print_exc()
-
-            try:
-                parent_end.close()
-            except Exception:
-                print("Unable to close parent connection")
-                traceback.print_exc()
+        for proc_id in list(self.processes):
+            self._stop_process(proc_id)
@@ -0,0 +1,52 @@
+import socket
+from typing import List, Optional, Tuple
+
+from rlgym_learn_backend import DEFAULT_NOTIFICATION_BACKEND
+from rlgym_learn_backend import relay_env_processes as rust_relay_env_processes
+
+from .communication import EVENT_STRING
+
+
+def remote_env_processes(
+    proc_ids: List[str],
+    parent_socknames: List,
+    worker_address: Tuple[str, int],
+    hello: bytes,
+    flinks_folder: str,
+    shm_buffer_size: int,
+    notification_backend: str = DEFAULT_NOTIFICATION_BACKEND,
+    notify_id: Optional[str] = None,
+    shm_buffer_max_size: int = 2**26,
+):
+    """
+    Stands in for env_process on the coordinator for several env processes at once, relaying the requests of the EPI
+    to env processes started by the remote worker at worker_address over a single connection.
+    :param proc_ids: Ids of the env processes, in the order of the seeds in hello.
+    :param parent_socknames: Parallel list of the addresses of the parent ends of the env processes.
+    :param hello: JSON encoded config of the env processes, sent to the remote worker.
+    """
+    child_ends = []
+    for parent_sockname in parent_socknames:
+        child_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        child_end.bind(("127.0.0.1", 0))
+        child_end.sendto(EVENT_STRING, parent_sockname)
+        child_ends.append(child_end)
+
+    stream = socket.create_connection(worker_address)
+    # Requests and responses are sent as single frames, so there is nothing to gain from delaying them
+    stream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        rust_relay_env_processes(
+            proc_ids,
+            child_ends,
+            parent_socknames,
+            stream,
+            hello,
+            flinks_folder,
+            shm_buffer_size,
+            notification_backend,
+            notify_id,
+            shm_buffer_max_size,
+        )
+    finally:
+        stream.close()
@@ -0,0 +1,237 @@
+import json
+import multiprocessing as mp
+import socket
+import threading
+import traceback
+from typing import Callable, Dict, Optional, Union
+from uuid import uuid4
+
+from rlgym.api import (
+    ActionSpaceType,
+    ActionType,
+    AgentID,
+    EngineActionType,
+    ObsSpaceType,
+    ObsType,
+    RewardType,
+    RLGym,
+    StateType,
+)
+from rlgym_learn_backend import serve_remote_env_processes
+
+from rlgym_learn.api import RustSerde, StateMetrics, StateMetricsReducer, TypeSerde
+
+from .communication import EVENT_STRING, FRAME_HELLO, MAX_HELLO_SIZE, recv_frame
+from .env_process import env_process
+
+
+def run_remote_worker(
+    build_env_fn: Callable[
+        [],
+        RLGym[
+            AgentID,
+            ObsType,
+            ActionType,
+            EngineActionType,
+            RewardType,
+            StateType,
+            ObsSpaceType,
+            ActionSpaceType,
+        ],
+    ],
+    port: int,
+    agent_id_serde: Optional[Union[TypeSerde[AgentID], RustSerde]] = None,
+    action_serde: Optional[Union[TypeSerde[ActionType], RustSerde]] = None,
+    obs_serde: Optional[Union[TypeSerde[ObsType], RustSerde]] = None,
+    reward_serde: Optional[Union[TypeSerde[RewardType], RustSerde]] = None,
+    obs_space_serde: Optional[Union[TypeSerde[ObsSpaceType], RustSerde]] = None,
+    action_space_serde: Optional[
+        Union[TypeSerde[ActionSpaceType], RustSerde]
+    ] = None,
+    state_serde: Optional[Union[TypeSerde[StateType], RustSerde]] = None,
+    state_metrics_serde: Optional[Union[TypeSerde[StateMetrics], RustSerde]] = None,
+    collect_state_metrics_fn: Optional[
+        Callable[[StateType, Dict[AgentID, RewardType]], StateMetrics]
+    ] = None,
+    build_state_metrics_reducer_fn: Optional[
+        Callable[[], StateMetricsReducer]
+    ] = None,
+    host: str = "127.0.0.1",
+    flinks_folder: str = "shmem_flinks",
+    max_processes_per_connection: int = 64,
+):
+    """
+    Serve env processes to learning coordinators on other machines. Every connection from a coordinator gets its own env processes,
+    as many as the coordinator asks for (up to max_processes_per_connection), which run until the coordinator stops them or the connection is lost.
+    The arguments must match the ones passed to the coordinator.
+    This function does not return.
+    Connections are not authenticated, and the env processes deserialize what they receive with the given serdes, which run arbitrary code
+    when they use pickle (like TypeSerdes based on pickle, or DynamicSerde). Only expose the port on trusted networks.
+    :param port: Port to listen on for connections from coordinators.
+    :param host: Address to listen on. Defaults to localhost, so another address (like "0.0.0.0") must be given to accept connections from other machines.
+    :param flinks_folder: Folder used for the shared memory flinks of the env processes on this machine.
+    :param max_processes_per_connection: Maximum number of env processes a single coordinator connection can ask for.
+    """
+    listener = socket.create_server((host, port))
+    print(f"Remote worker listening on {host}:{port}")
+    serve_args = (
+        build_env_fn,
+        agent_id_serde,
+        action_serde,
+        obs_serde,
+        reward_serde,
+        obs_space_serde,
+        action_space_serde,
+        state_serde,
+        state_metrics_serde,
+        collect_state_metrics_fn,
+        build_state_metrics_reducer_fn,
+        flinks_folder,
+        max_processes_per_connection,
+    )
+    while True:
+        stream, address = listener.accept()
+        threading.Thread(
+            target=_serve_connection,
+            args=(stream, address, *serve_args),
+            daemon=True,
+        ).start()
+
+
+def _serve_connection(
+    stream: socket.socket,
+    address,
+    build_env_fn,
+    agent_id_serde,
+    action_serde,
+    obs_serde,
+    reward_serde,
+    obs_space_serde,
+    action_space_serde,
+    state_serde,
+    state_metrics_serde,
+    collect_state_metrics_fn,
+    build_state_metrics_reducer_fn,
+    flinks_folder: str,
+    max_processes_per_connection: int,
+):
+    stream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    processes = []
+    parent_ends = []
+    served = threading.Event()
+    try:
+        config = json.loads(recv_frame(stream, FRAME_HELLO, MAX_HELLO_SIZE))
+        if len(config["seeds"]) > max_processes_per_connection:
+            raise ValueError(
+                f"Coordinator asked for {len(config['seeds'])} env processes, but at most {max_processes_per_connection} env processes are started per connection"
+            )
+        if config["collect_state_metrics"] != (collect_state_metrics_fn is not None):
+            raise ValueError(
+                "collect_state_metrics_fn must be provided to the remote worker if and only if it is provided to the coordinator"
+            )
+        if config["reduce_state_metrics"] != (
+            build_state_metrics_reducer_fn is not None
+        ):
+            raise ValueError(
+                "build_state_metrics_reducer_fn must be provided to the remote worker if and only if it is provided to the coordinator"
+            )
+        can_fork = "forkserver" in mp.get_all_start_methods()
+        context = mp.get_context("forkserver" if can_fork else "spawn")
+        proc_ids = []
+        for seed in config["seeds"]:
+            proc_id = str(uuid4())
+            parent_end = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            parent_end.bind(("127.0.0.1", 0))
+            parent_ends.append(parent_end)
+            process = context.Process(
+                target=env_process,
+                args=(
+                    proc_id,
+                    parent_end.getsockname(),
+                    build_env_fn,
+                    agent_id_serde,
+                    action_serde,
+                    obs_serde,
+                    reward_serde,
+                    obs_space_serde,
+                    action_space_serde,
+                    state_serde,
+                    state_metrics_serde,
+                    collect_state_metrics_fn,
+                    config["send_state_to_agent_controllers"],
+                    flinks_folder,
+                    config["shm_buffer_size"],
+                    seed,
+                    False,
+                    None,
+                    config["recalculate_agent_id_every_step"],
+                    config["envs_per_process"],
+                    "udp",
+                    None,
+                    config["shm_buffer_max_size"],
+                    None,
+                    config["intern_agent_ids"],
+                    build_state_metrics_reducer_fn,
+                    config["state_metrics_flush_interval"],
+                    False,
+                    config["state_delta_keyframe_interval"],
+                ),
+            )
+            process.start()
+            proc_ids.append(proc_id)
+            processes.append(process)
+        print(
+            f"Started {len(processes)} env processes for coordinator at {address[0]}:{address[1]}"
+        )
+        # If an env process dies, the connection is shut down so that the coordinator notices, and this
+        # thread is woken up so that it fails instead of waiting for the env process forever
+        for process, parent_end in zip(processes, parent_ends):
+            threading.Thread(
+                target=_watch_process,
+                args=(process, served, stream, parent_end.getsockname()),
+                daemon=True,
+            ).start()
+        child_socknames = []
+        for process, parent_end in zip(processes, parent_ends):
+            _, child_sockname = parent_end.recvfrom(1)
+            if not process.is_alive():
+                raise RuntimeError("Env process died during startup")
+            child_socknames.append(child_sockname)
+        serve_remote_env_processes(
+            proc_ids,
+            parent_ends,
+            child_socknames,
+            stream,
+            flinks_folder,
+            max(config["shm_buffer_max_size"], config["shm_buffer_size"]),
+        )
+        served.set()
+        for process in processes:
+            process.join()
+    except Exception:
+        print(f"Lost env processes for coordinator at {address[0]}:{address[1]}")
+        traceback.print_exc()
+    finally:
+        served.set()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        stream.close()
+        for parent_end in parent_ends:
+            parent_end.close()
+
+
+def _watch_process(
+    process, served: threading.Event, stream: socket.socket, parent_sockname
+):
+    process.join()
+    if served.is_set():
+        return
+    try:
+        stream.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as wakeup:
+        while not served.wait(1):
+            wakeup.sendto(EVENT_STRING, parent_sockname)
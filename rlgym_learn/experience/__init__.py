@@ -1 +1,2 @@
 from .timestep import Timestep
+from .timestep_batch import TimestepBatch
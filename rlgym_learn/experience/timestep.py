@@ -18,6 +18,7 @@ class Timestep(Generic[AgentID, ObsType, ActionType, RewardType]):
         "reward",
         "terminated",
         "truncated",
+        "agent_slot",
     )
     env_id: str
     timestep_id: int
@@ -29,3 +30,5 @@ class Timestep(Generic[AgentID, ObsType, ActionType, RewardType]):
     reward: RewardType
     terminated: bool
     truncated: bool
+    # Index of agent_id in the agent id table of the episode, if intern_agent_ids is enabled
+    agent_slot: Optional[int]
@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from typing import Generic, List, Optional, Union
+
+import numpy as np
+from rlgym.api import ActionType, AgentID, ObsType, RewardType
+
+from .timestep import Timestep
+
+
+@dataclass
+class TimestepBatch(Generic[AgentID, ObsType, ActionType, RewardType]):
+    """
+    The timesteps of all agents of an env for a single step, stored as parallel columns.
+    obs, next_obs, actions and rewards are numpy arrays stacked along the first dimension if the values are all
+    numpy arrays with the same shape and dtype (or all floats), and lists otherwise.
+    """
+
+    __slots__ = (
+        "env_id",
+        "agent_ids",
+        "timestep_ids",
+        "previous_timestep_ids",
+        "obs",
+        "next_obs",
+        "actions",
+        "rewards",
+        "terminated",
+        "truncated",
+        "agent_slots",
+    )
+    env_id: str
+    agent_ids: List[AgentID]
+    # uint64 arrays. 0 is used for no previous timestep.
+    timestep_ids: np.ndarray
+    previous_timestep_ids: np.ndarray
+    obs: Union[np.ndarray, List[ObsType]]
+    next_obs: Union[np.ndarray, List[ObsType]]
+    actions: Union[np.ndarray, List[ActionType]]
+    rewards: Union[np.ndarray, List[RewardType]]
+    # bool arrays
+    terminated: np.ndarray
+    truncated: np.ndarray
+    # int64 array of the index of each agent id in the agent id table of the episode, if intern_agent_ids is enabled
+    agent_slots: Optional[np.ndarray]
+
+    def __len__(self):
+        return len(self.agent_ids)
+
+    def to_timesteps(self) -> List[Timestep[AgentID, ObsType, ActionType, RewardType]]:
+        """
+        :return: The timesteps of this batch as separate Timestep instances.
+        """
+        agent_slots = (
+            self.agent_slots.tolist()
+            if self.agent_slots is not None
+            else [None] * len(self)
+        )
+        rewards = self.rewards
+        if isinstance(rewards, np.ndarray) and rewards.ndim == 1:
+            # Float rewards are converted back to Python floats
+            rewards = rewards.tolist()
+        return [
+            Timestep(
+                self.env_id,
+                timestep_id,
+                previous_timestep_id if previous_timestep_id != 0 else None,
+                agent_id,
+                obs,
+                next_obs,
+                action,
+                reward,
+                terminated,
+                truncated,
+                agent_slot,
+            )
+            for (
+                timestep_id,
+                previous_timestep_id,
+                agent_id,
+                obs,
+                next_obs,
+                action,
+                reward,
+                terminated,
+                truncated,
+                agent_slot,
+            ) in zip(
+                self.timestep_ids.tolist(),
+                self.previous_timestep_ids.tolist(),
+                self.agent_ids,
+                self.obs,
+                self.next_obs,
+                self.actions,
+                rewards,
+                self.terminated.tolist(),
+                self.truncated.tolist(),
+                agent_slots,
+            )
+        ]
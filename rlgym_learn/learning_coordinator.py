@@ -28,9 +28,20 @@ from rlgym.api import (
 )
 
 from rlgym_learn.agent import AgentManager
-from rlgym_learn.api import AgentController, RustSerde, StateMetrics, TypeSerde
+from rlgym_learn.api import (
+    AgentController,
+    RustSerde,
+    StateMetrics,
+    StateMetricsReducer,
+    TypeSerde,
+)
 from rlgym_learn.env_processing import EnvProcessInterface
-from rlgym_learn.util import KBHit
+from rlgym_learn.util import (
+    KBHit,
+    cpu_affinity_supported,
+    plan_cpu_placement,
+    set_cpu_affinity,
+)
 from rlgym_learn.util.torch_functions import get_device
 
 from .learning_coordinator_config import (
@@ -95,6 +106,9 @@ class LearningCoordinator(
         collect_state_metrics_fn: Optional[
             Callable[[StateType, Optional[Dict[AgentID, RewardType]]], StateMetrics]
         ] = None,
+        build_state_metrics_reducer_fn: Optional[
+            Callable[[], StateMetricsReducer]
+        ] = None,
         config_location: str = None,
     ):
         if config_location is None:
@@ -115,6 +129,16 @@ class LearningCoordinator(
 
         self.agent_manager = AgentManager(agent_controllers)
 
+        process_config = self.config.process_config
+        cpu_placement = None
+        if process_config.pin_cpus:
+            if cpu_affinity_supported():
+                cpu_placement = plan_cpu_placement(
+                    process_config.coordinator_cpus, process_config.cpus_per_env_process
+                )
+            else:
+                print("CPU pinning is not supported on this platform, ignoring pin_cpus")
+
         self.cumulative_timesteps = 0
         self.env_process_interface = EnvProcessInterface(
             env_create_function,
@@ -133,6 +157,20 @@ class LearningCoordinator(
             self.config.base_config.shm_buffer_size,
             self.config.base_config.random_seed,
             self.config.process_config.recalculate_agent_id_every_step,
+            self.config.process_config.envs_per_process,
+            self.config.base_config.notification_backend,
+            self.config.base_config.zero_copy_obs,
+            self.config.base_config.batched_obs,
+            self.config.base_config.shm_buffer_max_size,
+            self.config.process_config.autotune_min_process_steps_per_inference,
+            cpu_placement,
+            self.config.process_config.intern_agent_ids,
+            self.config.process_config.remote_workers,
+            build_state_metrics_reducer_fn,
+            self.config.process_config.state_metrics_flush_interval,
+            self.config.base_config.lazy_state,
+            self.config.process_config.collect_env_process_timings,
+            self.config.base_config.state_delta_keyframe_interval,
         )
         (
             self.initial_env_obs_data_dict,
@@ -141,14 +179,23 @@ class LearningCoordinator(
             action_space,
         ) = self.env_process_interface.init_processes(
             n_processes=self.config.process_config.n_proc,
-            spawn_delay=self.config.process_config.instance_launch_delay,
+            launch_concurrency=self.config.process_config.instance_launch_concurrency,
             render=self.config.process_config.render,
             render_delay=self.config.process_config.render_delay,
         )
+        # The coordinator is pinned after the env processes have been started, so that they don't inherit its CPUs
+        if cpu_placement is not None:
+            if cpu_placement.coordinator_cpus:
+                set_cpu_affinity(cpu_placement.coordinator_cpus)
+                torch.set_num_threads(len(cpu_placement.coordinator_cpus))
+            self.env_process_interface.print_cpu_placement()
         print("Loading agent controllers...")
         self.agent_manager.set_space_types(obs_space, action_space)
         self.agent_manager.set_device(self.device)
         self.agent_manager.load_agent_controllers(self.config)
+        self.env_process_interface.set_timestep_batches(
+            self.agent_manager.receives_timestep_batches()
+        )
         print("Learner successfully initialized!")
         # TODO: delete and remove import
         self.prof = cProfile.Profile()
@@ -202,15 +249,28 @@ class LearningCoordinator(
         # Collect the desired number of timesteps from our environments.
         loop_iterations = 0
         while self.cumulative_timesteps < self.config.base_config.timestep_limit:
-            total_timesteps_collected, env_obs_data_dict, timestep_data, state_info = (
+            total_timesteps_collected, env_obs_data, timestep_data, state_info = (
                 self.env_process_interface.collect_step_data()
             )
             self.cumulative_timesteps += total_timesteps_collected
+            dropped_env_ids = self.env_process_interface.take_dropped_env_ids()
+            if dropped_env_ids:
+                self.agent_manager.process_dropped_envs(dropped_env_ids)
             self.agent_manager.process_timestep_data(timestep_data)
+            env_process_metrics = self.env_process_interface.get_metrics()
+            if env_process_metrics is not None:
+                self.agent_manager.process_env_process_metrics(env_process_metrics)
 
-            self.env_process_interface.send_env_actions(
-                self.agent_manager.get_env_actions(env_obs_data_dict, state_info)
-            )
+            if self.config.base_config.batched_obs:
+                obs_batch, env_obs_index_dict = env_obs_data
+                env_actions = self.agent_manager.get_env_actions_batched(
+                    obs_batch, env_obs_index_dict, state_info
+                )
+            else:
+                env_actions = self.agent_manager.get_env_actions(
+                    env_obs_data, state_info
+                )
+            self.env_process_interface.send_env_actions(env_actions)
             loop_iterations += 1
             if loop_iterations % 50 == 0:
                 self.process_kbhit(kb)
@@ -235,13 +295,21 @@ class LearningCoordinator(
             if c in ("c", "p"):
                 print("Resuming...\n")
             if c == "a":
-                print("Adding process...")
                 self.env_process_interface.add_process()
-                print(f"Process added. ({self.env_process_interface.n_procs} total)")
+                print(
+                    f"Process started, its envs will join once they are built. ({self.env_process_interface.n_procs} total)"
+                )
             if c == "d":
                 print("Deleting process...")
                 self.env_process_interface.delete_process()
                 print(f"Process deleted. ({self.env_process_interface.n_procs} total)")
+            if c in ("j", "l") and (
+                self.env_process_interface.get_autotune_min_process_steps_per_inference()
+            ):
+                self.env_process_interface.set_autotune_min_process_steps_per_inference(
+                    False
+                )
+                print("Autotuning of min process steps per inference disabled")
             if c == "j":
                 min_process_steps_per_inference = (
                     self.env_process_interface.increase_min_process_steps_per_inference()
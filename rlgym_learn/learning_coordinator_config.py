@@ -1,7 +1,8 @@
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field, model_validator
+from rlgym_learn_backend import DEFAULT_NOTIFICATION_BACKEND
 
 
 class ProcessConfigModel(BaseModel):
@@ -9,8 +10,36 @@ class ProcessConfigModel(BaseModel):
     min_process_steps_per_inference: int = -1
     render: bool = False
     render_delay: float = 0
-    instance_launch_delay: Optional[float] = None
+    # Maximum number of processes building their envs at the same time. Processes are started and
+    # initialized concurrently, so None (the default) lets all of them build their envs at once.
+    instance_launch_concurrency: Optional[int] = None
     recalculate_agent_id_every_step: bool = False
+    # If True, the agent ids of each episode are only sent once, and agents are referred to by their slot in the
+    # agent id table of the episode afterwards. The slot is available as Timestep.agent_slot.
+    intern_agent_ids: bool = False
+    envs_per_process: int = 1
+    # If True, min_process_steps_per_inference is only the starting point, and is continuously adjusted to maximize the
+    # number of steps collected per second. Pressing (j) or (l) to set it manually turns this off.
+    autotune_min_process_steps_per_inference: bool = False
+    # If True, each env process is pinned to its own set of cpus_per_env_process CPUs from a single NUMA node, so its
+    # memory (including its shared memory) is allocated on that node. Processes share sets once there are more
+    # processes than sets. Only supported on Linux.
+    pin_cpus: bool = False
+    cpus_per_env_process: int = 1
+    # Number of CPUs reserved for the coordinator when pin_cpus is True. The coordinator is pinned to these, and
+    # the number of torch intra-op threads is set to match. 0 leaves the coordinator unpinned.
+    coordinator_cpus: int = 0
+    # Addresses (host:port) of remote workers started with run_remote_worker. If any are given, all env processes
+    # are run by the remote workers instead of on this machine, assigned to the workers in turn.
+    remote_workers: List[str] = []
+    # Only used if a state metrics reducer is provided. Each env sends the partial aggregate of its state metrics
+    # every state_metrics_flush_interval steps, as well as at the end of every episode.
+    state_metrics_flush_interval: int = 100
+    # If True, env processes time each phase of their loop (waiting for actions, deserializing them, stepping the envs,
+    # serializing the response, collecting state metrics, writing to shared memory and rendering), and count steps,
+    # resets and bytes written. The totals since the previous report are included in the env process metrics. Not
+    # available for remote workers.
+    collect_env_process_timings: bool = False
 
     @model_validator(mode="after")
     def set_default_min_process_steps_per_inference(self):
@@ -18,14 +47,92 @@ class ProcessConfigModel(BaseModel):
             self.min_process_steps_per_inference = max(1, int(0.45 * self.n_proc))
         return self
 
+    @model_validator(mode="after")
+    def validate_instance_launch_concurrency(self):
+        if (
+            self.instance_launch_concurrency is not None
+            and self.instance_launch_concurrency < 1
+        ):
+            raise ValueError("instance_launch_concurrency must be at least 1")
+        return self
+
+    @model_validator(mode="after")
+    def validate_cpu_placement(self):
+        if self.cpus_per_env_process < 1:
+            raise ValueError("cpus_per_env_process must be at least 1")
+        if self.coordinator_cpus < 0:
+            raise ValueError("coordinator_cpus must be at least 0")
+        return self
+
+    @model_validator(mode="after")
+    def validate_remote_workers(self):
+        for address in self.remote_workers:
+            host, _, port = address.rpartition(":")
+            if not host or not port.isdigit():
+                raise ValueError(
+                    f"remote worker address {address} is not of the form host:port"
+                )
+        return self
+
+    @model_validator(mode="after")
+    def validate_state_metrics_flush_interval(self):
+        if self.state_metrics_flush_interval < 1:
+            raise ValueError("state_metrics_flush_interval must be at least 1")
+        return self
+
+    @model_validator(mode="after")
+    def validate_envs_per_process(self):
+        if self.envs_per_process < 1:
+            raise ValueError("envs_per_process must be at least 1")
+        return self
+
 
 class BaseConfigModel(BaseModel):
     device: str = "auto"
     random_seed: int = 123
+    # Initial size of each shared memory region. A process whose responses outgrow its regions moves to a new
+    # shared memory segment with larger regions (a warning is printed when this happens), up to shm_buffer_max_size.
     shm_buffer_size: int = 8192
+    shm_buffer_max_size: int = 2**26
     flinks_folder: str = "shmem_flinks"
     timestep_limit: int = 5_000_000_000
     send_state_to_agent_controllers: bool = False
+    # If True, the states sent to the agent controllers are LazyState handles, which hold the serialized state and only
+    # deserialize it when it is first accessed (using get(), or by accessing an attribute of the state through the handle).
+    lazy_state: bool = False
+    # If greater than 0, the states sent to the agent controllers are delta encoded: each env process only sends the parts
+    # of the serialized state of an env which changed since the previous state it sent for that env, and sends the full
+    # state every state_delta_keyframe_interval states. 0 sends the full state every time.
+    state_delta_keyframe_interval: int = 0
+    # "shm_event" or "udp"
+    notification_backend: str = DEFAULT_NOTIFICATION_BACKEND
+    # If True, numpy obs are copied out of shared memory into a buffer owned by the coordinator and returned as
+    # views into this buffer instead of being deserialized into separate arrays. Requires obs_serde to be a numpy RustSerde.
+    zero_copy_obs: bool = False
+    # If True, the obs of all agents collected in a step are returned as one array with the obs along the first dimension, and
+    # agent controllers get actions using get_actions_batched. Requires all obs to be numpy arrays of the same shape and dtype
+    # sent using a numpy RustSerde.
+    batched_obs: bool = False
+
+    @model_validator(mode="after")
+    def validate_state_delta_keyframe_interval(self):
+        if self.state_delta_keyframe_interval < 0:
+            raise ValueError("state_delta_keyframe_interval must be at least 0")
+        return self
+
+    @model_validator(mode="after")
+    def validate_shm_buffer_max_size(self):
+        if self.shm_buffer_max_size < self.shm_buffer_size:
+            raise ValueError("shm_buffer_max_size must be at least shm_buffer_size")
+        return self
+
+    @model_validator(mode="after")
+    def validate_notification_backend(self):
+        if self.notification_backend not in ("shm_event", "udp"):
+            raise ValueError(
+                'notification_backend must be one of "shm_event" or "udp"'
+            )
+        return self
 
 
 class WandbConfigModel(BaseModel):
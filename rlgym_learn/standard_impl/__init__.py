@@ -18,3 +18,4 @@ from .serdes import (
     game_state_serde,
     physics_object_serde,
 )
+from .sum_count_min_max_reducer import SumCountMinMaxReducer
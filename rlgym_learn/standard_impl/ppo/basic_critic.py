@@ -27,6 +27,6 @@ class BasicCritic(Critic[AgentID, np.ndarray]):
 
     def forward(self, agent_id_list, obs_list) -> torch.Tensor:
         obs = torch.as_tensor(
-            np.array(obs_list), dtype=torch.float32, device=self.device
+            np.asarray(obs_list), dtype=torch.float32, device=self.device
         )
         return self.model(obs)
@@ -77,7 +77,7 @@ class ContinuousActor(Actor[AgentID, np.ndarray, np.ndarray]):
         self, obs_list: List[np.ndarray]
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         obs = torch.as_tensor(
-            np.array(obs_list), dtype=torch.float32, device=self.device
+            np.asarray(obs_list), dtype=torch.float32, device=self.device
         )
 
         policy_output = self.model(obs)
@@ -39,7 +39,7 @@ class DiscreteFF(Actor[AgentID, np.ndarray, np.ndarray]):
 
     def get_output(self, obs_list: List[np.ndarray]) -> torch.Tensor:
         obs = torch.as_tensor(
-            np.array(obs_list), dtype=torch.float32, device=self.device
+            np.asarray(obs_list), dtype=torch.float32, device=self.device
         )
         probs = self.model(obs)
         probs = torch.clamp(probs, min=1e-11, max=1)
@@ -1,46 +1,93 @@
 from typing import Dict, Generic, List, Optional, Tuple
 
+import numpy as np
 import torch
 from rlgym.api import ActionType, AgentID, ObsType, RewardType
 from torch import Tensor
 
-from rlgym_learn.experience import Timestep
+from rlgym_learn.experience import Timestep, TimestepBatch
 
 from .trajectory import Trajectory
 
 
 class EnvTrajectories(Generic[AgentID, ObsType, ActionType, RewardType]):
-    def __init__(self, agent_ids: List[AgentID]) -> None:
+    def __init__(
+        self, agent_ids: List[AgentID], agent_slots: Optional[List[int]] = None
+    ) -> None:
+        """
+        :param agent_ids: Ids of the agents in the env.
+        :param agent_slots: Slots of the agents in the agent id table of the episode, if agent ids are interned. If
+        provided, timesteps are matched to agents using their agent slot rather than their agent id.
+        """
         self.agent_ids = agent_ids
-        self.obs_lists: Dict[AgentID, List[ObsType]] = {}
-        self.action_lists: Dict[AgentID, List[ActionType]] = {}
-        self.reward_lists: Dict[AgentID, List[RewardType]] = {}
-        self.final_obs: Dict[AgentID, Optional[ObsType]] = {}
-        self.dones: Dict[AgentID, bool] = {}
-        self.truncateds: Dict[AgentID, bool] = {}
-        for agent_id in agent_ids:
-            self.obs_lists[agent_id] = []
-            self.action_lists[agent_id] = []
-            self.reward_lists[agent_id] = []
-            self.final_obs[agent_id] = None
-            self.dones[agent_id] = False
-            self.truncateds[agent_id] = False
+        # Data is stored per agent, in the order of agent_ids
+        self.obs_lists: List[List[ObsType]] = [[] for _ in agent_ids]
+        self.action_lists: List[List[ActionType]] = [[] for _ in agent_ids]
+        self.reward_lists: List[List[RewardType]] = [[] for _ in agent_ids]
+        self.final_obs: List[Optional[ObsType]] = [None for _ in agent_ids]
+        self.dones: List[bool] = [False for _ in agent_ids]
+        self.truncateds: List[bool] = [False for _ in agent_ids]
+        self.agent_idx_map: Dict[AgentID, int] = {
+            agent_id: idx for idx, agent_id in enumerate(agent_ids)
+        }
+        self.agent_slot_idx_list: Optional[List[Optional[int]]] = None
+        if agent_slots is not None:
+            self.agent_slot_idx_list = [None] * (max(agent_slots, default=-1) + 1)
+            for idx, agent_slot in enumerate(agent_slots):
+                self.agent_slot_idx_list[agent_slot] = idx
         self.log_probs_list = []
 
+    def _get_agent_idx(self, agent_id: AgentID, agent_slot: Optional[int]) -> int:
+        if self.agent_slot_idx_list is not None and agent_slot < len(
+            self.agent_slot_idx_list
+        ):
+            idx = self.agent_slot_idx_list[agent_slot]
+            if idx is not None:
+                return idx
+        return self.agent_idx_map[agent_id]
+
     def add_steps(self, timesteps: List[Timestep], log_probs: Tensor):
         steps_added = 0
         for timestep in timesteps:
-            agent_id = timestep.agent_id
-            if not self.dones[agent_id]:
+            idx = self._get_agent_idx(timestep.agent_id, timestep.agent_slot)
+            if not self.dones[idx]:
                 steps_added += 1
-                self.obs_lists[agent_id].append(timestep.obs)
-                self.action_lists[agent_id].append(timestep.action)
-                self.reward_lists[agent_id].append(timestep.reward)
-                self.final_obs[agent_id] = timestep.next_obs
+                self.obs_lists[idx].append(timestep.obs)
+                self.action_lists[idx].append(timestep.action)
+                self.reward_lists[idx].append(timestep.reward)
+                self.final_obs[idx] = timestep.next_obs
                 now_done = timestep.terminated or timestep.truncated
                 if now_done:
-                    self.dones[agent_id] = True
-                    self.truncateds[agent_id] = timestep.truncated
+                    self.dones[idx] = True
+                    self.truncateds[idx] = timestep.truncated
+        self.log_probs_list.append(log_probs)
+        return steps_added
+
+    def add_batch(self, timestep_batch: TimestepBatch, log_probs: Tensor):
+        steps_added = 0
+        rewards = timestep_batch.rewards
+        if isinstance(rewards, np.ndarray) and rewards.ndim == 1:
+            rewards = rewards.tolist()
+        terminated = timestep_batch.terminated.tolist()
+        truncated = timestep_batch.truncated.tolist()
+        agent_slots = (
+            timestep_batch.agent_slots.tolist()
+            if timestep_batch.agent_slots is not None
+            else None
+        )
+        for batch_idx, agent_id in enumerate(timestep_batch.agent_ids):
+            idx = self._get_agent_idx(
+                agent_id, agent_slots[batch_idx] if agent_slots is not None else None
+            )
+            if not self.dones[idx]:
+                steps_added += 1
+                self.obs_lists[idx].append(timestep_batch.obs[batch_idx])
+                self.action_lists[idx].append(timestep_batch.actions[batch_idx])
+                self.reward_lists[idx].append(rewards[batch_idx])
+                self.final_obs[idx] = timestep_batch.next_obs[batch_idx]
+                if terminated[batch_idx] or truncated[batch_idx]:
+                    self.dones[idx] = True
+                    self.truncateds[idx] = truncated[batch_idx]
         self.log_probs_list.append(log_probs)
         return steps_added
 
@@ -48,11 +95,9 @@ class EnvTrajectories(Generic[AgentID, ObsType, ActionType, RewardType]):
         """
         Truncates any unfinished trajectories, marks all trajectories as done.
         """
-        for agent_id in self.agent_ids:
-            self.truncateds[agent_id] = (
-                self.truncateds[agent_id] or not self.dones[agent_id]
-            )
-            self.dones[agent_id] = True
+        for idx in range(len(self.agent_ids)):
+            self.truncateds[idx] = self.truncateds[idx] or not self.dones[idx]
+            self.dones[idx] = True
 
     def get_trajectories(
         self,
@@ -63,18 +108,17 @@ class EnvTrajectories(Generic[AgentID, ObsType, ActionType, RewardType]):
         log_probs = torch.stack(self.log_probs_list)
         trajectories = []
         for idx, agent_id in enumerate(self.agent_ids):
-            obs_list = self.obs_lists[agent_id]
             trajectories.append(
                 Trajectory(
                     agent_id,
-                    obs_list,
-                    self.action_lists[agent_id],
+                    self.obs_lists[idx],
+                    self.action_lists[idx],
                     log_probs[:, idx],
-                    self.reward_lists[agent_id],
+                    self.reward_lists[idx],
                     None,
-                    self.final_obs[agent_id],
+                    self.final_obs[idx],
                     torch.tensor(0, dtype=torch.float32),
-                    self.truncateds[agent_id],
+                    self.truncateds[idx],
                 )
             )
         return trajectories
@@ -43,7 +43,7 @@ class MultiDiscreteFF(Actor[AgentID, np.ndarray, np.ndarray]):
 
     def get_output(self, obs_list: List[np.ndarray]):
         obs = torch.as_tensor(
-            np.array(obs_list), dtype=torch.float32, device=self.device
+            np.asarray(obs_list), dtype=torch.float32, device=self.device
         )
         policy_output = self.model(obs)
         return policy_output
@@ -3,7 +3,7 @@ import os
 import pickle
 import shutil
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Callable, Dict, Generic, List, Optional, Tuple
 
 import torch
@@ -27,8 +27,9 @@ from rlgym_learn.api import (
     MetricsLogger,
     ObsStandardizer,
     StateMetrics,
+    StateMetricsReducer,
 )
-from rlgym_learn.experience import Timestep
+from rlgym_learn.experience import TimestepBatch
 from rlgym_learn.util.torch_functions import get_device
 
 from ...learning_coordinator_config import WandbConfigModel
@@ -83,6 +84,7 @@ class PPOAgentControllerData(Generic[TrajectoryProcessorData]):
     iteration_time: float
     timesteps_collected: int
     timestep_collection_time: float
+    env_process_metrics: Dict[str, Any] = field(default_factory=dict)
 
 
 # TODO: the experience buffer should be passed to init and then get loaded based on config like everything else
@@ -126,6 +128,7 @@ class PPOAgentController(
         agent_choice_fn: Callable[
             [List[AgentID]], List[int]
         ] = lambda agent_id_list: list(range(len(agent_id_list))),
+        state_metrics_reducer: Optional[StateMetricsReducer] = None,
     ):
         self.learner = PPOLearner(actor_factory, critic_factory)
         self.experience_buffer = ExperienceBuffer(trajectory_processor_factory)
@@ -140,6 +143,9 @@ class PPOAgentController(
                 "Warning: using an obs standardizer is slow! It is recommended to design your obs to be standardized (i.e. have approximately mean 0 and std 1 for each value) without needing this extra post-processing step."
             )
         self.agent_choice_fn = agent_choice_fn
+        # If provided, the state metrics received are partial aggregates from the env processes, which are merged
+        # as they arrive so that the metrics logger receives a single aggregate per iteration
+        self.state_metrics_reducer = state_metrics_reducer
 
         self.current_env_trajectories: Dict[
             str,
@@ -149,6 +155,7 @@ class PPOAgentController(
             Trajectory[AgentID, ActionType, ObsType, RewardType]
         ] = []
         self.iteration_state_metrics: List[StateMetrics] = []
+        self.env_process_metrics: Dict[str, Any] = {}
         self.cur_iteration = 0
         self.iteration_timesteps = 0
         self.cumulative_timesteps = 0
@@ -436,47 +443,60 @@ class PPOAgentController(
         action_list, log_probs = self.learner.actor.get_action(agent_id_list, obs_list)
         return (action_list, log_probs)
 
-    def standardize_timestep_observations(
+    @torch.no_grad
+    def get_actions_batched(self, agent_id_list, obs_batch):
+        # The standard actors convert the obs list with np.asarray, so the batch can be passed in its place without being copied
+        action_list, log_probs = self.learner.actor.get_action(agent_id_list, obs_batch)
+        return (action_list, log_probs)
+
+    def receives_timestep_batches(self):
+        return True
+
+    def standardize_timestep_batch_observations(
         self,
-        timesteps: List[Timestep[AgentID, ObsType, ActionType, RewardType]],
+        timestep_batch: TimestepBatch[AgentID, ObsType, ActionType, RewardType],
     ):
-        agent_id_list = [None] * (2 * len(timesteps))
-        obs_list = [None] * len(agent_id_list)
-        for timestep_idx, timestep in enumerate(timesteps):
-            agent_id_list[2 * timestep_idx] = timestep.agent_id
-            agent_id_list[2 * timestep_idx + 1] = timestep.agent_id
-            obs_list[2 * timestep_idx] = timestep.obs
-            obs_list[2 * timestep_idx + 1] = timestep.next_obs
+        n_timesteps = len(timestep_batch)
+        agent_id_list = timestep_batch.agent_ids * 2
+        obs_list = list(timestep_batch.obs) + list(timestep_batch.next_obs)
         standardized_obs = self.obs_standardizer.standardize(agent_id_list, obs_list)
-        for obs_idx, obs in enumerate(standardized_obs):
-            if obs_idx % 2 == 0:
-                timesteps[obs_idx // 2].obs = obs
-            else:
-                timesteps[obs_idx // 2].next_obs = obs
+        timestep_batch.obs = standardized_obs[:n_timesteps]
+        timestep_batch.next_obs = standardized_obs[n_timesteps:]
 
     def process_timestep_data(self, timestep_data):
         timesteps_added = 0
         state_metrics: List[StateMetrics] = []
         for env_id, (
-            env_timesteps,
+            env_timestep_batch,
             env_log_probs,
             env_state_metrics,
             _,
         ) in timestep_data.items():
-            if self.obs_standardizer is not None:
-                self.standardize_timestep_observations(env_timesteps)
-            if env_timesteps:
+            if env_timestep_batch:
+                if self.obs_standardizer is not None:
+                    self.standardize_timestep_batch_observations(env_timestep_batch)
                 if env_id not in self.current_env_trajectories:
                     self.current_env_trajectories[env_id] = EnvTrajectories(
-                        [timestep.agent_id for timestep in env_timesteps]
+                        env_timestep_batch.agent_ids,
+                        (
+                            env_timestep_batch.agent_slots.tolist()
+                            if env_timestep_batch.agent_slots is not None
+                            else None
+                        ),
                     )
-                timesteps_added += self.current_env_trajectories[env_id].add_steps(
-                    env_timesteps, env_log_probs
+                timesteps_added += self.current_env_trajectories[env_id].add_batch(
+                    env_timestep_batch, env_log_probs
                 )
-            state_metrics.append(env_state_metrics)
+            # State metrics reduced in the env process are only sent every few steps
+            if env_state_metrics is not None:
+                state_metrics.append(env_state_metrics)
         self.iteration_timesteps += timesteps_added
         self.cumulative_timesteps += timesteps_added
         self.iteration_state_metrics += state_metrics
+        if self.state_metrics_reducer is not None and state_metrics:
+            self.iteration_state_metrics = [
+                self.state_metrics_reducer.merge(self.iteration_state_metrics)
+            ]
         if (
             self.iteration_timesteps
             >= self.config.agent_controller_config.timesteps_per_iteration
@@ -486,6 +506,13 @@ class PPOAgentController(
         if self.ts_since_last_save >= self.config.agent_controller_config.save_every_ts:
             self.save_checkpoint()
 
+    def process_dropped_envs(self, env_ids):
+        for env_id in env_ids:
+            self.current_env_trajectories.pop(env_id, None)
+
+    def process_env_process_metrics(self, metrics):
+        self.env_process_metrics = metrics
+
     def choose_env_actions(self, state_info):
         env_action_responses = {}
         for env_id in state_info:
@@ -493,7 +520,7 @@ class PPOAgentController(
                 # This must be the first env action after a reset, so we step
                 env_action_responses[env_id] = STEP_RESPONSE
                 continue
-            done = all(self.current_env_trajectories[env_id].dones.values())
+            done = all(self.current_env_trajectories[env_id].dones)
             if done:
                 env_action_responses[env_id] = RESET_RESPONSE
                 self.current_trajectories += self.current_env_trajectories.pop(
@@ -525,6 +552,7 @@ class PPOAgentController(
                     self.iteration_timesteps,
                     self.timestep_collection_end_time
                     - self.timestep_collection_start_time,
+                    self.env_process_metrics,
                 )
             )
             state_metrics = self.metrics_logger.collect_state_metrics(
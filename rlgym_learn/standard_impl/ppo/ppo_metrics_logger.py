@@ -40,6 +40,7 @@ class PPOMetricsLogger(
             "Collected Steps per Second": data.timesteps_collected
             / data.timestep_collection_time,
             "Overall Steps per Second": data.timesteps_collected / data.iteration_time,
+            **data.env_process_metrics,
         }
 
     def report_metrics(
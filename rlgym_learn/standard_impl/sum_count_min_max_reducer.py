@@ -0,0 +1,52 @@
+from typing import Dict, List, Optional, Tuple
+
+from rlgym_learn.api import StateMetricsReducer
+
+# Sum, count, min and max of each metric
+SumCountMinMax = Dict[str, Tuple[float, int, float, float]]
+
+
+class SumCountMinMaxReducer(StateMetricsReducer[Dict[str, float], SumCountMinMax]):
+    """
+    Reduces state metrics which are dicts of floats by keeping the sum, count, min and max of each metric.
+    """
+
+    def __init__(self):
+        self.aggregate: SumCountMinMax = {}
+
+    def add(self, state_metrics):
+        for name, value in state_metrics.items():
+            self.aggregate[name] = self._merge_values(
+                self.aggregate.get(name), (value, 1, value, value)
+            )
+
+    def flush(self):
+        if not self.aggregate:
+            return None
+        aggregate = self.aggregate
+        self.aggregate = {}
+        return aggregate
+
+    def merge(self, reduced_state_metrics_list):
+        merged: SumCountMinMax = {}
+        for reduced_state_metrics in reduced_state_metrics_list:
+            for name, values in reduced_state_metrics.items():
+                merged[name] = self._merge_values(merged.get(name), values)
+        return merged
+
+    @staticmethod
+    def _merge_values(
+        a: Optional[Tuple[float, int, float, float]],
+        b: Tuple[float, int, float, float],
+    ) -> Tuple[float, int, float, float]:
+        if a is None:
+            return tuple(b)
+        return (a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3]))
+
+    @staticmethod
+    def get_means(aggregate: SumCountMinMax) -> Dict[str, float]:
+        """
+        :param aggregate: Aggregate returned by flush or merge.
+        :return: Dictionary with the mean of each metric.
+        """
+        return {name: values[0] / values[1] for name, values in aggregate.items()}
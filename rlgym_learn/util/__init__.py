@@ -1,2 +1,9 @@
+from .cpu_affinity import (
+    CpuPlacement,
+    cpu_affinity_supported,
+    plan_cpu_placement,
+    print_cpu_placement,
+    set_cpu_affinity,
+)
 from .kbhit import KBHit
 from .running_stats import WelfordRunningStat
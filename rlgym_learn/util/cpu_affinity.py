@@ -0,0 +1,154 @@
+import os
+from dataclasses import dataclass
+from glob import glob
+from typing import Dict, List, Optional
+
+
+@dataclass
+class CpuPlacement:
+    coordinator_cpus: List[int]
+    # Each set of CPUs only contains CPUs from a single NUMA node
+    env_process_cpu_sets: List[List[int]]
+    cpu_node_map: Dict[int, int]
+
+    def get_env_process_cpus(self, proc_idx: int) -> Optional[List[int]]:
+        """
+        :param proc_idx: Index of the env process, in the order the processes were started.
+        :return: The CPUs the env process should be pinned to, or None if there are no CPUs left for env processes.
+        Processes are assigned the sets of CPUs in turn, so processes share sets once there are more processes than sets.
+        """
+        if not self.env_process_cpu_sets:
+            return None
+        return self.env_process_cpu_sets[proc_idx % len(self.env_process_cpu_sets)]
+
+    def get_node(self, cpus: List[int]) -> Optional[int]:
+        nodes = {self.cpu_node_map.get(cpu) for cpu in cpus}
+        return nodes.pop() if len(nodes) == 1 else None
+
+
+def cpu_affinity_supported() -> bool:
+    return hasattr(os, "sched_setaffinity") and hasattr(os, "sched_getaffinity")
+
+
+def _parse_cpu_list(cpu_list: str) -> List[int]:
+    # Parses the format used by sysfs, e.g. "0-3,8-11"
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus += range(int(start), int(end) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def get_numa_node_cpus() -> Dict[int, List[int]]:
+    """
+    :return: Dictionary with NUMA node ids as keys and the CPUs of the node which this process is allowed to run on as values.
+    If the NUMA topology is not available, all CPUs are reported as belonging to node 0.
+    """
+    if cpu_affinity_supported():
+        available_cpus = sorted(os.sched_getaffinity(0))
+    else:
+        available_cpus = list(range(os.cpu_count() or 1))
+    node_cpus = {}
+    for node_path in glob("/sys/devices/system/node/node[0-9]*"):
+        try:
+            with open(os.path.join(node_path, "cpulist"), "rt") as f:
+                cpus = _parse_cpu_list(f.read())
+        except OSError:
+            continue
+        cpus = [cpu for cpu in cpus if cpu in available_cpus]
+        if cpus:
+            node_cpus[int(os.path.basename(node_path)[4:])] = cpus
+    if not node_cpus:
+        node_cpus = {0: available_cpus}
+    return dict(sorted(node_cpus.items()))
+
+
+def plan_cpu_placement(
+    n_coordinator_cpus: int, cpus_per_env_process: int
+) -> CpuPlacement:
+    """
+    Split the available CPUs between the coordinator and the env processes.
+    :param n_coordinator_cpus: Number of CPUs reserved for the coordinator. These are taken from the first NUMA node.
+    :param cpus_per_env_process: Number of CPUs in each set of CPUs for env processes. Sets don't span NUMA nodes,
+    so CPUs of a node which don't fill a whole set are left out, unless the node has fewer CPUs than a set.
+    :return: The planned placement.
+    """
+    node_cpus = get_numa_node_cpus()
+    cpu_node_map = {cpu: node for node, cpus in node_cpus.items() for cpu in cpus}
+    coordinator_cpus = []
+    env_process_cpu_sets = []
+    for cpus in node_cpus.values():
+        n_reserved = min(n_coordinator_cpus - len(coordinator_cpus), len(cpus))
+        coordinator_cpus += cpus[:n_reserved]
+        cpus = cpus[n_reserved:]
+        if 0 < len(cpus) < cpus_per_env_process:
+            env_process_cpu_sets.append(cpus)
+            continue
+        for start in range(
+            0, len(cpus) - cpus_per_env_process + 1, cpus_per_env_process
+        ):
+            env_process_cpu_sets.append(cpus[start : start + cpus_per_env_process])
+    return CpuPlacement(coordinator_cpus, env_process_cpu_sets, cpu_node_map)
+
+
+def set_cpu_affinity(cpus: List[int]) -> bool:
+    """
+    Pin the calling process to the given CPUs.
+    :return: True if the affinity was set, False if this is not supported on this platform.
+    """
+    if not cpu_affinity_supported():
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def get_cpu_affinity(pid: int) -> Optional[List[int]]:
+    """
+    :return: The CPUs the process with the given pid is allowed to run on, or None if this can't be determined.
+    """
+    if not cpu_affinity_supported():
+        return None
+    try:
+        return sorted(os.sched_getaffinity(pid))
+    except OSError:
+        return None
+
+
+def _format_cpu_list(cpus: Optional[List[int]]) -> str:
+    if cpus is None:
+        return "unknown"
+    ranges = []
+    for cpu in cpus:
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(start) if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+
+def print_cpu_placement(placement: CpuPlacement, pids: Dict[str, int]):
+    """
+    Print the CPUs and NUMA node each process is actually running on.
+    :param placement: The planned placement, used to find the NUMA node of each CPU.
+    :param pids: Dictionary with names of processes as keys and their pids as values.
+    """
+    rows = [("Process", "NUMA Node", "CPUs")]
+    for name, pid in pids.items():
+        cpus = get_cpu_affinity(pid)
+        node = placement.get_node(cpus) if cpus is not None else None
+        rows.append(
+            (name, "mixed" if node is None else str(node), _format_cpu_list(cpus))
+        )
+    widths = [max(len(row[col]) for row in rows) for col in range(3)]
+    print("CPU placement:")
+    for row in rows:
+        print(
+            "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        )
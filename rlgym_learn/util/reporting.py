@@ -52,6 +52,21 @@ def _form_printable_groups(report):
         {"Timesteps Collected": report["Timesteps Collected"]},
     ]
 
+    env_process_group = {
+        key: report[key]
+        for key in (
+            "Min Process Steps per Inference",
+            "Env Process Steps per Second",
+            "Env Step Latency",
+            "Inference Latency",
+            "Mean Inference Batch Size",
+            "Learner Idle Fraction",
+        )
+        if key in report
+    }
+    if env_process_group:
+        groups.append(env_process_group)
+
     return groups
 
 
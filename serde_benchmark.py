@@ -0,0 +1,492 @@
+"""
+Round-trips representative payloads through every serde in PyAnySerdeFactory, the Python TypeSerdes in
+rlgym_learn.standard_impl and the Rocket League serdes, using the same append / retrieve path as shared memory.
+Reports ns/object and bytes/object with Rust and Python implementations of the same payload side by side, and
+saves the results as JSON so that runs can be diffed between versions.
+
+benchmark_serde is only part of rlgym_learn_backend when it is built with the benchmark feature, e.g. with
+maturin develop --release --features benchmark
+
+Usage: python serde_benchmark.py [--iterations N] [--buffer-size BYTES] [--output FILE] [--filter SUBSTRING]
+"""
+
+import argparse
+import dataclasses
+import json
+import pickle
+import platform
+import subprocess
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from rlgym_learn_backend import benchmark_serde
+except ImportError as e:
+    raise ImportError(
+        "rlgym_learn_backend was built without the benchmark feature, rebuild it with maturin develop --release --features benchmark"
+    ) from e
+
+from rlgym_learn.api import (
+    TypeSerde,
+    bool_serde,
+    bytes_serde,
+    compile_serde,
+    complex_serde,
+    dict_serde,
+    dynamic_serde,
+    float_serde,
+    int_serde,
+    list_serde,
+    numpy_serde,
+    numpy_static_serde,
+    pickle_serde,
+    quantized_numpy_serde,
+    set_serde,
+    string_serde,
+    struct_serde,
+    tuple_serde,
+)
+from rlgym_learn.standard_impl import (
+    BoolSerde,
+    DynamicPrimitiveTupleSerde,
+    FloatSerde,
+    HomogeneousTupleSerde,
+    IntSerde,
+    NumpyDynamicShapeSerde,
+    NumpyStaticShapeSerde,
+    StrIntTupleSerde,
+    StrSerde,
+    game_state_serde,
+)
+
+OBS_SIZE = 107
+
+
+class PickleTypeSerde(TypeSerde[Any]):
+    """
+    Python baseline for the Rust pickle_serde, which calls pickle from Rust.
+    """
+
+    def to_bytes(self, obj):
+        return pickle.dumps(obj)
+
+    def from_bytes(self, byts):
+        return pickle.loads(byts)
+
+
+@dataclasses.dataclass
+class ExampleStateMetrics:
+    goal_scored: bool
+    ball_speed: float
+    touches: int
+    car_speeds: np.ndarray
+
+
+def build_game_state(n_cars: int):
+    from rlgym.rocket_league.api import Car, GameConfig, GameState, PhysicsObject
+
+    def build_physics_object():
+        physics_object = PhysicsObject()
+        physics_object.position = np.random.rand(3).astype(np.float32)
+        physics_object.linear_velocity = np.random.rand(3).astype(np.float32)
+        physics_object.angular_velocity = np.random.rand(3).astype(np.float32)
+        physics_object._quaternion = np.random.rand(4).astype(np.float32)
+        physics_object._rotation_mtx = None
+        physics_object._euler_angles = None
+        return physics_object
+
+    config = GameConfig()
+    config.gravity = 1.0
+    config.boost_consumption = 1.0
+    config.dodge_deadzone = 0.5
+    cars = {}
+    for idx in range(n_cars):
+        car = Car()
+        car.team_num = idx % 2
+        car.hitbox_type = 0
+        car.ball_touches = 0
+        car.bump_victim_id = None
+        car.demo_respawn_timer = 0.0
+        car.on_ground = True
+        car.supersonic_time = 0.0
+        car.boost_amount = 33.0
+        car.boost_active_time = 0.0
+        car.handbrake = 0.0
+        car.has_jumped = False
+        car.is_holding_jump = False
+        car.is_jumping = False
+        car.jump_time = 0.0
+        car.has_flipped = False
+        car.has_double_jumped = False
+        car.air_time_since_jump = 0.0
+        car.flip_time = 0.0
+        car.flip_torque = np.zeros(3, dtype=np.float32)
+        car.is_autoflipping = False
+        car.autoflip_timer = 0.0
+        car.autoflip_direction = 0.0
+        car.physics = build_physics_object()
+        car._inverted_physics = build_physics_object()
+        cars[f"{'blue' if idx % 2 == 0 else 'orange'}-{idx // 2}"] = car
+    game_state = GameState()
+    game_state.tick_count = 1000
+    game_state.goal_scored = False
+    game_state.config = config
+    game_state.cars = cars
+    game_state.ball = build_physics_object()
+    game_state._inverted_ball = build_physics_object()
+    game_state.boost_pad_timers = np.zeros(34, dtype=np.float32)
+    game_state._inverted_boost_pad_timers = np.zeros(34, dtype=np.float32)
+    return game_state
+
+
+def build_cases() -> List[Tuple[str, Callable[[], Any], List[Tuple[str, str, Any]]]]:
+    """
+    :return: a list of (payload name, payload builder, [(implementation, serde name, serde)]).
+    """
+    obs = np.random.rand(OBS_SIZE)
+    low = [-1.0] * OBS_SIZE
+    high = [1.0] * OBS_SIZE
+    str_int_tuple = lambda: tuple_serde(string_serde(), int_serde())
+    cases = [
+        (
+            "bool",
+            lambda: True,
+            [
+                ("rust", "bool_serde", bool_serde()),
+                ("python", "BoolSerde", BoolSerde()),
+            ],
+        ),
+        (
+            "int",
+            lambda: 123456789,
+            [
+                ("rust", "int_serde", int_serde()),
+                ("python", "IntSerde", IntSerde()),
+            ],
+        ),
+        (
+            "float",
+            lambda: 3.14159,
+            [
+                ("rust", "float_serde", float_serde()),
+                ("python", "FloatSerde", FloatSerde()),
+            ],
+        ),
+        (
+            "complex",
+            lambda: complex(1.5, -2.5),
+            [
+                ("rust", "complex_serde", complex_serde()),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+        (
+            "str",
+            lambda: "blue-0",
+            [
+                ("rust", "string_serde", string_serde()),
+                ("python", "StrSerde", StrSerde()),
+            ],
+        ),
+        (
+            "bytes",
+            lambda: bytes(range(64)),
+            [
+                ("rust", "bytes_serde", bytes_serde()),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+        (
+            f"float64[{OBS_SIZE}]",
+            lambda: obs,
+            [
+                ("rust", "numpy_serde", numpy_serde(np.float64)),
+                (
+                    "rust",
+                    "numpy_static_serde",
+                    numpy_static_serde(np.float64, (OBS_SIZE,)),
+                ),
+                (
+                    "rust",
+                    "quantized_numpy_serde(float16)",
+                    quantized_numpy_serde(np.float64, "float16"),
+                ),
+                (
+                    "rust",
+                    "quantized_numpy_serde(bfloat16)",
+                    quantized_numpy_serde(np.float64, "bfloat16"),
+                ),
+                (
+                    "rust",
+                    "quantized_numpy_serde(int8)",
+                    quantized_numpy_serde(np.float64, "int8", low, high),
+                ),
+                ("rust", "dynamic_serde", dynamic_serde()),
+                (
+                    "python",
+                    "NumpyDynamicShapeSerde",
+                    NumpyDynamicShapeSerde(np.float64),
+                ),
+                (
+                    "python",
+                    "NumpyStaticShapeSerde",
+                    NumpyStaticShapeSerde(np.float64, (OBS_SIZE,)),
+                ),
+            ],
+        ),
+        (
+            "list[float] x 32",
+            lambda: [float(v) for v in range(32)],
+            [
+                ("rust", "list_serde(float_serde)", list_serde(float_serde())),
+                (
+                    "rust",
+                    "compile_serde(list_serde(float_serde))",
+                    compile_serde(list_serde(float_serde())),
+                ),
+                ("rust", "dynamic_serde", dynamic_serde()),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+        (
+            "set[int] x 32",
+            lambda: set(range(32)),
+            [
+                ("rust", "set_serde(int_serde)", set_serde(int_serde())),
+                ("rust", "dynamic_serde", dynamic_serde()),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+        (
+            "tuple[str, int]",
+            lambda: ("blue-0", 3),
+            [
+                ("rust", "tuple_serde(string_serde, int_serde)", str_int_tuple()),
+                (
+                    "rust",
+                    "compile_serde(tuple_serde(string_serde, int_serde))",
+                    compile_serde(str_int_tuple()),
+                ),
+                ("rust", "dynamic_serde", dynamic_serde()),
+                ("python", "StrIntTupleSerde", StrIntTupleSerde()),
+                ("python", "DynamicPrimitiveTupleSerde", DynamicPrimitiveTupleSerde()),
+            ],
+        ),
+        (
+            "tuple[float] x 8",
+            lambda: tuple(float(v) for v in range(8)),
+            [
+                (
+                    "rust",
+                    "tuple_serde(float_serde x 8)",
+                    tuple_serde(*[float_serde() for _ in range(8)]),
+                ),
+                (
+                    "rust",
+                    "compile_serde(tuple_serde(float_serde x 8))",
+                    compile_serde(tuple_serde(*[float_serde() for _ in range(8)])),
+                ),
+                (
+                    "python",
+                    "HomogeneousTupleSerde(FloatSerde)",
+                    HomogeneousTupleSerde(FloatSerde()),
+                ),
+            ],
+        ),
+        (
+            "dict[str, float] x 16",
+            lambda: {f"metric_{idx}": float(idx) for idx in range(16)},
+            [
+                (
+                    "rust",
+                    "dict_serde(string_serde, float_serde)",
+                    dict_serde(string_serde(), float_serde()),
+                ),
+                (
+                    "rust",
+                    "compile_serde(dict_serde(string_serde, float_serde))",
+                    compile_serde(dict_serde(string_serde(), float_serde())),
+                ),
+                (
+                    "mixed",
+                    "dict_serde(StrSerde, FloatSerde)",
+                    dict_serde(StrSerde(), FloatSerde()),
+                ),
+                ("rust", "dynamic_serde", dynamic_serde()),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+        (
+            "dataclass",
+            lambda: ExampleStateMetrics(False, 1234.5, 3, np.random.rand(4)),
+            [
+                (
+                    "rust",
+                    "struct_serde",
+                    struct_serde(
+                        ExampleStateMetrics,
+                        {
+                            "goal_scored": bool_serde(),
+                            "ball_speed": float_serde(),
+                            "touches": int_serde(),
+                            "car_speeds": numpy_static_serde(np.float64, (4,)),
+                        },
+                    ),
+                ),
+                ("rust", "pickle_serde", pickle_serde()),
+                ("python", "PickleTypeSerde", PickleTypeSerde()),
+            ],
+        ),
+    ]
+    try:
+        import rlgym.rocket_league.api
+
+        cases.append(
+            (
+                "GameState 2v2",
+                lambda: build_game_state(4),
+                [
+                    ("rust", "game_state_serde", game_state_serde(string_serde())),
+                    ("rust", "pickle_serde", pickle_serde()),
+                    ("python", "PickleTypeSerde", PickleTypeSerde()),
+                ],
+            )
+        )
+    except ImportError:
+        print("rlgym[rl] is not installed, skipping GameState payloads")
+    return cases
+
+
+def roundtrip_matches(obj, retrieved_obj) -> bool:
+    if isinstance(obj, np.ndarray):
+        return (
+            isinstance(retrieved_obj, np.ndarray)
+            and obj.shape == retrieved_obj.shape
+            and bool(np.allclose(obj, retrieved_obj, atol=1e-2, rtol=1e-2))
+        )
+    if isinstance(obj, ExampleStateMetrics):
+        return (
+            dataclasses.astuple(obj)[:3] == dataclasses.astuple(retrieved_obj)[:3]
+            and bool(np.array_equal(obj.car_speeds, retrieved_obj.car_speeds))
+        )
+    if hasattr(obj, "tick_count"):
+        return (
+            retrieved_obj.tick_count == obj.tick_count
+            and retrieved_obj.cars.keys() == obj.cars.keys()
+        )
+    return obj == retrieved_obj
+
+
+def run_case(
+    serde, obj, n_iterations: int, buffer_size: int
+) -> Tuple[float, float, int, bool]:
+    """
+    :return: ns per append, ns per retrieve, bytes per object and whether the retrieved object matches obj.
+    """
+    type_serde = None
+    dyn_serde = serde
+    if isinstance(serde, TypeSerde):
+        type_serde = serde
+        dyn_serde = None
+    # Warm up caches and detected serdes before timing
+    benchmark_serde(type_serde, dyn_serde, obj, min(n_iterations, 100), buffer_size)
+    append_ns, retrieve_ns, n_bytes, retrieved_obj = benchmark_serde(
+        type_serde, dyn_serde, obj, n_iterations, buffer_size
+    )
+    return (
+        append_ns / n_iterations,
+        retrieve_ns / n_iterations,
+        n_bytes,
+        roundtrip_matches(obj, retrieved_obj),
+    )
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=10_000)
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=65536,
+        help="size of the buffer each payload is appended to and retrieved from",
+    )
+    parser.add_argument("--output", default="serde_benchmark_results.json")
+    parser.add_argument(
+        "--filter", default=None, help="only run payloads containing this substring"
+    )
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    results = []
+    for payload_name, build_payload, serdes in build_cases():
+        if args.filter is not None and args.filter not in payload_name:
+            continue
+        obj = build_payload()
+        print(f"\n{payload_name}")
+        print(
+            f"    {'impl':<7}{'serde':<56}{'append ns':>11}{'retrieve ns':>13}{'total ns':>11}{'bytes':>8}"
+        )
+        for implementation, serde_name, serde in serdes:
+            append_ns, retrieve_ns, n_bytes, matches = run_case(
+                serde, obj, args.iterations, args.buffer_size
+            )
+            print(
+                f"    {implementation:<7}{serde_name:<56}{append_ns:>11.0f}{retrieve_ns:>13.0f}{append_ns + retrieve_ns:>11.0f}{n_bytes:>8}"
+                + ("" if matches else "  (round trip mismatch)")
+            )
+            results.append(
+                {
+                    "payload": payload_name,
+                    "implementation": implementation,
+                    "serde": serde_name,
+                    "append_ns_per_object": append_ns,
+                    "retrieve_ns_per_object": retrieve_ns,
+                    "roundtrip_ns_per_object": append_ns + retrieve_ns,
+                    "bytes_per_object": n_bytes,
+                    "roundtrip_matches": matches,
+                }
+            )
+
+    with open(args.output, "wt") as f:
+        json.dump(
+            {
+                "metadata": {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "git_commit": get_git_commit(),
+                    "python_version": platform.python_version(),
+                    "numpy_version": np.__version__,
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "iterations": args.iterations,
+                    "buffer_size": args.buffer_size,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
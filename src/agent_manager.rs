@@ -9,17 +9,59 @@ use pyo3::{IntoPyObjectExt, PyObject};
 use crate::common::misc::{as_tensor, tensor_slice_1d};
 use crate::env_action::{EnvAction, EnvActionResponse};
 
+// The obs to get actions for, either as a list of ObsType or as one batch with the obs along the first dimension
+enum ObsData<'py> {
+    List(Vec<PyObject>),
+    Batch(Bound<'py, PyAny>),
+}
+
+impl<'py> ObsData<'py> {
+    fn len(&self) -> PyResult<usize> {
+        match self {
+            ObsData::List(obs_list) => Ok(obs_list.len()),
+            ObsData::Batch(obs_batch) => obs_batch.len(),
+        }
+    }
+
+    // Returns the obs at the provided indices, in order
+    fn select(&self, py: Python<'py>, indices: &Vec<usize>) -> PyResult<ObsData<'py>> {
+        match self {
+            ObsData::List(obs_list) => Ok(ObsData::List(
+                indices
+                    .iter()
+                    .map(|&idx| obs_list[idx].clone_ref(py))
+                    .collect(),
+            )),
+            ObsData::Batch(obs_batch) => {
+                if indices.len() == obs_batch.len()?
+                    && indices.iter().enumerate().all(|(idx, &v)| idx == v)
+                {
+                    Ok(ObsData::Batch(obs_batch.clone()))
+                } else {
+                    Ok(ObsData::Batch(obs_batch.get_item(PyList::new(py, indices)?)?))
+                }
+            }
+        }
+    }
+}
+
 fn get_actions<'py>(
     agent_controller: &Bound<'py, PyAny>,
     agent_id_list: &Vec<&PyObject>,
-    obs_list: &Vec<&PyObject>,
+    obs_data: &ObsData<'py>,
 ) -> PyResult<(Vec<Option<PyObject>>, PyObject)> {
-    Ok(agent_controller
-        .call_method1(
-            intern!(agent_controller.py(), "get_actions"),
-            (agent_id_list, obs_list),
-        )?
-        .extract()?)
+    let py = agent_controller.py();
+    match obs_data {
+        ObsData::List(obs_list) => agent_controller
+            .call_method1(intern!(py, "get_actions"), (agent_id_list, obs_list))?
+            .extract(),
+        ObsData::Batch(obs_batch) => agent_controller
+            .call_method1(
+                intern!(py, "get_actions_batched"),
+                (agent_id_list, obs_batch),
+            )?
+            .extract(),
+    }
 }
 
 fn choose_agents<'py>(
@@ -46,6 +88,19 @@ fn choose_env_actions<'py>(
         .extract()?)
 }
 
+fn get_non_step_env_action(env_action_response: EnvActionResponse) -> EnvAction {
+    match env_action_response {
+        EnvActionResponse::RESET() => EnvAction::RESET {},
+        EnvActionResponse::SET_STATE(desired_state, prev_timestep_id_dict_option) => {
+            EnvAction::SET_STATE {
+                desired_state,
+                prev_timestep_id_dict_option,
+            }
+        }
+        EnvActionResponse::STEP() => unreachable!(),
+    }
+}
+
 #[pyclass(module = "rlgym_learn_backend")]
 pub struct AgentManager {
     agent_controllers: HashMap<String, PyObject>,
@@ -56,14 +111,15 @@ impl AgentManager {
         &self,
         py: Python<'py>,
         agent_id_list: Vec<PyObject>,
-        obs_list: Vec<PyObject>,
+        obs_data: ObsData<'py>,
     ) -> PyResult<(Vec<Option<PyObject>>, PyObject, bool)> {
-        let mut obs_idx_has_action_map = vec![false; obs_list.len()];
-        let mut action_list = vec![None; obs_list.len()];
-        let mut log_prob_list = vec![None; obs_list.len()];
+        let n_obs = obs_data.len()?;
+        let mut obs_idx_has_action_map = vec![false; n_obs];
+        let mut action_list = vec![None; n_obs];
+        let mut log_prob_list = vec![None; n_obs];
 
         let mut new_agent_id_list = agent_id_list;
-        let mut new_obs_list = obs_list;
+        let mut new_obs_data = obs_data;
         let mut new_obs_list_idx_has_action_map = obs_idx_has_action_map.clone();
         let mut first_agent_controller = true;
         let mut may_early_return = false;
@@ -87,13 +143,16 @@ impl AgentManager {
                     .filter(|(idx, _)| !new_obs_list_idx_has_action_map[*idx])
                     .map(|(_, v)| v)
                     .collect();
-                new_obs_list = new_obs_list
-                    .drain(..)
-                    .enumerate()
-                    .filter(|(idx, _)| !new_obs_list_idx_has_action_map[*idx])
-                    .map(|(_, v)| v)
-                    .collect();
-                new_obs_list_idx_has_action_map.resize(new_obs_list.len(), false);
+                new_obs_data = new_obs_data.select(
+                    py,
+                    &new_obs_list_idx_has_action_map
+                        .iter()
+                        .enumerate()
+                        .filter(|(_, &v)| !v)
+                        .map(|(idx, _)| idx)
+                        .collect(),
+                )?;
+                new_obs_list_idx_has_action_map.resize(new_agent_id_list.len(), false);
                 for v in &mut new_obs_list_idx_has_action_map {
                     *v = false;
                 }
@@ -105,14 +164,11 @@ impl AgentManager {
                 .iter()
                 .map(|&idx| new_agent_id_list.get(idx).unwrap())
                 .collect();
-            let agent_controller_obs_list: Vec<&PyObject> = agent_controller_indices
-                .iter()
-                .map(|&idx| new_obs_list.get(idx).unwrap())
-                .collect();
+            let agent_controller_obs_data = new_obs_data.select(py, &agent_controller_indices)?;
             let (agent_controller_action_list, agent_controller_log_probs) = get_actions(
                 &agent_controller,
                 &agent_controller_agent_id_list,
-                &agent_controller_obs_list,
+                &agent_controller_obs_data,
             )?;
             let agent_controller_log_probs = agent_controller_log_probs.call_method1(
                 py,
@@ -120,7 +176,7 @@ impl AgentManager {
                 (intern!(py, "cpu"),),
             )?;
             if may_early_return {
-                if agent_controller_indices.len() == new_obs_list.len() {
+                if agent_controller_indices.len() == new_agent_id_list.len() {
                     return Ok((
                         agent_controller_action_list,
                         agent_controller_log_probs,
@@ -150,6 +206,76 @@ impl AgentManager {
 
         Ok((action_list, log_prob_list.into_py_any(py)?, false))
     }
+
+    fn choose_env_action_responses<'py>(
+        &self,
+        py: Python<'py>,
+        state_info: HashMap<String, PyObject>,
+    ) -> PyResult<HashMap<String, EnvActionResponse>> {
+        let mut state_info = state_info;
+        let mut env_action_responses = HashMap::with_capacity(state_info.len());
+        for (_, py_agent_controller) in self.agent_controllers.iter() {
+            let agent_controller = py_agent_controller.bind(py);
+            let mut agent_controller_env_action_responses =
+                choose_env_actions(agent_controller, &state_info)?;
+            // println!(
+            //     "agent_controller_env_action_responses: {:?}",
+            //     agent_controller_env_action_responses
+            // );
+            agent_controller_env_action_responses.retain(|_, v| v.is_some());
+            env_action_responses.extend(
+                agent_controller_env_action_responses
+                    .drain()
+                    .map(|(k, v)| (k, v.unwrap())),
+            );
+            state_info.retain(|env_id, _| !env_action_responses.contains_key(env_id));
+            if state_info.is_empty() {
+                break;
+            }
+        }
+        if !state_info.is_empty() {
+            return Err(PyAssertionError::new_err(
+                "Some environments did not have env actions chosen by any agent controller",
+            ));
+        }
+        Ok(env_action_responses)
+    }
+
+    // Gets the actions for the agents of the stepped envs and appends the STEP env actions to env_actions.
+    // env_id_list_range_list contains the env ids with the start and stop indices of their agents in agent_id_list and obs_data.
+    fn append_step_env_actions<'py>(
+        &self,
+        py: Python<'py>,
+        env_actions: &mut Vec<(String, EnvAction)>,
+        env_id_list_range_list: Vec<(String, usize, usize)>,
+        agent_id_list: Vec<PyObject>,
+        obs_data: ObsData<'py>,
+    ) -> PyResult<()> {
+        let (action_list, py_log_probs, is_log_prob_tensor) =
+            self.get_actions(py, agent_id_list, obs_data)?;
+        let log_probs = py_log_probs.into_bound(py);
+        for (env_id, start, stop) in env_id_list_range_list.into_iter() {
+            env_actions.push((
+                env_id,
+                EnvAction::STEP {
+                    action_list: PyList::new(py, &action_list[start..stop])?.unbind(),
+                    log_probs: if is_log_prob_tensor {
+                        tensor_slice_1d(py, &log_probs, start, stop)?.unbind()
+                    } else {
+                        as_tensor(
+                            py,
+                            &log_probs
+                                .extract::<Bound<'_, PyList>>()?
+                                .get_slice(start, stop)
+                                .into_any(),
+                        )?
+                        .unbind()
+                    },
+                },
+            ))
+        }
+        Ok(())
+    }
 }
 
 #[pymethods]
@@ -159,53 +285,21 @@ impl AgentManager {
         AgentManager { agent_controllers }
     }
 
-    // Returns: PyTuple of (
-    //     List[ActionType],
-    //     List[Tensor]
-    // )
-
     fn get_env_actions(
         &self,
         mut env_obs_data_dict: HashMap<String, (Vec<PyObject>, Vec<PyObject>)>,
         state_info: HashMap<String, PyObject>,
     ) -> PyResult<Py<PyDict>> {
         Python::with_gil::<_, PyResult<Py<PyDict>>>(|py| {
-            let mut state_info = state_info;
-            let mut env_action_responses = HashMap::with_capacity(state_info.len());
-            for (_, py_agent_controller) in self.agent_controllers.iter() {
-                let agent_controller = py_agent_controller.bind(py);
-                let mut agent_controller_env_action_responses =
-                    choose_env_actions(agent_controller, &state_info)?;
-                // println!(
-                //     "agent_controller_env_action_responses: {:?}",
-                //     agent_controller_env_action_responses
-                // );
-                agent_controller_env_action_responses.retain(|_, v| v.is_some());
-                env_action_responses.extend(
-                    agent_controller_env_action_responses
-                        .drain()
-                        .map(|(k, v)| (k, v.unwrap())),
-                );
-                state_info.retain(|env_id, _| !env_action_responses.contains_key(env_id));
-                if state_info.is_empty() {
-                    break;
-                }
-            }
-            if !state_info.is_empty() {
-                return Err(PyAssertionError::new_err(
-                    "Some environments did not have env actions chosen by any agent controller",
-                ));
-            }
+            let env_action_responses = self.choose_env_action_responses(py, state_info)?;
             let mut env_actions = Vec::with_capacity(env_obs_data_dict.len());
             let mut env_agent_id_list_list = Vec::with_capacity(env_obs_data_dict.len());
             let mut env_obs_list_list = Vec::with_capacity(env_obs_data_dict.len());
             let mut env_id_list_range_list = Vec::with_capacity(env_obs_data_dict.len());
             let mut total_len = 0;
-            let mut should_get_actions = false;
             for (env_id, env_action_response) in env_action_responses.into_iter() {
                 match env_action_response {
                     EnvActionResponse::STEP() => {
-                        should_get_actions = true;
                         let Some((env_agent_id_list, env_obs_list)) =
                             env_obs_data_dict.remove(&env_id)
                         else {
@@ -222,44 +316,79 @@ impl AgentManager {
                         env_agent_id_list_list.push(env_agent_id_list);
                         env_obs_list_list.push(env_obs_list);
                     }
-                    EnvActionResponse::RESET() => env_actions.push((env_id, EnvAction::RESET {})),
-                    EnvActionResponse::SET_STATE(desired_state, prev_timestep_id_dict_option) => {
-                        env_actions.push((
-                            env_id,
-                            EnvAction::SET_STATE {
-                                desired_state,
-                                prev_timestep_id_dict_option,
-                            },
-                        ))
+                    env_action_response => {
+                        env_actions.push((env_id, get_non_step_env_action(env_action_response)))
                     }
                 };
             }
-            if should_get_actions {
+            if !env_id_list_range_list.is_empty() {
                 let agent_id_list = env_agent_id_list_list.into_iter().flatten().collect_vec();
                 let obs_list = env_obs_list_list.into_iter().flatten().collect_vec();
-                let (action_list, py_log_probs, is_log_prob_tensor) =
-                    self.get_actions(py, agent_id_list, obs_list)?;
-                let log_probs = py_log_probs.into_bound(py);
-                for (env_id, start, stop) in env_id_list_range_list.into_iter() {
-                    env_actions.push((
+                self.append_step_env_actions(
+                    py,
+                    &mut env_actions,
+                    env_id_list_range_list,
+                    agent_id_list,
+                    ObsData::List(obs_list),
+                )?;
+            }
+            Ok(PyDict::from_sequence(&env_actions.into_pyobject(py)?)?.unbind())
+        })
+    }
+
+    // Same as get_env_actions, but with the obs of all envs provided as one batch, and env_obs_index_dict
+    // containing the agent ids and the start and stop rows of the batch for each env. The obs of the
+    // envs which are stepped are passed to agent controllers using get_actions_batched.
+    fn get_env_actions_batched(
+        &self,
+        obs_batch: PyObject,
+        mut env_obs_index_dict: HashMap<String, (Vec<PyObject>, usize, usize)>,
+        state_info: HashMap<String, PyObject>,
+    ) -> PyResult<Py<PyDict>> {
+        Python::with_gil::<_, PyResult<Py<PyDict>>>(|py| {
+            let env_action_responses = self.choose_env_action_responses(py, state_info)?;
+            let mut env_actions = Vec::with_capacity(env_obs_index_dict.len());
+            let mut step_env_index_list = Vec::with_capacity(env_obs_index_dict.len());
+            for (env_id, env_action_response) in env_action_responses.into_iter() {
+                match env_action_response {
+                    EnvActionResponse::STEP() => {
+                        let Some((env_agent_id_list, start, stop)) =
+                            env_obs_index_dict.remove(&env_id)
+                        else {
+                            return Err(PyAssertionError::new_err(
+                                "state_info contains env ids not present in env_obs_index_dict",
+                            ));
+                        };
+                        step_env_index_list.push((env_id, env_agent_id_list, start, stop));
+                    }
+                    env_action_response => {
+                        env_actions.push((env_id, get_non_step_env_action(env_action_response)))
+                    }
+                };
+            }
+            if !step_env_index_list.is_empty() {
+                // Keep the rows in batch order so that the whole batch can be used as is when all envs are stepped
+                step_env_index_list.sort_by_key(|(_, _, start, _)| *start);
+                let mut env_id_list_range_list = Vec::with_capacity(step_env_index_list.len());
+                let mut agent_id_list = Vec::new();
+                let mut row_indices = Vec::new();
+                for (env_id, mut env_agent_id_list, start, stop) in step_env_index_list.into_iter() {
+                    env_id_list_range_list.push((
                         env_id,
-                        EnvAction::STEP {
-                            action_list: PyList::new(py, &action_list[start..stop])?.unbind(),
-                            log_probs: if is_log_prob_tensor {
-                                tensor_slice_1d(py, &log_probs, start, stop)?.unbind()
-                            } else {
-                                as_tensor(
-                                    py,
-                                    &log_probs
-                                        .extract::<Bound<'_, PyList>>()?
-                                        .get_slice(start, stop)
-                                        .into_any(),
-                                )?
-                                .unbind()
-                            },
-                        },
-                    ))
+                        agent_id_list.len(),
+                        agent_id_list.len() + env_agent_id_list.len(),
+                    ));
+                    agent_id_list.append(&mut env_agent_id_list);
+                    row_indices.extend(start..stop);
                 }
+                let obs_data = ObsData::Batch(obs_batch.into_bound(py)).select(py, &row_indices)?;
+                self.append_step_env_actions(
+                    py,
+                    &mut env_actions,
+                    env_id_list_range_list,
+                    agent_id_list,
+                    obs_data,
+                )?;
             }
             Ok(PyDict::from_sequence(&env_actions.into_pyobject(py)?)?.unbind())
         })
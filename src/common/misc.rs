@@ -1,9 +1,14 @@
-use std::mem::align_of;
+use std::mem::{align_of, size_of};
 
+use bytemuck::{cast_slice, NoUninit};
+use numpy::{
+    Element, PyArray1, PyArrayDescrMethods, PyArrayDyn, PyArrayMethods, PyUntypedArray,
+    PyUntypedArrayMethods,
+};
 use pyo3::{
     intern,
     sync::GILOnceCell,
-    types::{PyAnyMethods, PyBytes},
+    types::{PyAnyMethods, PyBytes, PyFloat, PyList},
     Bound, IntoPyObjectExt, PyAny, PyErr, PyObject, PyResult, Python,
 };
 use which;
@@ -16,6 +21,7 @@ pub fn py_hash(v: &Bound<'_, PyAny>) -> PyResult<i64> {
 static INTERNED_INT_1: GILOnceCell<PyObject> = GILOnceCell::new();
 static INTERNED_BYTES_0: GILOnceCell<PyObject> = GILOnceCell::new();
 static INTERNED_AS_TENSOR: GILOnceCell<PyObject> = GILOnceCell::new();
+static INTERNED_NP_STACK: GILOnceCell<PyObject> = GILOnceCell::new();
 
 pub fn recvfrom_byte<'py>(py: Python<'py>, socket: &PyObject) -> PyResult<()> {
     socket.call_method1(
@@ -45,6 +51,27 @@ pub fn get_bytes_to_alignment<T>(addr: usize) -> usize {
     aligned_addr.wrapping_sub(addr)
 }
 
+// Copies the elements of array into array_buf in logical (C) order. C-contiguous arrays are copied straight from their
+// data. as_slice and to_vec also succeed for F-contiguous arrays but return their data in memory order, so all other
+// arrays are copied one element at a time.
+pub fn copy_array_data<'py, T: Element + NoUninit>(
+    array_buf: &mut [u8],
+    array: &Bound<'py, PyArrayDyn<T>>,
+) -> PyResult<()> {
+    if array.is_c_contiguous() {
+        array_buf.copy_from_slice(cast_slice::<T, u8>(unsafe { array.as_slice() }?));
+    } else {
+        let array = array.try_readonly()?;
+        for (element_buf, element) in array_buf
+            .chunks_exact_mut(size_of::<T>())
+            .zip(array.as_array().iter())
+        {
+            element_buf.copy_from_slice(cast_slice::<T, u8>(std::slice::from_ref(element)));
+        }
+    }
+    Ok(())
+}
+
 #[allow(dead_code)]
 pub fn initialize_python() -> pyo3::PyResult<()> {
     // Due to https://github.com/ContinuumIO/anaconda-issues/issues/11439,
@@ -92,3 +119,42 @@ pub fn as_tensor<'py>(py: Python<'py>, obj: &Bound<'py, PyAny>) -> PyResult<Boun
         .bind(py)
         .call1((obj,))?)
 }
+
+// Returns the values as a single numpy array if they are all numpy arrays with the same shape and dtype (stacked
+// along a new first dimension) or all floats (as a float64 array), and as a list otherwise.
+pub fn stack_if_possible<'py>(py: Python<'py>, values: &Vec<PyObject>) -> PyResult<PyObject> {
+    if let Some(first) = values.first() {
+        let first = first.bind(py);
+        if let Ok(first_array) = first.downcast::<PyUntypedArray>() {
+            let shape = first_array.shape();
+            let dtype = first_array.dtype();
+            let stackable = values.iter().all(|value| {
+                value
+                    .bind(py)
+                    .downcast::<PyUntypedArray>()
+                    .map_or(false, |array| {
+                        array.shape() == shape && array.dtype().is_equiv_to(&dtype)
+                    })
+            });
+            if stackable {
+                return Ok(INTERNED_NP_STACK
+                    .get_or_try_init::<_, PyErr>(py, || {
+                        Ok(py.import("numpy")?.getattr("stack")?.unbind())
+                    })?
+                    .bind(py)
+                    .call1((PyList::new(py, values)?,))?
+                    .unbind());
+            }
+        } else if values
+            .iter()
+            .all(|value| value.bind(py).is_instance_of::<PyFloat>())
+        {
+            let floats = values
+                .iter()
+                .map(|value| value.extract::<f64>(py))
+                .collect::<PyResult<Vec<_>>>()?;
+            return Ok(PyArray1::from_vec(py, floats).into_any().unbind());
+        }
+    }
+    Ok(PyList::new(py, values)?.into_any().unbind())
+}
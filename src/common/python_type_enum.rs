@@ -9,7 +9,7 @@ use pyo3::Bound;
 use crate::common::numpy_dtype_enum::NumpyDtype;
 
 // This enum is used to store first-level information about Python types such that DynamicSerde can work properly.
-#[derive(Debug, PartialEq)]
+#[derive(Debug, PartialEq, Clone, Copy)]
 pub enum PythonType {
     BOOL,
     INT,
@@ -110,6 +110,21 @@ macro_rules! check_numpy {
     };
 }
 
+pub fn is_numpy_dtype<'py>(v: &Bound<'py, PyAny>, dtype: &NumpyDtype) -> bool {
+    match dtype {
+        NumpyDtype::INT8 => check_numpy!(v, i8),
+        NumpyDtype::INT16 => check_numpy!(v, i16),
+        NumpyDtype::INT32 => check_numpy!(v, i32),
+        NumpyDtype::INT64 => check_numpy!(v, i64),
+        NumpyDtype::UINT8 => check_numpy!(v, u8),
+        NumpyDtype::UINT16 => check_numpy!(v, u16),
+        NumpyDtype::UINT32 => check_numpy!(v, u32),
+        NumpyDtype::UINT64 => check_numpy!(v, u64),
+        NumpyDtype::FLOAT32 => check_numpy!(v, f32),
+        NumpyDtype::FLOAT64 => check_numpy!(v, f64),
+    }
+}
+
 pub fn detect_python_type<'py>(v: &Bound<'py, PyAny>) -> PyResult<PythonType> {
     if v.is_exact_instance_of::<PyBool>() {
         return Ok(PythonType::BOOL);
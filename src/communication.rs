@@ -1,13 +1,18 @@
 use std::fmt::{self, Display, Formatter};
 use std::mem::size_of;
 use std::os::raw::c_double;
+use std::sync::atomic::{AtomicU32, AtomicU64, Ordering};
 
 use pyo3::exceptions::asyncio::InvalidStateError;
-use pyo3::types::{PyAnyMethods, PyBytes, PyBytesMethods};
-use pyo3::{intern, Bound, PyAny, PyResult, Python};
+use pyo3::exceptions::PyBufferError;
+use pyo3::types::{PyAnyMethods, PyBytes, PyBytesMethods, PyList, PyListMethods};
+use pyo3::{intern, Bound, PyAny, PyErr, PyResult, Python};
 
 use paste::paste;
+use raw_sync::events::{Event, EventInit};
+use shared_memory::Shmem;
 
+use crate::env_process_stats::ShmStats;
 use crate::serdes::pyany_serde::{detect_pyany_serde, get_pyany_serde, PyAnySerde};
 use crate::serdes::serde_enum::retrieve_serde;
 
@@ -32,13 +37,138 @@ pub fn get_flink(flinks_folder: &str, proc_id: &str) -> String {
     format!("{}/{}", flinks_folder, proc_id)
 }
 
-pub fn append_header(buf: &mut [u8], offset: usize, header: Header) -> usize {
-    buf[offset] = match header {
+// Returns the flink of the shared memory segment with the given generation used by the process with id proc_id.
+// Every time a process outgrows its segment it moves to a new one with the next generation.
+pub fn get_shm_flink(flinks_folder: &str, proc_id: &str, generation: u64) -> String {
+    if generation == 0 {
+        get_flink(flinks_folder, proc_id)
+    } else {
+        format!("{}/{}_gen{}", flinks_folder, proc_id, generation)
+    }
+}
+
+// Control data shared between the EPI and an EP, placed after the event used by the EPI to signal the EP.
+// The rest of the shared memory segment is split into a request region, written by the EPI, and a response
+// region, written by the EP. The request and response lengths are published with release stores, so the other side
+// sees the contents of a region once it has loaded the length with an acquire load.
+// If a response doesn't fit in the response region, the EP creates a new segment with the next generation and larger
+// regions, writes the response there, and marks this segment as superseded before notifying the EPI.
+#[repr(C)]
+pub struct ShmControl {
+    // Set by the EP when its response has been written, cleared by the EPI when it picks up the response
+    pub response_ready: AtomicU32,
+    // Written once by the EP when the segment is created
+    pub region_size: AtomicU64,
+    // Written once by the EP when the segment is created
+    pub generation: AtomicU64,
+    // Set by the EP when it has moved to the segment with the next generation
+    pub superseded: AtomicU32,
+    // Number of bytes used by the latest request, written by the EPI before signaling the EP
+    pub request_len: AtomicU64,
+    // Number of bytes used by the latest response, written by the EP before notifying the EPI
+    pub response_len: AtomicU64,
+    // Written by the EP before the response length if env process timings are enabled, zero otherwise
+    pub stats: ShmStats,
+}
+
+const SHM_CONTROL_ALIGNMENT: usize = 64;
+
+fn round_up_to_control_alignment(n: usize) -> usize {
+    (n + SHM_CONTROL_ALIGNMENT - 1) / SHM_CONTROL_ALIGNMENT * SHM_CONTROL_ALIGNMENT
+}
+
+fn get_shm_control_offset() -> usize {
+    round_up_to_control_alignment(Event::size_of(None))
+}
+
+// Number of bytes used at the start of the shared memory segment before the payload (event + control region)
+pub fn get_shm_header_size() -> usize {
+    get_shm_control_offset() + round_up_to_control_alignment(size_of::<ShmControl>())
+}
+
+// Returns the size of the shared memory segment needed for the given region size, as well as the region size
+// actually used (which is rounded up to keep both regions aligned).
+pub fn get_shm_size(region_size: usize) -> (usize, usize) {
+    let region_size = round_up_to_control_alignment(region_size);
+    (get_shm_header_size() + 2 * region_size, region_size)
+}
+
+// Returns the control region of the shared memory segment.
+// The lifetime of the returned reference is not tied to the borrow of the Shmem, so the caller
+// is responsible for making sure the Shmem outlives the reference.
+pub unsafe fn get_shm_control<'a>(shmem: &Shmem) -> &'a ShmControl {
+    &*(shmem.as_ptr().add(get_shm_control_offset()) as *const ShmControl)
+}
+
+pub fn init_shm_control(control: &ShmControl, region_size: usize, generation: u64) {
+    control.response_ready.store(0, Ordering::Relaxed);
+    control
+        .region_size
+        .store(region_size as u64, Ordering::Relaxed);
+    control.generation.store(generation, Ordering::Relaxed);
+    control.superseded.store(0, Ordering::Relaxed);
+    control.request_len.store(0, Ordering::Relaxed);
+    control.response_len.store(0, Ordering::Relaxed);
+    control.stats.clear();
+}
+
+unsafe fn get_shm_region<'a>(shmem: &Shmem, region_idx: usize) -> &'a mut [u8] {
+    let region_size = get_shm_control(shmem).region_size.load(Ordering::Relaxed) as usize;
+    std::slice::from_raw_parts_mut(
+        shmem
+            .as_ptr()
+            .add(get_shm_header_size() + region_idx * region_size),
+        region_size,
+    )
+}
+
+// Returns the request region of the shared memory segment.
+// The lifetime of the returned slice is not tied to the borrow of the Shmem, so the caller
+// is responsible for making sure the Shmem outlives the slice.
+pub unsafe fn get_shm_request<'a>(shmem: &Shmem) -> &'a mut [u8] {
+    get_shm_region(shmem, 0)
+}
+
+// Returns the response region of the shared memory segment.
+// The lifetime of the returned slice is not tied to the borrow of the Shmem, so the caller
+// is responsible for making sure the Shmem outlives the slice.
+pub unsafe fn get_shm_response<'a>(shmem: &Shmem) -> &'a mut [u8] {
+    get_shm_region(shmem, 1)
+}
+
+// Used by the EPI before signaling the EP. request_len is the number of bytes of the request region used by the request.
+pub fn publish_request_len(control: &ShmControl, request_len: usize) {
+    control
+        .request_len
+        .store(request_len as u64, Ordering::Release);
+}
+
+// Returns the part of buf from offset to end, which the caller is about to write to. All the functions which write to
+// a buffer get the part they write to from here, so that data which doesn't fit in the buffer is reported as a
+// BufferError instead of panicking. The writer of the buffer can catch this error to retry with a larger buffer.
+pub fn get_write_slice(buf: &mut [u8], offset: usize, end: usize) -> PyResult<&mut [u8]> {
+    if end > buf.len() {
+        return Err(PyBufferError::new_err(format!(
+            "tried to write up to byte {} of a buffer of {} bytes",
+            end,
+            buf.len()
+        )));
+    }
+    Ok(&mut buf[offset..end])
+}
+
+// Returns true if err was returned by get_write_slice because the data didn't fit in the buffer
+pub fn is_buffer_overflow(py: Python<'_>, err: &PyErr) -> bool {
+    err.is_instance_of::<PyBufferError>(py)
+}
+
+pub fn append_header(buf: &mut [u8], offset: usize, header: Header) -> PyResult<usize> {
+    get_write_slice(buf, offset, offset + 1)?[0] = match header {
         Header::EnvShapesRequest => 0,
         Header::EnvAction => 1,
         Header::Stop => 2,
     };
-    offset + 1
+    Ok(offset + 1)
 }
 
 pub fn retrieve_header(slice: &[u8], offset: usize) -> PyResult<(Header, usize)> {
@@ -57,10 +187,10 @@ pub fn retrieve_header(slice: &[u8], offset: usize) -> PyResult<(Header, usize)>
 macro_rules! define_primitive_communication {
     ($type:ty) => {
         paste! {
-            pub fn [<append_ $type>](buf: &mut [u8], offset: usize, val: $type) -> usize {
+            pub fn [<append_ $type>](buf: &mut [u8], offset: usize, val: $type) -> PyResult<usize> {
                 let end = offset + size_of::<$type>();
-                buf[offset..end].copy_from_slice(&val.to_ne_bytes());
-                end
+                get_write_slice(buf, offset, end)?.copy_from_slice(&val.to_ne_bytes());
+                Ok(end)
             }
 
             pub fn [<retrieve_ $type>](buf: &[u8], offset: usize) -> PyResult<($type, usize)> {
@@ -78,11 +208,11 @@ define_primitive_communication!(u64);
 define_primitive_communication!(f32);
 define_primitive_communication!(f64);
 
-pub fn append_bool(buf: &mut [u8], offset: usize, val: bool) -> usize {
+pub fn append_bool(buf: &mut [u8], offset: usize, val: bool) -> PyResult<usize> {
     let end = offset + size_of::<u8>();
     let u8_bool = if val { 1_u8 } else { 0 };
-    buf[offset..end].copy_from_slice(&u8_bool.to_ne_bytes());
-    end
+    get_write_slice(buf, offset, end)?.copy_from_slice(&u8_bool.to_ne_bytes());
+    Ok(end)
 }
 
 pub fn retrieve_bool(slice: &[u8], offset: usize) -> PyResult<(bool, usize)> {
@@ -103,7 +233,7 @@ macro_rules! append_n_vec_elements {
     ($buf: ident, $offset: expr, $vec: ident, $n: expr) => {{
         let mut offset = $offset;
         for idx in 0..$n {
-            offset = crate::communication::append_f32($buf, offset, $vec[idx]);
+            offset = crate::communication::append_f32($buf, offset, $vec[idx])?;
         }
         offset
     }};
@@ -128,12 +258,12 @@ macro_rules! append_n_vec_elements_option {
     ($buf: ident, $offset: expr, $vec_option: ident, $n: expr) => {{
         let mut offset = $offset;
         if let Some(vec) = $vec_option {
-            offset = crate::communication::append_bool($buf, offset, true);
+            offset = crate::communication::append_bool($buf, offset, true)?;
             for idx in 0..$n {
-                offset = crate::communication::append_f32($buf, offset, vec[idx]);
+                offset = crate::communication::append_f32($buf, offset, vec[idx])?;
             }
         } else {
-            offset = crate::communication::append_bool($buf, offset, false)
+            offset = crate::communication::append_bool($buf, offset, false)?
         }
         offset
     }};
@@ -161,16 +291,16 @@ macro_rules! retrieve_n_vec_elements_option {
 
 pub fn insert_bytes(buf: &mut [u8], offset: usize, bytes: &[u8]) -> PyResult<usize> {
     let end = offset + bytes.len();
-    buf[offset..end].copy_from_slice(bytes);
+    get_write_slice(buf, offset, end)?.copy_from_slice(bytes);
     Ok(end)
 }
 
 pub fn append_bytes(buf: &mut [u8], offset: usize, bytes: &[u8]) -> PyResult<usize> {
     let bytes_len = bytes.len();
-    let start = append_usize(buf, offset, bytes_len);
+    let start = append_usize(buf, offset, bytes_len)?;
     let end = start + bytes.len();
     // println!("Appending {} bytes", bytes.len());
-    buf[start..end].copy_from_slice(bytes);
+    get_write_slice(buf, start, end)?.copy_from_slice(bytes);
     Ok(end)
 }
 
@@ -203,7 +333,7 @@ macro_rules! append_python_option_update_serde {
     ($buf: expr, $offset: expr, $obj_option: expr, $type_serde_option: expr, $pyany_serde_option: ident) => {{
         let mut offset = $offset;
         if let Some(obj) = $obj_option {
-            offset = crate::communication::append_bool($buf, offset, true);
+            offset = crate::communication::append_bool($buf, offset, true)?;
             let new_pyany_serde_option;
             (offset, new_pyany_serde_option) = crate::communication::append_python(
                 $buf,
@@ -216,7 +346,7 @@ macro_rules! append_python_option_update_serde {
                 $pyany_serde_option = new_pyany_serde_option;
             }
         } else {
-            offset = crate::communication::append_bool($buf, offset, false);
+            offset = crate::communication::append_bool($buf, offset, false)?;
         }
         offset
     }};
@@ -231,7 +361,7 @@ pub fn append_python<'py>(
 ) -> PyResult<(usize, Option<Box<dyn PyAnySerde>>)> {
     if let Some(type_serde) = type_serde_option {
         // println!("Entering append via typeserde flow");
-        let mut new_offset = append_bool(buf, offset, true);
+        let mut new_offset = append_bool(buf, offset, true)?;
         new_offset = append_bytes(
             buf,
             new_offset,
@@ -244,21 +374,19 @@ pub fn append_python<'py>(
         return Ok((new_offset, None));
     } else {
         // println!("Appending python bytes via pyany serde");
-        let mut new_offset = append_bool(buf, offset, false);
+        let mut new_offset = append_bool(buf, offset, false)?;
         let serde_enum_bytes;
         let new_pyany_serde_option;
         if let Some(pyany_serde) = pyany_serde_option {
             serde_enum_bytes = pyany_serde.get_enum_bytes();
             new_pyany_serde_option = None;
-            let end = new_offset + serde_enum_bytes.len();
-            buf[new_offset..end].copy_from_slice(&serde_enum_bytes[..]);
-            new_offset = pyany_serde.append(buf, end, &obj)?;
+            new_offset = insert_bytes(buf, new_offset, &serde_enum_bytes[..])?;
+            new_offset = pyany_serde.append(buf, new_offset, &obj)?;
         } else {
             let mut new_pyany_serde = detect_pyany_serde(&obj)?;
             serde_enum_bytes = new_pyany_serde.get_enum_bytes();
-            let end = new_offset + serde_enum_bytes.len();
-            buf[new_offset..end].copy_from_slice(&serde_enum_bytes[..]);
-            new_offset = new_pyany_serde.append(buf, end, &obj)?;
+            new_offset = insert_bytes(buf, new_offset, &serde_enum_bytes[..])?;
+            new_offset = new_pyany_serde.append(buf, new_offset, &obj)?;
             new_pyany_serde_option = Some(new_pyany_serde);
         }
         // println!("Exiting append via pyany serde flow");
@@ -266,6 +394,61 @@ pub fn append_python<'py>(
     }
 }
 
+#[macro_export]
+macro_rules! append_python_batch_update_serde {
+    ($buf: expr, $offset: expr, $items: expr, $type_serde_option: expr, $pyany_serde_option: ident) => {{
+        let (offset, new_pyany_serde_option) = crate::communication::append_python_batch(
+            $buf,
+            $offset,
+            $items,
+            $type_serde_option,
+            &mut $pyany_serde_option,
+        )?;
+        if new_pyany_serde_option.is_some() {
+            $pyany_serde_option = new_pyany_serde_option;
+        }
+        offset
+    }};
+}
+
+// Like append_python for each item of a list whose items all use the same serde, but the flag and the serde enum bytes are
+// only written once, and the items are appended using append_batch of the serde. Nothing is written for an empty list.
+pub fn append_python_batch<'py>(
+    buf: &mut [u8],
+    offset: usize,
+    items: &Bound<'py, PyList>,
+    type_serde_option: &Option<&Bound<'py, PyAny>>,
+    pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+) -> PyResult<(usize, Option<Box<dyn PyAnySerde>>)> {
+    if items.is_empty() {
+        return Ok((offset, None));
+    }
+    if let Some(type_serde) = type_serde_option {
+        let mut new_offset = append_bool(buf, offset, true)?;
+        for item in items.iter() {
+            new_offset = append_bytes(
+                buf,
+                new_offset,
+                type_serde
+                    .call_method1(intern!(items.py(), "to_bytes"), (item,))?
+                    .downcast::<PyBytes>()?
+                    .as_bytes(),
+            )?;
+        }
+        return Ok((new_offset, None));
+    }
+    let new_offset = append_bool(buf, offset, false)?;
+    let mut new_pyany_serde_option = None;
+    let pyany_serde = match pyany_serde_option {
+        Some(pyany_serde) => pyany_serde,
+        None => new_pyany_serde_option.insert(detect_pyany_serde(&items.get_item(0)?)?),
+    };
+    let serde_enum_bytes = pyany_serde.get_enum_bytes();
+    let new_offset = insert_bytes(buf, new_offset, &serde_enum_bytes[..])?;
+    let new_offset = pyany_serde.append_batch(buf, new_offset, items)?;
+    Ok((new_offset, new_pyany_serde_option))
+}
+
 #[macro_export]
 macro_rules! retrieve_python_update_serde {
     ($py: ident, $buf: expr, $offset: ident, $type_serde_option: expr, $pyany_serde_option: ident) => {{
@@ -352,3 +535,66 @@ pub fn retrieve_python<'py>(
         return Ok((obj, new_offset, new_pyany_serde_option));
     }
 }
+
+#[macro_export]
+macro_rules! retrieve_python_batch_update_serde {
+    ($py: ident, $buf: expr, $offset: ident, $n_items: expr, $type_serde_option: expr, $pyany_serde_option: ident) => {{
+        let (items, offset, new_pyany_serde_option) = crate::communication::retrieve_python_batch(
+            $py,
+            $buf,
+            $offset,
+            $n_items,
+            $type_serde_option,
+            &mut $pyany_serde_option,
+        )?;
+        if new_pyany_serde_option.is_some() {
+            $pyany_serde_option = new_pyany_serde_option;
+        }
+        (items, offset)
+    }};
+}
+
+// Retrieves n_items items appended using append_python_batch
+pub fn retrieve_python_batch<'py>(
+    py: Python<'py>,
+    buf: &[u8],
+    offset: usize,
+    n_items: usize,
+    type_serde_option: &Option<&Bound<'py, PyAny>>,
+    pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+) -> PyResult<(Vec<Bound<'py, PyAny>>, usize, Option<Box<dyn PyAnySerde>>)> {
+    if n_items == 0 {
+        return Ok((Vec::new(), offset, None));
+    }
+    let (is_type_serde, mut new_offset) = retrieve_bool(buf, offset)?;
+    if is_type_serde {
+        let type_serde = type_serde_option.ok_or(InvalidStateError::new_err(
+            "serialization indicated python TypeSerde used, but no such TypeSerde is present here",
+        ))?;
+        let mut items = Vec::with_capacity(n_items);
+        for _ in 0..n_items {
+            let obj_bytes;
+            (obj_bytes, new_offset) = retrieve_bytes(buf, new_offset)?;
+            items.push(
+                type_serde
+                    .call_method1(intern!(py, "from_bytes"), (PyBytes::new(py, obj_bytes),))?,
+            );
+        }
+        return Ok((items, new_offset, None));
+    }
+    let mut new_pyany_serde_option = None;
+    let pyany_serde = match pyany_serde_option {
+        Some(pyany_serde) => {
+            new_offset += pyany_serde.get_enum_bytes().len();
+            pyany_serde
+        }
+        None => {
+            let serde;
+            (serde, new_offset) = retrieve_serde(buf, new_offset)?;
+            new_pyany_serde_option.insert(get_pyany_serde(serde)?)
+        }
+    };
+    let items;
+    (items, new_offset) = pyany_serde.retrieve_batch(py, buf, new_offset, n_items)?;
+    Ok((items, new_offset, new_pyany_serde_option))
+}
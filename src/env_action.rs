@@ -30,25 +30,23 @@ macro_rules! append_env_action_update_serdes {
         let mut offset = $offset;
         match $env_action {
             crate::env_action::EnvAction::STEP { action_list, .. } => {
-                $buf[offset] = 0;
+                crate::communication::get_write_slice($buf, offset, offset + 1)?[0] = 0;
                 offset += 1;
-                let action_list = action_list.bind($py);
-                for action in action_list.iter() {
-                    offset = crate::append_python_update_serde!(
-                        $buf,
-                        offset,
-                        &action,
-                        $action_type_serde_option,
-                        $action_pyany_serde_option
-                    );
-                }
+                // The actions of the agents of an env are homogeneous, so they are appended as one batch
+                offset = crate::append_python_batch_update_serde!(
+                    $buf,
+                    offset,
+                    action_list.bind($py),
+                    $action_type_serde_option,
+                    $action_pyany_serde_option
+                );
             }
             crate::env_action::EnvAction::RESET {} => {
-                $buf[offset] = 1;
+                crate::communication::get_write_slice($buf, offset, offset + 1)?[0] = 1;
                 offset += 1;
             }
             crate::env_action::EnvAction::SET_STATE { desired_state, .. } => {
-                $buf[offset] = 2;
+                crate::communication::get_write_slice($buf, offset, offset + 1)?[0] = 2;
                 offset += 1;
                 offset = crate::append_python_update_serde!(
                     $buf,
@@ -70,18 +68,15 @@ macro_rules! retrieve_env_action_update_serdes {
         let mut offset = $offset + 1;
         match env_action_type {
             0 => {
-                let mut action_list = Vec::with_capacity($n_actions);
-                for _ in 0..$n_actions {
-                    let action;
-                    (action, offset) = crate::retrieve_python_update_serde!(
-                        $py,
-                        $buf,
-                        offset,
-                        $action_type_serde_option,
-                        $action_pyany_serde_option
-                    );
-                    action_list.push(action);
-                }
+                let action_list;
+                (action_list, offset) = crate::retrieve_python_batch_update_serde!(
+                    $py,
+                    $buf,
+                    offset,
+                    $n_actions,
+                    $action_type_serde_option,
+                    $action_pyany_serde_option
+                );
                 Ok((
                     crate::env_action::EnvAction::STEP {
                         action_list: pyo3::types::PyList::new($py, action_list)?.unbind(),
@@ -1,14 +1,27 @@
 use crate::common::misc::{py_hash, recvfrom_byte, sendto_byte};
 use crate::env_action::EnvAction;
-use crate::serdes::pyany_serde::DynPyAnySerde;
-use crate::{append_python_update_serde, communication::*, retrieve_env_action_update_serdes};
+use crate::env_process_stats::{EpStat, EpStats};
+use crate::notification::{
+    get_notification_backend, EpNotifier, NotificationBackend, ShmEventNotifier,
+    DEFAULT_NOTIFICATION_BACKEND,
+};
+use crate::serdes::pyany_serde::{DynPyAnySerde, PyAnySerde};
+use crate::state_delta::StateDeltaEncoder;
+use crate::{
+    append_python_batch_update_serde, append_python_update_serde, communication::*,
+    retrieve_env_action_update_serdes,
+};
+use itertools::izip;
 use pyo3::exceptions::asyncio::InvalidStateError;
 use pyo3::prelude::*;
-use pyo3::types::{PyDict, PyTuple};
+use pyo3::types::{PyDict, PyList, PyTuple};
 use pyo3::{intern, PyAny, PyObject, Python};
-use raw_sync::events::{Event, EventInit, EventState};
+use raw_sync::events::{Event, EventImpl, EventInit, EventState};
 use raw_sync::Timeout;
-use shared_memory::ShmemConf;
+use shared_memory::{Shmem, ShmemConf};
+use std::cmp::{max, min};
+use std::mem::size_of;
+use std::sync::atomic::Ordering;
 use std::thread::sleep;
 use std::time::Duration;
 
@@ -17,6 +30,295 @@ fn sync_with_epi<'py>(py: Python<'py>, socket: &PyObject, address: &PyObject) ->
     recvfrom_byte(py, socket)
 }
 
+// Returns the slot of agent_id in the agent id table of an episode, adding it to the table if it is not
+// there yet, and whether it was added
+fn get_agent_slot<'py>(
+    agent_id_table: &mut Vec<(Bound<'py, PyAny>, i64)>,
+    agent_id: &Bound<'py, PyAny>,
+    agent_id_hash: i64,
+) -> PyResult<(usize, bool)> {
+    for (slot, (table_agent_id, table_agent_id_hash)) in agent_id_table.iter().enumerate() {
+        if *table_agent_id_hash == agent_id_hash && table_agent_id.eq(agent_id)? {
+            return Ok((slot, false));
+        }
+    }
+    agent_id_table.push((agent_id.clone(), agent_id_hash));
+    Ok((agent_id_table.len() - 1, true))
+}
+
+// A shared memory segment created by this process. The EPI signals this process using the event at the start of the segment.
+pub(crate) struct EpShmSegment {
+    // The event must be dropped before the shared memory it lives in
+    pub(crate) epi_evt: Box<dyn EventImpl>,
+    pub(crate) shmem: Shmem,
+}
+
+impl EpShmSegment {
+    pub(crate) fn create(
+        flinks_folder: &str,
+        proc_id: &str,
+        generation: u64,
+        region_size: usize,
+    ) -> PyResult<Self> {
+        let flink = get_shm_flink(flinks_folder, proc_id, generation);
+        let (shm_size, region_size) = get_shm_size(region_size);
+        let shmem = ShmemConf::new()
+            .size(shm_size)
+            .flink(flink.clone())
+            .create()
+            .map_err(|err| {
+                InvalidStateError::new_err(format!(
+                    "Unable to create shmem flink {}: {}",
+                    flink, err
+                ))
+            })?;
+        // Touch every page from this process first, so that with first-touch NUMA allocation the segment is placed
+        // on the node this process runs on, rather than on the node of whichever process reads it first
+        unsafe { std::ptr::write_bytes(shmem.as_ptr(), 0, shmem.len()) };
+        let (epi_evt, _) = unsafe {
+            Event::new(shmem.as_ptr(), true).map_err(|err| {
+                InvalidStateError::new_err(format!(
+                    "Failed to create event from epi to this process: {}",
+                    err.to_string()
+                ))
+            })?
+        };
+        init_shm_control(unsafe { get_shm_control(&shmem) }, region_size, generation);
+        Ok(EpShmSegment { epi_evt, shmem })
+    }
+
+    // The lifetime of the returned reference is not tied to the borrow of self, so the caller
+    // is responsible for not using it after this segment has been dropped.
+    pub(crate) unsafe fn control<'a>(&self) -> &'a ShmControl {
+        get_shm_control(&self.shmem)
+    }
+
+    pub(crate) fn region_size(&self) -> usize {
+        unsafe { self.control() }
+            .region_size
+            .load(Ordering::Relaxed) as usize
+    }
+}
+
+// Copies the response into the response region and notifies the EPI. If the response doesn't fit in the response region,
+// a segment with larger regions is created first and replaces segment, and the old segment is moved to retired_segment_option.
+// The old segment needs to stay alive until the EPI has opened the new one, which has happened once the next request arrives.
+pub(crate) fn send_response<'py>(
+    py: Python<'py>,
+    segment: &mut EpShmSegment,
+    retired_segment_option: &mut Option<EpShmSegment>,
+    response: &[u8],
+    notifier: &EpNotifier,
+    flinks_folder: &str,
+    proc_id: &str,
+    shm_buffer_max_size: usize,
+) -> PyResult<()> {
+    let shm_control = unsafe { segment.control() };
+    let region_size = shm_control.region_size.load(Ordering::Relaxed) as usize;
+    if response.len() <= region_size {
+        let response_region = unsafe { get_shm_response(&segment.shmem) };
+        response_region[..response.len()].copy_from_slice(response);
+        shm_control
+            .response_len
+            .store(response.len() as u64, Ordering::Release);
+        return notifier.notify(py, shm_control);
+    }
+    if response.len() > shm_buffer_max_size {
+        return Err(InvalidStateError::new_err(format!(
+            "Env process {} sent a response of {} bytes, which exceeds shm_buffer_max_size ({} bytes)",
+            proc_id,
+            response.len(),
+            shm_buffer_max_size
+        )));
+    }
+
+    let new_region_size = min(
+        max(2 * region_size, response.len().next_power_of_two()),
+        shm_buffer_max_size,
+    );
+    println!(
+        "WARNING: env process {} sent a response of {} bytes, which does not fit in its shared memory regions of {} bytes. Growing the regions to {} bytes (shm_buffer_max_size is {} bytes).",
+        proc_id,
+        response.len(),
+        region_size,
+        new_region_size,
+        shm_buffer_max_size
+    );
+    let new_segment = EpShmSegment::create(
+        flinks_folder,
+        proc_id,
+        shm_control.generation.load(Ordering::Relaxed) + 1,
+        new_region_size,
+    )?;
+    let new_response_region = unsafe { get_shm_response(&new_segment.shmem) };
+    new_response_region[..response.len()].copy_from_slice(response);
+    let new_shm_control = unsafe { new_segment.control() };
+    new_shm_control
+        .response_len
+        .store(response.len() as u64, Ordering::Relaxed);
+    new_shm_control.stats.copy_from(&shm_control.stats);
+    // The EPI only knows about the old segment until it picks up this response, so it is notified through the old segment
+    shm_control.superseded.store(1, Ordering::Release);
+    notifier.notify(py, shm_control)?;
+    *retired_segment_option = Some(std::mem::replace(segment, new_segment));
+    Ok(())
+}
+
+// The buffers a response is serialized into before it is copied into shared memory: the response itself, the swap space
+// agent ids are serialized into, and the buffers of the state delta encoders. They all have the size of the shm regions,
+// and grow together with them. They also grow when a response doesn't fit, after which it is serialized again, up to
+// shm_buffer_max_size.
+struct ResponseBuffers {
+    size: usize,
+    max_size: usize,
+    // Responses are serialized into u64 words so that they are at least as aligned as the response region, which keeps the
+    // alignment padding serdes add in front of numpy data valid once they are copied there
+    response_words: Vec<u64>,
+    swap_space: Vec<u8>,
+    state_delta_encoders_option: Option<Vec<StateDeltaEncoder>>,
+}
+
+impl ResponseBuffers {
+    fn new(
+        size: usize,
+        max_size: usize,
+        state_delta_encoders_option: Option<Vec<StateDeltaEncoder>>,
+    ) -> Self {
+        ResponseBuffers {
+            size,
+            max_size,
+            response_words: vec![0_u64; size.div_ceil(size_of::<u64>())],
+            swap_space: vec![0_u8; size],
+            state_delta_encoders_option,
+        }
+    }
+
+    fn response(&self, len: usize) -> &[u8] {
+        &bytemuck::cast_slice::<u64, u8>(&self.response_words[..])[..len]
+    }
+
+    // Grows the buffers to size, keeping what was written to them. Buffers are never shrunk.
+    fn grow(&mut self, size: usize) {
+        if size <= self.size {
+            return;
+        }
+        self.size = size;
+        self.response_words
+            .resize(size.div_ceil(size_of::<u64>()), 0);
+        self.swap_space.resize(size, 0);
+        if let Some(state_delta_encoders) = self.state_delta_encoders_option.as_mut() {
+            for state_delta_encoder in state_delta_encoders.iter_mut() {
+                state_delta_encoder.grow(size);
+            }
+        }
+    }
+
+    // Doubles the size of the buffers after serializing into them failed with err, so that it can be retried. Returns
+    // err instead if it wasn't caused by the data not fitting, or if the buffers can't grow any further.
+    fn grow_after(&mut self, py: Python<'_>, err: PyErr) -> PyResult<()> {
+        if !is_buffer_overflow(py, &err) || self.size >= self.max_size {
+            return Err(err);
+        }
+        self.grow(min(2 * self.size, self.max_size));
+        Ok(())
+    }
+
+    // Serializes an agent id into the swap space, and returns its bytes
+    fn serialize_agent_id<'py>(
+        &mut self,
+        py: Python<'py>,
+        agent_id: &Bound<'py, PyAny>,
+        agent_id_type_serde_option: &Option<&Bound<'py, PyAny>>,
+        agent_id_pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+    ) -> PyResult<Vec<u8>> {
+        loop {
+            let agent_id_result = append_python(
+                &mut self.swap_space[..],
+                0,
+                agent_id,
+                agent_id_type_serde_option,
+                agent_id_pyany_serde_option,
+            );
+            match agent_id_result {
+                Ok((swap_offset, new_pyany_serde_option)) => {
+                    if new_pyany_serde_option.is_some() {
+                        *agent_id_pyany_serde_option = new_pyany_serde_option;
+                    }
+                    return Ok(self.swap_space[0..swap_offset].to_vec());
+                }
+                Err(err) => self.grow_after(py, err)?,
+            }
+        }
+    }
+
+    // Called once the section of the env at env_idx has been written, which makes the state it sent its previous state
+    fn commit_state(&mut self, env_idx: usize) {
+        if let Some(state_delta_encoders) = self.state_delta_encoders_option.as_mut() {
+            state_delta_encoders[env_idx].commit();
+        }
+    }
+}
+
+// Appends the state of an env, prefixed with its length so that the EPI can copy it without deserializing it
+fn append_state<'py>(
+    buf: &mut [u8],
+    offset: usize,
+    state: &Bound<'py, PyAny>,
+    state_delta_encoder_option: Option<&mut StateDeltaEncoder>,
+    state_type_serde_option: &Option<&Bound<'py, PyAny>>,
+    state_pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+) -> PyResult<usize> {
+    let state_offset = offset + size_of::<usize>();
+    let end = match state_delta_encoder_option {
+        Some(state_delta_encoder) => state_delta_encoder.append(
+            buf,
+            state_offset,
+            state,
+            state_type_serde_option,
+            state_pyany_serde_option,
+        )?,
+        None => {
+            let (end, new_pyany_serde_option) = append_python(
+                buf,
+                state_offset,
+                state,
+                state_type_serde_option,
+                state_pyany_serde_option,
+            )?;
+            if new_pyany_serde_option.is_some() {
+                *state_pyany_serde_option = new_pyany_serde_option;
+            }
+            end
+        }
+    };
+    append_usize(buf, offset, end - state_offset)?;
+    Ok(end)
+}
+
+pub(crate) fn open_ep_notifier<'py>(
+    py: Python<'py>,
+    notification_backend: &NotificationBackend,
+    child_end: &PyObject,
+    parent_sockname: &PyObject,
+    flinks_folder: &str,
+    notify_id_option: &Option<String>,
+) -> PyResult<EpNotifier> {
+    Ok(match notification_backend {
+        NotificationBackend::Udp => EpNotifier::Udp {
+            child_end: child_end.clone_ref(py),
+            parent_sockname: parent_sockname.clone_ref(py),
+        },
+        NotificationBackend::ShmEvent => {
+            let notify_id = notify_id_option.as_ref().ok_or(InvalidStateError::new_err(
+                "notify_id must be provided when using the shm_event notification backend",
+            ))?;
+            EpNotifier::ShmEvent {
+                notifier: ShmEventNotifier::open(&get_flink(flinks_folder, notify_id))?,
+            }
+        }
+    })
+}
+
 fn env_reset<'py>(env: &'py Bound<'py, PyAny>) -> PyResult<Bound<'py, PyDict>> {
     Ok(env
         .call_method0(intern!(env.py(), "reset"))?
@@ -100,7 +402,16 @@ fn env_step<'py>(
     send_state_to_agent_controllers=false,
     render=false,
     render_delay_option=None,
-    recalculate_agent_id_every_step=false))]
+    recalculate_agent_id_every_step=false,
+    envs_per_process=1,
+    notification_backend=DEFAULT_NOTIFICATION_BACKEND,
+    notify_id_option=None,
+    shm_buffer_max_size=67108864,
+    intern_agent_ids=false,
+    build_state_metrics_reducer_fn_option=None,
+    state_metrics_flush_interval=1,
+    collect_timings=false,
+    state_delta_keyframe_interval=0))]
 pub fn env_process(
     proc_id: &str,
     child_end: PyObject,
@@ -129,30 +440,32 @@ pub fn env_process(
     render: bool,
     render_delay_option: Option<Duration>,
     recalculate_agent_id_every_step: bool,
+    envs_per_process: usize,
+    notification_backend: &str,
+    notify_id_option: Option<String>,
+    shm_buffer_max_size: usize,
+    intern_agent_ids: bool,
+    build_state_metrics_reducer_fn_option: Option<PyObject>,
+    state_metrics_flush_interval: usize,
+    collect_timings: bool,
+    state_delta_keyframe_interval: usize,
 ) -> PyResult<()> {
-    let flink = get_flink(flinks_folder, proc_id);
-    let mut shmem = ShmemConf::new()
-        .size(shm_buffer_size)
-        .flink(flink.clone())
-        .create()
-        .map_err(|err| {
-            InvalidStateError::new_err(format!("Unable to create shmem flink {}: {}", flink, err))
-        })?;
-    let (epi_evt, used_bytes) = unsafe {
-        Event::new(shmem.as_ptr(), true).map_err(|err| {
-            InvalidStateError::new_err(format!(
-                "Failed to create event from epi to this process: {}",
-                err.to_string()
-            ))
-        })?
-    };
-    let shm_slice = unsafe { &mut shmem.as_slice_mut()[used_bytes..] };
-    let swap_space = &mut vec![0_u8; shm_buffer_size][..];
-    let mut swap_offset = 0;
+    if envs_per_process == 0 {
+        return Err(InvalidStateError::new_err(
+            "envs_per_process must be at least 1",
+        ));
+    }
+    let notification_backend = get_notification_backend(notification_backend)?;
+    let shm_buffer_max_size = max(shm_buffer_max_size, shm_buffer_size);
+    let mut segment = EpShmSegment::create(flinks_folder, proc_id, 0, shm_buffer_size)?;
+    let mut retired_segment_option = None;
 
-    Python::with_gil::<_, PyResult<()>>(|py| {
+    let run = |py: Python<'_>| -> PyResult<()> {
         // Initial setup
-        let env = build_env_fn.call0(py)?.into_bound(py);
+        let mut envs = Vec::with_capacity(envs_per_process);
+        for _ in 0..envs_per_process {
+            envs.push(build_env_fn.call0(py)?.into_bound(py));
+        }
         let mut game_speed_fn: Box<dyn Fn() -> PyResult<f64>> = Box::new(|| Ok(1.0));
         let mut game_paused_fn: Box<dyn Fn() -> PyResult<bool>> = Box::new(|| Ok(false));
         if render {
@@ -207,237 +520,479 @@ pub fn env_process(
         // println!("EP: Initialized for proc_id {}", flink.clone());
         sync_with_epi(py, &child_end, &parent_sockname)?;
 
-        let reset_obs = env_reset(&env)?;
-        let should_collect_state_metrics = !collect_state_metrics_fn_option.is_none()
-            && !state_metrics_type_serde_option.is_none();
-        let mut n_agents = reset_obs.len();
-        let mut agent_id_data_list = Vec::with_capacity(n_agents);
-        for agent_id in reset_obs.keys().iter() {
-            let agent_id_hash = py_hash(&agent_id)?;
-            swap_offset = append_python_update_serde!(
-                swap_space,
-                0,
-                &agent_id,
-                &agent_id_type_serde_option,
-                agent_id_pyany_serde_option
-            );
+        // The EPI has created its notification shm before syncing, so it can be opened now
+        let notifier = open_ep_notifier(
+            py,
+            &notification_backend,
+            &child_end,
+            &parent_sockname,
+            flinks_folder,
+            &notify_id_option,
+        )?;
 
-            agent_id_data_list.push((agent_id, agent_id_hash, swap_space[0..swap_offset].to_vec()));
-        }
+        // This needs to match the condition the EPI uses to decide whether to read state metrics
+        let should_collect_state_metrics = collect_state_metrics_fn_option.is_some()
+            && (state_metrics_type_serde_option.is_some()
+                || state_metrics_pyany_serde_option.is_some());
+
+        // With a state metrics reducer, the state metrics of each env are added to its reducer, and the partial
+        // aggregate is only sent every state_metrics_flush_interval steps and at the end of every episode
+        let env_state_metrics_reducers = match build_state_metrics_reducer_fn_option.as_ref() {
+            Some(build_state_metrics_reducer_fn) if should_collect_state_metrics => Some(
+                envs.iter()
+                    .map(|_| Ok(build_state_metrics_reducer_fn.call0(py)?.into_bound(py)))
+                    .collect::<PyResult<Vec<_>>>()?,
+            ),
+            _ => None,
+        };
+        let mut env_steps_since_flush = vec![0_usize; envs_per_process];
+
+        // With delta encoded states, each env only sends the parts of its serialized state which changed since the
+        // previous state it sent, with a keyframe every state_delta_keyframe_interval states
+        let state_delta_encoders_option = if send_state_to_agent_controllers
+            && state_delta_keyframe_interval > 0
+        {
+            Some(
+                (0..envs_per_process)
+                    .map(|_| StateDeltaEncoder::new(state_delta_keyframe_interval, shm_buffer_size))
+                    .collect::<Vec<_>>(),
+            )
+        } else {
+            None
+        };
+        let mut buffers = ResponseBuffers::new(
+            shm_buffer_size,
+            shm_buffer_max_size,
+            state_delta_encoders_option,
+        );
 
         // Write reset message (TODO: no state metrics?)
+        // The message contains one section per env, in the order the envs were built
+        let mut env_agent_id_data_lists = Vec::with_capacity(envs_per_process);
+        // With interned agent ids, the agent ids of each episode are sent once, and the agents are referred to by
+        // their slot in this table afterwards. New agents are added to the table when they first appear.
+        let mut env_agent_id_tables = Vec::with_capacity(envs_per_process);
+        let mut env_agent_slot_lists: Vec<Vec<(usize, bool)>> =
+            (0..envs_per_process).map(|_| Vec::new()).collect();
         let mut offset = 0;
-        offset = append_usize(shm_slice, offset, n_agents);
-        for (agent_id, _, serialized_agent_id) in agent_id_data_list.iter() {
-            offset = insert_bytes(shm_slice, offset, &serialized_agent_id[..])?;
-            offset = append_python_update_serde!(
-                shm_slice,
-                offset,
-                &reset_obs
-                    .get_item(agent_id)?
-                    .ok_or(InvalidStateError::new_err(
-                        "Reset obs python dict did not contain AgentID as key",
-                    ))?,
-                &obs_type_serde_option,
-                obs_pyany_serde_option
-            );
-        }
+        for (env_idx, env) in envs.iter().enumerate() {
+            let reset_obs = env_reset(env)?;
+            let n_agents = reset_obs.len();
+            let mut agent_id_data_list = Vec::with_capacity(n_agents);
+            for agent_id in reset_obs.keys().iter() {
+                let agent_id_hash = py_hash(&agent_id)?;
+                let serialized_agent_id = buffers.serialize_agent_id(
+                    py,
+                    &agent_id,
+                    &agent_id_type_serde_option,
+                    &mut agent_id_pyany_serde_option,
+                )?;
+                agent_id_data_list.push((agent_id, agent_id_hash, serialized_agent_id));
+            }
 
-        if send_state_to_agent_controllers {
-            _ = append_python_update_serde!(
-                shm_slice,
-                offset,
-                &env_state(&env)?,
-                &state_type_serde_option,
-                state_pyany_serde_option
-            );
+            let mut obs_list = Vec::with_capacity(n_agents);
+            for (agent_id, _, _) in agent_id_data_list.iter() {
+                obs_list.push(
+                    reset_obs
+                        .get_item(agent_id)?
+                        .ok_or(InvalidStateError::new_err(
+                            "Reset obs python dict did not contain AgentID as key",
+                        ))?,
+                );
+            }
+            let obs_list = PyList::new(py, obs_list)?;
+            let state_option = if send_state_to_agent_controllers {
+                Some(env_state(env)?)
+            } else {
+                None
+            };
+            // The section of this env is written again into larger buffers if it doesn't fit
+            offset = loop {
+                let response_buf =
+                    bytemuck::cast_slice_mut::<u64, u8>(&mut buffers.response_words[..]);
+                let env_result = (|| -> PyResult<usize> {
+                    let mut offset = append_usize(response_buf, offset, n_agents)?;
+                    for (_, _, serialized_agent_id) in agent_id_data_list.iter() {
+                        offset = insert_bytes(response_buf, offset, &serialized_agent_id[..])?;
+                    }
+                    // The obs of the agents of an env are homogeneous, so they are appended as one batch after the
+                    // agent ids
+                    offset = append_python_batch_update_serde!(
+                        response_buf,
+                        offset,
+                        &obs_list,
+                        &obs_type_serde_option,
+                        obs_pyany_serde_option
+                    );
+                    if let Some(state) = state_option.as_ref() {
+                        offset = append_state(
+                            response_buf,
+                            offset,
+                            state,
+                            buffers
+                                .state_delta_encoders_option
+                                .as_mut()
+                                .map(|encoders| &mut encoders[env_idx]),
+                            &state_type_serde_option,
+                            &mut state_pyany_serde_option,
+                        )?;
+                    }
+                    Ok(offset)
+                })();
+                match env_result {
+                    Ok(new_offset) => break new_offset,
+                    Err(err) => buffers.grow_after(py, err)?,
+                }
+            };
+            buffers.commit_state(env_idx);
+            env_agent_id_tables.push(if intern_agent_ids {
+                agent_id_data_list
+                    .iter()
+                    .map(|(agent_id, agent_id_hash, _)| (agent_id.clone(), *agent_id_hash))
+                    .collect()
+            } else {
+                Vec::new()
+            });
+            env_agent_id_data_lists.push(agent_id_data_list);
         }
         // println!(
         //     "EP: Sending ready message for reading initial obs for proc_id {}",
         //     flink.clone()
         // );
-        sendto_byte(py, &child_end, &parent_sockname)?;
+        send_response(
+            py,
+            &mut segment,
+            &mut retired_segment_option,
+            buffers.response(offset),
+            &notifier,
+            flinks_folder,
+            proc_id,
+            shm_buffer_max_size,
+        )?;
+        buffers.grow(segment.region_size());
 
         // Start main loop
-        let mut metrics_bytes = Vec::new();
+        let mut env_actions = Vec::with_capacity(envs_per_process);
+        let mut stats = EpStats::new(collect_timings);
         loop {
             // println!("EP: Waiting for signal from EPI...");
-            epi_evt
+            segment
+                .epi_evt
                 .wait(Timeout::Infinite)
                 .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
-            epi_evt
+            segment
+                .epi_evt
                 .set(EventState::Clear)
                 .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
+            // The EPI is using the current segment now
+            retired_segment_option = None;
+            stats.lap(EpStat::WaitNanos);
+            let request_slice = unsafe { get_shm_request(&segment.shmem) };
             offset = 0;
             let header;
-            (header, offset) = retrieve_header(shm_slice, offset)?;
+            (header, offset) = retrieve_header(request_slice, offset)?;
             // println!("EP: Got signal with header {}", header);
             match header {
                 Header::EnvAction => {
-                    let env_action;
-                    (env_action, _) = retrieve_env_action_update_serdes!(
-                        py,
-                        shm_slice,
-                        offset,
-                        agent_id_data_list.len(),
-                        &action_type_serde_option,
-                        action_pyany_serde_option,
-                        &state_type_serde_option,
-                        state_pyany_serde_option
-                    )?;
-                    // Read actions message
-                    let (
-                        obs_dict,
-                        rew_dict_option,
-                        terminated_dict_option,
-                        truncated_dict_option,
-                        is_step_action,
-                    );
-                    match &env_action {
-                        EnvAction::STEP { action_list, .. } => {
-                            let mut actions_kv_list = Vec::with_capacity(agent_id_data_list.len());
-                            let action_list = action_list.bind(py);
-                            for ((agent_id, _, _), action) in
-                                agent_id_data_list.iter().zip(action_list.iter())
-                            {
-                                actions_kv_list.push((agent_id, action));
-                            }
-                            let actions_dict =
-                                PyDict::from_sequence(&actions_kv_list.into_pyobject(py)?)?;
-                            let (rew_dict, terminated_dict, truncated_dict);
-                            (obs_dict, rew_dict, terminated_dict, truncated_dict) =
-                                env_step(&env, actions_dict)?;
-                            rew_dict_option = Some(rew_dict);
-                            terminated_dict_option = Some(terminated_dict);
-                            truncated_dict_option = Some(truncated_dict);
-                            is_step_action = true;
-                        }
-                        EnvAction::RESET {} => {
-                            obs_dict = env_reset(&env)?;
-                            rew_dict_option = None;
-                            terminated_dict_option = None;
-                            truncated_dict_option = None;
-                            is_step_action = false;
-                        }
-                        EnvAction::SET_STATE { desired_state, .. } => {
-                            obs_dict = env_set_state(&env, desired_state.bind(py))?;
-                            rew_dict_option = None;
-                            terminated_dict_option = None;
-                            truncated_dict_option = None;
-                            is_step_action = false;
-                        }
+                    // Read all env actions up front, before any env is stepped
+                    env_actions.clear();
+                    for agent_id_data_list in env_agent_id_data_lists.iter() {
+                        let env_action;
+                        (env_action, offset) = retrieve_env_action_update_serdes!(
+                            py,
+                            request_slice,
+                            offset,
+                            agent_id_data_list.len(),
+                            &action_type_serde_option,
+                            action_pyany_serde_option,
+                            &state_type_serde_option,
+                            state_pyany_serde_option
+                        )?;
+                        env_actions.push(env_action);
                     }
-                    let new_episode = !is_step_action;
-
-                    // Collect metrics
-                    if should_collect_state_metrics {
-                        let result = collect_state_metrics_fn_option
-                            .unwrap()
-                            .call1(py, (env_state(&env)?, &rew_dict_option))?
-                            .into_bound(py);
-                        swap_offset = append_python_update_serde!(
-                            swap_space,
-                            0,
-                            &result,
-                            &state_metrics_type_serde_option,
-                            state_metrics_pyany_serde_option
-                        );
-                        metrics_bytes = swap_space[0..swap_offset].to_vec();
-                    };
+                    stats.lap(EpStat::DeserializeNanos);
 
-                    // Recalculate agent ids if needed
-                    if recalculate_agent_id_every_step {
-                        agent_id_data_list.clear();
-                        for agent_id in obs_dict.keys().iter() {
-                            let agent_id_hash = py_hash(&agent_id)?;
-                            swap_offset = append_python_update_serde!(
-                                swap_space,
-                                0,
-                                &agent_id,
-                                &agent_id_type_serde_option,
-                                agent_id_pyany_serde_option
-                            );
-                            agent_id_data_list.push((
-                                agent_id,
-                                agent_id_hash,
-                                swap_space[0..swap_offset].to_vec(),
-                            ));
+                    offset = 0;
+                    for (
+                        env_idx,
+                        (
+                            env,
+                            env_action,
+                            agent_id_data_list,
+                            agent_id_table,
+                            agent_slot_list,
+                        ),
+                    ) in izip!(
+                        envs.iter(),
+                        env_actions.iter(),
+                        env_agent_id_data_lists.iter_mut(),
+                        env_agent_id_tables.iter_mut(),
+                        env_agent_slot_lists.iter_mut()
+                    )
+                    .enumerate()
+                    {
+                        let (
+                            obs_dict,
+                            rew_dict_option,
+                            terminated_dict_option,
+                            truncated_dict_option,
+                            is_step_action,
+                        );
+                        match env_action {
+                            EnvAction::STEP { action_list, .. } => {
+                                let mut actions_kv_list =
+                                    Vec::with_capacity(agent_id_data_list.len());
+                                let action_list = action_list.bind(py);
+                                for ((agent_id, _, _), action) in
+                                    agent_id_data_list.iter().zip(action_list.iter())
+                                {
+                                    actions_kv_list.push((agent_id, action));
+                                }
+                                let actions_dict =
+                                    PyDict::from_sequence(&actions_kv_list.into_pyobject(py)?)?;
+                                let (rew_dict, terminated_dict, truncated_dict);
+                                (obs_dict, rew_dict, terminated_dict, truncated_dict) =
+                                    env_step(env, actions_dict)?;
+                                rew_dict_option = Some(rew_dict);
+                                terminated_dict_option = Some(terminated_dict);
+                                truncated_dict_option = Some(truncated_dict);
+                                is_step_action = true;
+                                stats.add(EpStat::Steps, 1);
+                            }
+                            EnvAction::RESET {} => {
+                                obs_dict = env_reset(env)?;
+                                rew_dict_option = None;
+                                terminated_dict_option = None;
+                                truncated_dict_option = None;
+                                is_step_action = false;
+                                stats.add(EpStat::Resets, 1);
+                            }
+                            EnvAction::SET_STATE { desired_state, .. } => {
+                                obs_dict = env_set_state(env, desired_state.bind(py))?;
+                                rew_dict_option = None;
+                                terminated_dict_option = None;
+                                truncated_dict_option = None;
+                                is_step_action = false;
+                                stats.add(EpStat::Resets, 1);
+                            }
                         }
-                    }
-                    if new_episode {
-                        n_agents = obs_dict.len();
-                    }
+                        stats.lap(EpStat::EnvNanos);
+                        let new_episode = !is_step_action;
 
-                    // println!("Writing env step message");
-                    // Write env step message
-                    offset = 0;
-                    if new_episode {
-                        offset = append_usize(shm_slice, offset, n_agents);
-                    }
-                    for (agent_id, _, serialized_agent_id) in agent_id_data_list.iter() {
+                        // Recalculate agent ids if needed
                         if recalculate_agent_id_every_step || new_episode {
-                            offset = insert_bytes(shm_slice, offset, &serialized_agent_id[..])?;
+                            agent_id_data_list.clear();
+                            agent_slot_list.clear();
+                            if new_episode {
+                                agent_id_table.clear();
+                            }
+                            for agent_id in obs_dict.keys().iter() {
+                                let agent_id_hash = py_hash(&agent_id)?;
+                                let mut new_agent = true;
+                                if intern_agent_ids {
+                                    let agent_slot;
+                                    (agent_slot, new_agent) =
+                                        get_agent_slot(agent_id_table, &agent_id, agent_id_hash)?;
+                                    agent_slot_list.push((agent_slot, new_agent));
+                                }
+                                // Agents which are already in the agent id table are only sent as their slot
+                                let serialized_agent_id = if new_agent {
+                                    buffers.serialize_agent_id(
+                                        py,
+                                        &agent_id,
+                                        &agent_id_type_serde_option,
+                                        &mut agent_id_pyany_serde_option,
+                                    )?
+                                } else {
+                                    Vec::new()
+                                };
+                                agent_id_data_list.push((
+                                    agent_id,
+                                    agent_id_hash,
+                                    serialized_agent_id,
+                                ));
+                            }
                         }
-                        offset = append_python_update_serde!(
-                            shm_slice,
-                            offset,
-                            &obs_dict.get_item(agent_id)?.unwrap(),
-                            &obs_type_serde_option,
-                            obs_pyany_serde_option
-                        );
+
+                        // The obs and rewards of the agents of an env are homogeneous, so each is appended as one
+                        // batch, in the order of the agent ids
+                        let mut obs_list = Vec::with_capacity(agent_id_data_list.len());
+                        for (agent_id, _, _) in agent_id_data_list.iter() {
+                            obs_list.push(obs_dict.get_item(agent_id)?.unwrap());
+                        }
+                        let obs_list = PyList::new(py, obs_list)?;
+                        let mut reward_list_option = None;
+                        let mut terminated_truncated_list = Vec::new();
+                        let mut episode_done = false;
                         if is_step_action {
-                            offset = append_python_update_serde!(
-                                shm_slice,
-                                offset,
-                                &rew_dict_option
+                            let rew_dict = rew_dict_option.as_ref().unwrap();
+                            let mut reward_list = Vec::with_capacity(agent_id_data_list.len());
+                            for (agent_id, _, _) in agent_id_data_list.iter() {
+                                reward_list.push(rew_dict.get_item(agent_id)?.unwrap());
+                                let terminated = terminated_dict_option
                                     .as_ref()
                                     .unwrap()
                                     .get_item(agent_id)?
-                                    .unwrap(),
-                                &reward_type_serde_option,
-                                reward_pyany_serde_option
-                            );
-                            offset = append_bool(
-                                shm_slice,
-                                offset,
-                                terminated_dict_option
-                                    .as_ref()
                                     .unwrap()
-                                    .get_item(agent_id)?
-                                    .unwrap()
-                                    .extract::<bool>()?,
-                            );
-                            offset = append_bool(
-                                shm_slice,
-                                offset,
-                                truncated_dict_option
+                                    .extract::<bool>()?;
+                                let truncated = truncated_dict_option
                                     .as_ref()
                                     .unwrap()
                                     .get_item(agent_id)?
                                     .unwrap()
-                                    .extract::<bool>()?,
-                            );
+                                    .extract::<bool>()?;
+                                terminated_truncated_list.push((terminated, truncated));
+                                episode_done |= terminated || truncated;
+                            }
+                            reward_list_option = Some(PyList::new(py, reward_list)?);
                         }
-                    }
+                        let state_option = if send_state_to_agent_controllers {
+                            Some(env_state(env)?)
+                        } else {
+                            None
+                        };
+                        stats.lap(EpStat::SerializeNanos);
 
-                    if send_state_to_agent_controllers {
-                        offset = append_python_update_serde!(
-                            shm_slice,
-                            offset,
-                            &env_state(&env)?,
-                            &state_type_serde_option,
-                            state_pyany_serde_option
-                        );
-                    }
+                        // Collect metrics. Holds the state metrics to send if they were collected and are sent.
+                        let mut state_metrics_option = None;
+                        if should_collect_state_metrics {
+                            let mut result = collect_state_metrics_fn_option
+                                .unwrap()
+                                .call1(py, (env_state(env)?, &rew_dict_option))?
+                                .into_bound(py);
+                            let mut should_send = true;
+                            if let Some(reducers) = env_state_metrics_reducers.as_ref() {
+                                let reducer = &reducers[env_idx];
+                                reducer.call_method1(intern!(py, "add"), (&result,))?;
+                                env_steps_since_flush[env_idx] += 1;
+                                should_send = false;
+                                if episode_done
+                                    || env_steps_since_flush[env_idx]
+                                        >= state_metrics_flush_interval
+                                {
+                                    env_steps_since_flush[env_idx] = 0;
+                                    result = reducer.call_method0(intern!(py, "flush"))?;
+                                    should_send = !result.is_none();
+                                }
+                            }
+                            state_metrics_option = Some(should_send.then_some(result));
+                            stats.lap(EpStat::StateMetricsNanos);
+                        }
 
-                    if should_collect_state_metrics {
-                        append_bytes(shm_slice, offset, &metrics_bytes[..])?;
+                        // println!("Writing env step message");
+                        // Write env step message. It is written again into larger buffers if it doesn't fit.
+                        offset = loop {
+                            let response_buf = bytemuck::cast_slice_mut::<u64, u8>(
+                                &mut buffers.response_words[..],
+                            );
+                            let env_result = (|| -> PyResult<usize> {
+                                let mut offset = offset;
+                                if new_episode {
+                                    offset = append_usize(
+                                        response_buf,
+                                        offset,
+                                        agent_id_data_list.len(),
+                                    )?;
+                                }
+                                for (agent_idx, (_, _, serialized_agent_id)) in
+                                    agent_id_data_list.iter().enumerate()
+                                {
+                                    if new_episode
+                                        || (recalculate_agent_id_every_step && !intern_agent_ids)
+                                    {
+                                        offset = insert_bytes(
+                                            response_buf,
+                                            offset,
+                                            &serialized_agent_id[..],
+                                        )?;
+                                    } else if recalculate_agent_id_every_step {
+                                        let (agent_slot, new_agent) = agent_slot_list[agent_idx];
+                                        offset = append_usize(response_buf, offset, agent_slot)?;
+                                        if new_agent {
+                                            offset = insert_bytes(
+                                                response_buf,
+                                                offset,
+                                                &serialized_agent_id[..],
+                                            )?;
+                                        }
+                                    }
+                                }
+                                offset = append_python_batch_update_serde!(
+                                    response_buf,
+                                    offset,
+                                    &obs_list,
+                                    &obs_type_serde_option,
+                                    obs_pyany_serde_option
+                                );
+                                if let Some(reward_list) = reward_list_option.as_ref() {
+                                    offset = append_python_batch_update_serde!(
+                                        response_buf,
+                                        offset,
+                                        reward_list,
+                                        &reward_type_serde_option,
+                                        reward_pyany_serde_option
+                                    );
+                                    for &(terminated, truncated) in terminated_truncated_list.iter()
+                                    {
+                                        offset = append_bool(response_buf, offset, terminated)?;
+                                        offset = append_bool(response_buf, offset, truncated)?;
+                                    }
+                                }
+                                if let Some(state) = state_option.as_ref() {
+                                    offset = append_state(
+                                        response_buf,
+                                        offset,
+                                        state,
+                                        buffers
+                                            .state_delta_encoders_option
+                                            .as_mut()
+                                            .map(|encoders| &mut encoders[env_idx]),
+                                        &state_type_serde_option,
+                                        &mut state_pyany_serde_option,
+                                    )?;
+                                }
+                                if let Some(result_option) = state_metrics_option.as_ref() {
+                                    // The EPI only reads state metrics which have been marked as sent
+                                    offset =
+                                        append_bool(response_buf, offset, result_option.is_some())?;
+                                    if let Some(result) = result_option {
+                                        offset = append_python_update_serde!(
+                                            response_buf,
+                                            offset,
+                                            result,
+                                            &state_metrics_type_serde_option,
+                                            state_metrics_pyany_serde_option
+                                        );
+                                    }
+                                }
+                                Ok(offset)
+                            })();
+                            match env_result {
+                                Ok(new_offset) => break new_offset,
+                                Err(err) => buffers.grow_after(py, err)?,
+                            }
+                        };
+                        buffers.commit_state(env_idx);
+                        stats.lap(EpStat::SerializeNanos);
                     }
-                    sendto_byte(py, &child_end, &parent_sockname)?;
+                    stats.add(EpStat::BytesWritten, offset);
+                    stats.publish(&unsafe { segment.control() }.stats);
+                    send_response(
+                        py,
+                        &mut segment,
+                        &mut retired_segment_option,
+                        buffers.response(offset),
+                        &notifier,
+                        flinks_folder,
+                        proc_id,
+                        shm_buffer_max_size,
+                    )?;
+                    buffers.grow(segment.region_size());
+                    stats.lap(EpStat::ShmWriteNanos);
 
-                    // Render
+                    // Render (only the first env in this process is rendered)
                     if render {
-                        env_render(&env)?;
+                        env_render(&envs[0])?;
                         if let Some(render_delay) = render_delay_option {
                             sleep(Duration::from_micros(
                                 ((render_delay.as_micros() as f64) * game_speed_fn()?).round()
@@ -447,32 +1002,54 @@ pub fn env_process(
                         while game_paused_fn()? {
                             sleep(Duration::from_millis(100));
                         }
+                        stats.lap(EpStat::RenderNanos);
                     }
                 }
                 Header::EnvShapesRequest => {
-                    let obs_space = env_obs_spaces(&env)?.values().get_item(0)?;
-                    let action_space = env_action_spaces(&env)?.values().get_item(0)?;
+                    let obs_space = env_obs_spaces(&envs[0])?.values().get_item(0)?;
+                    let action_space = env_action_spaces(&envs[0])?.values().get_item(0)?;
                     println!("Received request for env shapes, returning:");
                     println!("- Observation space type: {}", obs_space.repr()?);
                     println!("- Action space type: {}", action_space.repr()?);
                     println!("--------------------");
 
-                    offset = 0;
-                    offset = append_python_update_serde!(
-                        shm_slice,
-                        offset,
-                        &obs_space,
-                        &obs_space_type_serde_option,
-                        obs_space_pyany_serde_option
-                    );
-                    append_python_update_serde!(
-                        shm_slice,
-                        offset,
-                        &action_space,
-                        &action_space_type_serde_option,
-                        action_space_pyany_serde_option
-                    );
-                    sendto_byte(py, &child_end, &parent_sockname)?;
+                    // The response is written again into larger buffers if it doesn't fit
+                    offset = loop {
+                        let response_buf =
+                            bytemuck::cast_slice_mut::<u64, u8>(&mut buffers.response_words[..]);
+                        let shapes_result = (|| -> PyResult<usize> {
+                            let mut offset = append_python_update_serde!(
+                                response_buf,
+                                0,
+                                &obs_space,
+                                &obs_space_type_serde_option,
+                                obs_space_pyany_serde_option
+                            );
+                            offset = append_python_update_serde!(
+                                response_buf,
+                                offset,
+                                &action_space,
+                                &action_space_type_serde_option,
+                                action_space_pyany_serde_option
+                            );
+                            Ok(offset)
+                        })();
+                        match shapes_result {
+                            Ok(new_offset) => break new_offset,
+                            Err(err) => buffers.grow_after(py, err)?,
+                        }
+                    };
+                    send_response(
+                        py,
+                        &mut segment,
+                        &mut retired_segment_option,
+                        buffers.response(offset),
+                        &notifier,
+                        flinks_folder,
+                        proc_id,
+                        shm_buffer_max_size,
+                    )?;
+                    buffers.grow(segment.region_size());
                 }
                 Header::Stop => {
                     break;
@@ -481,5 +1058,17 @@ pub fn env_process(
             // println!("EP: Finished processing {}", header);
         }
         Ok(())
+    };
+    Python::with_gil(|py| {
+        run(py).map_err(|err| {
+            if is_buffer_overflow(py, &err) {
+                InvalidStateError::new_err(format!(
+                    "Env process {} could not write its response ({}), which must fit in shm_buffer_max_size ({} bytes)",
+                    proc_id, err, shm_buffer_max_size
+                ))
+            } else {
+                err
+            }
+        })
     })
 }
@@ -1,9 +1,12 @@
 use std::cmp::max;
 use std::cmp::min;
 use std::collections::HashMap;
+use std::sync::atomic::Ordering;
+use std::time::{Duration, Instant};
 
 use itertools::izip;
 use itertools::Itertools;
+use numpy::PyArray1;
 use pyo3::exceptions::asyncio::InvalidStateError;
 use pyo3::intern;
 use pyo3::prelude::*;
@@ -14,6 +17,7 @@ use pyo3::PyObject;
 use raw_sync::events::Event;
 use raw_sync::events::EventInit;
 use raw_sync::events::EventState;
+use raw_sync::Timeout;
 use shared_memory::Shmem;
 use shared_memory::ShmemConf;
 
@@ -21,17 +25,39 @@ use crate::append_env_action_update_serdes;
 use crate::common::misc::clone_list;
 use crate::common::misc::recvfrom_byte;
 use crate::common::misc::sendto_byte;
+use crate::common::misc::stack_if_possible;
 use crate::communication::append_header;
 use crate::communication::get_flink;
+use crate::communication::get_shm_control;
+use crate::communication::get_shm_flink;
+use crate::communication::get_shm_request;
+use crate::communication::get_shm_response;
+use crate::communication::is_buffer_overflow;
+use crate::communication::publish_request_len;
 use crate::communication::retrieve_bool;
+use crate::communication::retrieve_python;
 use crate::communication::retrieve_usize;
 use crate::communication::Header;
 use crate::env_action::EnvAction;
+use crate::env_process_stats::EpStat;
+use crate::env_process_stats::EP_PHASES;
+use crate::env_process_stats::N_EP_STATS;
+use crate::lazy_state::LazyState;
+use crate::min_process_steps_autotuner::MinProcessStepsAutotuner;
+use crate::notification::get_notification_backend;
+use crate::notification::DEFAULT_NOTIFICATION_BACKEND;
+use crate::obs_arena::build_obs_batch;
+use crate::obs_arena::ObsArena;
+use crate::notification::take_response_ready;
+use crate::notification::NotificationBackend;
+use crate::notification::ShmEventNotifier;
+use crate::retrieve_python_batch_update_serde;
 use crate::retrieve_python_update_serde;
 use crate::serdes::pyany_serde::DynPyAnySerde;
 use crate::serdes::pyany_serde::PyAnySerde;
+use crate::state_delta::StateDeltaDecoder;
 
-fn sync_with_env_process<'py>(
+pub(crate) fn sync_with_env_process<'py>(
     py: Python<'py>,
     socket: &PyObject,
     address: &PyObject,
@@ -42,6 +68,55 @@ fn sync_with_env_process<'py>(
 
 static SELECTORS_EVENT_READ: GILOnceCell<u8> = GILOnceCell::new();
 
+fn get_selectors_event_read<'py>(py: Python<'py>) -> u8 {
+    *SELECTORS_EVENT_READ.get_or_init(py, || {
+        PyModule::import(py, "selectors")
+            .unwrap()
+            .getattr("EVENT_READ")
+            .unwrap()
+            .extract()
+            .unwrap()
+    })
+}
+
+// How long to wait for responses before checking whether the processes are still alive, and how often
+// to check while responses are coming in
+const LIVENESS_CHECK_INTERVAL: Duration = Duration::from_secs(1);
+// How long init_processes waits for pending processes to make progress before checking them again
+const PENDING_POLL_INTERVAL: Duration = Duration::from_millis(50);
+
+// Startup stages of a process, in order
+enum PendingProcState {
+    // The process has been started, and will send the address of its socket once it is running
+    Started,
+    // The process is waiting for a launch slot before building its envs
+    Queued { child_sockname: PyObject },
+    // The process is building its envs, and will sync once they are built
+    Launched { child_sockname: PyObject },
+    // The process has synced and its shared memory is open, and it is resetting its envs
+    Synced { shmem: Shmem },
+}
+
+// A process which has not sent its initial obs yet
+struct PendingProc {
+    process: PyObject,
+    parent_end: PyObject,
+    proc_id: String,
+    // Index of the dead process this process replaces, if any
+    replaced_pid_idx_option: Option<usize>,
+    state: PendingProcState,
+}
+
+type ObsDataKV = (PyObject, (Vec<PyObject>, Vec<PyObject>));
+type TimestepDataKV = (
+    PyObject,
+    (PyObject, PyObject, Option<PyObject>, Option<PyObject>),
+);
+type StateInfoKV = (
+    PyObject,
+    (Option<PyObject>, Option<Py<PyDict>>, Option<Py<PyDict>>),
+);
+
 #[pyclass(module = "rlgym_learn_backend", unsendable)]
 pub struct EnvProcessInterface {
     agent_id_type_serde_option: Option<PyObject>,
@@ -61,160 +136,757 @@ pub struct EnvProcessInterface {
     state_metrics_type_serde_option: Option<PyObject>,
     state_metrics_pyany_serde_option: Option<Box<dyn PyAnySerde>>,
     recalculate_agent_id_every_step: bool,
+    intern_agent_ids: bool,
     flinks_folder: String,
     proc_packages: Vec<(PyObject, Shmem, String)>,
+    // The multiprocessing Process of each process, used to check whether it is still alive
+    process_list: Vec<PyObject>,
+    proc_dead_list: Vec<bool>,
+    // Processes which have died since the last call to take_dead_processes
+    dead_pid_idx_list: Vec<usize>,
+    last_liveness_check: Instant,
     min_process_steps_per_inference: usize,
     send_state_to_agent_controllers: bool,
+    // If true, states are returned as LazyState handles which are only deserialized when accessed
+    lazy_state: bool,
+    // If true, the env processes send delta encoded states, which are rebuilt by the state delta decoder of each env
+    delta_states: bool,
     selector: PyObject,
     timestep_class: PyObject,
-    proc_id_pid_idx_map: HashMap<String, usize>,
-    pid_idx_current_env_action_list: Vec<Option<EnvAction>>,
-    pid_idx_current_agent_id_list: Vec<Option<Vec<PyObject>>>,
-    pid_idx_prev_timestep_id_list: Vec<Vec<Option<u128>>>,
-    pid_idx_current_obs_list: Vec<Vec<PyObject>>,
-    pid_idx_current_action_list: Vec<Vec<PyObject>>,
-    pid_idx_current_log_probs_list: Vec<Option<PyObject>>,
+    timestep_batch_class: PyObject,
+    // If true, the timesteps of each env are returned as a TimestepBatch instead of a list of Timesteps
+    timestep_batches: bool,
+    envs_per_process: usize,
+    notification_backend: NotificationBackend,
+    // Only used with the shm_event notification backend
+    notifier_option: Option<ShmEventNotifier>,
+    // Only used when zero_copy_obs or batched_obs is enabled
+    obs_arena_option: Option<ObsArena>,
+    batched_obs: bool,
+    autotuner: MinProcessStepsAutotuner,
+    // The env process stats of each process as of the previous call to get_metrics, by proc id
+    proc_stats_baseline_map: HashMap<String, [u64; N_EP_STATS]>,
+    // Each process hosts envs_per_process envs, so the env with index env_idx
+    // is hosted by the process with index env_idx / envs_per_process
+    env_id_list: Vec<String>,
+    env_id_env_idx_map: HashMap<String, usize>,
+    env_idx_current_env_action_list: Vec<Option<EnvAction>>,
+    env_idx_current_agent_id_list: Vec<Option<Vec<PyObject>>>,
+    // Only used when intern_agent_ids is enabled. The agent id table of the current episode of each env, and the
+    // slot in this table of each of the current agents.
+    env_idx_agent_id_table_list: Vec<Vec<PyObject>>,
+    env_idx_current_agent_slot_list: Vec<Vec<usize>>,
+    env_idx_prev_timestep_id_list: Vec<Vec<Option<u128>>>,
+    env_idx_current_obs_list: Vec<Vec<PyObject>>,
+    env_idx_current_action_list: Vec<Vec<PyObject>>,
+    env_idx_current_log_probs_list: Vec<Option<PyObject>>,
+    // Only used when delta_states is enabled
+    env_idx_state_delta_decoder_list: Vec<Option<StateDeltaDecoder>>,
     added_process_obs_data_kv_list: Vec<(Py<PyAny>, (Vec<PyObject>, Vec<PyObject>))>,
     added_process_state_info_kv_list: Vec<(
         Py<PyAny>,
         (Option<Py<PyAny>>, Option<Py<PyDict>>, Option<Py<PyDict>>),
     )>,
+    // Processes which have been started but have not sent their initial obs yet. They join collect_step_data
+    // once they have.
+    pending_proc_list: Vec<PendingProc>,
+    // Has the parent end of every pending process registered, with the proc id as data
+    pending_selector: PyObject,
+    last_pending_liveness_check: Instant,
+    // Maximum number of pending processes building their envs at the same time, or None for no limit
+    launch_concurrency_option: Option<usize>,
+}
+
+fn get_env_id(proc_id: &str, sub_env_idx: usize, envs_per_process: usize) -> String {
+    if envs_per_process == 1 {
+        proc_id.to_string()
+    } else {
+        format!("{}-{}", proc_id, sub_env_idx)
+    }
 }
 
 impl EnvProcessInterface {
+    // Returns the env process stats summed over the live processes since the previous call
+    fn take_env_process_stats(&mut self) -> [u64; N_EP_STATS] {
+        let mut totals = [0; N_EP_STATS];
+        let mut proc_stats_baseline_map = HashMap::with_capacity(self.proc_packages.len());
+        for ((_, shmem, proc_id), proc_dead) in
+            self.proc_packages.iter().zip(self.proc_dead_list.iter())
+        {
+            if *proc_dead {
+                continue;
+            }
+            let values = unsafe { get_shm_control(shmem) }.stats.read();
+            let baseline = self
+                .proc_stats_baseline_map
+                .get(proc_id)
+                .copied()
+                .unwrap_or([0; N_EP_STATS]);
+            for (total, value, baseline_value) in izip!(&mut totals, &values, &baseline) {
+                *total += value.saturating_sub(*baseline_value);
+            }
+            proc_stats_baseline_map.insert(proc_id.clone(), values);
+        }
+        self.proc_stats_baseline_map = proc_stats_baseline_map;
+        totals
+    }
+
+    // Reads a state written by the process, which is prefixed with its length. If lazy_state is enabled, the
+    // serialized state is copied into a LazyState instead of being deserialized. If delta_states is enabled, the
+    // serialized state is first rebuilt by the state delta decoder of the env.
+    fn retrieve_state<'py>(
+        &self,
+        py: Python<'py>,
+        shm_slice: &[u8],
+        offset: usize,
+        state_pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+        state_delta_decoder_option: &mut Option<StateDeltaDecoder>,
+    ) -> PyResult<(PyObject, usize)> {
+        let (state_len, offset) = retrieve_usize(shm_slice, offset)?;
+        let end = offset + state_len;
+        let state_bytes = match state_delta_decoder_option {
+            Some(state_delta_decoder) => state_delta_decoder.apply(&shm_slice[offset..end])?,
+            None => &shm_slice[offset..end],
+        };
+        if self.lazy_state {
+            let lazy_state = LazyState::new(
+                py,
+                state_bytes,
+                &self.state_type_serde_option,
+                state_pyany_serde_option,
+            );
+            return Ok((Py::new(py, lazy_state)?.into_any(), end));
+        }
+        let state_type_serde_option = self.state_type_serde_option.as_ref().map(|v| v.bind(py));
+        let (state, _, new_state_pyany_serde_option) = retrieve_python(
+            py,
+            state_bytes,
+            0,
+            &state_type_serde_option,
+            state_pyany_serde_option,
+        )?;
+        if new_state_pyany_serde_option.is_some() {
+            *state_pyany_serde_option = new_state_pyany_serde_option;
+        }
+        Ok((state.unbind(), end))
+    }
+
+    // Reads the reset message sent by the process after it is initialized, and sets up the
+    // per-env data for all the envs hosted by the process. The process must already have notified
+    // that the reset message is ready.
+    // Returns the obs data kv pairs and the state info kv pairs for each of these envs.
     fn get_initial_obs_data_proc<'py>(
         &mut self,
         py: Python<'py>,
         pid_idx: usize,
     ) -> PyResult<(
-        (PyObject, (Vec<PyObject>, Vec<PyObject>)),
-        (
+        Vec<(PyObject, (Vec<PyObject>, Vec<PyObject>))>,
+        Vec<(
             PyObject,
             (Option<PyObject>, Option<Py<PyDict>>, Option<Py<PyDict>>),
-        ),
+        )>,
     )> {
         // println!("EPI: Getting initial obs for some proc");
+        let mut agent_id_pyany_serde_option = self.agent_id_pyany_serde_option.take();
+        let mut obs_pyany_serde_option = self.obs_pyany_serde_option.take();
+        let mut state_pyany_serde_option = self.state_pyany_serde_option.take();
+        // The serdes are put back even if reading fails, so that later calls still have them
+        let result = (|| -> PyResult<_> {
+            let agent_id_type_serde_option =
+                self.agent_id_type_serde_option.as_ref().map(|v| v.bind(py));
+            let obs_type_serde_option = self.obs_type_serde_option.as_ref().map(|v| v.bind(py));
+
+            let (_, shmem, proc_id) = self.proc_packages.get(pid_idx).unwrap();
+            let proc_id = proc_id.clone();
+            let shm_slice = unsafe { get_shm_response(shmem) };
+            let mut offset = 0;
+            let mut obs_data_kv_list = Vec::with_capacity(self.envs_per_process);
+            let mut state_info_kv_list = Vec::with_capacity(self.envs_per_process);
+            for sub_env_idx in 0..self.envs_per_process {
+                let n_agents;
+                (n_agents, offset) = retrieve_usize(shm_slice, offset)?;
+                let mut agent_id_list: Vec<PyObject> = Vec::with_capacity(n_agents);
+                let mut agent_id;
+                for _ in 0..n_agents {
+                    (agent_id, offset) = retrieve_python_update_serde!(
+                        py,
+                        shm_slice,
+                        offset,
+                        &agent_id_type_serde_option,
+                        agent_id_pyany_serde_option
+                    );
+                    agent_id_list.push(agent_id.unbind());
+                }
+                let obs_batch;
+                (obs_batch, offset) = retrieve_python_batch_update_serde!(
+                    py,
+                    shm_slice,
+                    offset,
+                    n_agents,
+                    &obs_type_serde_option,
+                    obs_pyany_serde_option
+                );
+                let obs_list: Vec<PyObject> =
+                    obs_batch.into_iter().map(|obs| obs.unbind()).collect();
+
+                let env_id = get_env_id(&proc_id, sub_env_idx, self.envs_per_process);
+                let env_idx = pid_idx * self.envs_per_process + sub_env_idx;
+                // A replacement process takes over the env indices of the process it replaces
+                if env_idx == self.env_id_list.len() {
+                    self.env_id_list.push(String::new());
+                    self.env_idx_current_agent_id_list.push(None);
+                    self.env_idx_agent_id_table_list.push(Vec::new());
+                    self.env_idx_current_agent_slot_list.push(Vec::new());
+                    self.env_idx_current_obs_list.push(Vec::new());
+                    self.env_idx_prev_timestep_id_list.push(Vec::new());
+                    self.env_idx_current_env_action_list.push(None);
+                    self.env_idx_current_action_list.push(Vec::new());
+                    self.env_idx_current_log_probs_list.push(None);
+                    self.env_idx_state_delta_decoder_list.push(None);
+                }
+                self.env_id_env_idx_map.insert(env_id.clone(), env_idx);
+                self.env_idx_current_agent_id_list[env_idx] = Some(clone_list(py, &agent_id_list));
+                if self.intern_agent_ids {
+                    self.env_idx_agent_id_table_list[env_idx] = clone_list(py, &agent_id_list);
+                    self.env_idx_current_agent_slot_list[env_idx] = (0..n_agents).collect();
+                }
+                self.env_idx_current_obs_list[env_idx] = clone_list(py, &obs_list);
+                self.env_idx_prev_timestep_id_list[env_idx] = vec![None; n_agents];
+                self.env_idx_current_env_action_list[env_idx] = None;
+                self.env_idx_current_action_list[env_idx] = Vec::with_capacity(n_agents);
+                self.env_idx_current_log_probs_list[env_idx] = None;
+                // A new process starts its states with a keyframe
+                self.env_idx_state_delta_decoder_list[env_idx] = if self.delta_states {
+                    Some(StateDeltaDecoder::new())
+                } else {
+                    None
+                };
+
+                let state_option;
+                if self.send_state_to_agent_controllers {
+                    let mut state_delta_decoder_option =
+                        self.env_idx_state_delta_decoder_list[env_idx].take();
+                    let state;
+                    (state, offset) = self.retrieve_state(
+                        py,
+                        shm_slice,
+                        offset,
+                        &mut state_pyany_serde_option,
+                        &mut state_delta_decoder_option,
+                    )?;
+                    state_option = Some(state);
+                    self.env_idx_state_delta_decoder_list[env_idx] = state_delta_decoder_option;
+                } else {
+                    state_option = None;
+                }
+
+                let py_env_id = env_id.clone().into_py_any(py)?;
+                self.env_id_list[env_idx] = env_id;
+                obs_data_kv_list.push((py_env_id.clone_ref(py), (agent_id_list, obs_list)));
+                state_info_kv_list.push((py_env_id, (state_option, None, None)));
+            }
+            Ok((obs_data_kv_list, state_info_kv_list))
+        })();
+        self.agent_id_pyany_serde_option = agent_id_pyany_serde_option;
+        self.obs_pyany_serde_option = obs_pyany_serde_option;
+        self.state_pyany_serde_option = state_pyany_serde_option;
+
+        // println!("EPI: Exiting get_initial_obs_proc");
+        result
+    }
+
+    // Reads the response of the env with index env_idx from shm_slice, starting at offset.
+    // Returns number of timesteps collected, plus three kv pairs: the keys are all the env id,
+    // and the values are (agent id list, obs list),
+    // (timestep list or optional timestep batch, log probs, optional state metrics, optional state),
+    // and (optional state, optional terminated dict, optional truncated dict) respectively.
+    // Also returns the offset after the response of this env.
+    fn collect_env_response<'py>(
+        &mut self,
+        py: Python<'py>,
+        env_idx: usize,
+        shm_slice: &[u8],
+        offset: usize,
+    ) -> PyResult<(usize, ObsDataKV, TimestepDataKV, StateInfoKV, usize)> {
+        // println!("Entering collect_env_response for env_idx {}", env_idx);
+        let env_action = self.env_idx_current_env_action_list[env_idx]
+            .as_ref()
+            .ok_or_else(|| {
+                InvalidStateError::new_err(
+                    "Tried to collect response from env which doesn't have an env action yet",
+                )
+            })?;
+        let is_step_action = matches!(env_action, EnvAction::STEP { .. });
+        let new_episode = !is_step_action;
+        let env_id = &self.env_id_list[env_idx];
+        let mut offset = offset;
+        let current_agent_id_list = self
+            .env_idx_current_agent_id_list
+            .get_mut(env_idx)
+            .unwrap()
+            .take()
+            .unwrap();
+
         let agent_id_type_serde_option =
-            self.agent_id_type_serde_option.as_ref().map(|v| v.bind(py));
-        let obs_type_serde_option = self.obs_type_serde_option.as_ref().map(|v| v.bind(py));
+            self.agent_id_type_serde_option.as_mut().map(|v| v.bind(py));
+        let obs_type_serde_option = self.obs_type_serde_option.as_mut().map(|v| v.bind(py));
+        let reward_type_serde_option =
+            self.reward_type_serde_option.as_mut().map(|v| v.bind(py));
 
         let mut agent_id_pyany_serde_option = self.agent_id_pyany_serde_option.take();
         let mut obs_pyany_serde_option = self.obs_pyany_serde_option.take();
+        let mut reward_pyany_serde_option = self.reward_pyany_serde_option.take();
 
-        let (parent_end, shmem, proc_id) = self.proc_packages.get(pid_idx).unwrap();
-        let shm_slice = unsafe { &shmem.as_slice()[Event::size_of(None)..] };
-        recvfrom_byte(py, parent_end)?;
-        let mut offset = 0;
+        // Get n_agents for incoming data and instantiate lists
         let n_agents;
-        (n_agents, offset) = retrieve_usize(shm_slice, offset)?;
-        let mut agent_id_list: Vec<PyObject> = Vec::with_capacity(n_agents);
-        let mut obs_list: Vec<PyObject> = Vec::with_capacity(n_agents);
-        let mut agent_id;
-        let mut obs;
+        let mut agent_id_table = std::mem::take(&mut self.env_idx_agent_id_table_list[env_idx]);
+        let mut agent_slot_list;
+        let (
+            mut agent_id_list,
+            obs_list,
+            reward_list_option,
+            terminated_list_option,
+            truncated_list_option,
+        );
+
+        // println!("new_episode: {}", new_episode);
+        if new_episode {
+            (n_agents, offset) = retrieve_usize(shm_slice, offset)?;
+            agent_id_list = Vec::with_capacity(n_agents);
+            agent_slot_list = if self.intern_agent_ids {
+                (0..n_agents).collect()
+            } else {
+                Vec::new()
+            };
+        } else {
+            n_agents = current_agent_id_list.len();
+            if self.recalculate_agent_id_every_step {
+                agent_id_list = Vec::with_capacity(n_agents);
+                agent_slot_list = Vec::with_capacity(n_agents);
+            } else {
+                agent_id_list = current_agent_id_list;
+                agent_slot_list =
+                    std::mem::take(&mut self.env_idx_current_agent_slot_list[env_idx]);
+            }
+        }
+        // Populate lists
         for _ in 0..n_agents {
-            (agent_id, offset) = retrieve_python_update_serde!(
+            // println!("Retrieving prev info for agent {}", idx + 1);
+            if new_episode || (self.recalculate_agent_id_every_step && !self.intern_agent_ids) {
+                let agent_id;
+                (agent_id, offset) = retrieve_python_update_serde!(
+                    py,
+                    shm_slice,
+                    offset,
+                    &agent_id_type_serde_option,
+                    agent_id_pyany_serde_option
+                );
+                agent_id_list.push(agent_id.unbind());
+            } else if self.recalculate_agent_id_every_step {
+                // The agent id is only sent the first time the agent appears in the episode
+                let agent_slot;
+                (agent_slot, offset) = retrieve_usize(shm_slice, offset)?;
+                if agent_slot == agent_id_table.len() {
+                    let agent_id;
+                    (agent_id, offset) = retrieve_python_update_serde!(
+                        py,
+                        shm_slice,
+                        offset,
+                        &agent_id_type_serde_option,
+                        agent_id_pyany_serde_option
+                    );
+                    agent_id_table.push(agent_id.unbind());
+                }
+                agent_id_list.push(agent_id_table[agent_slot].clone_ref(py));
+                agent_slot_list.push(agent_slot);
+            }
+        }
+        // The obs and rewards of the agents are sent as one batch each, in the order of the agent ids
+        let obs_batch;
+        if let Some(obs_arena) = self.obs_arena_option.as_mut() {
+            (obs_batch, offset) = obs_arena.retrieve_batch(py, shm_slice, offset, n_agents)?;
+        } else {
+            (obs_batch, offset) = retrieve_python_batch_update_serde!(
                 py,
                 shm_slice,
                 offset,
-                &agent_id_type_serde_option,
-                agent_id_pyany_serde_option
+                n_agents,
+                &obs_type_serde_option,
+                obs_pyany_serde_option
             );
-            agent_id_list.push(agent_id.unbind());
-            (obs, offset) = retrieve_python_update_serde!(
+        }
+        obs_list = obs_batch
+            .into_iter()
+            .map(|obs| obs.unbind())
+            .collect::<Vec<PyObject>>();
+        if is_step_action {
+            let reward_batch;
+            (reward_batch, offset) = retrieve_python_batch_update_serde!(
                 py,
                 shm_slice,
                 offset,
-                &obs_type_serde_option,
-                obs_pyany_serde_option
+                n_agents,
+                &reward_type_serde_option,
+                reward_pyany_serde_option
+            );
+            reward_list_option = Some(
+                reward_batch
+                    .into_iter()
+                    .map(|reward| reward.unbind())
+                    .collect::<Vec<PyObject>>(),
             );
-            obs_list.push(obs.unbind());
+            let mut terminated_list = Vec::with_capacity(n_agents);
+            let mut truncated_list = Vec::with_capacity(n_agents);
+            for _ in 0..n_agents {
+                let terminated;
+                (terminated, offset) = retrieve_bool(shm_slice, offset)?;
+                terminated_list.push(terminated);
+                let truncated;
+                (truncated, offset) = retrieve_bool(shm_slice, offset)?;
+                truncated_list.push(truncated);
+            }
+            terminated_list_option = Some(terminated_list);
+            truncated_list_option = Some(truncated_list);
+        } else {
+            reward_list_option = None;
+            terminated_list_option = None;
+            truncated_list_option = None;
         }
 
         let state_option;
         if self.send_state_to_agent_controllers {
-            let state_type_serde_option = self.state_type_serde_option.as_mut().map(|v| v.bind(py));
             let mut state_pyany_serde_option = self.state_pyany_serde_option.take();
+            let mut state_delta_decoder_option =
+                self.env_idx_state_delta_decoder_list[env_idx].take();
             let state;
-            (state, _) = retrieve_python_update_serde!(
+            (state, offset) = self.retrieve_state(
                 py,
                 shm_slice,
                 offset,
-                &state_type_serde_option,
-                state_pyany_serde_option
-            );
-            state_option = Some(state.unbind());
+                &mut state_pyany_serde_option,
+                &mut state_delta_decoder_option,
+            )?;
+            state_option = Some(state);
             self.state_pyany_serde_option = state_pyany_serde_option;
+            self.env_idx_state_delta_decoder_list[env_idx] = state_delta_decoder_option;
         } else {
             state_option = None;
         }
 
+        let metrics_option;
+        if self.state_metrics_type_serde_option.is_some()
+            || self.state_metrics_pyany_serde_option.is_some()
+        {
+            let state_metrics_type_serde_option = self
+                .state_metrics_type_serde_option
+                .as_mut()
+                .map(|v| v.bind(py));
+            // State metrics are not sent every step if the env process reduces them before sending
+            let state_metrics_sent;
+            (state_metrics_sent, offset) = retrieve_bool(shm_slice, offset)?;
+            if state_metrics_sent {
+                let mut state_metrics_pyany_serde_option =
+                    self.state_metrics_pyany_serde_option.take();
+                let state_metrics;
+                (state_metrics, offset) = retrieve_python_update_serde!(
+                    py,
+                    shm_slice,
+                    offset,
+                    &state_metrics_type_serde_option,
+                    state_metrics_pyany_serde_option
+                );
+                metrics_option = Some(state_metrics.unbind());
+                self.state_metrics_pyany_serde_option = state_metrics_pyany_serde_option;
+            } else {
+                metrics_option = None;
+            }
+        } else {
+            metrics_option = None;
+        }
+
+        // println!(
+        //     "env_idx_prev_timestep_id_list len: {}\n
+        //     next_agent_id_list len: {}\n
+        //     env_idx_current_obs_list len: {}\n
+        //     next_obs_list len: {}\n
+        //     env_idx_current_action_list len: {}\n
+        //     env_idx_current_log_prob_list len: {}\n
+        //     next_reward_list len: {}\n
+        //     next_terminated_list len: {}\n
+        //     next_truncated_list len: {}",
+        //     self.env_idx_prev_timestep_id_list
+        //         .get(env_idx)
+        //         .unwrap()
+        //         .len(),
+        //     next_agent_id_list.len(),
+        //     self.env_idx_current_obs_list.get(env_idx).unwrap().len(),
+        //     next_obs_list.len(),
+        //     self.env_idx_current_action_list.get(env_idx).unwrap().len(),
+        //     self.env_idx_current_log_prob_list
+        //         .get(env_idx)
+        //         .unwrap()
+        //         .len(),
+        //     next_reward_list.len(),
+        //     next_terminated_list.len(),
+        //     next_truncated_list.len(),
+        // );
+
+        if new_episode && self.intern_agent_ids {
+            agent_id_table = clone_list(py, &agent_id_list);
+        }
+        self.env_idx_agent_id_table_list[env_idx] = agent_id_table;
+
+        let timestep_id_list_option;
+        let timesteps;
+        let n_timesteps;
+        if is_step_action && self.timestep_batches {
+            // Timestep ids are 64 bit here so that they fit in a numpy array, and 0 is used for no previous timestep
+            let mut timestep_id_list = Vec::with_capacity(n_agents);
+            let mut timestep_ids = Vec::with_capacity(n_agents);
+            for _ in 0..n_agents {
+                let timestep_id = fastrand::u64(1..);
+                timestep_id_list.push(Some(timestep_id as u128));
+                timestep_ids.push(timestep_id);
+            }
+            let previous_timestep_ids = self.env_idx_prev_timestep_id_list[env_idx]
+                .iter()
+                .map(|prev_timestep_id| prev_timestep_id.map_or(0, |id| id as u64))
+                .collect::<Vec<_>>();
+            let agent_slots_option = if self.intern_agent_ids {
+                Some(PyArray1::from_iter(
+                    py,
+                    agent_slot_list.iter().map(|&agent_slot| agent_slot as i64),
+                ))
+            } else {
+                None
+            };
+            timesteps = self
+                .timestep_batch_class
+                .bind(py)
+                .call1((
+                    env_id.into_py_any(py)?,
+                    clone_list(py, &agent_id_list),
+                    PyArray1::from_vec(py, timestep_ids),
+                    PyArray1::from_vec(py, previous_timestep_ids),
+                    stack_if_possible(py, &self.env_idx_current_obs_list[env_idx])?,
+                    stack_if_possible(py, &obs_list)?,
+                    stack_if_possible(py, &self.env_idx_current_action_list[env_idx])?,
+                    stack_if_possible(py, reward_list_option.as_ref().unwrap())?,
+                    PyArray1::from_slice(py, terminated_list_option.as_ref().unwrap()),
+                    PyArray1::from_slice(py, truncated_list_option.as_ref().unwrap()),
+                    agent_slots_option,
+                ))?
+                .unbind();
+            n_timesteps = n_agents;
+            timestep_id_list_option = Some(timestep_id_list);
+        } else if is_step_action {
+            let timestep_class = self.timestep_class.bind(py);
+            let mut timestep_id_list = Vec::with_capacity(n_agents);
+            let mut timestep_list = Vec::with_capacity(n_agents);
+            for (
+                agent_idx,
+                (
+                    prev_timestep_id,
+                    agent_id,
+                    obs,
+                    next_obs,
+                    action,
+                    reward,
+                    &terminated,
+                    &truncated,
+                ),
+            ) in izip!(
+                self.env_idx_prev_timestep_id_list.get(env_idx).unwrap(),
+                &agent_id_list,
+                self.env_idx_current_obs_list.get(env_idx).unwrap(),
+                &obs_list,
+                &self.env_idx_current_action_list[env_idx],
+                reward_list_option.as_ref().unwrap(),
+                terminated_list_option.as_ref().unwrap(),
+                truncated_list_option.as_ref().unwrap()
+            )
+            .enumerate()
+            {
+                let timestep_id = fastrand::u128(..);
+                timestep_id_list.push(Some(timestep_id));
+                timestep_list.push(
+                    timestep_class
+                        .call1((
+                            env_id.into_py_any(py)?,
+                            timestep_id,
+                            *prev_timestep_id,
+                            agent_id.clone_ref(py),
+                            obs,
+                            next_obs,
+                            action,
+                            reward,
+                            terminated,
+                            truncated,
+                            agent_slot_list.get(agent_idx).copied(),
+                        ))?
+                        .unbind(),
+                );
+            }
+            n_timesteps = timestep_list.len();
+            timesteps = timestep_list.into_py_any(py)?;
+            timestep_id_list_option = Some(timestep_id_list);
+        } else {
+            n_timesteps = 0;
+            timesteps = if self.timestep_batches {
+                py.None()
+            } else {
+                Vec::<PyObject>::new().into_py_any(py)?
+            };
+            timestep_id_list_option = None;
+        }
+
+        let terminated_dict_option;
+        let truncated_dict_option;
+        if new_episode {
+            terminated_dict_option = None;
+            truncated_dict_option = None;
+        } else {
+            let mut terminated_kv_list = Vec::with_capacity(n_agents);
+            let mut truncated_kv_list = Vec::with_capacity(n_agents);
+            for (agent_id, terminated, truncated) in izip!(
+                &agent_id_list,
+                terminated_list_option.unwrap(),
+                truncated_list_option.unwrap()
+            ) {
+                terminated_kv_list.push((agent_id.clone_ref(py), terminated));
+                truncated_kv_list.push((agent_id.clone_ref(py), truncated));
+            }
+            terminated_dict_option =
+                Some(PyDict::from_sequence(&terminated_kv_list.into_pyobject(py)?)?.unbind());
+            truncated_dict_option =
+                Some(PyDict::from_sequence(&truncated_kv_list.into_pyobject(py)?)?.unbind());
+        }
+
+        // Set prev_timestep_id_list for proc
+        let prev_timestep_id_list = &mut self.env_idx_prev_timestep_id_list[env_idx];
+        if is_step_action {
+            prev_timestep_id_list.clear();
+            prev_timestep_id_list.append(&mut timestep_id_list_option.unwrap());
+        } else if let EnvAction::SET_STATE {
+            prev_timestep_id_dict_option: Some(prev_timestep_id_dict),
+            ..
+        } = env_action
+        {
+            let prev_timestep_id_dict = prev_timestep_id_dict.downcast_bound::<PyDict>(py)?;
+            prev_timestep_id_list.clear();
+            for agent_id in agent_id_list.iter() {
+                let agent_id = agent_id.bind(py);
+                prev_timestep_id_list.push(
+                    prev_timestep_id_dict
+                        .get_item(agent_id)?
+                        .map_or(Ok(None), |prev_timestep_id| {
+                            prev_timestep_id.extract::<Option<u128>>()
+                        })?,
+                );
+            }
+        } else {
+            prev_timestep_id_list.clear();
+            prev_timestep_id_list.append(&mut vec![None; n_agents]);
+        }
+        self.env_idx_current_agent_id_list[env_idx] = Some(clone_list(py, &agent_id_list));
+        self.env_idx_current_agent_slot_list[env_idx] = agent_slot_list;
+        self.env_idx_current_obs_list[env_idx] = clone_list(py, &obs_list);
         self.agent_id_pyany_serde_option = agent_id_pyany_serde_option;
         self.obs_pyany_serde_option = obs_pyany_serde_option;
+        self.reward_pyany_serde_option = reward_pyany_serde_option;
 
-        let py_proc_id = proc_id.into_py_any(py)?;
+        let py_env_id = env_id.into_py_any(py)?;
+        let obs_data_kv = (py_env_id.clone_ref(py), (agent_id_list, obs_list));
+        let timestep_data_kv = (
+            py_env_id.clone_ref(py),
+            (
+                timesteps,
+                (&self.env_idx_current_log_probs_list[env_idx]).into_py_any(py)?,
+                metrics_option,
+                state_option.as_ref().map(|state| state.clone_ref(py)),
+            ),
+        );
+        let state_info_kv = (
+            py_env_id,
+            (state_option, terminated_dict_option, truncated_dict_option),
+        );
 
-        // println!("EPI: Exiting get_initial_obs_proc");
+        // println!("Exiting collect_response");
         Ok((
-            (py_proc_id.clone_ref(py), (agent_id_list, obs_list)),
-            (py_proc_id, (state_option, None, None)),
+            n_timesteps,
+            obs_data_kv,
+            timestep_data_kv,
+            state_info_kv,
+            offset,
         ))
     }
 
-    fn update_with_initial_obs<'py>(
+    // Reads the response of all the envs hosted by the process with index pid_idx, appending the
+    // kv pairs for each env to the provided lists. Returns the number of timesteps collected.
+    fn collect_response<'py>(
         &mut self,
         py: Python<'py>,
-    ) -> PyResult<(Py<PyDict>, Py<PyDict>)> {
-        let n_procs = self.proc_packages.len();
-        let mut obs_data_kv_list = Vec::with_capacity(n_procs);
-        let mut state_info_kv_list = Vec::with_capacity(n_procs);
-        for pid_idx in 0..n_procs {
-            // println!("EPI: Getting initial obs for pid_idx {}", pid_idx);
-            let ((py_proc_id, (agent_id_list, obs_list)), state_info_kv) =
-                self.get_initial_obs_data_proc(py, pid_idx)?;
-            let n_agents = agent_id_list.len();
-            self.pid_idx_current_agent_id_list
-                .push(Some(clone_list(py, &agent_id_list)));
-            self.pid_idx_current_obs_list
-                .push(clone_list(py, &obs_list));
-            self.pid_idx_prev_timestep_id_list
-                .push(vec![None; n_agents]);
-            obs_data_kv_list.push((py_proc_id, (agent_id_list, obs_list)));
+        pid_idx: usize,
+        obs_data_kv_list: &mut Vec<ObsDataKV>,
+        timestep_data_kv_list: &mut Vec<TimestepDataKV>,
+        state_info_kv_list: &mut Vec<StateInfoKV>,
+    ) -> PyResult<usize> {
+        let (_, shmem, _) = self.proc_packages.get(pid_idx).unwrap();
+        let shm_slice = unsafe { get_shm_response(shmem) };
+        let mut offset = 0;
+        let mut n_timesteps = 0;
+        for sub_env_idx in 0..self.envs_per_process {
+            let (env_n_timesteps, obs_data_kv, timestep_data_kv, state_info_kv);
+            (
+                env_n_timesteps,
+                obs_data_kv,
+                timestep_data_kv,
+                state_info_kv,
+                offset,
+            ) = self.collect_env_response(
+                py,
+                pid_idx * self.envs_per_process + sub_env_idx,
+                shm_slice,
+                offset,
+            )?;
+            n_timesteps += env_n_timesteps;
+            obs_data_kv_list.push(obs_data_kv);
+            timestep_data_kv_list.push(timestep_data_kv);
             state_info_kv_list.push(state_info_kv);
         }
-        // println!("EPI: Done getting initial obs list");
-        Ok((
-            PyDict::from_sequence(&obs_data_kv_list.into_pyobject(py)?)?.unbind(),
-            PyDict::from_sequence(&state_info_kv_list.into_pyobject(py)?)?.unbind(),
-        ))
+        Ok(n_timesteps)
     }
 
     fn get_space_types<'py>(&mut self, py: Python<'py>) -> PyResult<(PyObject, PyObject)> {
+        let (_, shmem, _) = self.proc_packages.get(0).unwrap();
+        let (ep_evt, _) = unsafe {
+            Event::from_existing(shmem.as_ptr()).map_err(|err| {
+                InvalidStateError::new_err(format!("Failed to get event: {}", err.to_string()))
+            })?
+        };
+        let request_slice = unsafe { get_shm_request(shmem) };
+        // println!("EPI: Sending signal with header EnvShapesRequest...");
+        let offset = append_header(request_slice, 0, Header::EnvShapesRequest)?;
+        publish_request_len(unsafe { get_shm_control(shmem) }, offset);
+        ep_evt
+            .set(EventState::Signaled)
+            .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
+        // println!("EPI: Waiting for EP to signal shm is updated with env shapes data...");
+        self.wait_for_process(py, 0)?;
         let obs_space_type_serde_option = self
             .obs_space_type_serde_option
-            .as_mut()
+            .as_ref()
             .map(|v| v.bind(py));
         let action_space_type_serde_option = self
             .action_space_type_serde_option
-            .as_mut()
+            .as_ref()
             .map(|v| v.bind(py));
 
         let mut obs_space_pyany_serde_option = self.obs_space_pyany_serde_option.take();
         let mut action_space_pyany_serde_option = self.action_space_pyany_serde_option.take();
 
-        let (parent_end, shmem, _) = self.proc_packages.get_mut(0).unwrap();
-        let (ep_evt, used_bytes) = unsafe {
-            Event::from_existing(shmem.as_ptr()).map_err(|err| {
-                InvalidStateError::new_err(format!("Failed to get event: {}", err.to_string()))
-            })?
-        };
-        let shm_slice = unsafe { &mut shmem.as_slice_mut()[used_bytes..] };
-        // println!("EPI: Sending signal with header EnvShapesRequest...");
-        append_header(shm_slice, 0, Header::EnvShapesRequest);
-        ep_evt
-            .set(EventState::Signaled)
-            .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
-        // println!("EPI: Waiting for EP to signal shm is updated with env shapes data...");
-        recvfrom_byte(py, parent_end)?;
+        let (_, shmem, _) = self.proc_packages.get(0).unwrap();
+        let shm_slice = unsafe { get_shm_response(shmem) };
         // println!("EPI: Received signal from EP that shm is updated with env shapes data");
         let mut offset = 0;
         let obs_space;
@@ -240,42 +912,339 @@ impl EnvProcessInterface {
         Ok((obs_space.unbind(), action_space.unbind()))
     }
 
-    fn add_proc_package<'py>(
+    fn register_with_selector<'py>(
+        py: Python<'py>,
+        selector: &PyObject,
+        parent_end: &PyObject,
+        data: PyObject,
+    ) -> PyResult<()> {
+        selector.call_method1(
+            py,
+            intern!(py, "register"),
+            (parent_end.clone_ref(py), get_selectors_event_read(py), data),
+        )?;
+        Ok(())
+    }
+
+    fn add_pending_process<'py>(
+        &mut self,
+        py: Python<'py>,
+        proc_package_def: (PyObject, PyObject, String),
+        replaced_pid_idx_option: Option<usize>,
+    ) -> PyResult<()> {
+        let (process, parent_end, proc_id) = proc_package_def;
+        Self::register_with_selector(
+            py,
+            &self.pending_selector,
+            &parent_end,
+            proc_id.clone().into_py_any(py)?,
+        )?;
+        self.pending_proc_list.push(PendingProc {
+            process,
+            parent_end,
+            proc_id,
+            replaced_pid_idx_option,
+            state: PendingProcState::Started,
+        });
+        Ok(())
+    }
+
+    // Advances the startup of the pending processes, blocking for at most timeout while waiting for them.
+    // Queued processes are allowed to build their envs as launch slots become available, and processes which
+    // have sent their initial obs become active. Their initial obs are returned by the next call to
+    // collect_step_data. Returns the ids of pending processes which died before sending their initial obs.
+    fn poll_pending_processes<'py>(
+        &mut self,
+        py: Python<'py>,
+        timeout: Duration,
+    ) -> PyResult<Vec<String>> {
+        let mut readable_proc_id_list = Vec::new();
+        for (key, event) in self
+            .pending_selector
+            .bind(py)
+            .call_method1(intern!(py, "select"), (timeout.as_secs_f64(),))?
+            .extract::<Vec<(PyObject, u8)>>()?
+        {
+            if event & get_selectors_event_read(py) == 0 {
+                continue;
+            }
+            let (_, _, _, proc_id) = key.extract::<(PyObject, PyObject, PyObject, String)>(py)?;
+            readable_proc_id_list.push(proc_id);
+        }
+        let check_liveness = self.last_pending_liveness_check.elapsed() >= LIVENESS_CHECK_INTERVAL;
+        if check_liveness {
+            self.last_pending_liveness_check = Instant::now();
+        }
+
+        let mut dead_proc_id_list = Vec::new();
+        let mut idx = 0;
+        while idx < self.pending_proc_list.len() {
+            let pending_proc = &mut self.pending_proc_list[idx];
+            let readable = readable_proc_id_list.contains(&pending_proc.proc_id);
+            let mut ready = false;
+            match &pending_proc.state {
+                PendingProcState::Started if readable => {
+                    let (_, child_sockname) = pending_proc
+                        .parent_end
+                        .call_method1(py, intern!(py, "recvfrom"), (1,))?
+                        .extract::<(PyObject, PyObject)>(py)?;
+                    pending_proc.state = PendingProcState::Queued { child_sockname };
+                }
+                PendingProcState::Launched { child_sockname } if readable => {
+                    sync_with_env_process(py, &pending_proc.parent_end, child_sockname)?;
+                    let flink = get_flink(&self.flinks_folder[..], pending_proc.proc_id.as_str());
+                    let shmem = ShmemConf::new()
+                        .flink(flink.clone())
+                        .open()
+                        .map_err(|err| {
+                            InvalidStateError::new_err(format!(
+                                "Unable to open shmem flink {}: {}",
+                                flink, err
+                            ))
+                        })?;
+                    pending_proc.state = PendingProcState::Synced { shmem };
+                }
+                PendingProcState::Synced { shmem } => {
+                    ready = match &self.notifier_option {
+                        None => {
+                            if readable {
+                                recvfrom_byte(py, &pending_proc.parent_end)?;
+                            }
+                            readable
+                        }
+                        Some(_) => take_response_ready(unsafe { get_shm_control(shmem) }),
+                    };
+                }
+                _ => (),
+            }
+            if ready {
+                let pending_proc = self.pending_proc_list.remove(idx);
+                self.activate_pending_process(py, pending_proc)?;
+                continue;
+            }
+            if check_liveness
+                && !pending_proc
+                    .process
+                    .call_method0(py, intern!(py, "is_alive"))?
+                    .extract::<bool>(py)?
+            {
+                let pending_proc = self.pending_proc_list.remove(idx);
+                println!(
+                    "Env process {} died before sending its initial obs",
+                    pending_proc.proc_id
+                );
+                self.pending_selector.call_method1(
+                    py,
+                    intern!(py, "unregister"),
+                    (pending_proc.parent_end,),
+                )?;
+                dead_proc_id_list.push(pending_proc.proc_id);
+                continue;
+            }
+            idx += 1;
+        }
+
+        // Let queued processes build their envs, in the order they were started, while there are launch slots available
+        let mut n_launched = self
+            .pending_proc_list
+            .iter()
+            .filter(|pending_proc| {
+                matches!(
+                    pending_proc.state,
+                    PendingProcState::Launched { .. } | PendingProcState::Synced { .. }
+                )
+            })
+            .count();
+        for pending_proc in self.pending_proc_list.iter_mut() {
+            if let Some(launch_concurrency) = self.launch_concurrency_option {
+                if n_launched >= launch_concurrency {
+                    break;
+                }
+            }
+            if let PendingProcState::Queued { child_sockname } = &pending_proc.state {
+                sendto_byte(py, &pending_proc.parent_end, child_sockname)?;
+                let child_sockname = child_sockname.clone_ref(py);
+                pending_proc.state = PendingProcState::Launched { child_sockname };
+                n_launched += 1;
+            }
+        }
+        Ok(dead_proc_id_list)
+    }
+
+    // Makes a pending process which has sent its initial obs active, either as a new process or in place of the
+    // dead process it replaces, and stores its initial obs to be returned by the next call to collect_step_data
+    fn activate_pending_process<'py>(
         &mut self,
         py: Python<'py>,
-        proc_package_def: (PyObject, PyObject, PyObject, String),
+        pending_proc: PendingProc,
     ) -> PyResult<()> {
-        let (_, parent_end, child_sockname, proc_id) = proc_package_def;
-        sync_with_env_process(py, &parent_end, &child_sockname)?;
-        let flink = get_flink(&self.flinks_folder[..], proc_id.as_str());
-        let shmem = ShmemConf::new()
+        let PendingProc {
+            process,
+            parent_end,
+            proc_id,
+            replaced_pid_idx_option,
+            state,
+        } = pending_proc;
+        let PendingProcState::Synced { shmem } = state else {
+            return Err(InvalidStateError::new_err(format!(
+                "Tried to activate env process {} before it synced",
+                proc_id
+            )));
+        };
+        self.pending_selector.call_method1(
+            py,
+            intern!(py, "unregister"),
+            (parent_end.clone_ref(py),),
+        )?;
+        let proc_package = (parent_end.clone_ref(py), shmem, proc_id);
+        let pid_idx = match replaced_pid_idx_option {
+            Some(pid_idx) => {
+                let (_, mut old_shmem, _) =
+                    std::mem::replace(&mut self.proc_packages[pid_idx], proc_package);
+                // The process which created the shared memory is gone, so it needs to be cleaned up from here
+                old_shmem.set_owner(true);
+                self.process_list[pid_idx] = process;
+                self.proc_dead_list[pid_idx] = false;
+                self.autotuner.forget_process(pid_idx);
+                let old_env_id_list = self.env_id_list
+                    [pid_idx * self.envs_per_process..(pid_idx + 1) * self.envs_per_process]
+                    .to_vec();
+                for env_id in old_env_id_list.iter() {
+                    self.env_id_env_idx_map.remove(env_id);
+                }
+                self.added_process_obs_data_kv_list
+                    .retain(|(py_env_id, _)| !old_env_id_list.contains(&py_env_id.to_string()));
+                self.added_process_state_info_kv_list
+                    .retain(|(py_env_id, _)| !old_env_id_list.contains(&py_env_id.to_string()));
+                pid_idx
+            }
+            None => {
+                self.proc_packages.push(proc_package);
+                self.process_list.push(process);
+                self.proc_dead_list.push(false);
+                self.autotuner.set_n_procs(self.proc_packages.len());
+                self.proc_packages.len() - 1
+            }
+        };
+        if self.notification_backend == NotificationBackend::Udp {
+            Self::register_with_selector(py, &self.selector, &parent_end, pid_idx.into_py_any(py)?)?;
+        }
+        self.follow_shm_resize(pid_idx)?;
+        let (mut obs_data_kv_list, mut state_info_kv_list) =
+            self.get_initial_obs_data_proc(py, pid_idx)?;
+        self.added_process_obs_data_kv_list
+            .append(&mut obs_data_kv_list);
+        self.added_process_state_info_kv_list
+            .append(&mut state_info_kv_list);
+        Ok(())
+    }
+
+    // Marks any processes which are no longer alive as dead, so that they are not waited on anymore
+    fn check_process_liveness<'py>(&mut self, py: Python<'py>) -> PyResult<()> {
+        self.last_liveness_check = Instant::now();
+        for (pid_idx, process) in self.process_list.iter().enumerate() {
+            if self.proc_dead_list[pid_idx] {
+                continue;
+            }
+            if !process
+                .call_method0(py, intern!(py, "is_alive"))?
+                .extract::<bool>(py)?
+            {
+                println!(
+                    "Env process {} is no longer alive, dropping its envs",
+                    self.proc_packages[pid_idx].2
+                );
+                self.proc_dead_list[pid_idx] = true;
+                self.dead_pid_idx_list.push(pid_idx);
+            }
+        }
+        Ok(())
+    }
+
+    // Called after picking up a response from the process with index pid_idx. If the process has moved to a
+    // larger shared memory segment to write this response, the new segment replaces the old one.
+    fn follow_shm_resize(&mut self, pid_idx: usize) -> PyResult<()> {
+        let (_, shmem, proc_id) = self.proc_packages.get_mut(pid_idx).unwrap();
+        let shm_control = unsafe { get_shm_control(shmem) };
+        if shm_control.superseded.load(Ordering::Acquire) == 0 {
+            return Ok(());
+        }
+        let flink = get_shm_flink(
+            &self.flinks_folder[..],
+            proc_id.as_str(),
+            shm_control.generation.load(Ordering::Relaxed) + 1,
+        );
+        *shmem = ShmemConf::new()
             .flink(flink.clone())
             .open()
             .map_err(|err| {
                 InvalidStateError::new_err(format!("Unable to open shmem flink {}: {}", flink, err))
             })?;
-        self.selector.call_method1(
-            py,
-            intern!(py, "register"),
-            (
-                parent_end.clone_ref(py),
-                SELECTORS_EVENT_READ.get_or_init(py, || {
-                    PyModule::import(py, "selectors")
-                        .unwrap()
-                        .getattr("EVENT_READ")
-                        .unwrap()
-                        .extract()
-                        .unwrap()
-                }),
-                self.proc_packages.len(),
-            ),
-        )?;
-        self.proc_id_pid_idx_map
-            .insert(proc_id.clone(), self.proc_packages.len());
-        self.proc_packages.push((parent_end, shmem, proc_id));
-
         Ok(())
     }
+
+    // Blocks until the process with index pid_idx has notified that its response is ready
+    fn wait_for_process<'py>(&mut self, py: Python<'py>, pid_idx: usize) -> PyResult<()> {
+        let (parent_end, shmem, _) = self.proc_packages.get(pid_idx).unwrap();
+        match &self.notifier_option {
+            None => recvfrom_byte(py, parent_end)?,
+            Some(notifier) => {
+                let shm_control = unsafe { get_shm_control(shmem) };
+                // The event is shared by all processes, so we may be woken up by another process.
+                // Its flag stays set, so its response will still be picked up later.
+                while !take_response_ready(shm_control) {
+                    notifier.wait(py, Timeout::Infinite)?;
+                }
+            }
+        }
+        self.follow_shm_resize(pid_idx)
+    }
+
+    // Blocks until at least one process has notified that its response is ready, and returns
+    // the indices of all the processes which have done so. Returns an empty list if no process
+    // has done so within LIVENESS_CHECK_INTERVAL.
+    fn wait_for_ready_processes<'py>(&mut self, py: Python<'py>) -> PyResult<Vec<usize>> {
+        let mut ready_pid_idx_list = Vec::new();
+        match &self.notifier_option {
+            None => {
+                for (key, event) in self
+                    .selector
+                    .bind(py)
+                    .call_method1(
+                        intern!(py, "select"),
+                        (LIVENESS_CHECK_INTERVAL.as_secs_f64(),),
+                    )?
+                    .extract::<Vec<(PyObject, u8)>>()?
+                {
+                    if event & get_selectors_event_read(py) == 0 {
+                        continue;
+                    }
+                    let (parent_end, _, _, pid_idx) =
+                        key.extract::<(PyObject, PyObject, PyObject, usize)>(py)?;
+                    recvfrom_byte(py, &parent_end)?;
+                    ready_pid_idx_list.push(pid_idx);
+                }
+            }
+            Some(notifier) => {
+                let mut timed_out = false;
+                loop {
+                    for (pid_idx, (_, shmem, _)) in self.proc_packages.iter().enumerate() {
+                        if take_response_ready(unsafe { get_shm_control(shmem) }) {
+                            ready_pid_idx_list.push(pid_idx);
+                        }
+                    }
+                    if !ready_pid_idx_list.is_empty() || timed_out {
+                        break;
+                    }
+                    timed_out = !notifier.wait_timeout(py, LIVENESS_CHECK_INTERVAL)?;
+                }
+            }
+        }
+        for &pid_idx in ready_pid_idx_list.iter() {
+            self.follow_shm_resize(pid_idx)?;
+        }
+        Ok(ready_pid_idx_list)
+    }
 }
 
 #[pymethods]
@@ -302,6 +1271,15 @@ impl EnvProcessInterface {
         flinks_folder_option,
         min_process_steps_per_inference,
         send_state_to_agent_controllers,
+        envs_per_process=1,
+        notification_backend=DEFAULT_NOTIFICATION_BACKEND,
+        notify_id_option=None,
+        zero_copy_obs=false,
+        batched_obs=false,
+        autotune_min_process_steps_per_inference=false,
+        intern_agent_ids=false,
+        lazy_state=false,
+        delta_states=false,
         ))]
     fn new(
         agent_id_type_serde_option: Option<PyObject>,
@@ -324,7 +1302,35 @@ impl EnvProcessInterface {
         flinks_folder_option: Option<String>,
         min_process_steps_per_inference: usize,
         send_state_to_agent_controllers: bool,
+        envs_per_process: usize,
+        notification_backend: &str,
+        notify_id_option: Option<String>,
+        zero_copy_obs: bool,
+        batched_obs: bool,
+        autotune_min_process_steps_per_inference: bool,
+        intern_agent_ids: bool,
+        lazy_state: bool,
+        delta_states: bool,
     ) -> PyResult<Self> {
+        if (zero_copy_obs || batched_obs) && obs_type_serde_option.is_some() {
+            return Err(InvalidStateError::new_err(
+                "zero_copy_obs and batched_obs require obs_serde to be a numpy RustSerde, but a TypeSerde was provided",
+            ));
+        }
+        let notification_backend = get_notification_backend(notification_backend)?;
+        let flinks_folder = flinks_folder_option.unwrap_or("shmem_flinks".to_string());
+        let notifier_option = match notification_backend {
+            NotificationBackend::Udp => None,
+            NotificationBackend::ShmEvent => {
+                let notify_id = notify_id_option.ok_or(InvalidStateError::new_err(
+                    "notify_id must be provided when using the shm_event notification backend",
+                ))?;
+                Some(ShmEventNotifier::create(&get_flink(
+                    &flinks_folder[..],
+                    &notify_id[..],
+                ))?)
+            }
+        };
         Python::with_gil::<_, PyResult<Self>>(|py| {
             let agent_id_pyany_serde_option =
                 agent_id_serde_option.map(|dyn_serde| dyn_serde.0.unwrap());
@@ -343,10 +1349,17 @@ impl EnvProcessInterface {
             let timestep_class = PyModule::import(py, "rlgym_learn.experience")?
                 .getattr("Timestep")?
                 .unbind();
+            let timestep_batch_class = PyModule::import(py, "rlgym_learn.experience")?
+                .getattr("TimestepBatch")?
+                .unbind();
             let selector = PyModule::import(py, "selectors")?
                 .getattr("DefaultSelector")?
                 .call0()?
                 .unbind();
+            let pending_selector = PyModule::import(py, "selectors")?
+                .getattr("DefaultSelector")?
+                .call0()?
+                .unbind();
             Ok(EnvProcessInterface {
                 agent_id_type_serde_option,
                 agent_id_pyany_serde_option,
@@ -365,137 +1378,187 @@ impl EnvProcessInterface {
                 state_metrics_type_serde_option,
                 state_metrics_pyany_serde_option,
                 recalculate_agent_id_every_step,
-                flinks_folder: flinks_folder_option.unwrap_or("shmem_flinks".to_string()),
+                intern_agent_ids,
+                flinks_folder,
                 proc_packages: Vec::new(),
+                process_list: Vec::new(),
+                proc_dead_list: Vec::new(),
+                dead_pid_idx_list: Vec::new(),
+                last_liveness_check: Instant::now(),
                 min_process_steps_per_inference,
                 send_state_to_agent_controllers,
+                lazy_state,
+                delta_states,
                 selector,
                 timestep_class,
-                proc_id_pid_idx_map: HashMap::new(),
-                pid_idx_current_env_action_list: Vec::new(),
-                pid_idx_current_agent_id_list: Vec::new(),
-                pid_idx_prev_timestep_id_list: Vec::new(),
-                pid_idx_current_obs_list: Vec::new(),
-                pid_idx_current_action_list: Vec::new(),
-                pid_idx_current_log_probs_list: Vec::new(),
+                timestep_batch_class,
+                timestep_batches: false,
+                envs_per_process,
+                notification_backend,
+                notifier_option,
+                // The obs batch is built from the obs retrieved into the arena
+                obs_arena_option: if zero_copy_obs || batched_obs {
+                    Some(ObsArena::new())
+                } else {
+                    None
+                },
+                batched_obs,
+                autotuner: MinProcessStepsAutotuner::new(autotune_min_process_steps_per_inference),
+                proc_stats_baseline_map: HashMap::new(),
+                env_id_list: Vec::new(),
+                env_id_env_idx_map: HashMap::new(),
+                env_idx_current_env_action_list: Vec::new(),
+                env_idx_current_agent_id_list: Vec::new(),
+                env_idx_agent_id_table_list: Vec::new(),
+                env_idx_current_agent_slot_list: Vec::new(),
+                env_idx_prev_timestep_id_list: Vec::new(),
+                env_idx_current_obs_list: Vec::new(),
+                env_idx_current_action_list: Vec::new(),
+                env_idx_current_log_probs_list: Vec::new(),
+                env_idx_state_delta_decoder_list: Vec::new(),
                 added_process_obs_data_kv_list: Vec::new(),
                 added_process_state_info_kv_list: Vec::new(),
+                pending_proc_list: Vec::new(),
+                pending_selector,
+                last_pending_liveness_check: Instant::now(),
+                launch_concurrency_option: None,
             })
         })
     }
 
+    // Starts up the processes concurrently, letting at most launch_concurrency_option of them build their envs
+    // at the same time, and waits for all of them to send their initial obs.
     // Return (
-    // Dict with key being proc_id, and value being (
+    // Dict with key being env id, and value being (
     // list of AgentID,
     // list of ObsType
     // ),
+    // Dict with key being env id, and value being the initial state info,
     // ObsSpaceType,
     // ActionSpaceType
     // )
+    #[pyo3(signature = (proc_package_defs, launch_concurrency_option=None))]
     fn init_processes(
         &mut self,
-        proc_package_defs: Vec<(PyObject, PyObject, PyObject, String)>,
+        proc_package_defs: Vec<(PyObject, PyObject, String)>,
+        launch_concurrency_option: Option<usize>,
     ) -> PyResult<(Py<PyDict>, Py<PyDict>, PyObject, PyObject)> {
+        self.launch_concurrency_option = launch_concurrency_option;
         Python::with_gil(|py| {
-            proc_package_defs
-                .into_iter()
-                .try_for_each::<_, PyResult<()>>(|proc_package_def| {
-                    self.add_proc_package(py, proc_package_def)
-                })?;
-            let (initial_obs_data_dict, initial_state_info_dict) =
-                self.update_with_initial_obs(py)?;
+            for proc_package_def in proc_package_defs.into_iter() {
+                self.add_pending_process(py, proc_package_def, None)?;
+            }
+            while !self.pending_proc_list.is_empty() {
+                let dead_proc_id_list = self.poll_pending_processes(py, PENDING_POLL_INTERVAL)?;
+                if let Some(proc_id) = dead_proc_id_list.first() {
+                    return Err(InvalidStateError::new_err(format!(
+                        "Env process {} died during initialization",
+                        proc_id
+                    )));
+                }
+            }
+            let initial_obs_data_kv_list = std::mem::take(&mut self.added_process_obs_data_kv_list);
+            let initial_state_info_kv_list =
+                std::mem::take(&mut self.added_process_state_info_kv_list);
             let n_procs = self.proc_packages.len();
             self.min_process_steps_per_inference =
                 min(self.min_process_steps_per_inference, n_procs);
-            for _ in 0..n_procs {
-                self.pid_idx_current_env_action_list.push(None);
-                self.pid_idx_current_action_list.push(Vec::new());
-                self.pid_idx_current_log_probs_list.push(None);
-            }
             let (obs_space, action_space) = self.get_space_types(py)?;
 
-            // TODO: delete - was for creating observation dict, but no longer want to do this
-            // let mut initial_obs_kv_list = Vec::with_capacity(n_procs);
-            // for ((_, _, proc_id), agent_id_list, obs_list) in izip!(
-            //     &self.proc_packages,
-            //     &self.pid_idx_current_agent_id_list,
-            //     &self.pid_idx_current_obs_list
-            // ) {
-            //     initial_obs_kv_list.push((
-            //         proc_id,
-            //         (
-            //             clone_list(py, agent_id_list.as_ref().unwrap()),
-            //             clone_list(py, obs_list),
-            //         ),
-            //     ))
-            // }
             Ok((
-                initial_obs_data_dict,
-                initial_state_info_dict,
+                PyDict::from_sequence(&initial_obs_data_kv_list.into_pyobject(py)?)?.unbind(),
+                PyDict::from_sequence(&initial_state_info_kv_list.into_pyobject(py)?)?.unbind(),
                 obs_space,
                 action_space,
             ))
         })
     }
 
-    fn add_process(
-        &mut self,
-        proc_package_def: (PyObject, PyObject, PyObject, String),
-    ) -> PyResult<()> {
+    // Adds a newly started process without waiting for it. The process joins collect_step_data once it has
+    // built its envs and sent its initial obs, which are returned by that call to collect_step_data.
+    fn add_process(&mut self, proc_package_def: (PyObject, PyObject, String)) -> PyResult<()> {
         Python::with_gil(|py| {
-            let pid_idx = self.proc_packages.len();
-            self.add_proc_package(py, proc_package_def)?;
-            let ((py_proc_id, (agent_id_list, obs_list)), state_info_kv) =
-                self.get_initial_obs_data_proc(py, pid_idx)?;
-            let n_agents = agent_id_list.len();
-            self.pid_idx_current_agent_id_list
-                .push(Some(clone_list(py, &agent_id_list)));
-            self.pid_idx_current_obs_list
-                .push(clone_list(py, &obs_list));
-            self.pid_idx_prev_timestep_id_list
-                .push(vec![None; n_agents]);
-            self.pid_idx_current_env_action_list.push(None);
-            self.pid_idx_current_action_list
-                .push(Vec::with_capacity(n_agents));
-            self.pid_idx_current_log_probs_list.push(None);
-            self.added_process_obs_data_kv_list
-                .push((py_proc_id, (agent_id_list, obs_list)));
-            self.added_process_state_info_kv_list.push(state_info_kv);
+            self.add_pending_process(py, proc_package_def, None)?;
+            self.poll_pending_processes(py, Duration::ZERO)?;
             Ok(())
         })
     }
 
-    fn delete_process(&mut self) -> PyResult<()> {
+    // Stops the most recently added process. Returns the ids of the processes which were stopped, which includes
+    // the pending replacement of the process if it is dead.
+    fn delete_process(&mut self) -> PyResult<Vec<String>> {
         let (parent_end, mut shmem, proc_id) = self.proc_packages.pop().unwrap();
-        self.proc_id_pid_idx_map.remove(&proc_id);
-        let (ep_evt, used_bytes) = unsafe {
-            Event::from_existing(shmem.as_ptr()).map_err(|err| {
-                InvalidStateError::new_err(format!("Failed to get event: {}", err.to_string()))
-            })?
-        };
-        let shm_slice = unsafe { &mut shmem.as_slice_mut()[used_bytes..] };
-        // println!("EPI: Sending signal with header Stop...");
-        append_header(shm_slice, 0, Header::Stop);
-        ep_evt
-            .set(EventState::Signaled)
-            .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
-        self.pid_idx_current_agent_id_list.pop();
-        self.pid_idx_prev_timestep_id_list.pop();
-        self.pid_idx_current_obs_list.pop();
-        self.pid_idx_current_env_action_list.pop();
-        self.pid_idx_current_action_list.pop();
-        self.pid_idx_current_log_probs_list.pop();
+        let pid_idx = self.proc_packages.len();
+        self.process_list.pop();
+        let dead = self.proc_dead_list.pop().unwrap();
+        self.dead_pid_idx_list.retain(|&dead_pid_idx| dead_pid_idx != pid_idx);
+        let mut stopped_proc_id_list = vec![proc_id];
+        if dead {
+            // The process which created the shared memory is gone, so it needs to be cleaned up from here
+            shmem.set_owner(true);
+        } else {
+            let (ep_evt, _) = unsafe {
+                Event::from_existing(shmem.as_ptr()).map_err(|err| {
+                    InvalidStateError::new_err(format!("Failed to get event: {}", err.to_string()))
+                })?
+            };
+            let request_slice = unsafe { get_shm_request(&shmem) };
+            // println!("EPI: Sending signal with header Stop...");
+            let offset = append_header(request_slice, 0, Header::Stop)?;
+            publish_request_len(unsafe { get_shm_control(&shmem) }, offset);
+            ep_evt
+                .set(EventState::Signaled)
+                .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
+        }
+        let n_envs = self.env_id_list.len() - self.envs_per_process;
+        let deleted_env_ids = self.env_id_list.split_off(n_envs);
+        for env_id in deleted_env_ids.iter() {
+            self.env_id_env_idx_map.remove(env_id);
+        }
+        self.env_idx_current_agent_id_list.truncate(n_envs);
+        self.env_idx_agent_id_table_list.truncate(n_envs);
+        self.env_idx_current_agent_slot_list.truncate(n_envs);
+        self.env_idx_prev_timestep_id_list.truncate(n_envs);
+        self.env_idx_current_obs_list.truncate(n_envs);
+        self.env_idx_current_env_action_list.truncate(n_envs);
+        self.env_idx_current_action_list.truncate(n_envs);
+        self.env_idx_current_log_probs_list.truncate(n_envs);
+        self.env_idx_state_delta_decoder_list.truncate(n_envs);
+        self.added_process_obs_data_kv_list
+            .retain(|(py_env_id, _)| !deleted_env_ids.contains(&py_env_id.to_string()));
         self.added_process_state_info_kv_list
-            .retain(|(py_proc_id, _)| py_proc_id.to_string() != proc_id);
+            .retain(|(py_env_id, _)| !deleted_env_ids.contains(&py_env_id.to_string()));
         self.min_process_steps_per_inference = min(
             self.min_process_steps_per_inference,
             self.proc_packages.len().try_into().unwrap(),
         );
-        Python::with_gil(|py| {
-            self.selector
-                .call_method1(py, intern!(py, "unregister"), (parent_end,))?;
+        self.autotuner.set_n_procs(self.proc_packages.len());
+        Python::with_gil::<_, PyResult<()>>(|py| {
+            // The parent end of a dead process is unregistered when it is replaced
+            if self.notification_backend == NotificationBackend::Udp && !dead {
+                self.selector
+                    .call_method1(py, intern!(py, "unregister"), (parent_end,))?;
+            }
+            // A pending replacement of this process has nothing left to replace
+            if let Some(idx) = self
+                .pending_proc_list
+                .iter()
+                .position(|pending_proc| pending_proc.replaced_pid_idx_option == Some(pid_idx))
+            {
+                let pending_proc = self.pending_proc_list.remove(idx);
+                pending_proc
+                    .process
+                    .call_method0(py, intern!(py, "terminate"))?;
+                self.pending_selector.call_method1(
+                    py,
+                    intern!(py, "unregister"),
+                    (pending_proc.parent_end,),
+                )?;
+                stopped_proc_id_list.push(pending_proc.proc_id);
+            }
             Ok(())
-        })
+        })?;
+        Ok(stopped_proc_id_list)
     }
 
     fn increase_min_process_steps_per_inference(&mut self) -> usize {
@@ -511,407 +1574,300 @@ impl EnvProcessInterface {
         self.min_process_steps_per_inference
     }
 
+    // Returns the index and id of each process which has died since the last call, along with the ids of the envs it hosted
+    fn take_dead_processes(&mut self) -> Vec<(usize, String, Vec<String>)> {
+        self.dead_pid_idx_list
+            .drain(..)
+            .map(|pid_idx| {
+                (
+                    pid_idx,
+                    self.proc_packages[pid_idx].2.clone(),
+                    self.env_id_list[pid_idx * self.envs_per_process
+                        ..(pid_idx + 1) * self.envs_per_process]
+                        .to_vec(),
+                )
+            })
+            .collect()
+    }
+
+    // Replaces the dead process with index pid_idx by a newly started process, which takes over its env indices
+    // once it has sent its initial obs. These are returned by the call to collect_step_data during which this happens.
+    fn replace_process(
+        &mut self,
+        pid_idx: usize,
+        proc_package_def: (PyObject, PyObject, String),
+    ) -> PyResult<()> {
+        Python::with_gil(|py| {
+            if self.notification_backend == NotificationBackend::Udp {
+                let (old_parent_end, _, _) = &self.proc_packages[pid_idx];
+                self.selector
+                    .call_method1(py, intern!(py, "unregister"), (old_parent_end,))?;
+            }
+            self.add_pending_process(py, proc_package_def, Some(pid_idx))?;
+            self.poll_pending_processes(py, Duration::ZERO)?;
+            Ok(())
+        })
+    }
+
+    // Returns the agent id table of the current episode of the env with the given id, so that the agent slot of a
+    // timestep is the index of its agent id in this list. Only available when intern_agent_ids is enabled.
+    fn get_agent_id_table(&self, env_id: &str) -> PyResult<Vec<PyObject>> {
+        if !self.intern_agent_ids {
+            return Err(InvalidStateError::new_err(
+                "Agent id tables are only kept when intern_agent_ids is enabled",
+            ));
+        }
+        let &env_idx = self.env_id_env_idx_map.get(env_id).ok_or_else(|| {
+            InvalidStateError::new_err(format!("Unknown env id {}", env_id))
+        })?;
+        Python::with_gil(|py| Ok(clone_list(py, &self.env_idx_agent_id_table_list[env_idx])))
+    }
+
+    fn set_autotune_min_process_steps_per_inference(&mut self, enabled: bool) {
+        self.autotuner.set_enabled(enabled);
+    }
+
+    fn get_autotune_min_process_steps_per_inference(&self) -> bool {
+        self.autotuner.is_enabled()
+    }
+
+    // If enabled, the timesteps collected from each env are returned as a single TimestepBatch (or None if there
+    // are no timesteps) instead of a list of Timesteps
+    fn set_timestep_batches(&mut self, enabled: bool) {
+        self.timestep_batches = enabled;
+    }
+
+    // Returns a dict of env process and inference timing metrics, or None if these have not been updated since the last call
+    fn get_metrics(&mut self) -> PyResult<Option<Py<PyDict>>> {
+        let Some(metrics) = self.autotuner.take_latest_metrics() else {
+            return Ok(None);
+        };
+        Python::with_gil(|py| {
+            let metrics_dict = PyDict::new(py);
+            metrics_dict.set_item(
+                "Min Process Steps per Inference",
+                metrics.min_process_steps_per_inference,
+            )?;
+            metrics_dict.set_item("Env Process Steps per Second", metrics.steps_per_second)?;
+            metrics_dict.set_item("Env Step Latency", metrics.env_step_latency)?;
+            metrics_dict.set_item("Inference Latency", metrics.inference_latency)?;
+            metrics_dict.set_item(
+                "Mean Inference Batch Size",
+                metrics.mean_inference_batch_size,
+            )?;
+            metrics_dict.set_item("Learner Idle Fraction", metrics.learner_idle_fraction)?;
+
+            // The stats are only written by processes with env process timings enabled
+            let stats = self.take_env_process_stats();
+            let phase_nanos: u64 = EP_PHASES.iter().map(|(stat, _)| stats[*stat as usize]).sum();
+            if phase_nanos > 0 {
+                for (stat, name) in EP_PHASES.iter() {
+                    metrics_dict.set_item(
+                        format!("Env Process {} Fraction", name),
+                        stats[*stat as usize] as f64 / phase_nanos as f64,
+                    )?;
+                }
+                metrics_dict.set_item("Env Process Steps", stats[EpStat::Steps as usize])?;
+                metrics_dict.set_item("Env Process Resets", stats[EpStat::Resets as usize])?;
+                metrics_dict.set_item(
+                    "Env Process Bytes Written",
+                    stats[EpStat::BytesWritten as usize],
+                )?;
+            }
+            Ok(Some(metrics_dict.unbind()))
+        })
+    }
+
     fn cleanup(&mut self) -> PyResult<()> {
         while let Some(proc_package) = self.proc_packages.pop() {
             let (parent_end, mut shmem, _) = proc_package;
-            let (ep_evt, used_bytes) = unsafe {
+            if self.proc_dead_list.pop().unwrap() {
+                // The parent end of a dead process is unregistered when it is replaced
+                shmem.set_owner(true);
+                continue;
+            }
+            let (ep_evt, _) = unsafe {
                 Event::from_existing(shmem.as_ptr()).map_err(|err| {
                     InvalidStateError::new_err(format!("Failed to get event: {}", err.to_string()))
                 })?
             };
-            let shm_slice = unsafe { &mut shmem.as_slice_mut()[used_bytes..] };
+            let request_slice = unsafe { get_shm_request(&shmem) };
             // println!("EPI: Sending signal with header Stop...");
-            append_header(shm_slice, 0, Header::Stop);
+            let offset = append_header(request_slice, 0, Header::Stop)?;
+            publish_request_len(unsafe { get_shm_control(&shmem) }, offset);
             ep_evt
                 .set(EventState::Signaled)
                 .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
-            Python::with_gil(|py| {
-                self.selector
-                    .call_method1(py, intern!(py, "unregister"), (parent_end,))
-            })?;
+            if self.notification_backend == NotificationBackend::Udp {
+                Python::with_gil(|py| {
+                    self.selector
+                        .call_method1(py, intern!(py, "unregister"), (parent_end,))
+                })?;
+            }
         }
-        self.proc_id_pid_idx_map.clear();
-        self.pid_idx_current_agent_id_list.clear();
-        self.pid_idx_prev_timestep_id_list.clear();
-        self.pid_idx_current_obs_list.clear();
-        self.pid_idx_current_action_list.clear();
-        self.pid_idx_current_log_probs_list.clear();
+        Python::with_gil::<_, PyResult<()>>(|py| {
+            for pending_proc in self.pending_proc_list.drain(..) {
+                pending_proc
+                    .process
+                    .call_method0(py, intern!(py, "terminate"))?;
+                self.pending_selector.call_method1(
+                    py,
+                    intern!(py, "unregister"),
+                    (pending_proc.parent_end,),
+                )?;
+            }
+            Ok(())
+        })?;
+        self.process_list.clear();
+        self.proc_dead_list.clear();
+        self.dead_pid_idx_list.clear();
+        self.env_id_list.clear();
+        self.env_id_env_idx_map.clear();
+        self.env_idx_current_agent_id_list.clear();
+        self.env_idx_agent_id_table_list.clear();
+        self.env_idx_current_agent_slot_list.clear();
+        self.env_idx_prev_timestep_id_list.clear();
+        self.env_idx_current_obs_list.clear();
+        self.env_idx_current_env_action_list.clear();
+        self.env_idx_current_action_list.clear();
+        self.env_idx_current_log_probs_list.clear();
+        self.env_idx_state_delta_decoder_list.clear();
+        self.added_process_obs_data_kv_list.clear();
         self.added_process_state_info_kv_list.clear();
         Ok(())
     }
 
     // Returns: (
-    // list of AgentID
-    // list of ObsType
-    // Dict of timesteps, state metrics, and state by proc id
-    // Dict of state, terminated dict, and truncated dict by proc id
+    // number of timesteps collected
+    // Dict of list of AgentID and list of ObsType by env id, or if batched_obs is enabled,
+    //     a tuple of the obs batch and a dict of list of AgentID and the start and stop rows of the obs batch by env id
+    // Dict of timesteps, log probs, state metrics, and state by env id
+    // Dict of state, terminated dict, and truncated dict by env id
     // )
-    fn collect_step_data(&mut self) -> PyResult<(usize, Py<PyDict>, Py<PyDict>, Py<PyDict>)> {
+    fn collect_step_data(&mut self) -> PyResult<(usize, PyObject, Py<PyDict>, Py<PyDict>)> {
+        // Pending processes which have sent their initial obs join from this call on
+        if !self.pending_proc_list.is_empty() {
+            Python::with_gil(|py| self.poll_pending_processes(py, Duration::ZERO))?;
+        }
         let mut n_process_steps_collected = 0;
         let mut total_timesteps_collected = 0;
-        let mut obs_data_kv_list = Vec::with_capacity(self.min_process_steps_per_inference);
-        let mut timestep_data_kv_list = Vec::with_capacity(self.min_process_steps_per_inference);
-        let mut state_info_kv_list = Vec::with_capacity(
-            self.min_process_steps_per_inference + self.added_process_state_info_kv_list.len(),
-        );
+        let n_envs_collected = self.min_process_steps_per_inference * self.envs_per_process;
+        let mut obs_data_kv_list =
+            Vec::with_capacity(n_envs_collected + self.added_process_obs_data_kv_list.len());
+        let mut timestep_data_kv_list = Vec::with_capacity(n_envs_collected);
+        let mut state_info_kv_list =
+            Vec::with_capacity(n_envs_collected + self.added_process_state_info_kv_list.len());
         obs_data_kv_list.append(&mut self.added_process_obs_data_kv_list);
         state_info_kv_list.append(&mut self.added_process_state_info_kv_list);
         Python::with_gil(|py| {
-            while n_process_steps_collected < self.min_process_steps_per_inference {
-                for (key, event) in self
-                    .selector
-                    .bind(py)
-                    .call_method0(intern!(py, "select"))?
-                    .extract::<Vec<(PyObject, u8)>>()?
+            if let Some(obs_arena) = self.obs_arena_option.as_mut() {
+                obs_arena.reset(py);
+            }
+            self.autotuner.on_collect_start();
+            let n_dead_processes_before = self.dead_pid_idx_list.len();
+            loop {
+                let n_alive_processes =
+                    self.proc_dead_list.iter().filter(|&&dead| !dead).count();
+                if n_process_steps_collected
+                    >= min(self.min_process_steps_per_inference, n_alive_processes)
                 {
-                    if event & SELECTORS_EVENT_READ.get(py).unwrap() == 0 {
-                        continue;
-                    }
-                    let (parent_end, _, _, pid_idx) =
-                        key.extract::<(PyObject, PyObject, PyObject, usize)>(py)?;
-                    recvfrom_byte(py, &parent_end)?;
-                    let (n_timesteps, obs_data_kv, timestep_data_kv, state_info_kv) =
-                        self.collect_response(pid_idx)?;
-                    obs_data_kv_list.push(obs_data_kv);
-                    timestep_data_kv_list.push(timestep_data_kv);
-                    state_info_kv_list.push(state_info_kv);
+                    break;
+                }
+                let ready_pid_idx_list = self.wait_for_ready_processes(py)?;
+                if ready_pid_idx_list.is_empty()
+                    || self.last_liveness_check.elapsed() >= LIVENESS_CHECK_INTERVAL
+                {
+                    self.check_process_liveness(py)?;
+                }
+                for pid_idx in ready_pid_idx_list {
+                    self.autotuner.on_response_collected(pid_idx);
+                    let n_timesteps = self.collect_response(
+                        py,
+                        pid_idx,
+                        &mut obs_data_kv_list,
+                        &mut timestep_data_kv_list,
+                        &mut state_info_kv_list,
+                    )?;
                     n_process_steps_collected += 1;
                     total_timesteps_collected += n_timesteps;
                 }
             }
+            // A process which died after responding during this call can't be sent env actions, so its envs are left out
+            if self.dead_pid_idx_list.len() > n_dead_processes_before {
+                let dead_env_id_list = self.dead_pid_idx_list[n_dead_processes_before..]
+                    .iter()
+                    .flat_map(|&pid_idx| {
+                        self.env_id_list[pid_idx * self.envs_per_process
+                            ..(pid_idx + 1) * self.envs_per_process]
+                            .iter()
+                            .cloned()
+                    })
+                    .collect::<Vec<_>>();
+                let is_alive_env = |py_env_id: &PyObject| {
+                    !dead_env_id_list.contains(&py_env_id.to_string())
+                };
+                obs_data_kv_list.retain(|(py_env_id, _)| is_alive_env(py_env_id));
+                timestep_data_kv_list.retain(|(py_env_id, _)| is_alive_env(py_env_id));
+                state_info_kv_list.retain(|(py_env_id, _)| is_alive_env(py_env_id));
+            }
+            self.min_process_steps_per_inference = self.autotuner.on_collect_end(
+                n_process_steps_collected,
+                total_timesteps_collected,
+                self.min_process_steps_per_inference,
+                self.proc_packages.len(),
+            );
+            let obs_data = if self.batched_obs {
+                let mut batch_obs_list = Vec::new();
+                let mut obs_index_kv_list = Vec::with_capacity(obs_data_kv_list.len());
+                for (env_id, (agent_id_list, mut obs_list)) in obs_data_kv_list.into_iter() {
+                    let start = batch_obs_list.len();
+                    batch_obs_list.append(&mut obs_list);
+                    obs_index_kv_list.push((env_id, (agent_id_list, start, batch_obs_list.len())));
+                }
+                (
+                    build_obs_batch(py, &batch_obs_list)?,
+                    PyDict::from_sequence(&obs_index_kv_list.into_pyobject(py)?)?,
+                )
+                    .into_py_any(py)?
+            } else {
+                PyDict::from_sequence(&obs_data_kv_list.into_pyobject(py)?)?.into_any().unbind()
+            };
             Ok((
                 total_timesteps_collected,
-                PyDict::from_sequence(&obs_data_kv_list.into_pyobject(py)?)?.unbind(),
+                obs_data,
                 PyDict::from_sequence(&timestep_data_kv_list.into_pyobject(py)?)?.unbind(),
                 PyDict::from_sequence(&state_info_kv_list.into_pyobject(py)?)?.unbind(),
             ))
         })
     }
 
-    // Returns number of timesteps collected, plus three kv pairs: the keys are all the proc id,
-    // and the values are (agent id list, obs list),
-    // (timestep list, optional state metrics, optional state),
-    // and (optional state, optional terminated dict, optional truncated dict) respectively
-    fn collect_response(
-        &mut self,
-        pid_idx: usize,
-    ) -> PyResult<(
-        usize,
-        (PyObject, (Vec<PyObject>, Vec<PyObject>)),
-        (
-            PyObject,
-            (Vec<PyObject>, PyObject, Option<PyObject>, Option<PyObject>),
-        ),
-        (
-            PyObject,
-            (Option<PyObject>, Option<Py<PyDict>>, Option<Py<PyDict>>),
-        ),
-    )> {
-        // println!("Entering collect_response for pid_idx {}", pid_idx);
-        let env_action = self.pid_idx_current_env_action_list[pid_idx]
-            .as_ref()
-            .ok_or_else(|| {
-                InvalidStateError::new_err(
-                    "Tried to collect response from env which doesn't have an env action yet",
-                )
+    fn send_env_actions(&mut self, env_actions: HashMap<String, EnvAction>) -> PyResult<()> {
+        // println!("EPI: Entering send_actions");
+        // All the envs hosted by a process are stepped together, so group the env actions by process first
+        let mut pid_idx_env_actions_map: HashMap<usize, Vec<Option<EnvAction>>> = HashMap::new();
+        for (env_id, env_action) in env_actions.into_iter() {
+            let &env_idx = self.env_id_env_idx_map.get(&env_id).ok_or_else(|| {
+                InvalidStateError::new_err(format!(
+                    "Tried to send env action to unknown env id {}",
+                    env_id
+                ))
             })?;
-        let is_step_action = matches!(env_action, EnvAction::STEP { .. });
-        let new_episode = !is_step_action;
-        let (_, shmem, proc_id) = self.proc_packages.get(pid_idx).unwrap();
-        let evt_used_bytes = Event::size_of(None);
-        let shm_slice = unsafe { &shmem.as_slice()[evt_used_bytes..] };
-        let mut offset = 0;
-        Python::with_gil(|py| {
-            let current_agent_id_list = self
-                .pid_idx_current_agent_id_list
-                .get_mut(pid_idx)
-                .unwrap()
-                .take()
-                .unwrap();
-
-            let agent_id_type_serde_option =
-                self.agent_id_type_serde_option.as_mut().map(|v| v.bind(py));
-            let obs_type_serde_option = self.obs_type_serde_option.as_mut().map(|v| v.bind(py));
-            let reward_type_serde_option =
-                self.reward_type_serde_option.as_mut().map(|v| v.bind(py));
-
-            let mut agent_id_pyany_serde_option = self.agent_id_pyany_serde_option.take();
-            let mut obs_pyany_serde_option = self.obs_pyany_serde_option.take();
-            let mut reward_pyany_serde_option = self.reward_pyany_serde_option.take();
-
-            // Get n_agents for incoming data and instantiate lists
-            let n_agents;
-            let (
-                mut agent_id_list,
-                mut obs_list,
-                mut reward_list_option,
-                mut terminated_list_option,
-                mut truncated_list_option,
-            );
-
-            // println!("new_episode: {}", new_episode);
-            if new_episode {
-                (n_agents, offset) = retrieve_usize(shm_slice, offset)?;
-                agent_id_list = Vec::with_capacity(n_agents);
-            } else {
-                n_agents = current_agent_id_list.len();
-                if self.recalculate_agent_id_every_step {
-                    agent_id_list = Vec::with_capacity(n_agents);
-                } else {
-                    agent_id_list = current_agent_id_list;
-                }
-            }
-            obs_list = Vec::with_capacity(n_agents);
-            if is_step_action {
-                reward_list_option = Some(Vec::with_capacity(n_agents));
-                terminated_list_option = Some(Vec::with_capacity(n_agents));
-                truncated_list_option = Some(Vec::with_capacity(n_agents));
-            } else {
-                reward_list_option = None;
-                terminated_list_option = None;
-                truncated_list_option = None;
-            }
-
-            // Populate lists
-            for _ in 0..n_agents {
-                // println!("Retrieving prev info for agent {}", idx + 1);
-                if self.recalculate_agent_id_every_step || new_episode {
-                    let agent_id;
-                    (agent_id, offset) = retrieve_python_update_serde!(
-                        py,
-                        shm_slice,
-                        offset,
-                        &agent_id_type_serde_option,
-                        agent_id_pyany_serde_option
-                    );
-                    agent_id_list.push(agent_id.unbind());
-                }
-                let obs;
-                (obs, offset) = retrieve_python_update_serde!(
-                    py,
-                    shm_slice,
-                    offset,
-                    &obs_type_serde_option,
-                    obs_pyany_serde_option
-                );
-                obs_list.push(obs.unbind());
-                if is_step_action {
-                    let reward;
-                    (reward, offset) = retrieve_python_update_serde!(
-                        py,
-                        shm_slice,
-                        offset,
-                        &reward_type_serde_option,
-                        reward_pyany_serde_option
-                    );
-                    reward_list_option.as_mut().unwrap().push(reward.unbind());
-                    let terminated;
-                    (terminated, offset) = retrieve_bool(shm_slice, offset)?;
-                    terminated_list_option.as_mut().unwrap().push(terminated);
-                    let truncated;
-                    (truncated, offset) = retrieve_bool(shm_slice, offset)?;
-                    truncated_list_option.as_mut().unwrap().push(truncated);
-                }
-            }
-
-            let state_option;
-            if self.send_state_to_agent_controllers {
-                let state_type_serde_option =
-                    self.state_type_serde_option.as_mut().map(|v| v.bind(py));
-                let mut state_pyany_serde_option = self.state_pyany_serde_option.take();
-                let state;
-                (state, offset) = retrieve_python_update_serde!(
-                    py,
-                    shm_slice,
-                    offset,
-                    &state_type_serde_option,
-                    state_pyany_serde_option
-                );
-                state_option = Some(state.unbind());
-                self.state_pyany_serde_option = state_pyany_serde_option;
-            } else {
-                state_option = None;
-            }
-
-            let metrics_option;
-            if self.state_metrics_type_serde_option.is_some()
-                || self.state_metrics_pyany_serde_option.is_some()
+            pid_idx_env_actions_map
+                .entry(env_idx / self.envs_per_process)
+                .or_insert_with(|| (0..self.envs_per_process).map(|_| None).collect())
+                [env_idx % self.envs_per_process] = Some(env_action);
+        }
+        for (&pid_idx, proc_env_actions) in pid_idx_env_actions_map.iter() {
+            if proc_env_actions
+                .iter()
+                .any(|env_action| env_action.is_none())
             {
-                let state_metrics_type_serde_option = self
-                    .state_metrics_type_serde_option
-                    .as_mut()
-                    .map(|v| v.bind(py));
-                let mut state_metrics_pyany_serde_option =
-                    self.state_metrics_pyany_serde_option.take();
-                let state_metrics;
-                (state_metrics, offset) = retrieve_python_update_serde!(
-                    py,
-                    shm_slice,
-                    offset,
-                    &state_metrics_type_serde_option,
-                    state_metrics_pyany_serde_option
-                );
-                metrics_option = Some(state_metrics.unbind());
-                self.state_metrics_pyany_serde_option = state_metrics_pyany_serde_option;
-            } else {
-                metrics_option = None;
-            }
-
-            // println!(
-            //     "pid_idx_prev_timestep_id_list len: {}\n
-            //     next_agent_id_list len: {}\n
-            //     pid_idx_current_obs_list len: {}\n
-            //     next_obs_list len: {}\n
-            //     pid_idx_current_action_list len: {}\n
-            //     pid_idx_current_log_prob_list len: {}\n
-            //     next_reward_list len: {}\n
-            //     next_terminated_list len: {}\n
-            //     next_truncated_list len: {}",
-            //     self.pid_idx_prev_timestep_id_list
-            //         .get(pid_idx)
-            //         .unwrap()
-            //         .len(),
-            //     next_agent_id_list.len(),
-            //     self.pid_idx_current_obs_list.get(pid_idx).unwrap().len(),
-            //     next_obs_list.len(),
-            //     self.pid_idx_current_action_list.get(pid_idx).unwrap().len(),
-            //     self.pid_idx_current_log_prob_list
-            //         .get(pid_idx)
-            //         .unwrap()
-            //         .len(),
-            //     next_reward_list.len(),
-            //     next_terminated_list.len(),
-            //     next_truncated_list.len(),
-            // );
-
-            let timestep_id_list_option;
-            let mut timestep_list;
-            if is_step_action {
-                let timestep_class = self.timestep_class.bind(py);
-                let mut timestep_id_list = Vec::with_capacity(n_agents);
-                timestep_list = Vec::with_capacity(n_agents);
-                for (
-                    prev_timestep_id,
-                    agent_id,
-                    obs,
-                    next_obs,
-                    action,
-                    reward,
-                    &terminated,
-                    &truncated,
-                ) in izip!(
-                    self.pid_idx_prev_timestep_id_list.get(pid_idx).unwrap(),
-                    &agent_id_list,
-                    self.pid_idx_current_obs_list.get(pid_idx).unwrap(),
-                    &obs_list,
-                    &self.pid_idx_current_action_list[pid_idx],
-                    reward_list_option.as_ref().unwrap(),
-                    terminated_list_option.as_ref().unwrap(),
-                    truncated_list_option.as_ref().unwrap()
-                ) {
-                    let timestep_id = fastrand::u128(..);
-                    timestep_id_list.push(Some(timestep_id));
-                    timestep_list.push(
-                        timestep_class
-                            .call1((
-                                proc_id.into_py_any(py)?,
-                                timestep_id,
-                                *prev_timestep_id,
-                                agent_id.clone_ref(py),
-                                obs,
-                                next_obs,
-                                action,
-                                reward,
-                                terminated,
-                                truncated,
-                            ))?
-                            .unbind(),
-                    );
-                }
-                timestep_id_list_option = Some(timestep_id_list);
-            } else {
-                timestep_id_list_option = None;
-                timestep_list = Vec::new();
+                return Err(InvalidStateError::new_err(format!(
+                    "All envs hosted by process {} must be sent env actions together",
+                    self.proc_packages[pid_idx].2
+                )));
             }
-            let n_timesteps = timestep_list.len();
-
-            let terminated_dict_option;
-            let truncated_dict_option;
-            if new_episode {
-                terminated_dict_option = None;
-                truncated_dict_option = None;
-            } else {
-                let mut terminated_kv_list = Vec::with_capacity(n_agents);
-                let mut truncated_kv_list = Vec::with_capacity(n_agents);
-                for (agent_id, terminated, truncated) in izip!(
-                    &agent_id_list,
-                    terminated_list_option.unwrap(),
-                    truncated_list_option.unwrap()
-                ) {
-                    terminated_kv_list.push((agent_id.clone_ref(py), terminated));
-                    truncated_kv_list.push((agent_id.clone_ref(py), truncated));
-                }
-                terminated_dict_option =
-                    Some(PyDict::from_sequence(&terminated_kv_list.into_pyobject(py)?)?.unbind());
-                truncated_dict_option =
-                    Some(PyDict::from_sequence(&truncated_kv_list.into_pyobject(py)?)?.unbind());
-            }
-
-            // Set prev_timestep_id_list for proc
-            let prev_timestep_id_list = &mut self.pid_idx_prev_timestep_id_list[pid_idx];
-            if is_step_action {
-                prev_timestep_id_list.clear();
-                prev_timestep_id_list.append(&mut timestep_id_list_option.unwrap());
-            } else if let EnvAction::SET_STATE {
-                prev_timestep_id_dict_option: Some(prev_timestep_id_dict),
-                ..
-            } = env_action
-            {
-                let prev_timestep_id_dict = prev_timestep_id_dict.downcast_bound::<PyDict>(py)?;
-                prev_timestep_id_list.clear();
-                for agent_id in agent_id_list.iter() {
-                    let agent_id = agent_id.bind(py);
-                    prev_timestep_id_list.push(
-                        prev_timestep_id_dict
-                            .get_item(agent_id)?
-                            .map_or(Ok(None), |prev_timestep_id| {
-                                prev_timestep_id.extract::<Option<u128>>()
-                            })?,
-                    );
-                }
-            } else {
-                prev_timestep_id_list.clear();
-                prev_timestep_id_list.append(&mut vec![None; n_agents]);
-            }
-            self.pid_idx_current_agent_id_list[pid_idx] = Some(clone_list(py, &agent_id_list));
-            self.pid_idx_current_obs_list[pid_idx] = clone_list(py, &obs_list);
-            self.agent_id_pyany_serde_option = agent_id_pyany_serde_option;
-            self.obs_pyany_serde_option = obs_pyany_serde_option;
-            self.reward_pyany_serde_option = reward_pyany_serde_option;
-
-            let py_proc_id = proc_id.into_py_any(py)?;
-            let obs_data_kv = (py_proc_id.clone_ref(py), (agent_id_list, obs_list));
-            let timestep_data_kv = (
-                py_proc_id.clone_ref(py),
-                (
-                    timestep_list,
-                    (&self.pid_idx_current_log_probs_list[pid_idx]).into_py_any(py)?,
-                    metrics_option,
-                    state_option.as_ref().map(|state| state.clone_ref(py)),
-                ),
-            );
-            let state_info_kv = (
-                py_proc_id,
-                (state_option, terminated_dict_option, truncated_dict_option),
-            );
-
-            // println!("Exiting collect_response");
-            Ok((n_timesteps, obs_data_kv, timestep_data_kv, state_info_kv))
-        })
-    }
-
-    fn send_env_actions(&mut self, env_actions: HashMap<String, EnvAction>) -> PyResult<()> {
-        // println!("EPI: Entering send_actions");
+        }
         Python::with_gil(|py| {
             let action_type_serde_option = self
                 .action_type_serde_option
@@ -924,60 +1880,87 @@ impl EnvProcessInterface {
 
             let mut action_pyany_serde_option = self.action_pyany_serde_option.take();
             let mut state_pyany_serde_option = self.state_pyany_serde_option.take();
+            // The serdes are put back even if sending fails, so that later calls still have them
+            let result = (|| -> PyResult<()> {
+                for (pid_idx, proc_env_actions) in pid_idx_env_actions_map.into_iter() {
+                    let (_, shmem, _) = self.proc_packages.get(pid_idx).unwrap();
+                    let (ep_evt, _) = unsafe {
+                        Event::from_existing(shmem.as_ptr()).map_err(|err| {
+                            InvalidStateError::new_err(format!(
+                                "Failed to get event from epi to process with index {}: {}",
+                                pid_idx,
+                                err.to_string()
+                            ))
+                        })?
+                    };
+                    let request_slice = unsafe { get_shm_request(shmem) };
+                    let request_region_size = request_slice.len();
+                    let shm_control = unsafe { get_shm_control(shmem) };
 
-            for (proc_id, env_action) in env_actions.into_iter() {
-                let &pid_idx = self.proc_id_pid_idx_map.get(&proc_id).unwrap();
-                let (_, shmem, _) = self.proc_packages.get_mut(pid_idx).unwrap();
-                let (ep_evt, evt_used_bytes) = unsafe {
-                    Event::from_existing(shmem.as_ptr()).map_err(|err| {
-                        InvalidStateError::new_err(format!(
-                            "Failed to get event from epi to process with index {}: {}",
-                            pid_idx,
-                            err.to_string()
-                        ))
-                    })?
-                };
-                let shm_slice = unsafe { &mut shmem.as_slice_mut()[evt_used_bytes..] };
-
-                if let EnvAction::STEP {
-                    ref action_list,
-                    ref log_probs,
-                } = env_action
-                {
-                    let current_action_list = &mut self.pid_idx_current_action_list[pid_idx];
-                    current_action_list.clear();
-                    current_action_list.append(
-                        &mut action_list
-                            .bind(py)
-                            .iter()
-                            .map(|action| action.unbind())
-                            .collect_vec(),
-                    );
-                    self.pid_idx_current_log_probs_list[pid_idx] = Some(log_probs.clone_ref(py));
-                } else {
-                    self.pid_idx_current_log_probs_list[pid_idx] = None;
-                }
+                    let offset = (|| -> PyResult<usize> {
+                        let mut offset = append_header(request_slice, 0, Header::EnvAction)?;
+                        for (sub_env_idx, env_action) in proc_env_actions.into_iter().enumerate() {
+                            let env_action = env_action.unwrap();
+                            let env_idx = pid_idx * self.envs_per_process + sub_env_idx;
+                            if let EnvAction::STEP {
+                                ref action_list,
+                                ref log_probs,
+                            } = env_action
+                            {
+                                let current_action_list =
+                                    &mut self.env_idx_current_action_list[env_idx];
+                                current_action_list.clear();
+                                current_action_list.append(
+                                    &mut action_list
+                                        .bind(py)
+                                        .iter()
+                                        .map(|action| action.unbind())
+                                        .collect_vec(),
+                                );
+                                self.env_idx_current_log_probs_list[env_idx] =
+                                    Some(log_probs.clone_ref(py));
+                            } else {
+                                self.env_idx_current_log_probs_list[env_idx] = None;
+                            }
 
-                let offset = append_header(shm_slice, 0, Header::EnvAction);
-                _ = append_env_action_update_serdes!(
-                    py,
-                    shm_slice,
-                    offset,
-                    &env_action,
-                    &action_type_serde_option,
-                    action_pyany_serde_option,
-                    &state_type_serde_option,
-                    state_pyany_serde_option
-                );
+                            offset = append_env_action_update_serdes!(
+                                py,
+                                request_slice,
+                                offset,
+                                &env_action,
+                                &action_type_serde_option,
+                                action_pyany_serde_option,
+                                &state_type_serde_option,
+                                state_pyany_serde_option
+                            );
+                            self.env_idx_current_env_action_list[env_idx] = Some(env_action);
+                        }
+                        Ok(offset)
+                    })()
+                    .map_err(|err| {
+                        if is_buffer_overflow(py, &err) {
+                            InvalidStateError::new_err(format!(
+                                "The env actions for env process {} could not be written to its request region ({}), which is {} bytes. Increase shm_buffer_size to send larger env actions",
+                                self.proc_packages[pid_idx].2,
+                                err,
+                                request_region_size
+                            ))
+                        } else {
+                            err
+                        }
+                    })?;
 
-                ep_evt
-                    .set(EventState::Signaled)
-                    .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
-                self.pid_idx_current_env_action_list[pid_idx] = Some(env_action);
-            }
+                    publish_request_len(shm_control, offset);
+                    ep_evt
+                        .set(EventState::Signaled)
+                        .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
+                    self.autotuner.on_actions_sent(pid_idx);
+                }
+                Ok(())
+            })();
             self.action_pyany_serde_option = action_pyany_serde_option;
             self.state_pyany_serde_option = state_pyany_serde_option;
-            Ok(())
+            result
         })
     }
 }
@@ -0,0 +1,105 @@
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::time::Instant;
+
+// Counters kept by the EP when env process timings are enabled
+#[derive(Debug, Clone, Copy)]
+pub enum EpStat {
+    // Time spent waiting for requests from the EPI
+    WaitNanos,
+    // Time spent reading the env actions from the request
+    DeserializeNanos,
+    // Time spent in env.step, env.reset and env.set_state (which includes building the obs)
+    EnvNanos,
+    // Time spent writing the response, including getting the agent ids and the state
+    SerializeNanos,
+    // Time spent collecting and reducing state metrics
+    StateMetricsNanos,
+    // Time spent copying the response into shared memory and notifying the EPI
+    ShmWriteNanos,
+    // Time spent rendering
+    RenderNanos,
+    Steps,
+    Resets,
+    BytesWritten,
+}
+
+pub const N_EP_STATS: usize = 10;
+
+pub const EP_PHASES: [(EpStat, &str); 7] = [
+    (EpStat::WaitNanos, "Wait"),
+    (EpStat::DeserializeNanos, "Deserialize"),
+    (EpStat::EnvNanos, "Env"),
+    (EpStat::SerializeNanos, "Serialize"),
+    (EpStat::StateMetricsNanos, "State Metrics"),
+    (EpStat::ShmWriteNanos, "Shm Write"),
+    (EpStat::RenderNanos, "Render"),
+];
+
+// The stats region of a shared memory segment. The EP keeps the totals itself and copies them here before sending each
+// response, so the counters are cumulative over the lifetime of the EP, including when it moves to a new segment.
+#[repr(C)]
+pub struct ShmStats {
+    pub counters: [AtomicU64; N_EP_STATS],
+}
+
+impl ShmStats {
+    pub fn clear(&self) {
+        for counter in self.counters.iter() {
+            counter.store(0, Ordering::Relaxed);
+        }
+    }
+
+    pub fn copy_from(&self, other: &ShmStats) {
+        for (counter, other_counter) in self.counters.iter().zip(other.counters.iter()) {
+            counter.store(other_counter.load(Ordering::Relaxed), Ordering::Relaxed);
+        }
+    }
+
+    pub fn read(&self) -> [u64; N_EP_STATS] {
+        let mut values = [0; N_EP_STATS];
+        for (value, counter) in values.iter_mut().zip(self.counters.iter()) {
+            *value = counter.load(Ordering::Relaxed);
+        }
+        values
+    }
+}
+
+// Attributes the time between consecutive laps to the phase that just ended. When disabled, none of the methods
+// do anything, so the EP loop can call them unconditionally.
+pub struct EpStats {
+    enabled: bool,
+    counters: [u64; N_EP_STATS],
+    last_lap: Instant,
+}
+
+impl EpStats {
+    pub fn new(enabled: bool) -> Self {
+        EpStats {
+            enabled,
+            counters: [0; N_EP_STATS],
+            last_lap: Instant::now(),
+        }
+    }
+
+    pub fn lap(&mut self, phase: EpStat) {
+        if self.enabled {
+            let now = Instant::now();
+            self.counters[phase as usize] += (now - self.last_lap).as_nanos() as u64;
+            self.last_lap = now;
+        }
+    }
+
+    pub fn add(&mut self, stat: EpStat, n: usize) {
+        if self.enabled {
+            self.counters[stat as usize] += n as u64;
+        }
+    }
+
+    pub fn publish(&self, shm_stats: &ShmStats) {
+        if self.enabled {
+            for (counter, value) in shm_stats.counters.iter().zip(self.counters.iter()) {
+                counter.store(*value, Ordering::Relaxed);
+            }
+        }
+    }
+}
@@ -0,0 +1,125 @@
+use pyo3::prelude::*;
+use pyo3::types::PyString;
+use pyo3::PyObject;
+
+use crate::communication::retrieve_python;
+use crate::serdes::pyany_serde::PyAnySerde;
+
+const WORD_SIZE: usize = std::mem::size_of::<u64>();
+
+// A state sent to the agent controllers which has not been deserialized yet. It holds a copy of the serialized
+// state and the serdes needed to deserialize it, and is only deserialized the first time it is accessed, so
+// that states which the agent controllers never look at are never turned into python objects.
+#[pyclass(module = "rlgym_learn_backend")]
+pub struct LazyState {
+    // The serdes pad numpy data based on the address of the buffer, so the serialized state is copied into u64 words
+    // at the same offset from a word boundary as the bytes it was read from, and is retrieved from that offset
+    words: Vec<u64>,
+    start: usize,
+    len: usize,
+    type_serde_option: Option<PyObject>,
+    pyany_serde_option: Option<Box<dyn PyAnySerde>>,
+    state_option: Option<PyObject>,
+}
+
+impl LazyState {
+    pub fn new<'py>(
+        py: Python<'py>,
+        bytes: &[u8],
+        type_serde_option: &Option<PyObject>,
+        pyany_serde_option: &Option<Box<dyn PyAnySerde>>,
+    ) -> Self {
+        let start = bytes.as_ptr() as usize % WORD_SIZE;
+        let mut words = vec![0_u64; (start + bytes.len()).div_ceil(WORD_SIZE)];
+        bytemuck::cast_slice_mut::<u64, u8>(&mut words[..])[start..start + bytes.len()]
+            .copy_from_slice(bytes);
+        LazyState {
+            words,
+            start,
+            len: bytes.len(),
+            type_serde_option: type_serde_option
+                .as_ref()
+                .map(|type_serde| type_serde.clone_ref(py)),
+            pyany_serde_option: pyany_serde_option.clone(),
+            state_option: None,
+        }
+    }
+}
+
+#[pymethods]
+impl LazyState {
+    // Returns the state, deserializing it if this is the first access
+    fn get(&mut self, py: Python<'_>) -> PyResult<PyObject> {
+        if let Some(state) = &self.state_option {
+            return Ok(state.clone_ref(py));
+        }
+        let type_serde_option = self.type_serde_option.as_ref().map(|v| v.bind(py));
+        let (state, _, _) = retrieve_python(
+            py,
+            &bytemuck::cast_slice::<u64, u8>(&self.words[..])[self.start..self.start + self.len],
+            0,
+            &type_serde_option,
+            &mut self.pyany_serde_option,
+        )?;
+        let state = state.unbind();
+        self.state_option = Some(state.clone_ref(py));
+        // The serialized state is not needed anymore
+        self.words = Vec::new();
+        self.len = 0;
+        self.pyany_serde_option = None;
+        Ok(state)
+    }
+
+    fn is_deserialized(&self) -> bool {
+        self.state_option.is_some()
+    }
+
+    // Attributes which are not attributes of LazyState are looked up on the state, so that the handle can mostly be
+    // used in place of the state
+    fn __getattr__(&mut self, py: Python<'_>, name: &Bound<'_, PyString>) -> PyResult<PyObject> {
+        self.get(py)?.getattr(py, name)
+    }
+
+    fn __repr__(&mut self, py: Python<'_>) -> PyResult<String> {
+        if self.state_option.is_some() {
+            Ok(format!("LazyState({})", self.get(py)?.bind(py).repr()?))
+        } else {
+            Ok(format!("LazyState(<{} serialized bytes>)", self.len))
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use numpy::ndarray::Array1;
+    use numpy::{PyArray1, PyArrayMethods};
+    use pyo3::prelude::*;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+    use crate::communication::append_python;
+    use crate::serdes::numpy_dynamic_shape_serde::get_numpy_dynamic_shape_serde;
+
+    use super::LazyState;
+
+    #[test]
+    fn test_numpy_state_written_at_unaligned_offset() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let values = vec![0.5, -1.25, 3.0, 1e10, -7.5];
+            let state = PyArray1::<f64>::from_owned_array(py, Array1::from_vec(values.clone()));
+            let mut pyany_serde_option = Some(get_numpy_dynamic_shape_serde(NumpyDtype::FLOAT64));
+            // The state is written 3 bytes past a word boundary, like a state written after other data in a response
+            let mut words = vec![0_u64; 64];
+            let buf = bytemuck::cast_slice_mut::<u64, u8>(&mut words[..]);
+            let start = 3;
+            let (end, _) =
+                append_python(buf, start, state.as_any(), &None, &mut pyany_serde_option)?;
+            let mut lazy_state = LazyState::new(py, &buf[start..end], &None, &pyany_serde_option);
+            let retrieved = lazy_state.get(py)?;
+            assert_eq!(
+                retrieved.bind(py).downcast::<PyArray1<f64>>()?.to_vec()?,
+                values
+            );
+            Ok(())
+        })
+    }
+}
@@ -6,13 +6,31 @@ mod communication;
 mod env_action;
 mod env_process;
 mod env_process_interface;
+mod env_process_stats;
+mod lazy_state;
+mod min_process_steps_autotuner;
+mod notification;
+mod obs_arena;
+mod remote;
 mod serdes;
 mod standard_impl;
+mod state_delta;
 
 #[pymodule]
 #[pyo3(name = "rlgym_learn_backend")]
 fn rlgym_learn_backend(m: &Bound<'_, PyModule>) -> PyResult<()> {
+    m.add(
+        "DEFAULT_NOTIFICATION_BACKEND",
+        notification::DEFAULT_NOTIFICATION_BACKEND,
+    )?;
     m.add_function(wrap_pyfunction!(env_process::env_process, m)?)?;
+    m.add_function(wrap_pyfunction!(remote::relay_env_processes, m)?)?;
+    m.add_function(wrap_pyfunction!(remote::serve_remote_env_processes, m)?)?;
+    #[cfg(feature = "benchmark")]
+    m.add_function(wrap_pyfunction!(
+        serdes::serde_benchmark::benchmark_serde,
+        m
+    )?)?;
     m.add_class::<env_process_interface::EnvProcessInterface>()?;
     m.add_class::<agent_manager::AgentManager>()?;
     m.add_class::<standard_impl::ppo::gae_trajectory_processor::GAETrajectoryProcessor>()?;
@@ -21,5 +39,6 @@ fn rlgym_learn_backend(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<standard_impl::rocket_league::rocket_league_serde_factory::RocketLeaguePyAnySerdeFactory>()?;
     m.add_class::<env_action::EnvActionResponse>()?;
     m.add_class::<env_action::EnvAction>()?;
+    m.add_class::<lazy_state::LazyState>()?;
     Ok(())
 }
@@ -0,0 +1,206 @@
+use std::cmp::{max, min};
+use std::collections::HashMap;
+use std::time::Instant;
+
+// Minimum time (excluding learner time) and number of collections measured before the throughput of a
+// min_process_steps_per_inference value is compared to the previous one
+const WINDOW_DURATION_SECS: f64 = 2.0;
+const MIN_WINDOW_COLLECTIONS: usize = 20;
+// Time between the end of collect_step_data and the next send_env_actions which is more than this many times the
+// usual inference time for the batch size is attributed to the learner, and not counted against the current value
+const LEARNER_OUTLIER_FACTOR: f64 = 4.0;
+const EMA_WEIGHT: f64 = 0.1;
+
+fn update_ema(ema_option: Option<f64>, sample: f64) -> f64 {
+    match ema_option {
+        Some(ema) => ema + EMA_WEIGHT * (sample - ema),
+        None => sample,
+    }
+}
+
+// Measurements over the last completed window
+#[derive(Clone, Copy)]
+pub struct AutotunerWindowMetrics {
+    pub min_process_steps_per_inference: usize,
+    pub steps_per_second: f64,
+    pub env_step_latency: f64,
+    pub inference_latency: f64,
+    pub mean_inference_batch_size: f64,
+    pub learner_idle_fraction: f64,
+}
+
+#[derive(Default)]
+struct Window {
+    n_collections: usize,
+    n_timesteps: usize,
+    // Time spent in collect_step_data waiting for processes
+    idle_secs: f64,
+    // Time spent outside collect_step_data, split into inference and learner time
+    inference_secs: f64,
+    learner_secs: f64,
+    env_step_latency_secs: f64,
+    n_env_steps: usize,
+    n_inference_batches: usize,
+    inference_batch_size_sum: usize,
+}
+
+// Measures how long env processes take to step, how long the coordinator takes to run inference for each batch
+// size, and how long the coordinator spends idle waiting for env processes. When enabled, it adjusts
+// min_process_steps_per_inference by hill climbing on the collected steps per second measured over consecutive
+// windows: the value keeps moving in the same direction while throughput improves, and the direction is reversed
+// with a smaller step when it gets worse.
+pub struct MinProcessStepsAutotuner {
+    enabled: bool,
+    step_size: usize,
+    direction: isize,
+    prev_steps_per_second_option: Option<f64>,
+    window_start: Instant,
+    window: Window,
+    // Time at which the latest env actions were sent to each process
+    action_sent_instant_list: Vec<Option<Instant>>,
+    collect_start_instant_option: Option<Instant>,
+    collect_end_instant_option: Option<Instant>,
+    last_batch_size: usize,
+    inference_secs_ema_map: HashMap<usize, f64>,
+    latest_metrics_option: Option<AutotunerWindowMetrics>,
+}
+
+impl MinProcessStepsAutotuner {
+    pub fn new(enabled: bool) -> Self {
+        MinProcessStepsAutotuner {
+            enabled,
+            step_size: 1,
+            direction: 1,
+            prev_steps_per_second_option: None,
+            window_start: Instant::now(),
+            window: Window::default(),
+            action_sent_instant_list: Vec::new(),
+            collect_start_instant_option: None,
+            collect_end_instant_option: None,
+            last_batch_size: 0,
+            inference_secs_ema_map: HashMap::new(),
+            latest_metrics_option: None,
+        }
+    }
+
+    pub fn set_enabled(&mut self, enabled: bool) {
+        self.enabled = enabled;
+        self.prev_steps_per_second_option = None;
+    }
+
+    pub fn is_enabled(&self) -> bool {
+        self.enabled
+    }
+
+    // Called when processes are added or deleted. The first step taken after this is a quarter of the way towards the bounds.
+    pub fn set_n_procs(&mut self, n_procs: usize) {
+        self.action_sent_instant_list.resize(n_procs, None);
+        self.step_size = max(n_procs / 4, 1);
+        self.prev_steps_per_second_option = None;
+    }
+
+    // Called when the process with index pid_idx has been replaced, since the actions sent to the old process never got a response
+    pub fn forget_process(&mut self, pid_idx: usize) {
+        self.action_sent_instant_list[pid_idx] = None;
+    }
+
+    pub fn on_actions_sent(&mut self, pid_idx: usize) {
+        let now = Instant::now();
+        self.action_sent_instant_list[pid_idx] = Some(now);
+        // Only the first process sent actions after a collection marks the end of inference
+        if let Some(collect_end_instant) = self.collect_end_instant_option.take() {
+            let secs = (now - collect_end_instant).as_secs_f64();
+            let ema_option = self
+                .inference_secs_ema_map
+                .get(&self.last_batch_size)
+                .copied();
+            let inference_secs = match ema_option {
+                Some(ema) if secs > LEARNER_OUTLIER_FACTOR * ema => ema,
+                _ => secs,
+            };
+            self.inference_secs_ema_map.insert(
+                self.last_batch_size,
+                update_ema(ema_option, inference_secs),
+            );
+            self.window.inference_secs += inference_secs;
+            self.window.learner_secs += secs - inference_secs;
+            self.window.n_inference_batches += 1;
+            self.window.inference_batch_size_sum += self.last_batch_size;
+        }
+    }
+
+    pub fn on_collect_start(&mut self) {
+        self.collect_start_instant_option = Some(Instant::now());
+    }
+
+    pub fn on_response_collected(&mut self, pid_idx: usize) {
+        if let Some(action_sent_instant) = self.action_sent_instant_list[pid_idx].take() {
+            self.window.env_step_latency_secs += action_sent_instant.elapsed().as_secs_f64();
+            self.window.n_env_steps += 1;
+        }
+    }
+
+    // Returns the new value of min_process_steps_per_inference
+    pub fn on_collect_end(
+        &mut self,
+        n_process_steps_collected: usize,
+        n_timesteps: usize,
+        min_process_steps_per_inference: usize,
+        n_procs: usize,
+    ) -> usize {
+        let now = Instant::now();
+        if let Some(collect_start_instant) = self.collect_start_instant_option.take() {
+            self.window.idle_secs += (now - collect_start_instant).as_secs_f64();
+        }
+        self.collect_end_instant_option = Some(now);
+        self.last_batch_size = n_process_steps_collected;
+        self.window.n_collections += 1;
+        self.window.n_timesteps += n_timesteps;
+
+        let measured_secs = (now - self.window_start).as_secs_f64() - self.window.learner_secs;
+        if measured_secs < WINDOW_DURATION_SECS || self.window.n_collections < MIN_WINDOW_COLLECTIONS
+        {
+            return min_process_steps_per_inference;
+        }
+
+        let steps_per_second = self.window.n_timesteps as f64 / measured_secs;
+        self.latest_metrics_option = Some(AutotunerWindowMetrics {
+            min_process_steps_per_inference,
+            steps_per_second,
+            env_step_latency: self.window.env_step_latency_secs
+                / max(self.window.n_env_steps, 1) as f64,
+            inference_latency: self.window.inference_secs
+                / max(self.window.n_inference_batches, 1) as f64,
+            mean_inference_batch_size: self.window.inference_batch_size_sum as f64
+                / max(self.window.n_inference_batches, 1) as f64,
+            learner_idle_fraction: self.window.idle_secs / measured_secs,
+        });
+        self.window = Window::default();
+        self.window_start = now;
+
+        if !self.enabled || n_procs == 0 {
+            return min_process_steps_per_inference;
+        }
+        if let Some(prev_steps_per_second) = self.prev_steps_per_second_option {
+            if steps_per_second < prev_steps_per_second {
+                self.direction = -self.direction;
+                self.step_size = max(self.step_size / 2, 1);
+            }
+        }
+        self.prev_steps_per_second_option = Some(steps_per_second);
+        let mut new_value = min_process_steps_per_inference as isize
+            + self.direction * self.step_size as isize;
+        if new_value < 1 || new_value > n_procs as isize {
+            // Bounce off the bounds
+            self.direction = -self.direction;
+            new_value = min_process_steps_per_inference as isize
+                + self.direction * self.step_size as isize;
+        }
+        min(max(new_value, 1) as usize, n_procs)
+    }
+
+    // Returns the metrics of the latest window if a window has been completed since the last call
+    pub fn take_latest_metrics(&mut self) -> Option<AutotunerWindowMetrics> {
+        self.latest_metrics_option.take()
+    }
+}
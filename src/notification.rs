@@ -0,0 +1,159 @@
+use std::sync::atomic::Ordering;
+use std::time::{Duration, Instant};
+
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::PyObject;
+use raw_sync::events::{Event, EventImpl, EventInit, EventState};
+use raw_sync::Timeout;
+use shared_memory::{Shmem, ShmemConf};
+
+use crate::common::misc::sendto_byte;
+use crate::communication::ShmControl;
+
+// The notification backend used unless another one is requested. Exposed to Python so that every default uses this one.
+pub const DEFAULT_NOTIFICATION_BACKEND: &str = "shm_event";
+
+// How an EP tells the EPI that its response has been written to shared memory
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub enum NotificationBackend {
+    // A byte is sent over a localhost UDP socket, and the EPI waits on the sockets using a Python selector
+    Udp,
+    // The EP sets a flag in the control region of its shm segment and then signals an event living in a
+    // separate shm segment owned by the EPI. The EPI waits on this event with the GIL released.
+    ShmEvent,
+}
+
+pub fn get_notification_backend(name: &str) -> PyResult<NotificationBackend> {
+    match name {
+        "udp" => Ok(NotificationBackend::Udp),
+        "shm_event" => Ok(NotificationBackend::ShmEvent),
+        v => Err(InvalidStateError::new_err(format!(
+            "Unknown notification backend {}, expected one of \"udp\" or \"shm_event\"",
+            v
+        ))),
+    }
+}
+
+// The events from raw_sync are not Send, but waiting on them from another thread is exactly what
+// they are designed for, so we wrap the reference to be able to wait with the GIL released.
+struct SendableEvent<'a>(&'a dyn EventImpl);
+
+unsafe impl Send for SendableEvent<'_> {}
+
+impl SendableEvent<'_> {
+    fn wait(&self, timeout: Timeout) -> PyResult<()> {
+        self.0
+            .wait(timeout)
+            .map_err(|err| InvalidStateError::new_err(err.to_string()))
+    }
+}
+
+pub struct ShmEventNotifier {
+    // The event must be dropped before the shared memory it lives in
+    evt: Box<dyn EventImpl>,
+    _shmem: Shmem,
+}
+
+impl ShmEventNotifier {
+    // Used by the EPI
+    pub fn create(flink: &str) -> PyResult<Self> {
+        let shmem = ShmemConf::new()
+            .size(Event::size_of(None))
+            .flink(flink)
+            .create()
+            .map_err(|err| {
+                InvalidStateError::new_err(format!(
+                    "Unable to create shmem flink {}: {}",
+                    flink, err
+                ))
+            })?;
+        let (evt, _) = unsafe {
+            Event::new(shmem.as_ptr(), true).map_err(|err| {
+                InvalidStateError::new_err(format!(
+                    "Failed to create event from env processes to epi: {}",
+                    err.to_string()
+                ))
+            })?
+        };
+        Ok(ShmEventNotifier {
+            evt,
+            _shmem: shmem,
+        })
+    }
+
+    // Used by the EP
+    pub fn open(flink: &str) -> PyResult<Self> {
+        let shmem = ShmemConf::new().flink(flink).open().map_err(|err| {
+            InvalidStateError::new_err(format!("Unable to open shmem flink {}: {}", flink, err))
+        })?;
+        let (evt, _) = unsafe {
+            Event::from_existing(shmem.as_ptr()).map_err(|err| {
+                InvalidStateError::new_err(format!(
+                    "Failed to get event from env processes to epi: {}",
+                    err.to_string()
+                ))
+            })?
+        };
+        Ok(ShmEventNotifier {
+            evt,
+            _shmem: shmem,
+        })
+    }
+
+    pub fn notify(&self, control: &ShmControl) -> PyResult<()> {
+        // The flag must be visible before the event is signaled, otherwise the EPI could wake up and miss it
+        control.response_ready.store(1, Ordering::Release);
+        self.evt
+            .set(EventState::Signaled)
+            .map_err(|err| InvalidStateError::new_err(err.to_string()))
+    }
+
+    pub fn wait<'py>(&self, py: Python<'py>, timeout: Timeout) -> PyResult<()> {
+        let sendable_evt = SendableEvent(&*self.evt);
+        py.allow_threads(move || sendable_evt.wait(timeout))
+    }
+
+    // Returns false if the timeout elapsed before the event was signaled.
+    // raw_sync reports an elapsed timeout as an error without a distinct error type, so an error is only treated as a
+    // timeout if the timeout has actually elapsed. Any other error means the event is unusable and is returned.
+    pub fn wait_timeout<'py>(&self, py: Python<'py>, timeout: Duration) -> PyResult<bool> {
+        let start = Instant::now();
+        match self.wait(py, Timeout::Val(timeout)) {
+            Ok(()) => Ok(true),
+            Err(_) if start.elapsed() >= timeout => Ok(false),
+            Err(err) => Err(InvalidStateError::new_err(format!(
+                "Failed to wait for notification from env processes: {}",
+                err
+            ))),
+        }
+    }
+}
+
+// Returns true if the EP this control region belongs to has notified that its response is ready,
+// and resets the flag so the response is only picked up once.
+pub fn take_response_ready(control: &ShmControl) -> bool {
+    control.response_ready.swap(0, Ordering::AcqRel) == 1
+}
+
+pub enum EpNotifier {
+    Udp {
+        child_end: PyObject,
+        parent_sockname: PyObject,
+    },
+    ShmEvent {
+        notifier: ShmEventNotifier,
+    },
+}
+
+impl EpNotifier {
+    pub fn notify<'py>(&self, py: Python<'py>, control: &ShmControl) -> PyResult<()> {
+        match self {
+            EpNotifier::Udp {
+                child_end,
+                parent_sockname,
+            } => sendto_byte(py, child_end, parent_sockname),
+            EpNotifier::ShmEvent { notifier } => notifier.notify(control),
+        }
+    }
+}
@@ -0,0 +1,361 @@
+use std::cmp::max;
+use std::mem::{align_of, size_of};
+
+use bytemuck::{AnyBitPattern, NoUninit};
+use numpy::ndarray::{ArrayViewD, IxDyn};
+use numpy::{
+    Element, PyArray1, PyArrayDescrMethods, PyArrayDyn, PyArrayMethods, PyUntypedArray,
+    PyUntypedArrayMethods,
+};
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::intern;
+use pyo3::prelude::*;
+use pyo3::types::{PyList, PySlice, PyTuple};
+
+use crate::common::misc::get_bytes_to_alignment;
+use crate::common::numpy_dtype_enum::NumpyDtype;
+use crate::communication::{retrieve_bool, retrieve_usize};
+use crate::serdes::numpy_dynamic_shape_serde::NumpyDynamicShapeSerde;
+use crate::serdes::serde_enum::{retrieve_serde, Serde};
+
+// Chunks are allocated as u64 arrays so that every dtype can be aligned within them
+const CHUNK_ALIGNMENT: usize = align_of::<u64>();
+const MIN_CHUNK_SIZE: usize = 1 << 16;
+
+fn round_up_to_chunk_alignment(n: usize) -> usize {
+    (n + CHUNK_ALIGNMENT - 1) / CHUNK_ALIGNMENT * CHUNK_ALIGNMENT
+}
+
+struct ArenaChunk {
+    array: Py<PyArray1<u64>>,
+    ptr: *mut u8,
+    size: usize,
+}
+
+impl ArenaChunk {
+    fn new<'py>(py: Python<'py>, size: usize) -> Self {
+        let size = round_up_to_chunk_alignment(size);
+        let array = unsafe { PyArray1::<u64>::new(py, [size / CHUNK_ALIGNMENT], false) };
+        let ptr = array.data() as *mut u8;
+        ArenaChunk {
+            array: array.unbind(),
+            ptr,
+            size,
+        }
+    }
+}
+
+// Coordinator-owned memory that numpy obs are copied into straight out of shared memory. Each obs is
+// returned as a numpy array viewing part of a chunk, and the chunk is kept alive by these views, so the
+// obs stay valid for as long as they are referenced. A chunk is only reused once all the views into it
+// have been dropped, otherwise a new chunk is allocated.
+pub struct ObsArena {
+    chunk_option: Option<ArenaChunk>,
+    used: usize,
+    // Number of bytes used since the last reset
+    used_since_reset: usize,
+    // Size of the next chunk allocated, based on the number of bytes used between the last two resets
+    next_chunk_size: usize,
+}
+
+impl ObsArena {
+    pub fn new() -> Self {
+        ObsArena {
+            chunk_option: None,
+            used: 0,
+            used_since_reset: 0,
+            next_chunk_size: MIN_CHUNK_SIZE,
+        }
+    }
+
+    // Called at the start of every collection of step data
+    pub fn reset<'py>(&mut self, py: Python<'py>) {
+        self.next_chunk_size = max(self.used_since_reset, MIN_CHUNK_SIZE);
+        let reusable = self
+            .chunk_option
+            .as_ref()
+            .map(|chunk| chunk.size >= self.next_chunk_size && chunk.array.get_refcnt(py) == 1)
+            .unwrap_or(false);
+        if !reusable {
+            self.chunk_option = None;
+        }
+        self.used = 0;
+        self.used_since_reset = 0;
+    }
+
+    // Returns the chunk and the offset within the chunk where n_bytes bytes aligned to align can be written.
+    // Consecutive reservations of the same size and alignment are contiguous unless a new chunk is needed,
+    // which allows consecutive obs of the same shape and dtype to be viewed as one batch.
+    fn reserve<'py>(
+        &mut self,
+        py: Python<'py>,
+        n_bytes: usize,
+        align: usize,
+    ) -> (&ArenaChunk, usize) {
+        let aligned_offset = (self.used + align - 1) / align * align;
+        let fits = self
+            .chunk_option
+            .as_ref()
+            .map(|chunk| aligned_offset + n_bytes <= chunk.size)
+            .unwrap_or(false);
+        let offset;
+        if fits {
+            offset = aligned_offset;
+            self.used_since_reset += aligned_offset + n_bytes - self.used;
+        } else {
+            self.chunk_option = Some(ArenaChunk::new(py, max(self.next_chunk_size, n_bytes)));
+            offset = 0;
+            self.used_since_reset += n_bytes;
+        }
+        self.used = offset + n_bytes;
+        (self.chunk_option.as_ref().unwrap(), offset)
+    }
+
+    fn retrieve_array<'py, T: Element + AnyBitPattern + NoUninit>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let (shape, obj_bytes, new_offset) =
+            NumpyDynamicShapeSerde::<T>::retrieve_shape_and_bytes(buf, offset)?;
+        if shape.iter().product::<usize>() * size_of::<T>() != obj_bytes.len() {
+            return Err(InvalidStateError::new_err(format!(
+                "Numpy obs with shape {:?} does not match its data length of {} bytes",
+                shape,
+                obj_bytes.len()
+            )));
+        }
+        Ok((self.copy_array::<T>(py, &shape, obj_bytes)?, new_offset))
+    }
+
+    fn copy_array<'py, T: Element + AnyBitPattern + NoUninit>(
+        &mut self,
+        py: Python<'py>,
+        shape: &[usize],
+        obj_bytes: &[u8],
+    ) -> PyResult<Bound<'py, PyAny>> {
+        let (chunk, chunk_offset) = self.reserve(py, obj_bytes.len(), align_of::<T>());
+        let array = unsafe {
+            let ptr = chunk.ptr.add(chunk_offset);
+            std::ptr::copy_nonoverlapping(obj_bytes.as_ptr(), ptr, obj_bytes.len());
+            let view = ArrayViewD::<T>::from_shape_ptr(IxDyn(shape), ptr as *const T);
+            PyArrayDyn::<T>::borrow_from_array(&view, chunk.array.bind(py).clone().into_any())
+        };
+        Ok(array.into_any())
+    }
+
+    // Copies the data of n_arrays arrays of the same shape, stored as one contiguous block, into one reservation
+    // of this arena, and returns a view of each array
+    fn copy_arrays<'py, T: Element + AnyBitPattern + NoUninit>(
+        &mut self,
+        py: Python<'py>,
+        shape: &[usize],
+        n_arrays: usize,
+        block: &[u8],
+    ) -> PyResult<Vec<Bound<'py, PyAny>>> {
+        let n_bytes = shape.iter().product::<usize>() * size_of::<T>();
+        let (chunk, chunk_offset) = self.reserve(py, block.len(), align_of::<T>());
+        let mut arrays = Vec::with_capacity(n_arrays);
+        unsafe {
+            let block_ptr = chunk.ptr.add(chunk_offset);
+            std::ptr::copy_nonoverlapping(block.as_ptr(), block_ptr, block.len());
+            for array_idx in 0..n_arrays {
+                let ptr = block_ptr.add(array_idx * n_bytes);
+                let view = ArrayViewD::<T>::from_shape_ptr(IxDyn(shape), ptr as *const T);
+                arrays.push(
+                    PyArrayDyn::<T>::borrow_from_array(
+                        &view,
+                        chunk.array.bind(py).clone().into_any(),
+                    )
+                    .into_any(),
+                );
+            }
+        }
+        Ok(arrays)
+    }
+
+    // Retrieves n_arrays arrays appended using append_batch of NumpyDynamicShapeSerde
+    fn retrieve_array_batch<'py, T: Element + AnyBitPattern + NoUninit>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_arrays: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        let (same_shape, mut new_offset) = retrieve_bool(buf, offset)?;
+        if !same_shape {
+            let mut arrays = Vec::with_capacity(n_arrays);
+            for _ in 0..n_arrays {
+                let array;
+                (array, new_offset) = self.retrieve_array::<T>(py, buf, new_offset)?;
+                arrays.push(array);
+            }
+            return Ok((arrays, new_offset));
+        }
+        let shape_len;
+        (shape_len, new_offset) = retrieve_usize(buf, new_offset)?;
+        let mut shape = Vec::with_capacity(shape_len);
+        for _ in 0..shape_len {
+            let dim;
+            (dim, new_offset) = retrieve_usize(buf, new_offset)?;
+            shape.push(dim);
+        }
+        let start = new_offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + new_offset);
+        let end = start + n_arrays * shape.iter().product::<usize>() * size_of::<T>();
+        Ok((
+            self.copy_arrays::<T>(py, &shape, n_arrays, &buf[start..end])?,
+            end,
+        ))
+    }
+
+    // Retrieves n_arrays arrays appended using append_batch of NumpyStaticShapeSerde
+    fn retrieve_static_array_batch<'py, T: Element + AnyBitPattern + NoUninit>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_arrays: usize,
+        shape: Vec<usize>,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        let start = offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + offset);
+        let end = start + n_arrays * shape.iter().product::<usize>() * size_of::<T>();
+        Ok((
+            self.copy_arrays::<T>(py, &shape, n_arrays, &buf[start..end])?,
+            end,
+        ))
+    }
+
+    // Retrieves the n_obs obs of an env appended by the EP using append_python_batch with a numpy serde. The obs are
+    // copied into this arena as one block, so the obs of an env are always consecutive views into the same chunk.
+    pub fn retrieve_batch<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_obs: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        if n_obs == 0 {
+            return Ok((Vec::new(), offset));
+        }
+        let (is_type_serde, mut new_offset) = retrieve_bool(buf, offset)?;
+        if is_type_serde {
+            return Err(InvalidStateError::new_err(
+                "zero_copy_obs requires obs to be sent using a numpy RustSerde, but a TypeSerde was used",
+            ));
+        }
+        let serde;
+        (serde, new_offset) = retrieve_serde(buf, new_offset)?;
+        match serde {
+            Serde::NUMPY { dtype } => match dtype {
+                NumpyDtype::INT8 => self.retrieve_array_batch::<i8>(py, buf, new_offset, n_obs),
+                NumpyDtype::INT16 => self.retrieve_array_batch::<i16>(py, buf, new_offset, n_obs),
+                NumpyDtype::INT32 => self.retrieve_array_batch::<i32>(py, buf, new_offset, n_obs),
+                NumpyDtype::INT64 => self.retrieve_array_batch::<i64>(py, buf, new_offset, n_obs),
+                NumpyDtype::UINT8 => self.retrieve_array_batch::<u8>(py, buf, new_offset, n_obs),
+                NumpyDtype::UINT16 => self.retrieve_array_batch::<u16>(py, buf, new_offset, n_obs),
+                NumpyDtype::UINT32 => self.retrieve_array_batch::<u32>(py, buf, new_offset, n_obs),
+                NumpyDtype::UINT64 => self.retrieve_array_batch::<u64>(py, buf, new_offset, n_obs),
+                NumpyDtype::FLOAT32 => self.retrieve_array_batch::<f32>(py, buf, new_offset, n_obs),
+                NumpyDtype::FLOAT64 => self.retrieve_array_batch::<f64>(py, buf, new_offset, n_obs),
+            },
+            Serde::NUMPY_STATIC { dtype, shape } => match dtype {
+                NumpyDtype::INT8 => {
+                    self.retrieve_static_array_batch::<i8>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::INT16 => {
+                    self.retrieve_static_array_batch::<i16>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::INT32 => {
+                    self.retrieve_static_array_batch::<i32>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::INT64 => {
+                    self.retrieve_static_array_batch::<i64>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::UINT8 => {
+                    self.retrieve_static_array_batch::<u8>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::UINT16 => {
+                    self.retrieve_static_array_batch::<u16>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::UINT32 => {
+                    self.retrieve_static_array_batch::<u32>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::UINT64 => {
+                    self.retrieve_static_array_batch::<u64>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::FLOAT32 => {
+                    self.retrieve_static_array_batch::<f32>(py, buf, new_offset, n_obs, shape)
+                }
+                NumpyDtype::FLOAT64 => {
+                    self.retrieve_static_array_batch::<f64>(py, buf, new_offset, n_obs, shape)
+                }
+            },
+            v => Err(InvalidStateError::new_err(format!(
+                "zero_copy_obs requires obs to be sent using a numpy RustSerde, but got serde {:?}",
+                v
+            ))),
+        }
+    }
+}
+
+// Returns a view of the obs in obs_list as one (n_obs, *obs_shape) array if they are consecutive views of the same
+// shape and dtype into the same arena chunk, otherwise returns None.
+fn get_contiguous_batch_view<'py>(
+    py: Python<'py>,
+    numpy: &Bound<'py, PyModule>,
+    obs_list: &Vec<PyObject>,
+) -> PyResult<Option<Bound<'py, PyAny>>> {
+    let Ok(first_obs) = obs_list[0].bind(py).downcast::<PyUntypedArray>() else {
+        return Ok(None);
+    };
+    let base = first_obs.getattr(intern!(py, "base"))?;
+    let Ok(chunk) = base.downcast::<PyArray1<u64>>() else {
+        return Ok(None);
+    };
+    let shape = first_obs.shape().to_vec();
+    let dtype = first_obs.dtype();
+    let obs_n_bytes = first_obs.len() * dtype.itemsize();
+    let first_obs_addr = unsafe { (*first_obs.as_array_ptr()).data as usize };
+    for (obs_idx, obs) in obs_list.iter().enumerate().skip(1) {
+        let Ok(obs) = obs.bind(py).downcast::<PyUntypedArray>() else {
+            return Ok(None);
+        };
+        if obs.shape() != &shape[..]
+            || !obs.dtype().is_equiv_to(&dtype)
+            || !obs.getattr(intern!(py, "base"))?.is(&base)
+            || unsafe { (*obs.as_array_ptr()).data as usize }
+                != first_obs_addr + obs_idx * obs_n_bytes
+        {
+            return Ok(None);
+        }
+    }
+    let start = first_obs_addr - chunk.data() as usize;
+    let stop = start + obs_list.len() * obs_n_bytes;
+    let mut batch_shape = Vec::with_capacity(shape.len() + 1);
+    batch_shape.push(obs_list.len());
+    batch_shape.extend(shape);
+    Ok(Some(
+        chunk
+            .call_method1(intern!(py, "view"), (numpy.getattr(intern!(py, "uint8"))?,))?
+            .get_item(PySlice::new(py, start as isize, stop as isize, 1))?
+            .call_method1(intern!(py, "view"), (dtype,))?
+            .call_method1(intern!(py, "reshape"), (PyTuple::new(py, batch_shape)?,))?,
+    ))
+}
+
+// Returns a (n_obs, *obs_shape) array with the obs in obs_list, in order. When the obs were all retrieved
+// consecutively from the same arena chunk this is a view into the chunk, otherwise the obs are stacked into a new array.
+pub fn build_obs_batch<'py>(
+    py: Python<'py>,
+    obs_list: &Vec<PyObject>,
+) -> PyResult<Bound<'py, PyAny>> {
+    let numpy = PyModule::import(py, intern!(py, "numpy"))?;
+    if obs_list.is_empty() {
+        return numpy.call_method1(intern!(py, "empty"), ((0,),));
+    }
+    if let Some(batch) = get_contiguous_batch_view(py, &numpy, obs_list)? {
+        return Ok(batch);
+    }
+    numpy.call_method1(intern!(py, "stack"), (PyList::new(py, obs_list)?,))
+}
@@ -0,0 +1,731 @@
+use std::cmp::max;
+use std::sync::atomic::Ordering;
+use std::sync::mpsc::{channel, Receiver, Sender};
+use std::thread::{self, JoinHandle};
+
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::types::PyBytes;
+use pyo3::{intern, PyObject};
+use raw_sync::events::{Event, EventInit, EventState};
+use raw_sync::Timeout;
+use shared_memory::{Shmem, ShmemConf};
+
+use crate::common::misc::{recvfrom_byte, sendto_byte};
+use crate::communication::{
+    get_flink, get_shm_control, get_shm_flink, get_shm_request, get_shm_response,
+    publish_request_len, retrieve_header, Header,
+};
+use crate::env_process::{open_ep_notifier, send_response, EpShmSegment};
+use crate::env_process_interface::sync_with_env_process;
+use crate::notification::{get_notification_backend, EpNotifier, DEFAULT_NOTIFICATION_BACKEND};
+
+// Remote env workers run env processes on other machines. On the coordinator, all the env processes a coordinator
+// runs on one worker are represented by a single relay process, which looks like a regular env process to the EPI for
+// each of them: it owns a shared memory segment per env process and answers the EPI's requests. On the worker, a relay
+// talks to the regular env processes the way the EPI would. The two relays are connected over a single TCP connection
+// and forward the requests and responses as-is, so the message format is the one used over shared memory. The
+// requests (or responses) which are available at the same time are sent together in one frame, so a step of all the
+// env processes on a worker takes one round trip.
+//
+// Every message is sent as a frame [kind: u8][payload length: u64 little endian][payload]:
+// Hello: coordinator -> worker, the config of the env processes to start, with one seed per env process (JSON)
+// Launch: coordinator -> worker, [env process index: u64], the env process may build its envs
+// Ready: worker -> coordinator, [env process index: u64], sent once the envs of the env process have been built
+// Requests: coordinator -> worker, a batch of contents of request regions
+// Responses: worker -> coordinator, a batch of contents of response regions
+// A batch is [n: u64] followed by n times [env process index: u64][length: u64][message], with all integers little endian.
+// Env processes are indexed by their position in the seeds of the Hello.
+#[derive(Debug, Clone, Copy, PartialEq)]
+enum FrameKind {
+    Hello = 0,
+    Launch = 1,
+    Ready = 2,
+    Requests = 3,
+    Responses = 4,
+}
+
+impl TryFrom<u8> for FrameKind {
+    type Error = PyErr;
+
+    fn try_from(value: u8) -> PyResult<Self> {
+        match value {
+            0 => Ok(FrameKind::Hello),
+            1 => Ok(FrameKind::Launch),
+            2 => Ok(FrameKind::Ready),
+            3 => Ok(FrameKind::Requests),
+            4 => Ok(FrameKind::Responses),
+            v => Err(InvalidStateError::new_err(format!(
+                "Received frame of unknown kind {} from remote connection",
+                v
+            ))),
+        }
+    }
+}
+
+const FRAME_HEADER_SIZE: usize = 9;
+
+// The header and payload are sent with a single call so that small messages go out in a single segment
+fn send_frame<'py>(
+    py: Python<'py>,
+    stream: &PyObject,
+    kind: FrameKind,
+    payload: &[u8],
+) -> PyResult<()> {
+    let mut frame = Vec::with_capacity(FRAME_HEADER_SIZE + payload.len());
+    frame.push(kind as u8);
+    frame.extend_from_slice(&(payload.len() as u64).to_le_bytes());
+    frame.extend_from_slice(payload);
+    stream.call_method1(py, intern!(py, "sendall"), (PyBytes::new(py, &frame[..]),))?;
+    Ok(())
+}
+
+fn recv_exact<'py>(py: Python<'py>, stream: &PyObject, n: usize) -> PyResult<Vec<u8>> {
+    let mut buf = Vec::with_capacity(n);
+    while buf.len() < n {
+        let chunk = stream.call_method1(py, intern!(py, "recv"), (n - buf.len(),))?;
+        let chunk = chunk.downcast_bound::<PyBytes>(py)?.as_bytes();
+        if chunk.is_empty() {
+            return Err(InvalidStateError::new_err(
+                "Remote connection was closed by the other side",
+            ));
+        }
+        buf.extend_from_slice(chunk);
+    }
+    Ok(buf)
+}
+
+// Returns the largest payload of a frame carrying a batch of messages, each of which fits in a region of
+// shm_buffer_max_size bytes, for n_procs env processes
+fn get_max_batch_payload_len(n_procs: usize, shm_buffer_max_size: usize) -> usize {
+    8 + n_procs * (16 + shm_buffer_max_size)
+}
+
+// The payload length comes from the other side, so it is checked against max_payload_len before anything is allocated for it
+fn recv_frame<'py>(
+    py: Python<'py>,
+    stream: &PyObject,
+    max_payload_len: usize,
+) -> PyResult<(FrameKind, Vec<u8>)> {
+    let header = recv_exact(py, stream, FRAME_HEADER_SIZE)?;
+    let kind = FrameKind::try_from(header[0])?;
+    let payload_len = u64::from_le_bytes(header[1..FRAME_HEADER_SIZE].try_into().unwrap());
+    if payload_len > max_payload_len as u64 {
+        return Err(InvalidStateError::new_err(format!(
+            "Received a frame of {} bytes from remote connection, which exceeds the maximum of {} bytes",
+            payload_len, max_payload_len
+        )));
+    }
+    Ok((kind, recv_exact(py, stream, payload_len as usize)?))
+}
+
+fn retrieve_le_u64(payload: &[u8], offset: usize) -> PyResult<(usize, usize)> {
+    let end = offset + 8;
+    if end > payload.len() {
+        return Err(InvalidStateError::new_err(
+            "Received truncated frame from remote connection",
+        ));
+    }
+    Ok((
+        u64::from_le_bytes(payload[offset..end].try_into().unwrap()) as usize,
+        end,
+    ))
+}
+
+fn check_proc_idx(proc_idx: usize, n_procs: usize) -> PyResult<usize> {
+    if proc_idx >= n_procs {
+        return Err(InvalidStateError::new_err(format!(
+            "Received a message for env process {} from remote connection, but only {} env processes are relayed over it",
+            proc_idx, n_procs
+        )));
+    }
+    Ok(proc_idx)
+}
+
+fn encode_proc_idx(proc_idx: usize) -> [u8; 8] {
+    (proc_idx as u64).to_le_bytes()
+}
+
+fn decode_proc_idx(payload: &[u8], n_procs: usize) -> PyResult<usize> {
+    check_proc_idx(retrieve_le_u64(payload, 0)?.0, n_procs)
+}
+
+fn encode_batch(messages: &[(usize, &[u8])]) -> Vec<u8> {
+    let payload_len = 8 + messages
+        .iter()
+        .map(|(_, message)| 16 + message.len())
+        .sum::<usize>();
+    let mut payload = Vec::with_capacity(payload_len);
+    payload.extend_from_slice(&(messages.len() as u64).to_le_bytes());
+    for (proc_idx, message) in messages.iter() {
+        payload.extend_from_slice(&encode_proc_idx(*proc_idx));
+        payload.extend_from_slice(&(message.len() as u64).to_le_bytes());
+        payload.extend_from_slice(message);
+    }
+    payload
+}
+
+fn decode_batch(payload: &[u8], n_procs: usize) -> PyResult<Vec<(usize, &[u8])>> {
+    let (n_messages, mut offset) = retrieve_le_u64(payload, 0)?;
+    let mut messages = Vec::with_capacity(n_messages);
+    for _ in 0..n_messages {
+        let proc_idx;
+        let message_len;
+        (proc_idx, offset) = retrieve_le_u64(payload, offset)?;
+        (message_len, offset) = retrieve_le_u64(payload, offset)?;
+        let end = offset + message_len;
+        if end > payload.len() {
+            return Err(InvalidStateError::new_err(
+                "Received truncated frame from remote connection",
+            ));
+        }
+        messages.push((check_proc_idx(proc_idx, n_procs)?, &payload[offset..end]));
+        offset = end;
+    }
+    Ok(messages)
+}
+
+fn open_shmem(flink: &str) -> PyResult<Shmem> {
+    ShmemConf::new().flink(flink).open().map_err(|err| {
+        InvalidStateError::new_err(format!("Unable to open shmem flink {}: {}", flink, err))
+    })
+}
+
+fn shutdown_stream<'py>(py: Python<'py>, stream: &PyObject) {
+    // The stream may already be closed by the other side, in which case there is nothing to do
+    let _ = PyModule::import(py, "socket")
+        .and_then(|socket| socket.getattr("SHUT_RDWR"))
+        .and_then(|how| stream.call_method1(py, intern!(py, "shutdown"), (how,)));
+}
+
+// Something the coordinator relay needs to act on, sent to its main thread by the threads waiting on its inputs
+enum RelayEvent {
+    // The EPI sent a byte to the env process with this index, which is either the signal to launch it or the
+    // answer to its sync
+    Udp(usize),
+    Frame(FrameKind, Vec<u8>),
+    // The EPI signaled that it wrote a request for the env process with this index
+    Request(usize),
+}
+
+#[derive(Debug, PartialEq)]
+enum RelayedProcState {
+    // Waiting for the EPI to launch it
+    Started,
+    // Building its envs on the worker
+    Launched,
+    // Waiting for the EPI to answer its sync. Its initial obs are kept here if they arrive in the meantime.
+    Syncing,
+    Serving,
+    Stopped,
+}
+
+// An env process relayed by the coordinator relay
+struct RelayedProc {
+    proc_id: String,
+    child_end: PyObject,
+    parent_sockname: PyObject,
+    segment: EpShmSegment,
+    retired_segment_option: Option<EpShmSegment>,
+    state: RelayedProcState,
+    initial_response_option: Option<Vec<u8>>,
+    notifier_option: Option<EpNotifier>,
+    // Used to make the request waiter of this env process wait on the event of the given segment address.
+    // Dropped once the env process has stopped, which ends the request waiter.
+    arm_tx_option: Option<Sender<usize>>,
+    // True while the request waiter of this env process is waiting for the next request
+    armed: bool,
+}
+
+impl RelayedProc {
+    fn send_response<'py>(
+        &mut self,
+        py: Python<'py>,
+        response: &[u8],
+        flinks_folder: &str,
+        shm_buffer_max_size: usize,
+    ) -> PyResult<()> {
+        if self.state != RelayedProcState::Serving {
+            return Err(InvalidStateError::new_err(format!(
+                "Received a response for env process {} while it was not being served",
+                self.proc_id
+            )));
+        }
+        send_response(
+            py,
+            &mut self.segment,
+            &mut self.retired_segment_option,
+            response,
+            self.notifier_option.as_ref().unwrap(),
+            flinks_folder,
+            &self.proc_id,
+            shm_buffer_max_size,
+        )?;
+        // The segment may have been replaced by a larger one to fit the response, and the next request comes through the new one
+        self.arm_tx_option
+            .as_ref()
+            .unwrap()
+            .send(self.segment.shmem.as_ptr() as usize)
+            .map_err(|_| {
+                InvalidStateError::new_err(format!(
+                    "Request waiter of env process {} exited",
+                    self.proc_id
+                ))
+            })?;
+        self.armed = true;
+        Ok(())
+    }
+}
+
+// Waits for the EPI to signal the event at each address it receives, reporting the request to the main thread
+fn spawn_request_waiter(
+    proc_idx: usize,
+    arm_rx: Receiver<usize>,
+    event_tx: Sender<PyResult<RelayEvent>>,
+) -> JoinHandle<()> {
+    thread::spawn(move || {
+        while let Ok(evt_addr) = arm_rx.recv() {
+            let result = unsafe { Event::from_existing(evt_addr as *mut u8) }
+                .and_then(|(evt, _)| {
+                    evt.wait(Timeout::Infinite)?;
+                    evt.set(EventState::Clear)
+                })
+                .map(|_| RelayEvent::Request(proc_idx))
+                .map_err(|err| InvalidStateError::new_err(err.to_string()));
+            if event_tx.send(result).is_err() {
+                return;
+            }
+        }
+    })
+}
+
+// Reads the frames from the worker and the bytes the EPI sends to the env processes during their startup, reporting
+// them to the main thread. Returns once the stream has been closed.
+fn spawn_relay_reader(
+    stream: PyObject,
+    child_end_list: Vec<PyObject>,
+    max_payload_len: usize,
+    event_tx: Sender<PyResult<RelayEvent>>,
+) -> JoinHandle<()> {
+    thread::spawn(move || {
+        let result = Python::with_gil::<_, PyResult<()>>(|py| {
+            let selectors = PyModule::import(py, "selectors")?;
+            let event_read = selectors.getattr("EVENT_READ")?;
+            let selector = selectors.getattr("DefaultSelector")?.call0()?;
+            selector.call_method1(
+                intern!(py, "register"),
+                (stream.clone_ref(py), &event_read, py.None()),
+            )?;
+            for (proc_idx, child_end) in child_end_list.iter().enumerate() {
+                selector.call_method1(
+                    intern!(py, "register"),
+                    (child_end.clone_ref(py), &event_read, proc_idx),
+                )?;
+            }
+            // Each env process gets two bytes from the EPI: the signal to launch it and the answer to its sync
+            let mut n_bytes_received = vec![0; child_end_list.len()];
+            loop {
+                for (key, _) in selector
+                    .call_method1(intern!(py, "select"), (py.None(),))?
+                    .extract::<Vec<(PyObject, PyObject)>>()?
+                {
+                    let (_, _, _, proc_idx_option) =
+                        key.extract::<(PyObject, PyObject, PyObject, Option<usize>)>(py)?;
+                    let event = match proc_idx_option {
+                        None => {
+                            let (kind, payload) = recv_frame(py, &stream, max_payload_len)?;
+                            RelayEvent::Frame(kind, payload)
+                        }
+                        Some(proc_idx) => {
+                            let child_end = &child_end_list[proc_idx];
+                            recvfrom_byte(py, child_end)?;
+                            n_bytes_received[proc_idx] += 1;
+                            if n_bytes_received[proc_idx] == 2 {
+                                selector.call_method1(
+                                    intern!(py, "unregister"),
+                                    (child_end.clone_ref(py),),
+                                )?;
+                            }
+                            RelayEvent::Udp(proc_idx)
+                        }
+                    };
+                    if event_tx.send(Ok(event)).is_err() {
+                        return Ok(());
+                    }
+                }
+            }
+        });
+        if let Err(err) = result {
+            let _ = event_tx.send(Err(err));
+        }
+    })
+}
+
+// Runs on the coordinator in place of env_process, for all of the env processes started by the remote worker at the
+// address stream is connected to, using the config in hello. The env process with index i has the id proc_id_list[i]
+// and has already told the EPI it was started using child_end_list[i]. Returns once the EPI has sent Stop to all of them.
+#[pyfunction]
+#[pyo3(signature=(proc_id_list,
+    child_end_list,
+    parent_sockname_list,
+    stream,
+    hello,
+    flinks_folder,
+    shm_buffer_size,
+    notification_backend=DEFAULT_NOTIFICATION_BACKEND,
+    notify_id_option=None,
+    shm_buffer_max_size=67108864))]
+pub fn relay_env_processes(
+    py: Python<'_>,
+    proc_id_list: Vec<String>,
+    child_end_list: Vec<PyObject>,
+    parent_sockname_list: Vec<PyObject>,
+    stream: PyObject,
+    hello: &[u8],
+    flinks_folder: &str,
+    shm_buffer_size: usize,
+    notification_backend: &str,
+    notify_id_option: Option<String>,
+    shm_buffer_max_size: usize,
+) -> PyResult<()> {
+    let notification_backend = get_notification_backend(notification_backend)?;
+    let shm_buffer_max_size = max(shm_buffer_max_size, shm_buffer_size);
+    let n_procs = proc_id_list.len();
+    let (event_tx, mut event_rx) = channel();
+    let mut proc_list = Vec::with_capacity(n_procs);
+    let mut waiter_list = Vec::with_capacity(n_procs);
+    for (proc_idx, ((proc_id, child_end), parent_sockname)) in proc_id_list
+        .into_iter()
+        .zip(child_end_list.iter())
+        .zip(parent_sockname_list.into_iter())
+        .enumerate()
+    {
+        let segment = EpShmSegment::create(flinks_folder, &proc_id, 0, shm_buffer_size)?;
+        let (arm_tx, arm_rx) = channel();
+        waiter_list.push(spawn_request_waiter(proc_idx, arm_rx, event_tx.clone()));
+        proc_list.push(RelayedProc {
+            proc_id,
+            child_end: child_end.clone_ref(py),
+            parent_sockname,
+            segment,
+            retired_segment_option: None,
+            state: RelayedProcState::Started,
+            initial_response_option: None,
+            notifier_option: None,
+            arm_tx_option: Some(arm_tx),
+            armed: false,
+        });
+    }
+    let reader = spawn_relay_reader(
+        stream.clone_ref(py),
+        child_end_list,
+        get_max_batch_payload_len(n_procs, shm_buffer_max_size),
+        event_tx,
+    );
+
+    let result = (|| -> PyResult<()> {
+        send_frame(py, &stream, FrameKind::Hello, hello)?;
+        let mut request_list = Vec::new();
+        while proc_list
+            .iter()
+            .any(|proc| proc.state != RelayedProcState::Stopped)
+        {
+            let event_rx_ref = &mut event_rx;
+            let first_event = py.allow_threads(move || event_rx_ref.recv()).map_err(|_| {
+                InvalidStateError::new_err("All threads of the remote env process relay exited")
+            })?;
+            // Everything which has arrived in the meantime is handled too, so that requests signaled together
+            // are forwarded in one frame
+            let mut events = vec![first_event];
+            events.extend(event_rx.try_iter());
+            request_list.clear();
+            for event in events {
+                match event? {
+                    RelayEvent::Udp(proc_idx) => {
+                        let proc = &mut proc_list[proc_idx];
+                        match proc.state {
+                            RelayedProcState::Started => {
+                                send_frame(
+                                    py,
+                                    &stream,
+                                    FrameKind::Launch,
+                                    &encode_proc_idx(proc_idx),
+                                )?;
+                                proc.state = RelayedProcState::Launched;
+                            }
+                            RelayedProcState::Syncing => {
+                                proc.notifier_option = Some(open_ep_notifier(
+                                    py,
+                                    &notification_backend,
+                                    &proc.child_end,
+                                    &proc.parent_sockname,
+                                    flinks_folder,
+                                    &notify_id_option,
+                                )?);
+                                proc.state = RelayedProcState::Serving;
+                                // The first response is the initial obs, which the worker sends without being asked
+                                if let Some(response) = proc.initial_response_option.take() {
+                                    proc.send_response(
+                                        py,
+                                        &response[..],
+                                        flinks_folder,
+                                        shm_buffer_max_size,
+                                    )?;
+                                }
+                            }
+                            _ => {
+                                return Err(InvalidStateError::new_err(format!(
+                                    "Unexpected message from the EPI to env process {}",
+                                    proc.proc_id
+                                )))
+                            }
+                        }
+                    }
+                    RelayEvent::Frame(FrameKind::Ready, payload) => {
+                        let proc = &mut proc_list[decode_proc_idx(&payload[..], n_procs)?];
+                        // The EPI's answer to the sync arrives as a Udp event
+                        sendto_byte(py, &proc.child_end, &proc.parent_sockname)?;
+                        proc.state = RelayedProcState::Syncing;
+                    }
+                    RelayEvent::Frame(FrameKind::Responses, payload) => {
+                        for (proc_idx, response) in decode_batch(&payload[..], n_procs)? {
+                            let proc = &mut proc_list[proc_idx];
+                            if proc.state == RelayedProcState::Syncing {
+                                proc.initial_response_option = Some(response.to_vec());
+                            } else {
+                                proc.send_response(
+                                    py,
+                                    response,
+                                    flinks_folder,
+                                    shm_buffer_max_size,
+                                )?;
+                            }
+                        }
+                    }
+                    RelayEvent::Frame(kind, _) => {
+                        return Err(InvalidStateError::new_err(format!(
+                            "Unexpected frame of kind {:?} from remote connection",
+                            kind
+                        )))
+                    }
+                    RelayEvent::Request(proc_idx) => {
+                        let proc = &mut proc_list[proc_idx];
+                        proc.armed = false;
+                        // The EPI has opened the current segment by the time it sends a request
+                        proc.retired_segment_option = None;
+                        let shm_control = unsafe { proc.segment.control() };
+                        let request_len = shm_control.request_len.load(Ordering::Acquire) as usize;
+                        let request_region: &[u8] = unsafe { get_shm_request(&proc.segment.shmem) };
+                        let request = &request_region[..request_len];
+                        let (header, _) = retrieve_header(request, 0)?;
+                        if header == Header::Stop {
+                            proc.state = RelayedProcState::Stopped;
+                            proc.arm_tx_option = None;
+                        }
+                        request_list.push((proc_idx, request));
+                    }
+                }
+            }
+            if !request_list.is_empty() {
+                send_frame(
+                    py,
+                    &stream,
+                    FrameKind::Requests,
+                    &encode_batch(&request_list[..])[..],
+                )?;
+            }
+        }
+        Ok(())
+    })();
+
+    // Wake up all the threads so that they exit, and wait for them before the segments they use are dropped
+    drop(event_rx);
+    for proc in proc_list.iter_mut() {
+        proc.arm_tx_option = None;
+        if proc.armed {
+            let _ = proc.segment.epi_evt.set(EventState::Signaled);
+        }
+    }
+    shutdown_stream(py, &stream);
+    py.allow_threads(move || {
+        let _ = reader.join();
+        for waiter in waiter_list {
+            let _ = waiter.join();
+        }
+    });
+    result
+}
+
+// The state of an env process served by the worker relay
+#[derive(Debug, PartialEq)]
+enum ServedProcState {
+    // Waiting for the coordinator to launch it
+    Started,
+    // Building its envs
+    Launched,
+    Serving,
+    Stopped,
+}
+
+// Runs on the remote worker. Forwards the requests received over stream to the env processes with ids in proc_id_list,
+// which must have been started with the udp notification backend and already have told this worker they were started,
+// and sends their responses back. Returns once Stop has been forwarded to all of them. Frames larger than a batch of
+// requests of shm_buffer_max_size bytes for every env process are rejected.
+#[pyfunction]
+pub fn serve_remote_env_processes(
+    py: Python<'_>,
+    proc_id_list: Vec<String>,
+    parent_end_list: Vec<PyObject>,
+    child_sockname_list: Vec<PyObject>,
+    stream: PyObject,
+    flinks_folder: &str,
+    shm_buffer_max_size: usize,
+) -> PyResult<()> {
+    let n_procs = proc_id_list.len();
+    let max_payload_len = get_max_batch_payload_len(n_procs, shm_buffer_max_size);
+    let selectors = PyModule::import(py, "selectors")?;
+    let event_read = selectors.getattr("EVENT_READ")?;
+    let selector = selectors.getattr("DefaultSelector")?.call0()?;
+    selector.call_method1(
+        intern!(py, "register"),
+        (stream.clone_ref(py), &event_read, py.None()),
+    )?;
+    for (proc_idx, parent_end) in parent_end_list.iter().enumerate() {
+        selector.call_method1(
+            intern!(py, "register"),
+            (parent_end.clone_ref(py), &event_read, proc_idx),
+        )?;
+    }
+    let mut state_list: Vec<ServedProcState> =
+        (0..n_procs).map(|_| ServedProcState::Started).collect();
+    let mut shmem_option_list: Vec<Option<Shmem>> = (0..n_procs).map(|_| None).collect();
+
+    let mut ready_proc_idx_list = Vec::new();
+    while state_list
+        .iter()
+        .any(|state| *state != ServedProcState::Stopped)
+    {
+        ready_proc_idx_list.clear();
+        for (key, _) in selector
+            .call_method1(intern!(py, "select"), (py.None(),))?
+            .extract::<Vec<(PyObject, PyObject)>>()?
+        {
+            let (_, _, _, proc_idx_option) =
+                key.extract::<(PyObject, PyObject, PyObject, Option<usize>)>(py)?;
+            let Some(proc_idx) = proc_idx_option else {
+                let (kind, payload) = recv_frame(py, &stream, max_payload_len)?;
+                match kind {
+                    FrameKind::Launch => {
+                        let proc_idx = decode_proc_idx(&payload[..], n_procs)?;
+                        sendto_byte(
+                            py,
+                            &parent_end_list[proc_idx],
+                            &child_sockname_list[proc_idx],
+                        )?;
+                        state_list[proc_idx] = ServedProcState::Launched;
+                    }
+                    FrameKind::Requests => {
+                        for (proc_idx, request) in decode_batch(&payload[..], n_procs)? {
+                            let shmem = shmem_option_list[proc_idx].as_ref().ok_or_else(|| {
+                                InvalidStateError::new_err(format!(
+                                    "Received a request for env process {} before it was ready",
+                                    proc_id_list[proc_idx]
+                                ))
+                            })?;
+                            let request_slice = unsafe { get_shm_request(shmem) };
+                            if request.len() > request_slice.len() {
+                                return Err(InvalidStateError::new_err(format!(
+                                    "Received a request of {} bytes for env process {}, which does not fit in its request region of {} bytes",
+                                    request.len(),
+                                    proc_id_list[proc_idx],
+                                    request_slice.len()
+                                )));
+                            }
+                            request_slice[..request.len()].copy_from_slice(request);
+                            publish_request_len(unsafe { get_shm_control(shmem) }, request.len());
+                            let (ep_evt, _) = unsafe {
+                                Event::from_existing(shmem.as_ptr()).map_err(|err| {
+                                    InvalidStateError::new_err(format!(
+                                        "Failed to get event: {}",
+                                        err.to_string()
+                                    ))
+                                })?
+                            };
+                            ep_evt
+                                .set(EventState::Signaled)
+                                .map_err(|err| InvalidStateError::new_err(err.to_string()))?;
+                            let (header, _) = retrieve_header(request, 0)?;
+                            if header == Header::Stop {
+                                state_list[proc_idx] = ServedProcState::Stopped;
+                                selector.call_method1(
+                                    intern!(py, "unregister"),
+                                    (parent_end_list[proc_idx].clone_ref(py),),
+                                )?;
+                            }
+                        }
+                    }
+                    kind => {
+                        return Err(InvalidStateError::new_err(format!(
+                            "Unexpected frame of kind {:?} from remote connection",
+                            kind
+                        )))
+                    }
+                }
+                continue;
+            };
+            match state_list[proc_idx] {
+                ServedProcState::Launched => {
+                    // The env process syncs once its envs have been built, so the coordinator is only told it's ready then
+                    sync_with_env_process(
+                        py,
+                        &parent_end_list[proc_idx],
+                        &child_sockname_list[proc_idx],
+                    )?;
+                    shmem_option_list[proc_idx] = Some(open_shmem(&get_flink(
+                        flinks_folder,
+                        &proc_id_list[proc_idx],
+                    ))?);
+                    send_frame(py, &stream, FrameKind::Ready, &encode_proc_idx(proc_idx))?;
+                    state_list[proc_idx] = ServedProcState::Serving;
+                }
+                ServedProcState::Serving => {
+                    recvfrom_byte(py, &parent_end_list[proc_idx])?;
+                    let shmem = shmem_option_list[proc_idx].as_mut().unwrap();
+                    let shm_control = unsafe { get_shm_control(shmem) };
+                    if shm_control.superseded.load(Ordering::Acquire) != 0 {
+                        *shmem = open_shmem(&get_shm_flink(
+                            flinks_folder,
+                            &proc_id_list[proc_idx],
+                            shm_control.generation.load(Ordering::Relaxed) + 1,
+                        ))?;
+                    }
+                    ready_proc_idx_list.push(proc_idx);
+                }
+                _ => {
+                    return Err(InvalidStateError::new_err(format!(
+                        "Unexpected notification from env process {}",
+                        proc_id_list[proc_idx]
+                    )))
+                }
+            }
+        }
+        if !ready_proc_idx_list.is_empty() {
+            let mut response_list = Vec::with_capacity(ready_proc_idx_list.len());
+            for &proc_idx in ready_proc_idx_list.iter() {
+                let shmem = shmem_option_list[proc_idx].as_ref().unwrap();
+                let response_region: &[u8] = unsafe { get_shm_response(shmem) };
+                let response_len = unsafe { get_shm_control(shmem) }
+                    .response_len
+                    .load(Ordering::Acquire) as usize;
+                response_list.push((proc_idx, &response_region[..response_len]));
+            }
+            send_frame(
+                py,
+                &stream,
+                FrameKind::Responses,
+                &encode_batch(&response_list[..])[..],
+            )?;
+        }
+    }
+    Ok(())
+}
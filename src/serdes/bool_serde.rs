@@ -28,7 +28,7 @@ impl PyAnySerde for BoolSerde {
         offset: usize,
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
-        Ok(append_bool(buf, offset, obj.extract::<bool>()?))
+        append_bool(buf, offset, obj.extract::<bool>()?)
     }
 
     fn retrieve<'py>(
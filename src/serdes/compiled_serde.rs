@@ -0,0 +1,655 @@
+use core::str;
+use std::iter::zip;
+use std::sync::Arc;
+
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::types::{PyBytes, PyComplex, PyDict, PyList, PySet, PyString, PyTuple};
+use pyo3::Bound;
+
+use crate::communication::{
+    append_bool, append_bytes, append_c_double, append_f64, append_i64, append_usize, insert_bytes,
+    retrieve_bool, retrieve_bytes, retrieve_c_double, retrieve_f64, retrieve_i64, retrieve_python,
+    retrieve_usize,
+};
+
+use super::pyany_serde::{get_pyany_serde, PyAnySerde};
+use super::serde_enum::{get_serde_bytes, Serde};
+
+#[derive(Clone)]
+enum PlanNode {
+    Bool,
+    Int,
+    Float,
+    Complex,
+    String,
+    Bytes,
+    List {
+        item: usize,
+    },
+    Set {
+        item: usize,
+    },
+    // If every item has a fixed size, item_offsets_option has the offset of each item from the start of the tuple
+    Tuple {
+        items: Vec<usize>,
+        item_offsets_option: Option<Vec<usize>>,
+    },
+    // Dict entries are written with append_python, so every key and value is preceded by a flag and its serde enum bytes
+    Dict {
+        key: usize,
+        key_enum_bytes: Vec<u8>,
+        value: usize,
+        value_enum_bytes: Vec<u8>,
+    },
+    // Serdes which have no compiled form, by index into the serde list of the plan
+    Serde(usize),
+}
+
+// A serde tree compiled once into a flat list of nodes in pre-order, where containers refer to their children by index.
+// The size of every node which always serializes to the same number of bytes is computed up front, so the items of
+// fixed-size tuples are written at precomputed offsets, and lists and sets of fixed-size items are laid out without
+// chaining offsets from item to item. Scalars, strings and containers are handled without dynamic dispatch, and other
+// serdes (numpy, pickle, dynamic) are called as they are. The bytes written are the same as with the uncompiled serde.
+#[derive(Clone)]
+pub struct CompiledSerde {
+    // Shared so that the plan can be walked while the serdes it holds are mutably borrowed
+    nodes: Arc<Vec<PlanNode>>,
+    fixed_sizes: Vec<Option<usize>>,
+    serdes: Vec<Box<dyn PyAnySerde>>,
+    align: usize,
+    serde_enum: Serde,
+    serde_enum_bytes: Vec<u8>,
+}
+
+impl CompiledSerde {
+    fn compile_node(&mut self, nodes: &mut Vec<PlanNode>, serde: &Serde) -> PyResult<usize> {
+        let idx = nodes.len();
+        // Placeholder until the children of the node have been compiled
+        nodes.push(PlanNode::Bool);
+        self.fixed_sizes.push(None);
+        let (node, fixed_size_option) = match serde {
+            Serde::BOOLEAN => (PlanNode::Bool, Some(1)),
+            Serde::INT => (PlanNode::Int, Some(8)),
+            Serde::FLOAT => (PlanNode::Float, Some(8)),
+            Serde::COMPLEX => (PlanNode::Complex, Some(16)),
+            Serde::STRING => (PlanNode::String, None),
+            Serde::BYTES => (PlanNode::Bytes, None),
+            Serde::LIST { items } => (
+                PlanNode::List {
+                    item: self.compile_node(nodes, items)?,
+                },
+                None,
+            ),
+            Serde::SET { items } => (
+                PlanNode::Set {
+                    item: self.compile_node(nodes, items)?,
+                },
+                None,
+            ),
+            Serde::TUPLE { items } => {
+                let items = items
+                    .iter()
+                    .map(|item| self.compile_node(nodes, item))
+                    .collect::<PyResult<Vec<usize>>>()?;
+                let item_fixed_sizes = items
+                    .iter()
+                    .map(|item| self.fixed_sizes[*item])
+                    .collect::<Option<Vec<usize>>>();
+                match item_fixed_sizes {
+                    Some(item_fixed_sizes) => {
+                        let mut item_offsets = Vec::with_capacity(items.len());
+                        let mut fixed_size = 0;
+                        for item_fixed_size in item_fixed_sizes {
+                            item_offsets.push(fixed_size);
+                            fixed_size += item_fixed_size;
+                        }
+                        (
+                            PlanNode::Tuple {
+                                items,
+                                item_offsets_option: Some(item_offsets),
+                            },
+                            Some(fixed_size),
+                        )
+                    }
+                    None => (
+                        PlanNode::Tuple {
+                            items,
+                            item_offsets_option: None,
+                        },
+                        None,
+                    ),
+                }
+            }
+            Serde::DICT { keys, values } => (
+                PlanNode::Dict {
+                    key: self.compile_node(nodes, keys)?,
+                    key_enum_bytes: get_serde_bytes(keys),
+                    value: self.compile_node(nodes, values)?,
+                    value_enum_bytes: get_serde_bytes(values),
+                },
+                None,
+            ),
+            Serde::COMPILED { serde } => {
+                // The compiled serde is inlined, so this node is replaced by its root
+                nodes.pop();
+                self.fixed_sizes.pop();
+                return self.compile_node(nodes, serde);
+            }
+            Serde::OTHER => {
+                return Err(InvalidStateError::new_err(
+                    "Tried to compile a serde containing a serde which cannot be reconstructed from its Serde enum",
+                ))
+            }
+            serde => {
+                self.serdes.push(get_pyany_serde(serde.clone())?);
+                (PlanNode::Serde(self.serdes.len() - 1), None)
+            }
+        };
+        nodes[idx] = node;
+        self.fixed_sizes[idx] = fixed_size_option;
+        Ok(idx)
+    }
+
+    fn append_node<'py>(
+        &mut self,
+        nodes: &[PlanNode],
+        idx: usize,
+        buf: &mut [u8],
+        offset: usize,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<usize> {
+        match &nodes[idx] {
+            PlanNode::Bool => append_bool(buf, offset, obj.extract::<bool>()?),
+            PlanNode::Int => append_i64(buf, offset, obj.extract::<i64>()?),
+            PlanNode::Float => append_f64(buf, offset, obj.extract::<f64>()?),
+            PlanNode::Complex => {
+                let complex = obj.downcast::<PyComplex>()?;
+                let new_offset = append_c_double(buf, offset, complex.real())?;
+                append_c_double(buf, new_offset, complex.imag())
+            }
+            PlanNode::String => append_bytes(
+                buf,
+                offset,
+                obj.downcast::<PyString>()?.to_str()?.as_bytes(),
+            ),
+            PlanNode::Bytes => append_bytes(buf, offset, obj.downcast::<PyBytes>()?.as_bytes()),
+            &PlanNode::List { item } => {
+                let list = obj.downcast::<PyList>()?;
+                let new_offset = append_usize(buf, offset, list.len())?;
+                // Like ListSerde, items handled by a serde are appended as one batch
+                if let &PlanNode::Serde(serde_idx) = &nodes[item] {
+                    return self.serdes[serde_idx].append_batch(buf, new_offset, list);
+                }
+                self.append_items(nodes, item, buf, new_offset, list.iter())
+            }
+            &PlanNode::Set { item } => {
+                let set = obj.downcast::<PySet>()?;
+                let new_offset = append_usize(buf, offset, set.len())?;
+                self.append_items(nodes, item, buf, new_offset, set.iter())
+            }
+            PlanNode::Tuple {
+                items,
+                item_offsets_option,
+            } => {
+                let tuple = obj.downcast::<PyTuple>()?;
+                if tuple.len() != items.len() {
+                    return Err(InvalidStateError::new_err(format!(
+                        "Compiled serde expected a tuple of length {} but got a tuple of length {}",
+                        items.len(),
+                        tuple.len()
+                    )));
+                }
+                if let Some(item_offsets) = item_offsets_option {
+                    for ((item, item_offset), item_obj) in
+                        zip(zip(items, item_offsets), tuple.iter())
+                    {
+                        self.append_node(nodes, *item, buf, offset + item_offset, &item_obj)?;
+                    }
+                    Ok(offset + self.fixed_sizes[idx].unwrap())
+                } else {
+                    let mut new_offset = offset;
+                    for (item, item_obj) in zip(items, tuple.iter()) {
+                        new_offset = self.append_node(nodes, *item, buf, new_offset, &item_obj)?;
+                    }
+                    Ok(new_offset)
+                }
+            }
+            PlanNode::Dict {
+                key,
+                key_enum_bytes,
+                value,
+                value_enum_bytes,
+            } => {
+                let dict = obj.downcast::<PyDict>()?;
+                let mut new_offset = append_usize(buf, offset, dict.len())?;
+                for (key_obj, value_obj) in dict.iter() {
+                    new_offset = append_bool(buf, new_offset, false)?;
+                    new_offset = insert_bytes(buf, new_offset, &key_enum_bytes[..])?;
+                    new_offset = self.append_node(nodes, *key, buf, new_offset, &key_obj)?;
+                    new_offset = append_bool(buf, new_offset, false)?;
+                    new_offset = insert_bytes(buf, new_offset, &value_enum_bytes[..])?;
+                    new_offset = self.append_node(nodes, *value, buf, new_offset, &value_obj)?;
+                }
+                Ok(new_offset)
+            }
+            &PlanNode::Serde(serde_idx) => self.serdes[serde_idx].append(buf, offset, obj),
+        }
+    }
+
+    fn append_items<'py>(
+        &mut self,
+        nodes: &[PlanNode],
+        item: usize,
+        buf: &mut [u8],
+        offset: usize,
+        item_objs: impl ExactSizeIterator<Item = Bound<'py, PyAny>>,
+    ) -> PyResult<usize> {
+        if let Some(item_size) = self.fixed_sizes[item] {
+            let end = offset + item_objs.len() * item_size;
+            get_fixed_size_buf(buf, offset, end)?;
+            for (item_idx, item_obj) in item_objs.enumerate() {
+                self.append_node(nodes, item, buf, offset + item_idx * item_size, &item_obj)?;
+            }
+            Ok(end)
+        } else {
+            let mut new_offset = offset;
+            for item_obj in item_objs {
+                new_offset = self.append_node(nodes, item, buf, new_offset, &item_obj)?;
+            }
+            Ok(new_offset)
+        }
+    }
+
+    fn retrieve_node<'py>(
+        &mut self,
+        nodes: &[PlanNode],
+        py: Python<'py>,
+        idx: usize,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        match &nodes[idx] {
+            PlanNode::Bool => {
+                let (val, new_offset) = retrieve_bool(buf, offset)?;
+                Ok((val.into_pyobject(py)?.to_owned().into_any(), new_offset))
+            }
+            PlanNode::Int => {
+                let (val, new_offset) = retrieve_i64(buf, offset)?;
+                Ok((val.into_pyobject(py)?.into_any(), new_offset))
+            }
+            PlanNode::Float => {
+                let (val, new_offset) = retrieve_f64(buf, offset)?;
+                Ok((val.into_pyobject(py)?.into_any(), new_offset))
+            }
+            PlanNode::Complex => {
+                let (real, new_offset) = retrieve_c_double(buf, offset)?;
+                let (imag, new_offset) = retrieve_c_double(buf, new_offset)?;
+                Ok((
+                    PyComplex::from_doubles(py, real, imag).into_any(),
+                    new_offset,
+                ))
+            }
+            PlanNode::String => {
+                let (obj_bytes, new_offset) = retrieve_bytes(buf, offset)?;
+                Ok((
+                    PyString::new(py, str::from_utf8(obj_bytes)?).into_any(),
+                    new_offset,
+                ))
+            }
+            PlanNode::Bytes => {
+                let (obj_bytes, new_offset) = retrieve_bytes(buf, offset)?;
+                Ok((PyBytes::new(py, obj_bytes).into_any(), new_offset))
+            }
+            &PlanNode::List { item } => {
+                let (n_items, new_offset) = retrieve_usize(buf, offset)?;
+                let (item_objs, new_offset) = if let &PlanNode::Serde(serde_idx) = &nodes[item] {
+                    self.serdes[serde_idx].retrieve_batch(py, buf, new_offset, n_items)?
+                } else {
+                    self.retrieve_items(nodes, py, item, n_items, buf, new_offset)?
+                };
+                Ok((PyList::new(py, item_objs)?.into_any(), new_offset))
+            }
+            &PlanNode::Set { item } => {
+                let (n_items, new_offset) = retrieve_usize(buf, offset)?;
+                let (item_objs, new_offset) =
+                    self.retrieve_items(nodes, py, item, n_items, buf, new_offset)?;
+                Ok((PySet::new(py, item_objs)?.into_any(), new_offset))
+            }
+            PlanNode::Tuple {
+                items,
+                item_offsets_option,
+            } => {
+                let mut item_objs = Vec::with_capacity(items.len());
+                if let Some(item_offsets) = item_offsets_option {
+                    let end = offset + self.fixed_sizes[idx].unwrap();
+                    let tuple_buf = get_fixed_size_buf(buf, offset, end)?;
+                    for (item, item_offset) in zip(items, item_offsets) {
+                        item_objs.push(
+                            self.retrieve_node(nodes, py, *item, tuple_buf, offset + item_offset)?
+                                .0,
+                        );
+                    }
+                    Ok((PyTuple::new(py, item_objs)?.into_any(), end))
+                } else {
+                    let mut new_offset = offset;
+                    for item in items {
+                        let item_obj;
+                        (item_obj, new_offset) =
+                            self.retrieve_node(nodes, py, *item, buf, new_offset)?;
+                        item_objs.push(item_obj);
+                    }
+                    Ok((PyTuple::new(py, item_objs)?.into_any(), new_offset))
+                }
+            }
+            PlanNode::Dict {
+                key,
+                key_enum_bytes,
+                value,
+                value_enum_bytes,
+            } => {
+                let dict = PyDict::new(py);
+                let (n_items, mut new_offset) = retrieve_usize(buf, offset)?;
+                for _ in 0..n_items {
+                    let key_obj;
+                    (key_obj, new_offset) =
+                        self.retrieve_dict_entry(nodes, py, *key, key_enum_bytes, buf, new_offset)?;
+                    let value_obj;
+                    (value_obj, new_offset) = self.retrieve_dict_entry(
+                        nodes,
+                        py,
+                        *value,
+                        value_enum_bytes,
+                        buf,
+                        new_offset,
+                    )?;
+                    dict.set_item(key_obj, value_obj)?;
+                }
+                Ok((dict.into_any(), new_offset))
+            }
+            &PlanNode::Serde(serde_idx) => self.serdes[serde_idx].retrieve(py, buf, offset),
+        }
+    }
+
+    fn retrieve_items<'py>(
+        &mut self,
+        nodes: &[PlanNode],
+        py: Python<'py>,
+        item: usize,
+        n_items: usize,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        let mut item_objs = Vec::with_capacity(n_items);
+        if let Some(item_size) = self.fixed_sizes[item] {
+            let end = offset + n_items * item_size;
+            let items_buf = get_fixed_size_buf(buf, offset, end)?;
+            for item_idx in 0..n_items {
+                item_objs.push(
+                    self.retrieve_node(nodes, py, item, items_buf, offset + item_idx * item_size)?
+                        .0,
+                );
+            }
+            Ok((item_objs, end))
+        } else {
+            let mut new_offset = offset;
+            for _ in 0..n_items {
+                let item_obj;
+                (item_obj, new_offset) = self.retrieve_node(nodes, py, item, buf, new_offset)?;
+                item_objs.push(item_obj);
+            }
+            Ok((item_objs, new_offset))
+        }
+    }
+
+    // Entries which were not written with the expected serde (for example by a DictSerde which detected the serde of
+    // its values) are retrieved using the serde given by their enum bytes
+    fn retrieve_dict_entry<'py>(
+        &mut self,
+        nodes: &[PlanNode],
+        py: Python<'py>,
+        idx: usize,
+        enum_bytes: &[u8],
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let (is_type_serde, new_offset) = retrieve_bool(buf, offset)?;
+        let enum_end = new_offset + enum_bytes.len();
+        if !is_type_serde && buf.get(new_offset..enum_end) == Some(enum_bytes) {
+            return self.retrieve_node(nodes, py, idx, buf, enum_end);
+        }
+        let (obj, new_offset, _) = retrieve_python(py, buf, offset, &None, &mut None)?;
+        Ok((obj, new_offset))
+    }
+}
+
+// Checks once that a run of fixed-size data fits in buf, so the nodes inside it don't need to
+fn get_fixed_size_buf(buf: &[u8], offset: usize, end: usize) -> PyResult<&[u8]> {
+    if end > buf.len() {
+        return Err(InvalidStateError::new_err(format!(
+            "Compiled serde needs {} bytes but only {} are available",
+            end - offset,
+            buf.len().saturating_sub(offset)
+        )));
+    }
+    Ok(&buf[..end])
+}
+
+// Compiles the serde tree described by the enum of pyany_serde. Serdes which are not containers, and serdes which cannot
+// be rebuilt from their enum (such as those holding a TypeSerde), are returned as they are.
+pub fn compile_pyany_serde(pyany_serde: Box<dyn PyAnySerde>) -> PyResult<Box<dyn PyAnySerde>> {
+    let serde = match pyany_serde.get_enum() {
+        Serde::COMPILED { serde } => (**serde).clone(),
+        serde => serde.clone(),
+    };
+    // Only containers benefit from being compiled
+    let is_container = matches!(
+        serde,
+        Serde::LIST { .. } | Serde::SET { .. } | Serde::TUPLE { .. } | Serde::DICT { .. }
+    );
+    if !is_container || contains_other(&serde) {
+        return Ok(pyany_serde);
+    }
+    Ok(Box::new(CompiledSerde::new(serde, pyany_serde.align_of())?))
+}
+
+fn contains_other(serde: &Serde) -> bool {
+    match serde {
+        Serde::OTHER => true,
+        Serde::LIST { items } | Serde::SET { items } => contains_other(items),
+        Serde::TUPLE { items } => items.iter().any(contains_other),
+        Serde::DICT { keys, values } => contains_other(keys) || contains_other(values),
+        Serde::COMPILED { serde } => contains_other(serde),
+        Serde::STRUCT { fields, .. } => fields
+            .iter()
+            .any(|(_, field_serde)| contains_other(field_serde)),
+        _ => false,
+    }
+}
+
+impl CompiledSerde {
+    pub fn new(serde: Serde, align: usize) -> PyResult<Self> {
+        let serde_enum = Serde::COMPILED {
+            serde: Box::new(serde.clone()),
+        };
+        let mut compiled_serde = CompiledSerde {
+            nodes: Arc::new(Vec::new()),
+            fixed_sizes: Vec::new(),
+            serdes: Vec::new(),
+            align,
+            serde_enum_bytes: get_serde_bytes(&serde_enum),
+            serde_enum,
+        };
+        let mut nodes = Vec::new();
+        compiled_serde.compile_node(&mut nodes, &serde)?;
+        compiled_serde.nodes = Arc::new(nodes);
+        Ok(compiled_serde)
+    }
+}
+
+impl PyAnySerde for CompiledSerde {
+    fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<usize> {
+        let nodes = self.nodes.clone();
+        self.append_node(&nodes, 0, buf, offset, obj)
+    }
+
+    fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let nodes = self.nodes.clone();
+        self.retrieve_node(&nodes, py, 0, buf, offset)
+    }
+
+    fn align_of(&self) -> usize {
+        self.align
+    }
+
+    fn get_enum(&self) -> &Serde {
+        &self.serde_enum
+    }
+
+    fn get_enum_bytes(&self) -> &[u8] {
+        &self.serde_enum_bytes
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use pyo3::ffi::c_str;
+    use pyo3::prelude::*;
+    use pyo3::types::IntoPyDict;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+    use crate::serdes::pyany_serde::get_pyany_serde;
+    use crate::serdes::serde_enum::Serde;
+
+    use super::compile_pyany_serde;
+
+    // Appends obj with the uncompiled and the compiled serde of serde, checks that the bytes are the same, and returns
+    // obj retrieved from those bytes by the compiled serde
+    fn compiled_round_trip<'py>(
+        py: Python<'py>,
+        serde: Serde,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        let mut uncompiled_serde = get_pyany_serde(serde.clone())?;
+        let mut compiled_serde = compile_pyany_serde(get_pyany_serde(serde)?)?;
+        assert!(matches!(compiled_serde.get_enum(), Serde::COMPILED { .. }));
+        // The same buffer is used for both so that the padding for alignment is the same
+        let mut buf = vec![0_u8; 4096];
+        let uncompiled_end = uncompiled_serde.append(&mut buf[..], 0, obj)?;
+        let uncompiled_bytes = buf[..uncompiled_end].to_vec();
+        buf.fill(0);
+        let compiled_end = compiled_serde.append(&mut buf[..], 0, obj)?;
+        assert_eq!(buf[..compiled_end], uncompiled_bytes[..]);
+        let (retrieved, retrieve_end) = compiled_serde.retrieve(py, &buf[..], 0)?;
+        assert_eq!(retrieve_end, compiled_end);
+        Ok(retrieved)
+    }
+
+    #[test]
+    fn test_compiled_tuple_matches_uncompiled() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let serde = Serde::TUPLE {
+                items: vec![
+                    Serde::STRING,
+                    Serde::INT,
+                    Serde::FLOAT,
+                    Serde::BOOLEAN,
+                    Serde::COMPLEX,
+                    Serde::BYTES,
+                ],
+            };
+            let obj = py.eval(c_str!("('abc', -5, 2.5, True, 1 + 2j, b'xy')"), None, None)?;
+            assert!(compiled_round_trip(py, serde, &obj)?.eq(&obj)?);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_compiled_fixed_size_list_matches_uncompiled() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let serde = Serde::LIST {
+                items: Box::new(Serde::TUPLE {
+                    items: vec![Serde::INT, Serde::FLOAT, Serde::BOOLEAN],
+                }),
+            };
+            for code in [
+                c_str!("[(i, i / 2, i % 2 == 0) for i in range(5)]"),
+                c_str!("[]"),
+            ] {
+                let obj = py.eval(code, None, None)?;
+                assert!(compiled_round_trip(py, serde.clone(), &obj)?.eq(&obj)?);
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_compiled_dict_and_set_match_uncompiled() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let dict_serde = Serde::DICT {
+                keys: Box::new(Serde::STRING),
+                values: Box::new(Serde::LIST {
+                    items: Box::new(Serde::INT),
+                }),
+            };
+            let obj = py.eval(c_str!("{'a': [1, 2, 3], 'b': []}"), None, None)?;
+            assert!(compiled_round_trip(py, dict_serde, &obj)?.eq(&obj)?);
+
+            let set_serde = Serde::SET {
+                items: Box::new(Serde::STRING),
+            };
+            let obj = py.eval(c_str!("{'x', 'yy', 'zzz'}"), None, None)?;
+            assert!(compiled_round_trip(py, set_serde, &obj)?.eq(&obj)?);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_compiled_numpy_items_match_uncompiled() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let serde = Serde::TUPLE {
+                items: vec![
+                    Serde::NUMPY {
+                        dtype: NumpyDtype::FLOAT32,
+                    },
+                    Serde::LIST {
+                        items: Box::new(Serde::NUMPY_STATIC {
+                            dtype: NumpyDtype::INT64,
+                            shape: vec![2],
+                        }),
+                    },
+                ],
+            };
+            let numpy = py.import("numpy")?;
+            let obj = py.eval(
+                c_str!("(numpy.arange(6, dtype=numpy.float32).reshape(2, 3), [numpy.array([1, 2]), numpy.array([3, 4])])"),
+                Some(&[("numpy", numpy.clone())].into_py_dict(py)?),
+                None,
+            )?;
+            let retrieved = compiled_round_trip(py, serde, &obj)?;
+            let array_equal = numpy.getattr("array_equal")?;
+            assert!(array_equal
+                .call1((retrieved.get_item(0)?, obj.get_item(0)?))?
+                .is_truthy()?);
+            for item_idx in 0..2 {
+                assert!(array_equal
+                    .call1((
+                        retrieved.get_item(1)?.get_item(item_idx)?,
+                        obj.get_item(1)?.get_item(item_idx)?,
+                    ))?
+                    .is_truthy()?);
+            }
+            Ok(())
+        })
+    }
+}
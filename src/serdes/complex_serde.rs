@@ -31,8 +31,8 @@ impl PyAnySerde for ComplexSerde {
     ) -> PyResult<usize> {
         let complex = obj.downcast::<PyComplex>()?;
         let mut new_offset;
-        new_offset = append_c_double(buf, offset, complex.real());
-        new_offset = append_c_double(buf, new_offset, complex.imag());
+        new_offset = append_c_double(buf, offset, complex.real())?;
+        new_offset = append_c_double(buf, new_offset, complex.imag())?;
         Ok(new_offset)
     }
 
@@ -65,7 +65,7 @@ impl PyAnySerde for DictSerde {
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
         let dict = obj.downcast::<PyDict>()?;
-        let mut offset = append_usize(buf, offset, dict.len());
+        let mut offset = append_usize(buf, offset, dict.len())?;
         Python::with_gil::<_, PyResult<()>>(|py| {
             let key_type_serde_option = self
                 .key_type_serde_option
@@ -77,7 +77,7 @@ impl PyAnySerde for DictSerde {
                 .map(|type_serde| type_serde.bind(py));
 
             let mut key_pyany_serde_option = self.key_pyany_serde_option.take();
-            let mut value_pyany_serde_option = self.key_pyany_serde_option.take();
+            let mut value_pyany_serde_option = self.value_pyany_serde_option.take();
             for (key, value) in dict.iter() {
                 offset = append_python_update_serde!(
                     buf,
@@ -117,7 +117,7 @@ impl PyAnySerde for DictSerde {
             .map(|type_serde| type_serde.bind(py));
 
         let mut key_pyany_serde_option = self.key_pyany_serde_option.take();
-        let mut value_pyany_serde_option = self.key_pyany_serde_option.take();
+        let mut value_pyany_serde_option = self.value_pyany_serde_option.take();
 
         let dict = PyDict::new(py);
         let (n_items, mut offset) = retrieve_usize(buf, offset)?;
@@ -1,12 +1,13 @@
+use numpy::PyUntypedArray;
 use pyo3::prelude::*;
-use pyo3::types::{PyDict, PyList, PySet, PyTuple};
+use pyo3::types::{PyDict, PyList, PySet, PyTuple, PyType};
 use pyo3::Bound;
 
 use crate::common::numpy_dtype_enum::NumpyDtype;
 use crate::common::python_type_enum::{
-    detect_python_type, get_python_type_byte, retrieve_python_type, PythonType,
+    detect_python_type, get_python_type_byte, is_numpy_dtype, retrieve_python_type, PythonType,
 };
-use crate::communication::{append_usize, retrieve_usize};
+use crate::communication::{append_usize, get_write_slice, retrieve_usize};
 
 use super::bool_serde::BoolSerde;
 use super::bytes_serde::BytesSerde;
@@ -19,6 +20,9 @@ use super::pyany_serde::PyAnySerde;
 use super::serde_enum::{get_serde_bytes, Serde};
 use super::string_serde::StringSerde;
 
+// Objects of types past this many are still serialized, but always go through detect_python_type
+const MAX_CACHED_TYPES: usize = 16;
+
 #[derive(Clone)]
 pub struct DynamicSerde {
     pickle_serde: PickleSerde,
@@ -38,6 +42,9 @@ pub struct DynamicSerde {
     numpy_u64_serde: NumpyDynamicShapeSerde<u64>,
     numpy_f32_serde: NumpyDynamicShapeSerde<f32>,
     numpy_f64_serde: NumpyDynamicShapeSerde<f64>,
+    // The Python types seen so far and what they were detected as, so that objects of a type which has been seen
+    // before only need a type check instead of a full detect_python_type
+    type_cache: Vec<(Py<PyType>, PythonType)>,
     align: usize,
     serde_enum: Serde,
     serde_enum_bytes: Vec<u8>,
@@ -100,11 +107,40 @@ impl DynamicSerde {
             numpy_u64_serde,
             numpy_f32_serde,
             numpy_f64_serde,
+            type_cache: Vec::new(),
             align,
             serde_enum: Serde::DYNAMIC,
             serde_enum_bytes: get_serde_bytes(&Serde::DYNAMIC),
         })
     }
+
+    fn get_python_type<'py>(&mut self, obj: &Bound<'py, PyAny>) -> PyResult<PythonType> {
+        let obj_type = obj.get_type();
+        let cached_idx_option = self
+            .type_cache
+            .iter()
+            .position(|(cached_type, _)| cached_type.as_ptr() == obj_type.as_ptr());
+        if let Some(cached_idx) = cached_idx_option {
+            let python_type = self.type_cache[cached_idx].1;
+            // All numpy arrays have the same type, so the dtype needs to be checked as well
+            match python_type {
+                PythonType::NUMPY { dtype } if !is_numpy_dtype(obj, &dtype) => (),
+                _ => return Ok(python_type),
+            }
+        }
+        let python_type = detect_python_type(obj)?;
+        // Arrays of a dtype without a numpy serde are detected as OTHER. That can't be cached for ndarray, since it would
+        // send all the arrays after it through pickle_serde.
+        if matches!(python_type, PythonType::OTHER) && obj.is_instance_of::<PyUntypedArray>() {
+            return Ok(python_type);
+        }
+        if let Some(cached_idx) = cached_idx_option {
+            self.type_cache[cached_idx].1 = python_type;
+        } else if self.type_cache.len() < MAX_CACHED_TYPES {
+            self.type_cache.push((obj_type.unbind(), python_type));
+        }
+        Ok(python_type)
+    }
 }
 
 impl PyAnySerde for DynamicSerde {
@@ -114,8 +150,8 @@ impl PyAnySerde for DynamicSerde {
         offset: usize,
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
-        let python_type = detect_python_type(obj)?;
-        buf[offset] = get_python_type_byte(&python_type);
+        let python_type = self.get_python_type(obj)?;
+        get_write_slice(buf, offset, offset + 1)?[0] = get_python_type_byte(&python_type);
         let mut new_offset = offset + 1;
         match python_type {
             PythonType::BOOL => {
@@ -180,28 +216,28 @@ impl PyAnySerde for DynamicSerde {
             },
             PythonType::LIST => {
                 let list = obj.downcast::<PyList>()?;
-                new_offset = append_usize(buf, new_offset, list.len());
+                new_offset = append_usize(buf, new_offset, list.len())?;
                 for item in list.iter() {
                     new_offset = self.append(buf, new_offset, &item)?;
                 }
             }
             PythonType::SET => {
                 let set = obj.downcast::<PySet>()?;
-                new_offset = append_usize(buf, new_offset, set.len());
+                new_offset = append_usize(buf, new_offset, set.len())?;
                 for item in set.iter() {
                     new_offset = self.append(buf, new_offset, &item)?;
                 }
             }
             PythonType::TUPLE => {
                 let tuple = obj.downcast::<PyTuple>()?;
-                new_offset = append_usize(buf, new_offset, tuple.len());
+                new_offset = append_usize(buf, new_offset, tuple.len())?;
                 for item in tuple.iter() {
                     new_offset = self.append(buf, new_offset, &item)?;
                 }
             }
             PythonType::DICT => {
                 let dict = obj.downcast::<PyDict>()?;
-                new_offset = append_usize(buf, new_offset, dict.len());
+                new_offset = append_usize(buf, new_offset, dict.len())?;
                 for (key, value) in dict.iter() {
                     new_offset = self.append(buf, new_offset, &key)?;
                     new_offset = self.append(buf, new_offset, &value)?;
@@ -348,3 +384,54 @@ impl PyAnySerde for DynamicSerde {
         &self.serde_enum_bytes
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use pyo3::ffi::c_str;
+    use pyo3::prelude::*;
+    use pyo3::types::IntoPyDict;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+    use crate::common::python_type_enum::{get_python_type_byte, PythonType};
+    use crate::serdes::pyany_serde::PyAnySerde;
+
+    use super::DynamicSerde;
+
+    #[test]
+    fn test_unsupported_dtype_does_not_replace_cached_ndarray() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let numpy = py.import("numpy")?;
+            // float16 has no numpy serde, so it is sent through pickle_serde
+            let arrays = py
+                .eval(
+                    c_str!("[numpy.zeros(4, dtype=dtype) for dtype in ['float16', 'float64', 'float16', 'float64']]"),
+                    Some(&[("numpy", numpy)].into_py_dict(py)?),
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let float16_type_byte = get_python_type_byte(&PythonType::OTHER);
+            let float64_type_byte = get_python_type_byte(&PythonType::NUMPY {
+                dtype: NumpyDtype::FLOAT64,
+            });
+            let mut serde = DynamicSerde::new()?;
+            let mut buf = vec![0_u8; 1024];
+            let mut type_bytes = Vec::new();
+            for array in arrays.iter() {
+                let end = serde.append(&mut buf[..], 0, array)?;
+                type_bytes.push(buf[0]);
+                let (_, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+                assert_eq!(retrieve_end, end);
+            }
+            assert_eq!(
+                type_bytes,
+                vec![
+                    float16_type_byte,
+                    float64_type_byte,
+                    float16_type_byte,
+                    float64_type_byte
+                ]
+            );
+            Ok(())
+        })
+    }
+}
@@ -1,7 +1,10 @@
+use std::mem::size_of;
+
 use pyo3::prelude::*;
+use pyo3::types::PyList;
 use pyo3::Bound;
 
-use crate::communication::{append_f64, retrieve_f64};
+use crate::communication::{append_f64, get_write_slice, retrieve_f64};
 
 use super::pyany_serde::PyAnySerde;
 use super::serde_enum::{get_serde_bytes, Serde};
@@ -28,7 +31,7 @@ impl PyAnySerde for FloatSerde {
         offset: usize,
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
-        Ok(append_f64(buf, offset, obj.extract::<f64>()?))
+        append_f64(buf, offset, obj.extract::<f64>()?)
     }
 
     fn retrieve<'py>(
@@ -41,6 +44,40 @@ impl PyAnySerde for FloatSerde {
         Ok((val.into_pyobject(py)?.into_any(), new_offset))
     }
 
+    fn append_batch<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        items: &Bound<'py, PyList>,
+    ) -> PyResult<usize> {
+        let end = offset + items.len() * size_of::<f64>();
+        for (item_buf, item) in get_write_slice(buf, offset, end)?
+            .chunks_exact_mut(size_of::<f64>())
+            .zip(items.iter())
+        {
+            item_buf.copy_from_slice(&item.extract::<f64>()?.to_ne_bytes());
+        }
+        Ok(end)
+    }
+
+    fn retrieve_batch<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_items: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        let end = offset + n_items * size_of::<f64>();
+        let items = buf[offset..end]
+            .chunks_exact(size_of::<f64>())
+            .map(|item_buf| -> PyResult<Bound<'py, PyAny>> {
+                let val = f64::from_ne_bytes(item_buf.try_into()?);
+                Ok(val.into_pyobject(py)?.into_any())
+            })
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok((items, end))
+    }
+
     fn align_of(&self) -> usize {
         1usize
     }
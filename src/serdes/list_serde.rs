@@ -38,11 +38,8 @@ impl PyAnySerde for ListSerde {
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
         let list = obj.downcast::<PyList>()?;
-        let mut new_offset = append_usize(buf, offset, list.len());
-        for item in list.iter() {
-            new_offset = self.item_serde.append(buf, new_offset, &item)?;
-        }
-        Ok(new_offset)
+        let new_offset = append_usize(buf, offset, list.len())?;
+        self.item_serde.append_batch(buf, new_offset, list)
     }
 
     fn retrieve<'py>(
@@ -51,14 +48,11 @@ impl PyAnySerde for ListSerde {
         buf: &[u8],
         offset: usize,
     ) -> PyResult<(Bound<'py, PyAny>, usize)> {
-        let list = PyList::empty(py);
-        let (n_items, mut new_offset) = retrieve_usize(buf, offset)?;
-        for _ in 0..n_items {
-            let item;
-            (item, new_offset) = self.item_serde.retrieve(py, buf, new_offset)?;
-            list.append(item)?;
-        }
-        Ok((list.into_any(), new_offset))
+        let (n_items, new_offset) = retrieve_usize(buf, offset)?;
+        let (items, new_offset) = self
+            .item_serde
+            .retrieve_batch(py, buf, new_offset, n_items)?;
+        Ok((PyList::new(py, items)?.into_any(), new_offset))
     }
 
     fn align_of(&self) -> usize {
@@ -1,5 +1,6 @@
 pub mod bool_serde;
 pub mod bytes_serde;
+pub mod compiled_serde;
 pub mod complex_serde;
 pub mod dict_serde;
 pub mod dynamic_serde;
@@ -7,9 +8,14 @@ pub mod float_serde;
 pub mod int_serde;
 pub mod list_serde;
 pub mod numpy_dynamic_shape_serde;
+pub mod numpy_static_shape_serde;
 pub mod pickle_serde;
 pub mod pyany_serde;
+pub mod quantized_numpy_serde;
+#[cfg(feature = "benchmark")]
+pub mod serde_benchmark;
 pub mod serde_enum;
 pub mod set_serde;
 pub mod string_serde;
+pub mod struct_serde;
 pub mod tuple_serde;
@@ -6,11 +6,14 @@ use numpy::IntoPyArray;
 use numpy::{ndarray::ArrayD, Element, PyArrayDyn, PyArrayMethods, PyUntypedArrayMethods};
 use pyo3::exceptions::asyncio::InvalidStateError;
 use pyo3::prelude::*;
+use pyo3::types::PyList;
 use pyo3::Bound;
 
-use crate::common::misc::get_bytes_to_alignment;
+use crate::common::misc::{copy_array_data, get_bytes_to_alignment};
 use crate::common::numpy_dtype_enum::NumpyDtype;
-use crate::communication::{append_bytes, append_usize, retrieve_bytes, retrieve_usize};
+use crate::communication::{
+    append_bool, append_usize, get_write_slice, retrieve_bool, retrieve_bytes, retrieve_usize,
+};
 
 use super::pyany_serde::PyAnySerde;
 use super::serde_enum::{get_serde_bytes, Serde};
@@ -47,22 +50,24 @@ impl<T: Element + AnyBitPattern + NoUninit> NumpyDynamicShapeSerde<T> {
         array: &Bound<'py, PyArrayDyn<T>>,
     ) -> PyResult<usize> {
         let shape = array.shape();
-        let mut new_offset = append_usize(buf, offset, shape.len());
+        let mut new_offset = append_usize(buf, offset, shape.len())?;
         for dim in shape.iter() {
-            new_offset = append_usize(buf, new_offset, *dim);
+            new_offset = append_usize(buf, new_offset, *dim)?;
         }
-        let obj_vec = array.to_vec()?;
         new_offset = new_offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + new_offset);
-        new_offset = append_bytes(buf, new_offset, cast_slice::<T, u8>(&obj_vec))?;
-        Ok(new_offset)
+        // Same layout as append_bytes, with the data of the array copied straight into buf
+        let n_bytes = array.len() * size_of::<T>();
+        let start = append_usize(buf, new_offset, n_bytes)?;
+        let end = start + n_bytes;
+        copy_array_data(get_write_slice(buf, start, end)?, array)?;
+        Ok(end)
     }
 
-    pub fn retrieve<'py>(
-        &mut self,
-        py: Python<'py>,
-        buf: &[u8],
+    // Returns the shape and the raw bytes of an array appended by this serde, without creating a Python object
+    pub fn retrieve_shape_and_bytes<'a>(
+        buf: &'a [u8],
         offset: usize,
-    ) -> PyResult<(Bound<'py, PyArrayDyn<T>>, usize)> {
+    ) -> PyResult<(Vec<usize>, &'a [u8], usize)> {
         let (shape_len, mut new_offset) = retrieve_usize(buf, offset)?;
         let mut shape = Vec::with_capacity(shape_len);
         for _ in 0..shape_len {
@@ -73,6 +78,16 @@ impl<T: Element + AnyBitPattern + NoUninit> NumpyDynamicShapeSerde<T> {
         new_offset = new_offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + new_offset);
         let obj_bytes;
         (obj_bytes, new_offset) = retrieve_bytes(buf, new_offset)?;
+        Ok((shape, obj_bytes, new_offset))
+    }
+
+    pub fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyArrayDyn<T>>, usize)> {
+        let (shape, obj_bytes, new_offset) = Self::retrieve_shape_and_bytes(buf, offset)?;
         let array_vec = cast_slice::<u8, T>(obj_bytes).to_vec();
         let array = ArrayD::from_shape_vec(shape, array_vec).map_err(|err| {
             InvalidStateError::new_err(format!(
@@ -132,6 +147,112 @@ impl<T: Element + AnyBitPattern + NoUninit> PyAnySerde for NumpyDynamicShapeSerd
         Ok((array.into_any(), offset))
     }
 
+    // If all the arrays have the same shape, the shape is written once and the data of the arrays is written as one
+    // contiguous block. Otherwise, the arrays are appended one at a time.
+    fn append_batch<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        items: &Bound<'py, PyList>,
+    ) -> PyResult<usize> {
+        if items.is_empty() {
+            return Ok(offset);
+        }
+        let arrays = items
+            .iter()
+            .map(|item| -> PyResult<Bound<'py, PyArrayDyn<T>>> {
+                Ok(item.downcast_into::<PyArrayDyn<T>>()?)
+            })
+            .collect::<PyResult<Vec<_>>>()?;
+        let shape = arrays[0].shape();
+        let same_shape = arrays.iter().all(|array| array.shape() == shape);
+        let mut new_offset = append_bool(buf, offset, same_shape)?;
+        if !same_shape {
+            for array in arrays.iter() {
+                new_offset = self.append(buf, new_offset, array)?;
+            }
+            return Ok(new_offset);
+        }
+        new_offset = append_usize(buf, new_offset, shape.len())?;
+        for dim in shape.iter() {
+            new_offset = append_usize(buf, new_offset, *dim)?;
+        }
+        let n_bytes = shape.iter().product::<usize>() * size_of::<T>();
+        let start = new_offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + new_offset);
+        let end = start + arrays.len() * n_bytes;
+        let block = get_write_slice(buf, start, end)?;
+        for (array_idx, array) in arrays.iter().enumerate() {
+            copy_array_data(
+                &mut block[array_idx * n_bytes..(array_idx + 1) * n_bytes],
+                array,
+            )?;
+        }
+        Ok(end)
+    }
+
+    // Arrays of the same shape are retrieved as views into one stacked array
+    fn retrieve_batch<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_items: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        if n_items == 0 {
+            return Ok((Vec::new(), offset));
+        }
+        let (same_shape, mut new_offset) = retrieve_bool(buf, offset)?;
+        let mut items = Vec::with_capacity(n_items);
+        if !same_shape {
+            for _ in 0..n_items {
+                let array;
+                (array, new_offset) = self.retrieve(py, buf, new_offset)?;
+                items.push(array.into_any());
+            }
+            return Ok((items, new_offset));
+        }
+        let shape_len;
+        (shape_len, new_offset) = retrieve_usize(buf, new_offset)?;
+        let mut stacked_shape = Vec::with_capacity(shape_len + 1);
+        stacked_shape.push(n_items);
+        for _ in 0..shape_len {
+            let dim;
+            (dim, new_offset) = retrieve_usize(buf, new_offset)?;
+            stacked_shape.push(dim);
+        }
+        let n_bytes = stacked_shape[1..].iter().product::<usize>() * size_of::<T>();
+        let start = new_offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + new_offset);
+        let end = start + n_items * n_bytes;
+        let block = &buf[start..end];
+        // Indexing a 1d array gives numpy scalars rather than 0d arrays
+        if shape_len == 0 {
+            for array_buf in block.chunks_exact(n_bytes) {
+                let array = unsafe { PyArrayDyn::<T>::new(py, &stacked_shape[1..], false) };
+                unsafe {
+                    std::ptr::copy_nonoverlapping(
+                        array_buf.as_ptr(),
+                        array.data() as *mut u8,
+                        n_bytes,
+                    );
+                }
+                items.push(array.into_any());
+            }
+            return Ok((items, end));
+        }
+        let stacked_array = unsafe { PyArrayDyn::<T>::new(py, &stacked_shape[..], false) };
+        unsafe {
+            std::ptr::copy_nonoverlapping(
+                block.as_ptr(),
+                stacked_array.data() as *mut u8,
+                block.len(),
+            );
+        }
+        for item_idx in 0..n_items {
+            items.push(stacked_array.as_any().get_item(item_idx)?);
+        }
+        Ok((items, end))
+    }
+
     fn align_of(&self) -> usize {
         size_of::<T>()
     }
@@ -144,3 +265,46 @@ impl<T: Element + AnyBitPattern + NoUninit> PyAnySerde for NumpyDynamicShapeSerd
         &self.serde_enum_bytes
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use numpy::ndarray::{ArrayD, IxDyn};
+    use numpy::{PyArrayDyn, PyArrayMethods, PyUntypedArrayMethods};
+    use pyo3::prelude::*;
+    use pyo3::types::PyList;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+
+    use super::get_numpy_dynamic_shape_serde;
+
+    #[test]
+    fn test_fortran_order_array_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_dynamic_shape_serde(NumpyDtype::INT32);
+            // Reversing the axes of a C-order (3, 2) array gives an F-order (2, 3) array over the same data
+            let data = ArrayD::from_shape_vec(IxDyn(&[3, 2]), (0..6).collect()).unwrap();
+            let array = PyArrayDyn::<i32>::from_owned_array(py, data.reversed_axes());
+            assert!(array.is_fortran_contiguous() && !array.is_c_contiguous());
+            let expected = vec![0, 2, 4, 1, 3, 5];
+
+            let mut buf = vec![0_u8; 256];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            let retrieved = obj.downcast::<PyArrayDyn<i32>>()?;
+            assert_eq!(retrieved.shape(), &[2, 3]);
+            assert_eq!(retrieved.to_vec()?, expected);
+
+            let batch_end =
+                serde.append_batch(&mut buf[..], 0, &PyList::new(py, [&array, &array])?)?;
+            let (retrieved, retrieve_end) = serde.retrieve_batch(py, &buf[..], 0, 2)?;
+            assert_eq!(retrieve_end, batch_end);
+            for obj in retrieved.iter() {
+                let retrieved_array = obj.downcast::<PyArrayDyn<i32>>()?;
+                assert_eq!(retrieved_array.shape(), &[2, 3]);
+                assert_eq!(retrieved_array.to_vec()?, expected);
+            }
+            Ok(())
+        })
+    }
+}
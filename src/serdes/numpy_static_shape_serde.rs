@@ -0,0 +1,378 @@
+use std::marker::PhantomData;
+use std::mem::size_of;
+
+use bytemuck::{AnyBitPattern, NoUninit};
+use numpy::{Element, PyArrayDyn, PyArrayMethods, PyUntypedArrayMethods};
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::types::PyList;
+use pyo3::Bound;
+
+use crate::common::misc::{copy_array_data, get_bytes_to_alignment};
+use crate::common::numpy_dtype_enum::NumpyDtype;
+use crate::communication::get_write_slice;
+
+use super::pyany_serde::PyAnySerde;
+use super::serde_enum::{get_serde_bytes, Serde};
+
+// Serde for numpy arrays which always have the same dtype and shape. Since the shape is part of the serde, only
+// the data of the array is written, aligned for the dtype.
+#[derive(Clone)]
+pub struct NumpyStaticShapeSerde<T: Element> {
+    dtype: PhantomData<T>,
+    shape: Vec<usize>,
+    n_bytes: usize,
+    serde_enum: Serde,
+    serde_enum_bytes: Vec<u8>,
+}
+
+macro_rules! define_primitive_impls {
+    ($($t:ty => $dtype:expr),* $(,)?) => {
+        $(
+            impl NumpyStaticShapeSerde<$t> {
+                pub fn new(shape: Vec<usize>) -> Self {
+                    let serde_enum = Serde::NUMPY_STATIC {
+                        dtype: $dtype,
+                        shape: shape.clone(),
+                    };
+                    Self {
+                        dtype: PhantomData,
+                        n_bytes: shape.iter().product::<usize>() * size_of::<$t>(),
+                        shape,
+                        serde_enum_bytes: get_serde_bytes(&serde_enum),
+                        serde_enum,
+                    }
+                }
+            }
+        )*
+    }
+}
+
+impl<T: Element + AnyBitPattern + NoUninit> NumpyStaticShapeSerde<T> {
+    // Copies the data of array into array_buf, which is n_bytes long
+    fn copy_array<'py>(
+        &self,
+        array_buf: &mut [u8],
+        array: &Bound<'py, PyArrayDyn<T>>,
+    ) -> PyResult<()> {
+        if array.shape() != &self.shape[..] {
+            return Err(InvalidStateError::new_err(format!(
+                "numpy_static_serde was created for arrays of shape {:?} but got an array of shape {:?}",
+                self.shape,
+                array.shape()
+            )));
+        }
+        copy_array_data(array_buf, array)
+    }
+
+    pub fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        array: &Bound<'py, PyArrayDyn<T>>,
+    ) -> PyResult<usize> {
+        let start = offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + offset);
+        let end = start + self.n_bytes;
+        self.copy_array(get_write_slice(buf, start, end)?, array)?;
+        Ok(end)
+    }
+
+    // Appends the arrays of a list as one contiguous block. Since n_bytes is a multiple of the alignment of T, this
+    // writes the same bytes as appending the arrays one at a time.
+    pub fn append_stacked<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        arrays: &Bound<'py, PyList>,
+    ) -> PyResult<usize> {
+        let start = offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + offset);
+        let end = start + arrays.len() * self.n_bytes;
+        let block = get_write_slice(buf, start, end)?;
+        for (array_idx, array) in arrays.iter().enumerate() {
+            self.copy_array(
+                &mut block[array_idx * self.n_bytes..(array_idx + 1) * self.n_bytes],
+                array.downcast::<PyArrayDyn<T>>()?,
+            )?;
+        }
+        Ok(end)
+    }
+
+    // Retrieves n_arrays arrays appended using append_stacked as one array, with the arrays stacked along a new first
+    // dimension. The data is copied once for all the arrays.
+    pub fn retrieve_stacked<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_arrays: usize,
+    ) -> PyResult<(Bound<'py, PyArrayDyn<T>>, usize)> {
+        let start = offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + offset);
+        let end = start + n_arrays * self.n_bytes;
+        let block = &buf[start..end];
+        let mut shape = Vec::with_capacity(self.shape.len() + 1);
+        shape.push(n_arrays);
+        shape.extend_from_slice(&self.shape[..]);
+        let array = unsafe { PyArrayDyn::<T>::new(py, &shape[..], false) };
+        unsafe {
+            std::ptr::copy_nonoverlapping(block.as_ptr(), array.data() as *mut u8, block.len());
+        }
+        Ok((array, end))
+    }
+
+    // Returns the raw bytes of an array of the given shape appended by this serde, without creating a Python object
+    pub fn retrieve_bytes_for_shape<'a>(
+        buf: &'a [u8],
+        offset: usize,
+        shape: &[usize],
+    ) -> (&'a [u8], usize) {
+        let start = offset + get_bytes_to_alignment::<T>(buf.as_ptr() as usize + offset);
+        let end = start + shape.iter().product::<usize>() * size_of::<T>();
+        (&buf[start..end], end)
+    }
+
+    pub fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyArrayDyn<T>>, usize)> {
+        let (obj_bytes, new_offset) = Self::retrieve_bytes_for_shape(buf, offset, &self.shape);
+        let array = unsafe { PyArrayDyn::<T>::new(py, &self.shape[..], false) };
+        unsafe {
+            std::ptr::copy_nonoverlapping(
+                obj_bytes.as_ptr(),
+                array.data() as *mut u8,
+                self.n_bytes,
+            );
+        }
+        Ok((array, new_offset))
+    }
+}
+
+define_primitive_impls! {
+    i8 => NumpyDtype::INT8,
+    i16 => NumpyDtype::INT16,
+    i32 => NumpyDtype::INT32,
+    i64 => NumpyDtype::INT64,
+    u8 => NumpyDtype::UINT8,
+    u16 => NumpyDtype::UINT16,
+    u32 => NumpyDtype::UINT32,
+    u64 => NumpyDtype::UINT64,
+    f32 => NumpyDtype::FLOAT32,
+    f64 => NumpyDtype::FLOAT64,
+}
+
+pub fn get_numpy_static_shape_serde(
+    dtype: NumpyDtype,
+    shape: Vec<usize>,
+) -> Box<dyn PyAnySerde> {
+    match dtype {
+        NumpyDtype::INT8 => Box::new(NumpyStaticShapeSerde::<i8>::new(shape)),
+        NumpyDtype::INT16 => Box::new(NumpyStaticShapeSerde::<i16>::new(shape)),
+        NumpyDtype::INT32 => Box::new(NumpyStaticShapeSerde::<i32>::new(shape)),
+        NumpyDtype::INT64 => Box::new(NumpyStaticShapeSerde::<i64>::new(shape)),
+        NumpyDtype::UINT8 => Box::new(NumpyStaticShapeSerde::<u8>::new(shape)),
+        NumpyDtype::UINT16 => Box::new(NumpyStaticShapeSerde::<u16>::new(shape)),
+        NumpyDtype::UINT32 => Box::new(NumpyStaticShapeSerde::<u32>::new(shape)),
+        NumpyDtype::UINT64 => Box::new(NumpyStaticShapeSerde::<u64>::new(shape)),
+        NumpyDtype::FLOAT32 => Box::new(NumpyStaticShapeSerde::<f32>::new(shape)),
+        NumpyDtype::FLOAT64 => Box::new(NumpyStaticShapeSerde::<f64>::new(shape)),
+    }
+}
+
+impl<T: Element + AnyBitPattern + NoUninit> PyAnySerde for NumpyStaticShapeSerde<T> {
+    fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<usize> {
+        self.append(buf, offset, obj.downcast::<PyArrayDyn<T>>()?)
+    }
+
+    fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let (array, offset) = self.retrieve(py, buf, offset)?;
+        Ok((array.into_any(), offset))
+    }
+
+    fn append_batch<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        items: &Bound<'py, PyList>,
+    ) -> PyResult<usize> {
+        self.append_stacked(buf, offset, items)
+    }
+
+    // The arrays are retrieved as views into one stacked array
+    fn retrieve_batch<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_items: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        // Indexing a 1d array gives numpy scalars rather than 0d arrays
+        if self.shape.is_empty() {
+            let mut items = Vec::with_capacity(n_items);
+            let mut new_offset = offset;
+            for _ in 0..n_items {
+                let item;
+                (item, new_offset) = self.retrieve(py, buf, new_offset)?;
+                items.push(item.into_any());
+            }
+            return Ok((items, new_offset));
+        }
+        let (stacked_array, new_offset) = self.retrieve_stacked(py, buf, offset, n_items)?;
+        let items = (0..n_items)
+            .map(|item_idx| stacked_array.as_any().get_item(item_idx))
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok((items, new_offset))
+    }
+
+    fn align_of(&self) -> usize {
+        size_of::<T>()
+    }
+
+    fn get_enum(&self) -> &Serde {
+        &self.serde_enum
+    }
+
+    fn get_enum_bytes(&self) -> &[u8] {
+        &self.serde_enum_bytes
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use numpy::ndarray::{ArrayD, IxDyn};
+    use numpy::{PyArrayDyn, PyArrayMethods, PyUntypedArrayMethods};
+    use pyo3::prelude::*;
+    use pyo3::types::PyList;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+
+    use super::get_numpy_static_shape_serde;
+
+    #[test]
+    fn test_0d_array_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_static_shape_serde(NumpyDtype::FLOAT32, Vec::new());
+            let array = PyArrayDyn::<f32>::from_owned_array(py, ArrayD::from_elem(IxDyn(&[]), 1.5));
+            let mut buf = vec![0_u8; 64];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            let retrieved = obj.downcast::<PyArrayDyn<f32>>()?;
+            assert_eq!(retrieved.ndim(), 0);
+            assert_eq!(retrieved.to_vec()?, vec![1.5]);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_0d_array_batch_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_static_shape_serde(NumpyDtype::INT64, Vec::new());
+            let values = [-3_i64, 0, 7];
+            let items = PyList::new(
+                py,
+                values.iter().map(|v| {
+                    PyArrayDyn::<i64>::from_owned_array(py, ArrayD::from_elem(IxDyn(&[]), *v))
+                }),
+            )?;
+            let mut buf = vec![0_u8; 64];
+            let end = serde.append_batch(&mut buf[..], 0, &items)?;
+            let (retrieved, retrieve_end) = serde.retrieve_batch(py, &buf[..], 0, values.len())?;
+            assert_eq!(retrieve_end, end);
+            assert_eq!(retrieved.len(), values.len());
+            for (obj, v) in retrieved.iter().zip(values.iter()) {
+                // The items must be 0-d arrays like the ones appended, not numpy scalars
+                let array = obj.downcast::<PyArrayDyn<i64>>()?;
+                assert_eq!(array.ndim(), 0);
+                assert_eq!(array.to_vec()?, vec![*v]);
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_batch_matches_single_appends() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_static_shape_serde(NumpyDtype::FLOAT64, vec![2, 3]);
+            let arrays = (0..4)
+                .map(|array_idx| {
+                    let data = (0..6).map(|v| (array_idx * 6 + v) as f64).collect();
+                    PyArrayDyn::<f64>::from_owned_array(
+                        py,
+                        ArrayD::from_shape_vec(IxDyn(&[2, 3]), data).unwrap(),
+                    )
+                })
+                .collect::<Vec<_>>();
+            // The same buffer is used for both so that the padding for alignment is the same
+            let mut buf = vec![0_u8; 256];
+            let mut single_end = 0;
+            for array in arrays.iter() {
+                single_end = serde.append(&mut buf[..], single_end, array.as_any())?;
+            }
+            let single_bytes = buf[..single_end].to_vec();
+            buf.fill(0);
+            let batch_end =
+                serde.append_batch(&mut buf[..], 0, &PyList::new(py, arrays.iter())?)?;
+            assert_eq!(batch_end, single_end);
+            assert_eq!(buf[..batch_end], single_bytes[..]);
+
+            let (retrieved, retrieve_end) = serde.retrieve_batch(py, &buf[..], 0, arrays.len())?;
+            assert_eq!(retrieve_end, batch_end);
+            for (obj, array) in retrieved.iter().zip(arrays.iter()) {
+                let retrieved_array = obj.downcast::<PyArrayDyn<f64>>()?;
+                assert_eq!(retrieved_array.shape(), &[2, 3]);
+                assert_eq!(retrieved_array.to_vec()?, array.to_vec()?);
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_fortran_order_array_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_static_shape_serde(NumpyDtype::FLOAT64, vec![2, 3]);
+            // Reversing the axes of a C-order (3, 2) array gives an F-order (2, 3) array over the same data
+            let data =
+                ArrayD::from_shape_vec(IxDyn(&[3, 2]), (0..6).map(|v| v as f64).collect()).unwrap();
+            let array = PyArrayDyn::<f64>::from_owned_array(py, data.reversed_axes());
+            assert!(array.is_fortran_contiguous() && !array.is_c_contiguous());
+            let expected = vec![0.0, 2.0, 4.0, 1.0, 3.0, 5.0];
+
+            let mut buf = vec![0_u8; 256];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            assert_eq!(obj.downcast::<PyArrayDyn<f64>>()?.to_vec()?, expected);
+
+            let batch_end =
+                serde.append_batch(&mut buf[..], 0, &PyList::new(py, [&array, &array])?)?;
+            let (retrieved, retrieve_end) = serde.retrieve_batch(py, &buf[..], 0, 2)?;
+            assert_eq!(retrieve_end, batch_end);
+            for obj in retrieved.iter() {
+                assert_eq!(obj.downcast::<PyArrayDyn<f64>>()?.to_vec()?, expected);
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_wrong_shape_is_rejected() {
+        Python::with_gil(|py| {
+            let mut serde = get_numpy_static_shape_serde(NumpyDtype::FLOAT32, vec![3]);
+            let array = PyArrayDyn::<f32>::from_owned_array(py, ArrayD::zeros(IxDyn(&[4])));
+            let mut buf = vec![0_u8; 64];
+            assert!(serde.append(&mut buf[..], 0, array.as_any()).is_err());
+        })
+    }
+}
@@ -1,12 +1,46 @@
+use pyo3::buffer::PyBuffer;
 use pyo3::prelude::*;
-use pyo3::types::PyBytes;
-use pyo3::Bound;
+use pyo3::types::{PyByteArray, PyBytes, PyDict, PyList};
+use pyo3::{intern, Bound};
 
-use crate::communication::{append_bytes, retrieve_bytes};
+use crate::common::misc::get_bytes_to_alignment;
+use crate::communication::{
+    append_bytes, append_usize, get_write_slice, retrieve_bytes, retrieve_usize,
+};
 
 use super::pyany_serde::PyAnySerde;
 use super::serde_enum::{get_serde_bytes, Serde};
 
+// Buffers smaller than this are left in the pickle stream, since sending them out-of-band costs more than it saves
+const MIN_OUT_OF_BAND_BYTES: usize = 1024;
+
+// The buffer_callback passed to pickle.dumps. Contiguous buffers of at least MIN_OUT_OF_BAND_BYTES are kept to be
+// written out-of-band, and everything else is serialized in-band.
+#[pyclass]
+struct PickleBufferCollector {
+    buffers: Vec<PyObject>,
+}
+
+#[pymethods]
+impl PickleBufferCollector {
+    fn __call__(&mut self, pickle_buffer: &Bound<'_, PyAny>) -> PyResult<bool> {
+        let py = pickle_buffer.py();
+        // raw() fails for non-contiguous buffers, which are left in-band
+        let Ok(raw) = pickle_buffer.call_method0(intern!(py, "raw")) else {
+            return Ok(true);
+        };
+        if raw.getattr(intern!(py, "nbytes"))?.extract::<usize>()? < MIN_OUT_OF_BAND_BYTES {
+            return Ok(true);
+        }
+        self.buffers.push(raw.unbind());
+        Ok(false)
+    }
+}
+
+// Pickles with protocol 5. Large contiguous buffers (such as the data of numpy arrays) are taken out of the pickle stream
+// and copied straight into the buffer after it, instead of being copied into the pickle bytes and then into the buffer.
+// On retrieve, each out-of-band buffer is copied once into a bytearray which the unpickled object uses directly.
+// The buffers can't be views into the shared memory, since it is overwritten by the next response.
 #[derive(Clone)]
 pub struct PickleSerde {
     pickle_dumps: Py<PyAny>,
@@ -19,8 +53,8 @@ impl PickleSerde {
     pub fn new() -> PyResult<Self> {
         Python::with_gil(|py| {
             Ok(PickleSerde {
-                pickle_dumps: py.import("pickle")?.get_item("dumps")?.unbind(),
-                pickle_loads: py.import("pickle")?.get_item("loads")?.unbind(),
+                pickle_dumps: py.import("pickle")?.getattr("dumps")?.unbind(),
+                pickle_loads: py.import("pickle")?.getattr("loads")?.unbind(),
                 serde_enum: Serde::PICKLE,
                 serde_enum_bytes: get_serde_bytes(&Serde::PICKLE),
             })
@@ -35,15 +69,36 @@ impl PyAnySerde for PickleSerde {
         offset: usize,
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
-        append_bytes(
+        let py = obj.py();
+        let buffer_collector = Bound::new(
+            py,
+            PickleBufferCollector {
+                buffers: Vec::new(),
+            },
+        )?;
+        let kwargs = PyDict::new(py);
+        kwargs.set_item(intern!(py, "protocol"), 5)?;
+        kwargs.set_item(intern!(py, "buffer_callback"), &buffer_collector)?;
+        let mut new_offset = append_bytes(
             buf,
             offset,
             self.pickle_dumps
-                .bind(obj.py())
-                .call1((obj,))?
+                .bind(py)
+                .call((obj,), Some(&kwargs))?
                 .downcast_into::<PyBytes>()?
                 .as_bytes(),
-        )
+        )?;
+        let buffers = &buffer_collector.borrow().buffers;
+        new_offset = append_usize(buf, new_offset, buffers.len())?;
+        for raw in buffers.iter() {
+            let buffer = PyBuffer::<u8>::get(raw.bind(py))?;
+            new_offset = append_usize(buf, new_offset, buffer.len_bytes())?;
+            new_offset += get_bytes_to_alignment::<u64>(buf.as_ptr() as usize + new_offset);
+            let end = new_offset + buffer.len_bytes();
+            buffer.copy_to_slice(py, get_write_slice(buf, new_offset, end)?)?;
+            new_offset = end;
+        }
+        Ok(new_offset)
     }
 
     fn retrieve<'py>(
@@ -52,11 +107,31 @@ impl PyAnySerde for PickleSerde {
         buf: &[u8],
         offset: usize,
     ) -> PyResult<(Bound<'py, PyAny>, usize)> {
-        let (bytes, new_offset) = retrieve_bytes(buf, offset)?;
+        let (bytes, mut new_offset) = retrieve_bytes(buf, offset)?;
+        let pickle_bytes = PyBytes::new(py, bytes);
+        let n_buffers;
+        (n_buffers, new_offset) = retrieve_usize(buf, new_offset)?;
+        if n_buffers == 0 {
+            return Ok((
+                self.pickle_loads.bind(py).call1((pickle_bytes,))?,
+                new_offset,
+            ));
+        }
+        let buffers = PyList::empty(py);
+        for _ in 0..n_buffers {
+            let n_bytes;
+            (n_bytes, new_offset) = retrieve_usize(buf, new_offset)?;
+            new_offset += get_bytes_to_alignment::<u64>(buf.as_ptr() as usize + new_offset);
+            let end = new_offset + n_bytes;
+            buffers.append(PyByteArray::new(py, &buf[new_offset..end]))?;
+            new_offset = end;
+        }
+        let kwargs = PyDict::new(py);
+        kwargs.set_item(intern!(py, "buffers"), buffers)?;
         Ok((
             self.pickle_loads
                 .bind(py)
-                .call1((PyBytes::new(py, bytes),))?,
+                .call((pickle_bytes,), Some(&kwargs))?,
             new_offset,
         ))
     }
@@ -1,15 +1,16 @@
 use dyn_clone::{clone_trait_object, DynClone};
 use numpy::PyArrayDescr;
 use pyo3::exceptions::asyncio::InvalidStateError;
-use pyo3::types::{PyDict, PyTuple};
+use pyo3::types::{PyDict, PyList, PyTuple, PyType};
 use pyo3::Bound;
 use pyo3::{prelude::*, pyclass};
 
-use crate::common::numpy_dtype_enum::get_numpy_dtype;
+use crate::common::numpy_dtype_enum::{get_numpy_dtype, NumpyDtype};
 use crate::common::python_type_enum::{detect_python_type, PythonType};
 
 use super::bool_serde::BoolSerde;
 use super::bytes_serde::BytesSerde;
+use super::compiled_serde::compile_pyany_serde;
 use super::complex_serde::ComplexSerde;
 use super::dict_serde::DictSerde;
 use super::dynamic_serde::DynamicSerde;
@@ -17,10 +18,15 @@ use super::float_serde::FloatSerde;
 use super::int_serde::IntSerde;
 use super::list_serde::ListSerde;
 use super::numpy_dynamic_shape_serde::get_numpy_dynamic_shape_serde;
+use super::numpy_static_shape_serde::get_numpy_static_shape_serde;
 use super::pickle_serde::PickleSerde;
+use super::quantized_numpy_serde::{
+    describe_quantization, get_quantized_numpy_serde, QuantizedEncoding,
+};
 use super::serde_enum::{retrieve_serde, Serde};
 use super::set_serde::SetSerde;
 use super::string_serde::StringSerde;
+use super::struct_serde::{import_struct_type, StructSerde};
 use super::tuple_serde::TupleSerde;
 
 #[pyclass(module = "rlgym_learn_backend")]
@@ -58,6 +64,12 @@ impl PyAnySerdeFactory {
         DynPyAnySerde(Some(Box::new(BytesSerde::new())))
     }
     #[staticmethod]
+    pub fn compile_serde(dyn_serde: &DynPyAnySerde) -> PyResult<DynPyAnySerde> {
+        Ok(DynPyAnySerde(Some(compile_pyany_serde(
+            dyn_serde.0.as_ref().unwrap().clone(),
+        )?)))
+    }
+    #[staticmethod]
     pub fn complex_serde() -> DynPyAnySerde {
         DynPyAnySerde(Some(Box::new(ComplexSerde::new())))
     }
@@ -101,10 +113,44 @@ impl PyAnySerdeFactory {
         ))))
     }
     #[staticmethod]
+    pub fn numpy_static_serde(
+        py_dtype: Py<PyArrayDescr>,
+        shape: Vec<usize>,
+    ) -> PyResult<DynPyAnySerde> {
+        Ok(DynPyAnySerde(Some(get_numpy_static_shape_serde(
+            get_numpy_dtype(py_dtype)?,
+            shape,
+        ))))
+    }
+    #[staticmethod]
     pub fn pickle_serde() -> PyResult<DynPyAnySerde> {
         Ok(DynPyAnySerde(Some(Box::new(PickleSerde::new()?))))
     }
     #[staticmethod]
+    #[pyo3(signature = (py_dtype, encoding, low=None, high=None))]
+    pub fn quantized_numpy_serde(
+        py_dtype: Py<PyArrayDescr>,
+        encoding: String,
+        low: Option<Vec<f32>>,
+        high: Option<Vec<f32>>,
+    ) -> PyResult<DynPyAnySerde> {
+        let (dtype, encoding, bounds) = get_quantization_args(py_dtype, encoding, low, high)?;
+        Ok(DynPyAnySerde(Some(get_quantized_numpy_serde(
+            dtype, encoding, bounds,
+        )?)))
+    }
+    #[staticmethod]
+    #[pyo3(signature = (py_dtype, encoding, low=None, high=None))]
+    pub fn describe_quantized_numpy_serde(
+        py_dtype: Py<PyArrayDescr>,
+        encoding: String,
+        low: Option<Vec<f32>>,
+        high: Option<Vec<f32>>,
+    ) -> PyResult<String> {
+        let (dtype, encoding, bounds) = get_quantization_args(py_dtype, encoding, low, high)?;
+        describe_quantization(&dtype, &encoding, &bounds)
+    }
+    #[staticmethod]
     pub fn set_serde(dyn_items_serde: &DynPyAnySerde) -> DynPyAnySerde {
         DynPyAnySerde(Some(Box::new(SetSerde::new(
             dyn_items_serde.0.as_ref().unwrap().clone(),
@@ -115,6 +161,21 @@ impl PyAnySerdeFactory {
         DynPyAnySerde(Some(Box::new(StringSerde::new())))
     }
     #[staticmethod]
+    pub fn struct_serde(
+        py_type: &Bound<'_, PyType>,
+        field_names: Vec<String>,
+        field_dyn_serdes: Vec<DynPyAnySerde>,
+    ) -> PyResult<DynPyAnySerde> {
+        Ok(DynPyAnySerde(Some(Box::new(StructSerde::new(
+            py_type,
+            field_names,
+            field_dyn_serdes
+                .into_iter()
+                .map(|field_dyn_serde| field_dyn_serde.0.unwrap())
+                .collect(),
+        )?))))
+    }
+    #[staticmethod]
     pub fn tuple_serde(dyn_item_serdes: Vec<DynPyAnySerde>) -> DynPyAnySerde {
         DynPyAnySerde(Some(Box::new(TupleSerde::new(
             dyn_item_serdes
@@ -125,6 +186,40 @@ impl PyAnySerdeFactory {
     }
 }
 
+fn get_quantization_args(
+    py_dtype: Py<PyArrayDescr>,
+    encoding: String,
+    low: Option<Vec<f32>>,
+    high: Option<Vec<f32>>,
+) -> PyResult<(NumpyDtype, QuantizedEncoding, Vec<(f32, f32)>)> {
+    let dtype = get_numpy_dtype(py_dtype)?;
+    let encoding = QuantizedEncoding::from_str(&encoding)?;
+    let bounds = match (low, high) {
+        (Some(low), Some(high)) => {
+            if low.len() != high.len() {
+                return Err(InvalidStateError::new_err(format!(
+                    "low has {} features but high has {}",
+                    low.len(),
+                    high.len()
+                )));
+            }
+            low.into_iter().zip(high.into_iter()).collect()
+        }
+        (None, None) => Vec::new(),
+        _ => {
+            return Err(InvalidStateError::new_err(
+                "low and high must either both be provided or both be None",
+            ))
+        }
+    };
+    if encoding != QuantizedEncoding::INT8 && !bounds.is_empty() {
+        return Err(InvalidStateError::new_err(
+            "low and high are only used by the int8 encoding",
+        ));
+    }
+    Ok((dtype, encoding, bounds))
+}
+
 pub trait PyAnySerde: DynClone + Send + Sync {
     fn append<'py>(
         &mut self,
@@ -138,6 +233,37 @@ pub trait PyAnySerde: DynClone + Send + Sync {
         buf: &[u8],
         offset: usize,
     ) -> PyResult<(Bound<'py, PyAny>, usize)>;
+    // Appends the items of a list which all use this serde. By default the items are appended one at a time. Serdes of
+    // fixed size items override this to write the items as one contiguous block.
+    fn append_batch<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        items: &Bound<'py, PyList>,
+    ) -> PyResult<usize> {
+        let mut new_offset = offset;
+        for item in items.iter() {
+            new_offset = self.append(buf, new_offset, &item)?;
+        }
+        Ok(new_offset)
+    }
+    // Retrieves n_items items appended using append_batch
+    fn retrieve_batch<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+        n_items: usize,
+    ) -> PyResult<(Vec<Bound<'py, PyAny>>, usize)> {
+        let mut items = Vec::with_capacity(n_items);
+        let mut new_offset = offset;
+        for _ in 0..n_items {
+            let item;
+            (item, new_offset) = self.retrieve(py, buf, new_offset)?;
+            items.push(item);
+        }
+        Ok((items, new_offset))
+    }
     fn align_of(&self) -> usize;
     fn get_enum(&self) -> &Serde;
     fn get_enum_bytes(&self) -> &[u8];
@@ -212,6 +338,28 @@ pub fn get_pyany_serde(serde: Serde) -> PyResult<Box<dyn PyAnySerde>> {
             None,
             Some(get_pyany_serde(*values)?),
         ))),
+        Serde::NUMPY_STATIC { dtype, shape } => Ok(get_numpy_static_shape_serde(dtype, shape)),
+        Serde::COMPILED { serde } => compile_pyany_serde(get_pyany_serde(*serde)?),
+        Serde::QUANTIZED_NUMPY {
+            dtype,
+            encoding,
+            bounds,
+        } => get_quantized_numpy_serde(dtype, encoding, bounds),
+        Serde::STRUCT {
+            module,
+            qualname,
+            fields,
+        } => Python::with_gil(|py| {
+            let (field_names, field_serdes) = fields
+                .into_iter()
+                .map(|(field_name, field_serde)| Ok((field_name, get_pyany_serde(field_serde)?)))
+                .collect::<PyResult<(Vec<String>, Vec<Box<dyn PyAnySerde>>)>>()?;
+            Ok(Box::new(StructSerde::new(
+                &import_struct_type(py, &module, &qualname)?,
+                field_names,
+                field_serdes,
+            )?) as Box<dyn PyAnySerde>)
+        }),
         Serde::OTHER => Err(InvalidStateError::new_err("Tried to deserialize an OTHER type of Serde which cannot be dynamically determined / reconstructed. Ensure the RustSerde used is passed to both the EPI and EP explicitly."))
     }
 }
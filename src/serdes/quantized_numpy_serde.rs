@@ -0,0 +1,640 @@
+use std::marker::PhantomData;
+use std::mem::size_of;
+
+use num_traits::AsPrimitive;
+use numpy::PyUntypedArrayMethods;
+use numpy::{ndarray::ArrayD, Element, IntoPyArray, PyArrayDyn, PyArrayMethods};
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::Bound;
+
+use crate::common::misc::get_bytes_to_alignment;
+use crate::common::numpy_dtype_enum::NumpyDtype;
+use crate::communication::{append_usize, get_write_slice, retrieve_usize};
+
+use super::pyany_serde::PyAnySerde;
+use super::serde_enum::{get_serde_bytes, Serde};
+
+// How the values of a float array are stored by QuantizedNumpySerde
+#[derive(Debug, PartialEq, Clone, Copy)]
+pub enum QuantizedEncoding {
+    FLOAT16,
+    BFLOAT16,
+    // Per-feature affine quantization over the last axis, using the (low, high) bounds of each feature
+    INT8,
+}
+
+impl QuantizedEncoding {
+    pub fn from_str(encoding: &str) -> PyResult<Self> {
+        match encoding {
+            "float16" => Ok(QuantizedEncoding::FLOAT16),
+            "bfloat16" => Ok(QuantizedEncoding::BFLOAT16),
+            "int8" => Ok(QuantizedEncoding::INT8),
+            v => Err(InvalidStateError::new_err(format!(
+                "Unknown quantized encoding {}, expected one of float16, bfloat16, int8",
+                v
+            ))),
+        }
+    }
+
+    fn n_bytes(&self) -> usize {
+        match self {
+            QuantizedEncoding::FLOAT16 | QuantizedEncoding::BFLOAT16 => 2,
+            QuantizedEncoding::INT8 => 1,
+        }
+    }
+}
+
+// IEEE 754 binary32 to binary16, rounding to nearest even. Values too large for float16 become inf.
+fn f32_to_f16_bits(value: f32) -> u16 {
+    let bits = value.to_bits();
+    let sign = ((bits >> 16) & 0x8000) as u16;
+    let exp = ((bits >> 23) & 0xff) as i32;
+    let mant = bits & 0x7f_ffff;
+    if exp == 0xff {
+        // inf stays inf and nan stays nan
+        return sign | 0x7c00 | if mant != 0 { 0x200 } else { 0 };
+    }
+    let half_exp = exp - 127 + 15;
+    if half_exp >= 0x1f {
+        return sign | 0x7c00;
+    }
+    if half_exp <= 0 {
+        // Subnormal in float16, or too small and rounded to zero
+        if half_exp < -10 {
+            return sign;
+        }
+        let mant = mant | 0x80_0000;
+        let shift = (14 - half_exp) as u32;
+        let round_bit = 1 << (shift - 1);
+        let rem = mant & ((1 << shift) - 1);
+        let mut half_mant = mant >> shift;
+        if rem > round_bit || (rem == round_bit && (half_mant & 1) == 1) {
+            half_mant += 1;
+        }
+        return sign | half_mant as u16;
+    }
+    let rem = mant & 0x1fff;
+    // Rounding up can carry into the exponent, which is still the correctly rounded value
+    let mut half_bits = ((half_exp as u32) << 10) | (mant >> 13);
+    if rem > 0x1000 || (rem == 0x1000 && (half_bits & 1) == 1) {
+        half_bits += 1;
+    }
+    sign | half_bits as u16
+}
+
+fn f16_bits_to_f32(half_bits: u16) -> f32 {
+    let sign = ((half_bits & 0x8000) as u32) << 16;
+    let exp = ((half_bits >> 10) & 0x1f) as u32;
+    let mant = (half_bits & 0x3ff) as u32;
+    let bits = if exp == 0 {
+        if mant == 0 {
+            sign
+        } else {
+            // Subnormal in float16 but normal in float32
+            let mut exp = 127 - 15 + 1;
+            let mut mant = mant;
+            while mant & 0x400 == 0 {
+                mant <<= 1;
+                exp -= 1;
+            }
+            sign | (exp << 23) | ((mant & 0x3ff) << 13)
+        }
+    } else if exp == 0x1f {
+        sign | 0x7f80_0000 | (mant << 13)
+    } else {
+        sign | ((exp + 127 - 15) << 23) | (mant << 13)
+    };
+    f32::from_bits(bits)
+}
+
+// bfloat16 is the upper half of a float32, rounded to nearest even
+fn f32_to_bf16_bits(value: f32) -> u16 {
+    let bits = value.to_bits();
+    if value.is_nan() {
+        return ((bits >> 16) | 0x40) as u16;
+    }
+    ((bits + 0x7fff + ((bits >> 16) & 1)) >> 16) as u16
+}
+
+fn bf16_bits_to_f32(bf16_bits: u16) -> f32 {
+    f32::from_bits((bf16_bits as u32) << 16)
+}
+
+// Serde for float numpy arrays which are sent at reduced precision. Arrays are converted to float16, bfloat16 or int8
+// when appended and converted back to their original dtype when retrieved, so the receiving side sees the same dtype
+// as with numpy_serde but with the precision of the encoding.
+#[derive(Clone)]
+pub struct QuantizedNumpySerde<T: Element> {
+    dtype: PhantomData<T>,
+    encoding: QuantizedEncoding,
+    // For INT8, the center and scale of each feature, so that value = center + scale * q for q in [-127, 127]
+    centers: Vec<f32>,
+    scales: Vec<f32>,
+    inv_scales: Vec<f32>,
+    serde_enum: Serde,
+    serde_enum_bytes: Vec<u8>,
+}
+
+macro_rules! define_primitive_impls {
+    ($($t:ty => $dtype:expr),* $(,)?) => {
+        $(
+            impl QuantizedNumpySerde<$t> {
+                pub fn new(encoding: QuantizedEncoding, bounds: Vec<(f32, f32)>) -> PyResult<Self> {
+                    let (centers, scales) = get_int8_centers_and_scales(&encoding, &bounds)?;
+                    let serde_enum = Serde::QUANTIZED_NUMPY {
+                        dtype: $dtype,
+                        encoding,
+                        bounds,
+                    };
+                    Ok(Self {
+                        dtype: PhantomData,
+                        encoding,
+                        inv_scales: scales
+                            .iter()
+                            .map(|scale| if *scale > 0.0 { 1.0 / scale } else { 0.0 })
+                            .collect(),
+                        centers,
+                        scales,
+                        serde_enum_bytes: get_serde_bytes(&serde_enum),
+                        serde_enum,
+                    })
+                }
+            }
+        )*
+    }
+}
+
+fn get_int8_centers_and_scales(
+    encoding: &QuantizedEncoding,
+    bounds: &Vec<(f32, f32)>,
+) -> PyResult<(Vec<f32>, Vec<f32>)> {
+    match encoding {
+        QuantizedEncoding::INT8 => {
+            if bounds.is_empty() {
+                return Err(InvalidStateError::new_err(
+                    "int8 quantization requires the low and high bounds of each feature",
+                ));
+            }
+            if let Some((low, high)) = bounds.iter().find(|(low, high)| !(low <= high)) {
+                return Err(InvalidStateError::new_err(format!(
+                    "int8 quantization requires low <= high for each feature, but got low {} and high {}",
+                    low, high
+                )));
+            }
+            Ok(bounds
+                .iter()
+                .map(|(low, high)| ((low + high) / 2.0, (high - low) / 254.0))
+                .unzip())
+        }
+        _ => Ok((Vec::new(), Vec::new())),
+    }
+}
+
+// Describes the size and precision of a quantized encoding, exposed through describe_quantized_numpy_serde
+pub fn describe_quantization(
+    dtype: &NumpyDtype,
+    encoding: &QuantizedEncoding,
+    bounds: &Vec<(f32, f32)>,
+) -> PyResult<String> {
+    let original_n_bytes = match dtype {
+        NumpyDtype::FLOAT32 => 4,
+        NumpyDtype::FLOAT64 => 8,
+        v => {
+            return Err(InvalidStateError::new_err(format!(
+                "quantized_numpy_serde only supports float32 and float64 arrays, but got {}",
+                v
+            )))
+        }
+    };
+    let size_description = format!(
+        "{} byte(s) per value instead of {} ({}x smaller)",
+        encoding.n_bytes(),
+        original_n_bytes,
+        original_n_bytes / encoding.n_bytes()
+    );
+    match encoding {
+        QuantizedEncoding::FLOAT16 => Ok(format!(
+            "float16 encoding of {} arrays: {}, relative error <= {:.3e}, values with magnitude above 65504 become inf and below {:.3e} lose precision",
+            dtype,
+            size_description,
+            2f32.powi(-11),
+            2f32.powi(-14)
+        )),
+        QuantizedEncoding::BFLOAT16 => Ok(format!(
+            "bfloat16 encoding of {} arrays: {}, relative error <= {:.3e}, same range as float32",
+            dtype,
+            size_description,
+            2f32.powi(-8)
+        )),
+        QuantizedEncoding::INT8 => {
+            let (_, scales) = get_int8_centers_and_scales(encoding, bounds)?;
+            let min_scale = scales.iter().cloned().fold(f32::INFINITY, f32::min);
+            let max_scale = scales.iter().cloned().fold(0.0, f32::max);
+            Ok(format!(
+                "int8 encoding of {} arrays with {} features: {}, scale per feature between {:.3e} and {:.3e}, absolute error <= scale / 2 (at most {:.3e}) for values within [low, high], values outside are clamped",
+                dtype,
+                scales.len(),
+                size_description,
+                min_scale,
+                max_scale,
+                max_scale / 2.0
+            ))
+        }
+    }
+}
+
+impl<T> QuantizedNumpySerde<T>
+where
+    T: Element + Copy + AsPrimitive<f32>,
+    f32: AsPrimitive<T>,
+{
+    pub fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        array: &Bound<'py, PyArrayDyn<T>>,
+    ) -> PyResult<usize> {
+        let shape = array.shape();
+        if self.encoding == QuantizedEncoding::INT8 && shape.last() != Some(&self.scales.len()) {
+            return Err(InvalidStateError::new_err(format!(
+                "int8 quantized_numpy_serde was created for {} features but got an array of shape {:?}",
+                self.scales.len(),
+                shape
+            )));
+        }
+        let mut new_offset = append_usize(buf, offset, shape.len())?;
+        for dim in shape.iter() {
+            new_offset = append_usize(buf, new_offset, *dim)?;
+        }
+        // The values need to be in logical (C) order, since the int8 encoding finds the feature of a value from its
+        // index. as_slice and to_vec also succeed for F-contiguous arrays but return their data in memory order, so
+        // only C-contiguous arrays are read straight from their data.
+        let array_vec: Vec<T>;
+        let values = if array.is_c_contiguous() {
+            unsafe { array.as_slice() }?
+        } else {
+            array_vec = array.try_readonly()?.as_array().iter().copied().collect();
+            &array_vec[..]
+        };
+        match self.encoding {
+            QuantizedEncoding::FLOAT16 | QuantizedEncoding::BFLOAT16 => {
+                let to_bits = if self.encoding == QuantizedEncoding::FLOAT16 {
+                    f32_to_f16_bits
+                } else {
+                    f32_to_bf16_bits
+                };
+                new_offset += get_bytes_to_alignment::<u16>(buf.as_ptr() as usize + new_offset);
+                let end = new_offset + values.len() * size_of::<u16>();
+                for (value_buf, value) in get_write_slice(buf, new_offset, end)?
+                    .chunks_exact_mut(size_of::<u16>())
+                    .zip(values.iter())
+                {
+                    value_buf.copy_from_slice(&to_bits(value.as_()).to_ne_bytes());
+                }
+                Ok(end)
+            }
+            QuantizedEncoding::INT8 => {
+                let end = new_offset + values.len();
+                let n_features = self.scales.len();
+                for (idx, (value_byte, value)) in get_write_slice(buf, new_offset, end)?
+                    .iter_mut()
+                    .zip(values.iter())
+                    .enumerate()
+                {
+                    let feature = idx % n_features;
+                    let q = ((value.as_() - self.centers[feature]) * self.inv_scales[feature])
+                        .round()
+                        .clamp(-127.0, 127.0) as i8;
+                    *value_byte = q as u8;
+                }
+                Ok(end)
+            }
+        }
+    }
+
+    pub fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyArrayDyn<T>>, usize)> {
+        let (shape_len, mut new_offset) = retrieve_usize(buf, offset)?;
+        let mut shape = Vec::with_capacity(shape_len);
+        for _ in 0..shape_len {
+            let dim;
+            (dim, new_offset) = retrieve_usize(buf, new_offset)?;
+            shape.push(dim);
+        }
+        let n_values = shape.iter().product::<usize>();
+        let array_vec: Vec<T>;
+        match self.encoding {
+            QuantizedEncoding::FLOAT16 | QuantizedEncoding::BFLOAT16 => {
+                let from_bits = if self.encoding == QuantizedEncoding::FLOAT16 {
+                    f16_bits_to_f32
+                } else {
+                    bf16_bits_to_f32
+                };
+                new_offset += get_bytes_to_alignment::<u16>(buf.as_ptr() as usize + new_offset);
+                let end = new_offset + n_values * size_of::<u16>();
+                array_vec = buf[new_offset..end]
+                    .chunks_exact(size_of::<u16>())
+                    .map(|value_bytes| {
+                        from_bits(u16::from_ne_bytes(value_bytes.try_into().unwrap())).as_()
+                    })
+                    .collect();
+                new_offset = end;
+            }
+            QuantizedEncoding::INT8 => {
+                let end = new_offset + n_values;
+                let n_features = self.scales.len();
+                array_vec = buf[new_offset..end]
+                    .iter()
+                    .enumerate()
+                    .map(|(idx, value_byte)| {
+                        let feature = idx % n_features;
+                        (self.centers[feature] + self.scales[feature] * (*value_byte as i8) as f32)
+                            .as_()
+                    })
+                    .collect();
+                new_offset = end;
+            }
+        }
+        let array = ArrayD::from_shape_vec(shape, array_vec).map_err(|err| {
+            InvalidStateError::new_err(format!(
+                "Failed create Numpy array of T from shape and Vec<T>: {}",
+                err
+            ))
+        })?;
+        Ok((array.into_pyarray(py), new_offset))
+    }
+}
+
+define_primitive_impls! {
+    f32 => NumpyDtype::FLOAT32,
+    f64 => NumpyDtype::FLOAT64,
+}
+
+pub fn get_quantized_numpy_serde(
+    dtype: NumpyDtype,
+    encoding: QuantizedEncoding,
+    bounds: Vec<(f32, f32)>,
+) -> PyResult<Box<dyn PyAnySerde>> {
+    match dtype {
+        NumpyDtype::FLOAT32 => Ok(Box::new(QuantizedNumpySerde::<f32>::new(encoding, bounds)?)),
+        NumpyDtype::FLOAT64 => Ok(Box::new(QuantizedNumpySerde::<f64>::new(encoding, bounds)?)),
+        v => Err(InvalidStateError::new_err(format!(
+            "quantized_numpy_serde only supports float32 and float64 arrays, but got {}",
+            v
+        ))),
+    }
+}
+
+impl<T> PyAnySerde for QuantizedNumpySerde<T>
+where
+    T: Element + Copy + AsPrimitive<f32>,
+    f32: AsPrimitive<T>,
+{
+    fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<usize> {
+        self.append(buf, offset, obj.downcast::<PyArrayDyn<T>>()?)
+    }
+
+    fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let (array, offset) = self.retrieve(py, buf, offset)?;
+        Ok((array.into_any(), offset))
+    }
+
+    fn align_of(&self) -> usize {
+        match self.encoding {
+            QuantizedEncoding::FLOAT16 | QuantizedEncoding::BFLOAT16 => size_of::<u16>(),
+            QuantizedEncoding::INT8 => 1,
+        }
+    }
+
+    fn get_enum(&self) -> &Serde {
+        &self.serde_enum
+    }
+
+    fn get_enum_bytes(&self) -> &[u8] {
+        &self.serde_enum_bytes
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use numpy::ndarray::{ArrayD, IxDyn};
+    use numpy::{PyArrayDyn, PyArrayMethods, PyUntypedArrayMethods};
+    use pyo3::prelude::*;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+
+    use super::{
+        bf16_bits_to_f32, f16_bits_to_f32, f32_to_bf16_bits, f32_to_f16_bits,
+        get_quantized_numpy_serde, QuantizedEncoding,
+    };
+
+    #[test]
+    fn test_f16_round_trips_every_value() {
+        for half_bits in 0..=u16::MAX {
+            let value = f16_bits_to_f32(half_bits);
+            let is_nan = (half_bits & 0x7c00) == 0x7c00 && (half_bits & 0x3ff) != 0;
+            if is_nan {
+                assert!(value.is_nan());
+                assert!(f16_bits_to_f32(f32_to_f16_bits(value)).is_nan());
+            } else {
+                assert_eq!(f32_to_f16_bits(value), half_bits, "value {:e}", value);
+            }
+        }
+    }
+
+    #[test]
+    fn test_f16_special_values() {
+        assert_eq!(f32_to_f16_bits(0.0), 0x0000);
+        assert_eq!(f32_to_f16_bits(-0.0), 0x8000);
+        assert_eq!(f32_to_f16_bits(1.0), 0x3c00);
+        assert_eq!(f32_to_f16_bits(65504.0), 0x7bff);
+        assert_eq!(f32_to_f16_bits(1e6), 0x7c00);
+        assert_eq!(f32_to_f16_bits(f32::INFINITY), 0x7c00);
+        assert_eq!(f32_to_f16_bits(f32::NEG_INFINITY), 0xfc00);
+        assert!(f16_bits_to_f32(f32_to_f16_bits(f32::NAN)).is_nan());
+        // A nan with only low mantissa bits set must not become inf
+        assert!(f16_bits_to_f32(f32_to_f16_bits(f32::from_bits(0x7f80_0001))).is_nan());
+    }
+
+    #[test]
+    fn test_f16_subnormals() {
+        // Smallest subnormal and smallest normal
+        assert_eq!(f32_to_f16_bits(2f32.powi(-24)), 0x0001);
+        assert_eq!(f32_to_f16_bits(2f32.powi(-14)), 0x0400);
+        assert_eq!(f32_to_f16_bits(-2f32.powi(-24)), 0x8001);
+        // Halfway between 0 and the smallest subnormal rounds to even, which is 0
+        assert_eq!(f32_to_f16_bits(2f32.powi(-25)), 0x0000);
+        assert_eq!(f32_to_f16_bits(1.5 * 2f32.powi(-25)), 0x0001);
+        assert_eq!(f32_to_f16_bits(2f32.powi(-26)), 0x0000);
+        // Halfway between the subnormals 1 and 2 rounds to 2, and between 2 and 3 rounds to 2
+        assert_eq!(f32_to_f16_bits(1.5 * 2f32.powi(-24)), 0x0002);
+        assert_eq!(f32_to_f16_bits(2.5 * 2f32.powi(-24)), 0x0002);
+        // Rounding up the largest subnormal gives the smallest normal
+        assert_eq!(f32_to_f16_bits(2f32.powi(-14) - 2f32.powi(-26)), 0x0400);
+    }
+
+    #[test]
+    fn test_f16_ties_to_even() {
+        // Halfway between 0x3c00 and 0x3c01 rounds down, halfway between 0x3c01 and 0x3c02 rounds up
+        assert_eq!(f32_to_f16_bits(1.0 + 2f32.powi(-11)), 0x3c00);
+        assert_eq!(f32_to_f16_bits(1.0 + 3.0 * 2f32.powi(-11)), 0x3c02);
+        assert_eq!(
+            f32_to_f16_bits(1.0 + 2f32.powi(-11) + 2f32.powi(-20)),
+            0x3c01
+        );
+        // Halfway between the largest float16 and the next power of two rounds to inf
+        assert_eq!(f32_to_f16_bits(65520.0), 0x7c00);
+        assert_eq!(f32_to_f16_bits(65519.0), 0x7bff);
+    }
+
+    #[test]
+    fn test_bf16_round_trips_every_value() {
+        for bf16_bits in 0..=u16::MAX {
+            let value = bf16_bits_to_f32(bf16_bits);
+            if value.is_nan() {
+                assert!(bf16_bits_to_f32(f32_to_bf16_bits(value)).is_nan());
+            } else {
+                assert_eq!(f32_to_bf16_bits(value), bf16_bits, "value {:e}", value);
+            }
+        }
+    }
+
+    #[test]
+    fn test_bf16_special_values_and_ties_to_even() {
+        assert_eq!(f32_to_bf16_bits(1.0), 0x3f80);
+        assert_eq!(f32_to_bf16_bits(-0.0), 0x8000);
+        assert_eq!(f32_to_bf16_bits(f32::INFINITY), 0x7f80);
+        assert_eq!(f32_to_bf16_bits(f32::NEG_INFINITY), 0xff80);
+        assert_eq!(f32_to_bf16_bits(f32::MAX), 0x7f80);
+        assert!(bf16_bits_to_f32(f32_to_bf16_bits(f32::NAN)).is_nan());
+        assert!(bf16_bits_to_f32(f32_to_bf16_bits(f32::from_bits(0x7f80_0001))).is_nan());
+        assert_eq!(f32_to_bf16_bits(f32::from_bits(0x3f80_8000)), 0x3f80);
+        assert_eq!(f32_to_bf16_bits(f32::from_bits(0x3f81_8000)), 0x3f82);
+        assert_eq!(f32_to_bf16_bits(f32::from_bits(0x3f80_8001)), 0x3f81);
+        // Subnormals are kept, since bfloat16 has the exponent range of float32
+        assert_eq!(f32_to_bf16_bits(f32::from_bits(0x0001_0000)), 0x0001);
+    }
+
+    #[test]
+    fn test_int8_clamps_values_outside_bounds() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let bounds = vec![(-1.0, 1.0), (0.0, 10.0)];
+            let mut serde =
+                get_quantized_numpy_serde(NumpyDtype::FLOAT64, QuantizedEncoding::INT8, bounds)?;
+            let values = vec![-5.0, 20.0, 0.5, 5.0, 1.0, 0.0, 0.3, 9.99];
+            let array = PyArrayDyn::<f64>::from_owned_array(
+                py,
+                ArrayD::from_shape_vec(IxDyn(&[4, 2]), values.clone()).unwrap(),
+            );
+            let mut buf = vec![0_u8; 256];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            let retrieved = obj.downcast::<PyArrayDyn<f64>>()?.to_vec()?;
+            let scales = [2.0 / 254.0, 10.0 / 254.0];
+            let expected = [-1.0, 10.0, 0.5, 5.0, 1.0, 0.0, 0.3, 9.99];
+            for (idx, (retrieved_value, expected_value)) in
+                retrieved.iter().zip(expected.iter()).enumerate()
+            {
+                let tolerance = scales[idx % 2] / 2.0 + 1e-6;
+                assert!(
+                    (retrieved_value - expected_value).abs() <= tolerance,
+                    "value {} was retrieved as {}",
+                    values[idx],
+                    retrieved_value
+                );
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_int8_fortran_order_array_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let bounds = vec![(-1.0, 1.0), (0.0, 100.0), (-10.0, 0.0)];
+            let mut serde =
+                get_quantized_numpy_serde(NumpyDtype::FLOAT64, QuantizedEncoding::INT8, bounds)?;
+            // Reversing the axes of a C-order (3, 2) array gives an F-order (2, 3) array over the same data, so each
+            // row holds one value of each of the 3 features
+            let data =
+                ArrayD::from_shape_vec(IxDyn(&[3, 2]), vec![0.5, -0.5, 50.0, 25.0, -5.0, -2.5])
+                    .unwrap();
+            let array = PyArrayDyn::<f64>::from_owned_array(py, data.reversed_axes());
+            assert!(array.is_fortran_contiguous() && !array.is_c_contiguous());
+            let expected = [0.5, 50.0, -5.0, -0.5, 25.0, -2.5];
+            let mut buf = vec![0_u8; 256];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            let retrieved = obj.downcast::<PyArrayDyn<f64>>()?;
+            assert_eq!(retrieved.shape(), &[2, 3]);
+            let scales = [2.0 / 254.0, 100.0 / 254.0, 10.0 / 254.0];
+            for (idx, (retrieved_value, expected_value)) in
+                retrieved.to_vec()?.iter().zip(expected.iter()).enumerate()
+            {
+                assert!(
+                    (retrieved_value - expected_value).abs() <= scales[idx % 3] / 2.0 + 1e-6,
+                    "value {} was retrieved as {}",
+                    expected_value,
+                    retrieved_value
+                );
+            }
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_int8_rejects_wrong_number_of_features() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_quantized_numpy_serde(
+                NumpyDtype::FLOAT32,
+                QuantizedEncoding::INT8,
+                vec![(0.0, 1.0); 3],
+            )?;
+            let array = PyArrayDyn::<f32>::from_owned_array(py, ArrayD::zeros(IxDyn(&[2, 4])));
+            let mut buf = vec![0_u8; 256];
+            assert!(serde.append(&mut buf[..], 0, array.as_any()).is_err());
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_float16_serde_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let mut serde = get_quantized_numpy_serde(
+                NumpyDtype::FLOAT64,
+                QuantizedEncoding::FLOAT16,
+                Vec::new(),
+            )?;
+            // These values are all exactly representable in float16
+            let values = vec![0.0, -2.5, 65504.0, 2f64.powi(-24), 0.125, -1024.0];
+            let array = PyArrayDyn::<f64>::from_owned_array(
+                py,
+                ArrayD::from_shape_vec(IxDyn(&[2, 3]), values.clone()).unwrap(),
+            );
+            let mut buf = vec![0_u8; 256];
+            let end = serde.append(&mut buf[..], 0, array.as_any())?;
+            let (obj, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+            assert_eq!(retrieve_end, end);
+            let retrieved = obj.downcast::<PyArrayDyn<f64>>()?;
+            assert_eq!(retrieved.shape(), &[2, 3]);
+            assert_eq!(retrieved.to_vec()?, values);
+            Ok(())
+        })
+    }
+}
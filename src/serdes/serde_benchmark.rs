@@ -0,0 +1,63 @@
+use std::time::Instant;
+
+use pyo3::prelude::*;
+
+use crate::communication::{append_python, retrieve_python};
+
+use super::pyany_serde::DynPyAnySerde;
+
+// Round-trips obj through a serde n_iterations times, using append_python and retrieve_python on a buffer of
+// buffer_size bytes the same way data is sent through shared memory. The appending and retrieving sides each have their
+// own copy of the serde, like the EP and EPI. Returns the total nanoseconds spent appending, the total nanoseconds spent
+// retrieving, the number of bytes written per object, and the last retrieved object so the round trip can be checked.
+#[pyfunction]
+#[pyo3(signature = (type_serde_option, dyn_serde_option, obj, n_iterations, buffer_size))]
+pub fn benchmark_serde<'py>(
+    py: Python<'py>,
+    type_serde_option: Option<PyObject>,
+    dyn_serde_option: Option<DynPyAnySerde>,
+    obj: Bound<'py, PyAny>,
+    n_iterations: usize,
+    buffer_size: usize,
+) -> PyResult<(u64, u64, usize, PyObject)> {
+    let type_serde_option = type_serde_option
+        .as_ref()
+        .map(|type_serde| type_serde.bind(py));
+    let mut append_pyany_serde_option = dyn_serde_option.and_then(|dyn_serde| dyn_serde.0);
+    let mut retrieve_pyany_serde_option = append_pyany_serde_option.clone();
+    let mut buf = vec![0_u8; buffer_size];
+    let mut append_nanos = 0;
+    let mut retrieve_nanos = 0;
+    let mut n_bytes = 0;
+    let mut retrieved_obj = py.None();
+    for _ in 0..n_iterations {
+        let start = Instant::now();
+        let (offset, new_pyany_serde_option) = append_python(
+            &mut buf[..],
+            0,
+            &obj,
+            &type_serde_option,
+            &mut append_pyany_serde_option,
+        )?;
+        append_nanos += start.elapsed().as_nanos() as u64;
+        if new_pyany_serde_option.is_some() {
+            append_pyany_serde_option = new_pyany_serde_option;
+        }
+        n_bytes = offset;
+
+        let start = Instant::now();
+        let (obj, _, new_pyany_serde_option) = retrieve_python(
+            py,
+            &buf[..],
+            0,
+            &type_serde_option,
+            &mut retrieve_pyany_serde_option,
+        )?;
+        retrieve_nanos += start.elapsed().as_nanos() as u64;
+        if new_pyany_serde_option.is_some() {
+            retrieve_pyany_serde_option = new_pyany_serde_option;
+        }
+        retrieved_obj = obj.unbind();
+    }
+    Ok((append_nanos, retrieve_nanos, n_bytes, retrieved_obj))
+}
@@ -5,7 +5,10 @@ use pyo3::prelude::*;
 
 use crate::common::numpy_dtype_enum::NumpyDtype;
 
+use super::quantized_numpy_serde::QuantizedEncoding;
+
 // This enum is used to store all of the information about a Python type required to choose a Serde
+#[allow(non_camel_case_types)]
 #[derive(Debug, PartialEq, Clone)]
 pub enum Serde {
     PICKLE,
@@ -33,6 +36,97 @@ pub enum Serde {
         values: Box<Serde>,
     },
     OTHER,
+    NUMPY_STATIC {
+        dtype: NumpyDtype,
+        shape: Vec<usize>,
+    },
+    // A serde tree which has been compiled into a CompiledSerde. The serialized data is the same as for the serde tree.
+    COMPILED {
+        serde: Box<Serde>,
+    },
+    // bounds holds the (low, high) of each feature for INT8 and is empty otherwise
+    QUANTIZED_NUMPY {
+        dtype: NumpyDtype,
+        encoding: QuantizedEncoding,
+        bounds: Vec<(f32, f32)>,
+    },
+    // The class is identified by its module and qualified name so that it can be imported when the serde is rebuilt
+    STRUCT {
+        module: String,
+        qualname: String,
+        fields: Vec<(String, Serde)>,
+    },
+}
+
+fn get_numpy_dtype_byte(dtype: &NumpyDtype) -> u8 {
+    match dtype {
+        NumpyDtype::INT8 => 0,
+        NumpyDtype::INT16 => 1,
+        NumpyDtype::INT32 => 2,
+        NumpyDtype::INT64 => 3,
+        NumpyDtype::UINT8 => 4,
+        NumpyDtype::UINT16 => 5,
+        NumpyDtype::UINT32 => 6,
+        NumpyDtype::UINT64 => 7,
+        NumpyDtype::FLOAT32 => 8,
+        NumpyDtype::FLOAT64 => 9,
+    }
+}
+
+fn retrieve_numpy_dtype(buf: &[u8], offset: usize) -> PyResult<(NumpyDtype, usize)> {
+    let dtype = match buf[offset] {
+        0 => Ok(NumpyDtype::INT8),
+        1 => Ok(NumpyDtype::INT16),
+        2 => Ok(NumpyDtype::INT32),
+        3 => Ok(NumpyDtype::INT64),
+        4 => Ok(NumpyDtype::UINT8),
+        5 => Ok(NumpyDtype::UINT16),
+        6 => Ok(NumpyDtype::UINT32),
+        7 => Ok(NumpyDtype::UINT64),
+        8 => Ok(NumpyDtype::FLOAT32),
+        9 => Ok(NumpyDtype::FLOAT64),
+        v => Err(InvalidStateError::new_err(format!(
+            "tried to deserialize Serde as NUMPY but got {} for NumpyDtype",
+            v
+        ))),
+    }?;
+    Ok((dtype, offset + 1))
+}
+
+fn get_quantized_encoding_byte(encoding: &QuantizedEncoding) -> u8 {
+    match encoding {
+        QuantizedEncoding::FLOAT16 => 0,
+        QuantizedEncoding::BFLOAT16 => 1,
+        QuantizedEncoding::INT8 => 2,
+    }
+}
+
+fn retrieve_quantized_encoding(buf: &[u8], offset: usize) -> PyResult<(QuantizedEncoding, usize)> {
+    let encoding = match buf[offset] {
+        0 => Ok(QuantizedEncoding::FLOAT16),
+        1 => Ok(QuantizedEncoding::BFLOAT16),
+        2 => Ok(QuantizedEncoding::INT8),
+        v => Err(InvalidStateError::new_err(format!(
+            "tried to deserialize Serde as QUANTIZED_NUMPY but got {} for QuantizedEncoding",
+            v
+        ))),
+    }?;
+    Ok((encoding, offset + 1))
+}
+
+fn append_string_bytes(bytes: &mut Vec<u8>, string: &str) {
+    bytes.extend_from_slice(&string.len().to_ne_bytes());
+    bytes.extend_from_slice(string.as_bytes());
+}
+
+fn retrieve_string(buf: &[u8], offset: usize) -> PyResult<(String, usize)> {
+    let end = offset + size_of::<usize>();
+    let string_len = usize::from_ne_bytes(buf[offset..end].try_into()?);
+    let string_end = end + string_len;
+    Ok((
+        String::from_utf8(buf[end..string_end].to_vec())?,
+        string_end,
+    ))
 }
 
 pub fn get_serde_bytes(serde: &Serde) -> Vec<u8> {
@@ -45,18 +139,7 @@ pub fn get_serde_bytes(serde: &Serde) -> Vec<u8> {
         Serde::STRING => vec![5],
         Serde::BYTES => vec![6],
         Serde::DYNAMIC => vec![7],
-        Serde::NUMPY { dtype } => match dtype {
-            NumpyDtype::INT8 => vec![8, 0],
-            NumpyDtype::INT16 => vec![8, 1],
-            NumpyDtype::INT32 => vec![8, 2],
-            NumpyDtype::INT64 => vec![8, 3],
-            NumpyDtype::UINT8 => vec![8, 4],
-            NumpyDtype::UINT16 => vec![8, 5],
-            NumpyDtype::UINT32 => vec![8, 6],
-            NumpyDtype::UINT64 => vec![8, 7],
-            NumpyDtype::FLOAT32 => vec![8, 8],
-            NumpyDtype::FLOAT64 => vec![8, 9],
-        },
+        Serde::NUMPY { dtype } => vec![8, get_numpy_dtype_byte(dtype)],
         Serde::LIST { items } => {
             let mut bytes: Vec<u8> = vec![9];
             bytes.append(&mut get_serde_bytes(&*items));
@@ -82,6 +165,51 @@ pub fn get_serde_bytes(serde: &Serde) -> Vec<u8> {
             bytes
         }
         Serde::OTHER => vec![13],
+        Serde::NUMPY_STATIC { dtype, shape } => {
+            let mut bytes: Vec<u8> = vec![14, get_numpy_dtype_byte(dtype)];
+            bytes.extend_from_slice(&shape.len().to_ne_bytes());
+            for dim in shape {
+                bytes.extend_from_slice(&dim.to_ne_bytes());
+            }
+            bytes
+        }
+        Serde::COMPILED { serde } => {
+            let mut bytes: Vec<u8> = vec![15];
+            bytes.append(&mut get_serde_bytes(&*serde));
+            bytes
+        }
+        Serde::QUANTIZED_NUMPY {
+            dtype,
+            encoding,
+            bounds,
+        } => {
+            let mut bytes: Vec<u8> = vec![
+                16,
+                get_numpy_dtype_byte(dtype),
+                get_quantized_encoding_byte(encoding),
+            ];
+            bytes.extend_from_slice(&bounds.len().to_ne_bytes());
+            for (low, high) in bounds {
+                bytes.extend_from_slice(&low.to_ne_bytes());
+                bytes.extend_from_slice(&high.to_ne_bytes());
+            }
+            bytes
+        }
+        Serde::STRUCT {
+            module,
+            qualname,
+            fields,
+        } => {
+            let mut bytes: Vec<u8> = vec![17];
+            append_string_bytes(&mut bytes, module);
+            append_string_bytes(&mut bytes, qualname);
+            bytes.extend_from_slice(&fields.len().to_ne_bytes());
+            for (field_name, field_serde) in fields {
+                append_string_bytes(&mut bytes, field_name);
+                bytes.append(&mut get_serde_bytes(field_serde));
+            }
+            bytes
+        }
     }
 }
 
@@ -99,23 +227,8 @@ pub fn retrieve_serde(buf: &[u8], offset: usize) -> PyResult<(Serde, usize)> {
         6 => Ok(Serde::BYTES),
         7 => Ok(Serde::DYNAMIC),
         8 => {
-            let dtype = match buf[cur_offset] {
-                0 => Ok(NumpyDtype::INT8),
-                1 => Ok(NumpyDtype::INT16),
-                2 => Ok(NumpyDtype::INT32),
-                3 => Ok(NumpyDtype::INT64),
-                4 => Ok(NumpyDtype::UINT8),
-                5 => Ok(NumpyDtype::UINT16),
-                6 => Ok(NumpyDtype::UINT32),
-                7 => Ok(NumpyDtype::UINT64),
-                8 => Ok(NumpyDtype::FLOAT32),
-                9 => Ok(NumpyDtype::FLOAT64),
-                v => Err(InvalidStateError::new_err(format!(
-                    "tried to deserialize Serde as NUMPY but got {} for NumpyDtype",
-                    v
-                ))),
-            }?;
-            cur_offset += 1;
+            let dtype;
+            (dtype, cur_offset) = retrieve_numpy_dtype(buf, cur_offset)?;
             Ok(Serde::NUMPY { dtype })
         }
         9 => {
@@ -155,6 +268,73 @@ pub fn retrieve_serde(buf: &[u8], offset: usize) -> PyResult<(Serde, usize)> {
             })
         }
         13 => Ok(Serde::OTHER),
+        14 => {
+            let dtype;
+            (dtype, cur_offset) = retrieve_numpy_dtype(buf, cur_offset)?;
+            let end = cur_offset + size_of::<usize>();
+            let shape_len = usize::from_ne_bytes(buf[cur_offset..end].try_into()?);
+            cur_offset = end;
+            let mut shape = Vec::with_capacity(shape_len);
+            for _ in 0..shape_len {
+                let end = cur_offset + size_of::<usize>();
+                shape.push(usize::from_ne_bytes(buf[cur_offset..end].try_into()?));
+                cur_offset = end;
+            }
+            Ok(Serde::NUMPY_STATIC { dtype, shape })
+        }
+        15 => {
+            let serde;
+            (serde, cur_offset) = retrieve_serde(buf, cur_offset)?;
+            Ok(Serde::COMPILED {
+                serde: Box::new(serde),
+            })
+        }
+        16 => {
+            let dtype;
+            (dtype, cur_offset) = retrieve_numpy_dtype(buf, cur_offset)?;
+            let encoding;
+            (encoding, cur_offset) = retrieve_quantized_encoding(buf, cur_offset)?;
+            let end = cur_offset + size_of::<usize>();
+            let bounds_len = usize::from_ne_bytes(buf[cur_offset..end].try_into()?);
+            cur_offset = end;
+            let mut bounds = Vec::with_capacity(bounds_len);
+            for _ in 0..bounds_len {
+                let end = cur_offset + size_of::<f32>();
+                let low = f32::from_ne_bytes(buf[cur_offset..end].try_into()?);
+                cur_offset = end;
+                let end = cur_offset + size_of::<f32>();
+                let high = f32::from_ne_bytes(buf[cur_offset..end].try_into()?);
+                cur_offset = end;
+                bounds.push((low, high));
+            }
+            Ok(Serde::QUANTIZED_NUMPY {
+                dtype,
+                encoding,
+                bounds,
+            })
+        }
+        17 => {
+            let module;
+            (module, cur_offset) = retrieve_string(buf, cur_offset)?;
+            let qualname;
+            (qualname, cur_offset) = retrieve_string(buf, cur_offset)?;
+            let end = cur_offset + size_of::<usize>();
+            let fields_len = usize::from_ne_bytes(buf[cur_offset..end].try_into()?);
+            cur_offset = end;
+            let mut fields = Vec::with_capacity(fields_len);
+            for _ in 0..fields_len {
+                let field_name;
+                (field_name, cur_offset) = retrieve_string(buf, cur_offset)?;
+                let field_serde;
+                (field_serde, cur_offset) = retrieve_serde(buf, cur_offset)?;
+                fields.push((field_name, field_serde));
+            }
+            Ok(Serde::STRUCT {
+                module,
+                qualname,
+                fields,
+            })
+        }
         v => Err(InvalidStateError::new_err(format!(
             "Tried to deserialize Serde but got {}",
             v
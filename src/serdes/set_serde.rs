@@ -38,7 +38,7 @@ impl PyAnySerde for SetSerde {
         obj: &Bound<'py, PyAny>,
     ) -> PyResult<usize> {
         let set = obj.downcast::<PySet>()?;
-        let mut new_offset = append_usize(buf, offset, set.len());
+        let mut new_offset = append_usize(buf, offset, set.len())?;
         for item in set.iter() {
             new_offset = self.item_serde.append(buf, new_offset, &item)?;
         }
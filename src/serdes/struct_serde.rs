@@ -0,0 +1,298 @@
+use std::iter::zip;
+
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+use pyo3::types::{PyString, PyType};
+use pyo3::{ffi, intern, Bound};
+
+use super::pyany_serde::PyAnySerde;
+use super::serde_enum::{get_serde_bytes, Serde};
+
+// Serde for instances of a dataclass or __slots__ class. Only the values of the fields are written, in order, each
+// using its own serde. Instances are rebuilt with cls.__new__ and the fields are set with object.__setattr__, so
+// __init__, __post_init__ and any __setattr__ override (such as the one of frozen dataclasses) are skipped.
+#[derive(Clone)]
+pub struct StructSerde {
+    py_type: Py<PyType>,
+    field_names: Vec<Py<PyString>>,
+    field_serdes: Vec<Box<dyn PyAnySerde>>,
+    align: usize,
+    serde_enum: Serde,
+    serde_enum_bytes: Vec<u8>,
+}
+
+impl StructSerde {
+    pub fn new<'py>(
+        py_type: &Bound<'py, PyType>,
+        field_names: Vec<String>,
+        field_serdes: Vec<Box<dyn PyAnySerde>>,
+    ) -> PyResult<Self> {
+        let py = py_type.py();
+        if field_names.len() != field_serdes.len() {
+            return Err(InvalidStateError::new_err(format!(
+                "struct_serde got {} field names but {} field serdes",
+                field_names.len(),
+                field_serdes.len()
+            )));
+        }
+        let serde_enum = Serde::STRUCT {
+            module: py_type
+                .getattr(intern!(py, "__module__"))?
+                .extract::<String>()?,
+            qualname: py_type.qualname()?.to_string(),
+            fields: zip(field_names.iter(), field_serdes.iter())
+                .map(|(field_name, field_serde)| {
+                    (field_name.clone(), field_serde.get_enum().clone())
+                })
+                .collect(),
+        };
+        Ok(StructSerde {
+            py_type: py_type.clone().unbind(),
+            field_names: field_names
+                .iter()
+                .map(|field_name| PyString::intern(py, field_name).unbind())
+                .collect(),
+            align: field_serdes
+                .iter()
+                .map(|serde| serde.align_of())
+                .max()
+                .unwrap_or(1),
+            field_serdes,
+            serde_enum_bytes: get_serde_bytes(&serde_enum),
+            serde_enum,
+        })
+    }
+}
+
+// Imports the class a STRUCT serde enum was created for
+pub fn import_struct_type<'py>(
+    py: Python<'py>,
+    module: &str,
+    qualname: &str,
+) -> PyResult<Bound<'py, PyType>> {
+    if qualname.contains("<locals>") {
+        return Err(InvalidStateError::new_err(format!(
+            "Tried to rebuild a struct_serde for {}.{}, but classes defined inside functions cannot be imported. Define the class at the top level of a module.",
+            module, qualname
+        )));
+    }
+    let mut obj = py.import(module)?.into_any();
+    for name in qualname.split('.') {
+        obj = obj.getattr(name)?;
+    }
+    Ok(obj.downcast_into::<PyType>()?)
+}
+
+impl PyAnySerde for StructSerde {
+    fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<usize> {
+        let py = obj.py();
+        let mut new_offset = offset;
+        for (field_name, field_serde) in zip(self.field_names.iter(), self.field_serdes.iter_mut())
+        {
+            new_offset = field_serde.append(buf, new_offset, &obj.getattr(field_name.bind(py))?)?;
+        }
+        Ok(new_offset)
+    }
+
+    fn retrieve<'py>(
+        &mut self,
+        py: Python<'py>,
+        buf: &[u8],
+        offset: usize,
+    ) -> PyResult<(Bound<'py, PyAny>, usize)> {
+        let py_type = self.py_type.bind(py);
+        let obj = py_type.call_method1(intern!(py, "__new__"), (py_type,))?;
+        let mut new_offset = offset;
+        for (field_name, field_serde) in zip(self.field_names.iter(), self.field_serdes.iter_mut())
+        {
+            let field;
+            (field, new_offset) = field_serde.retrieve(py, buf, new_offset)?;
+            // Equivalent to object.__setattr__(obj, field_name, field)
+            let result = unsafe {
+                ffi::PyObject_GenericSetAttr(obj.as_ptr(), field_name.as_ptr(), field.as_ptr())
+            };
+            if result == -1 {
+                return Err(PyErr::fetch(py));
+            }
+        }
+        Ok((obj, new_offset))
+    }
+
+    fn align_of(&self) -> usize {
+        self.align
+    }
+
+    fn get_enum(&self) -> &Serde {
+        &self.serde_enum
+    }
+
+    fn get_enum_bytes(&self) -> &[u8] {
+        &self.serde_enum_bytes
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use pyo3::ffi::c_str;
+    use pyo3::prelude::*;
+    use pyo3::sync::GILOnceCell;
+    use pyo3::types::PyType;
+
+    use crate::serdes::float_serde::FloatSerde;
+    use crate::serdes::int_serde::IntSerde;
+    use crate::serdes::list_serde::ListSerde;
+    use crate::serdes::pyany_serde::{get_pyany_serde, PyAnySerde};
+    use crate::serdes::string_serde::StringSerde;
+
+    use super::{import_struct_type, StructSerde};
+
+    static TEST_MODULE: GILOnceCell<Py<PyModule>> = GILOnceCell::new();
+
+    // The classes are defined in a module registered in sys.modules, so that serdes rebuilt from their enum can
+    // import them
+    fn get_test_class<'py>(py: Python<'py>, name: &str) -> PyResult<Bound<'py, PyType>> {
+        let module = TEST_MODULE.get_or_try_init(py, || -> PyResult<Py<PyModule>> {
+            Ok(PyModule::from_code(
+                py,
+                c_str!(
+                    r#"
+import dataclasses
+
+
+@dataclasses.dataclass(frozen=True)
+class FrozenPoint:
+    x: int
+    y: float
+    label: str
+    n_post_inits = 0
+
+    def __post_init__(self):
+        type(self).n_post_inits += 1
+
+
+class SlotsPoint:
+    __slots__ = ("x", "ys")
+    n_inits = 0
+
+    def __init__(self, x, ys):
+        type(self).n_inits += 1
+        self.x = x
+        self.ys = ys
+"#
+                ),
+                c_str!("struct_serde_test_classes.py"),
+                c_str!("struct_serde_test_classes"),
+            )?
+            .unbind())
+        })?;
+        Ok(module.bind(py).getattr(name)?.downcast_into::<PyType>()?)
+    }
+
+    fn round_trip<'py>(
+        py: Python<'py>,
+        serde: &mut dyn PyAnySerde,
+        obj: &Bound<'py, PyAny>,
+    ) -> PyResult<(Bound<'py, PyAny>, Vec<u8>)> {
+        let mut buf = vec![0_u8; 256];
+        let end = serde.append(&mut buf[..], 0, obj)?;
+        let (retrieved, retrieve_end) = serde.retrieve(py, &buf[..], 0)?;
+        assert_eq!(retrieve_end, end);
+        buf.truncate(end);
+        Ok((retrieved, buf))
+    }
+
+    #[test]
+    fn test_frozen_dataclass_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let cls = get_test_class(py, "FrozenPoint")?;
+            let mut serde = StructSerde::new(
+                &cls,
+                vec!["x".to_string(), "y".to_string(), "label".to_string()],
+                vec![
+                    Box::new(IntSerde::new()),
+                    Box::new(FloatSerde::new()),
+                    Box::new(StringSerde::new()),
+                ],
+            )?;
+            let obj = cls.call1((3, -1.5, "a"))?;
+            let n_post_inits = cls.getattr("n_post_inits")?.extract::<usize>()?;
+            let (retrieved, _) = round_trip(py, &mut serde, &obj)?;
+            assert!(retrieved.is_instance(&cls)?);
+            assert!(retrieved.eq(&obj)?);
+            // The fields are set directly, without __init__ or __post_init__
+            assert_eq!(
+                cls.getattr("n_post_inits")?.extract::<usize>()?,
+                n_post_inits
+            );
+            // The instance is still frozen
+            assert!(retrieved.setattr("x", 4).is_err());
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_slots_class_round_trip() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let cls = get_test_class(py, "SlotsPoint")?;
+            let mut serde = StructSerde::new(
+                &cls,
+                vec!["x".to_string(), "ys".to_string()],
+                vec![
+                    Box::new(FloatSerde::new()),
+                    Box::new(ListSerde::new(Box::new(IntSerde::new()))),
+                ],
+            )?;
+            let obj = cls.call1((0.25, vec![1, 2, 3]))?;
+            let n_inits = cls.getattr("n_inits")?.extract::<usize>()?;
+            let (retrieved, _) = round_trip(py, &mut serde, &obj)?;
+            assert!(retrieved.is_instance(&cls)?);
+            assert!(!retrieved.hasattr("__dict__")?);
+            assert_eq!(retrieved.getattr("x")?.extract::<f64>()?, 0.25);
+            assert_eq!(
+                retrieved.getattr("ys")?.extract::<Vec<i64>>()?,
+                vec![1, 2, 3]
+            );
+            assert_eq!(cls.getattr("n_inits")?.extract::<usize>()?, n_inits);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_struct_serde_rebuilt_from_enum() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let cls = get_test_class(py, "FrozenPoint")?;
+            let mut serde = StructSerde::new(
+                &cls,
+                vec!["label".to_string(), "x".to_string(), "y".to_string()],
+                vec![
+                    Box::new(StringSerde::new()),
+                    Box::new(IntSerde::new()),
+                    Box::new(FloatSerde::new()),
+                ],
+            )?;
+            let obj = cls.call1((7, 0.5, "b"))?;
+            let (_, bytes) = round_trip(py, &mut serde, &obj)?;
+            let mut rebuilt_serde = get_pyany_serde(serde.get_enum().clone())?;
+            assert_eq!(rebuilt_serde.get_enum_bytes(), serde.get_enum_bytes());
+            let (retrieved, retrieve_end) = rebuilt_serde.retrieve(py, &bytes[..], 0)?;
+            assert_eq!(retrieve_end, bytes.len());
+            assert_eq!(retrieved.get_type().qualname()?.to_string(), "FrozenPoint");
+            assert_eq!(retrieved.getattr("x")?.extract::<i64>()?, 7);
+            assert_eq!(retrieved.getattr("y")?.extract::<f64>()?, 0.5);
+            assert_eq!(retrieved.getattr("label")?.extract::<String>()?, "b");
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_local_classes_are_rejected() {
+        Python::with_gil(|py| {
+            assert!(import_struct_type(py, "builtins", "f.<locals>.Point").is_err());
+        })
+    }
+}
@@ -3,7 +3,7 @@ use pyo3::{types::PyAnyMethods, IntoPyObject, PyObject, PyResult, Python};
 
 use crate::{
     append_n_vec_elements, append_python_option_update_serde,
-    communication::{append_bool, append_f32, retrieve_bool, retrieve_f32},
+    communication::{append_bool, append_f32, get_write_slice, retrieve_bool, retrieve_f32},
     retrieve_n_vec_elements, retrieve_python_option_update_serde,
     serdes::{
         pyany_serde::PyAnySerde,
@@ -48,9 +48,11 @@ impl CarSerde {
         let mut agent_id_pyany_serde_option = self.agent_id_pyany_serde_option.take();
 
         let flip_torque = car.flip_torque.bind(py).to_vec()?;
-        buf[offset] = car.team_num;
-        buf[offset + 1] = car.hitbox_type;
-        buf[offset + 2] = car.ball_touches;
+        get_write_slice(buf, offset, offset + 3)?.copy_from_slice(&[
+            car.team_num,
+            car.hitbox_type,
+            car.ball_touches,
+        ]);
         let mut offset = offset + 3;
         offset = append_python_option_update_serde!(
             buf,
@@ -61,24 +63,24 @@ impl CarSerde {
             &agent_id_type_serde_option,
             agent_id_pyany_serde_option
         );
-        offset = append_f32(buf, offset, car.demo_respawn_timer);
-        offset = append_bool(buf, offset, car.on_ground);
-        offset = append_f32(buf, offset, car.supersonic_time);
-        offset = append_f32(buf, offset, car.boost_amount);
-        offset = append_f32(buf, offset, car.boost_active_time);
-        offset = append_f32(buf, offset, car.handbrake);
-        offset = append_bool(buf, offset, car.has_jumped);
-        offset = append_bool(buf, offset, car.is_holding_jump);
-        offset = append_bool(buf, offset, car.is_jumping);
-        offset = append_f32(buf, offset, car.jump_time);
-        offset = append_bool(buf, offset, car.has_flipped);
-        offset = append_bool(buf, offset, car.has_double_jumped);
-        offset = append_f32(buf, offset, car.air_time_since_jump);
-        offset = append_f32(buf, offset, car.flip_time);
+        offset = append_f32(buf, offset, car.demo_respawn_timer)?;
+        offset = append_bool(buf, offset, car.on_ground)?;
+        offset = append_f32(buf, offset, car.supersonic_time)?;
+        offset = append_f32(buf, offset, car.boost_amount)?;
+        offset = append_f32(buf, offset, car.boost_active_time)?;
+        offset = append_f32(buf, offset, car.handbrake)?;
+        offset = append_bool(buf, offset, car.has_jumped)?;
+        offset = append_bool(buf, offset, car.is_holding_jump)?;
+        offset = append_bool(buf, offset, car.is_jumping)?;
+        offset = append_f32(buf, offset, car.jump_time)?;
+        offset = append_bool(buf, offset, car.has_flipped)?;
+        offset = append_bool(buf, offset, car.has_double_jumped)?;
+        offset = append_f32(buf, offset, car.air_time_since_jump)?;
+        offset = append_f32(buf, offset, car.flip_time)?;
         offset = append_n_vec_elements!(buf, offset, flip_torque, 3);
-        offset = append_bool(buf, offset, car.is_autoflipping);
-        offset = append_f32(buf, offset, car.autoflip_timer);
-        offset = append_f32(buf, offset, car.autoflip_direction);
+        offset = append_bool(buf, offset, car.is_autoflipping)?;
+        offset = append_f32(buf, offset, car.autoflip_timer)?;
+        offset = append_f32(buf, offset, car.autoflip_direction)?;
         offset = self
             .physics_object_serde
             .append(py, buf, offset, &car.physics)?;
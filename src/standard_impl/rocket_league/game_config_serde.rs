@@ -31,9 +31,9 @@ impl GameConfigSerde {
         offset: usize,
         game_config: &GameConfig,
     ) -> usize {
-        let mut offset = append_f32(buf, offset, game_config.gravity);
-        offset = append_f32(buf, offset, game_config.boost_consumption);
-        offset = append_f32(buf, offset, game_config.dodge_deadzone);
+        let mut offset = append_f32(buf, offset, game_config.gravity)?;
+        offset = append_f32(buf, offset, game_config.boost_consumption)?;
+        offset = append_f32(buf, offset, game_config.dodge_deadzone)?;
         offset
     }
 
@@ -56,8 +56,8 @@ impl GameStateSerde {
         offset: usize,
         game_state: GameState,
     ) -> PyResult<usize> {
-        let mut offset = append_u64(buf, offset, game_state.tick_count);
-        offset = append_bool(buf, offset, game_state.goal_scored);
+        let mut offset = append_u64(buf, offset, game_state.tick_count)?;
+        offset = append_bool(buf, offset, game_state.goal_scored)?;
         offset = self
             .game_config_serde
             .append(buf, offset, &game_state.config);
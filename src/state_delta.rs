@@ -0,0 +1,415 @@
+use std::mem::{size_of, swap};
+
+use pyo3::exceptions::asyncio::InvalidStateError;
+use pyo3::prelude::*;
+
+use crate::communication::{
+    append_bool, append_bytes, append_python, append_usize, insert_bytes, retrieve_bool,
+    retrieve_bytes, retrieve_usize,
+};
+use crate::serdes::pyany_serde::PyAnySerde;
+
+// States are serialized into u64 buffers so that they are aligned the same way on both sides, which keeps the alignment
+// padding serdes add in front of numpy data valid once the state is rebuilt by the EPI
+const WORD_SIZE: usize = size_of::<u64>();
+// Changed runs separated by at most this many unchanged words are sent as one run, since the unchanged words cost no more
+// than the start and length of another run
+const RUN_MERGE_GAP_WORDS: usize = 2 * size_of::<usize>() / WORD_SIZE;
+
+// Delta encodes the states of one env for the EPI. Each state is serialized into a buffer owned by the encoder and
+// compared with the previous state word by word, and only the runs of bytes which changed are sent. The full state is
+// sent instead (a keyframe) for the first state, whenever the length of the serialized state changes, whenever the
+// delta would not be smaller, and at least every keyframe_interval states. An appended state only becomes the previous
+// state once commit is called, so that the append can be retried if the rest of the response doesn't fit in its buffer.
+pub struct StateDeltaEncoder {
+    keyframe_interval: usize,
+    words: Vec<u64>,
+    prev_words: Vec<u64>,
+    prev_len_option: Option<usize>,
+    n_deltas_since_keyframe: usize,
+    // Start and end word of each changed run
+    runs: Vec<(usize, usize)>,
+    // Length of the state appended since the last commit, and whether it was appended as a keyframe
+    pending_option: Option<(usize, bool)>,
+}
+
+impl StateDeltaEncoder {
+    // buffer_size is the size of the buffers states are serialized into. Appending a state which doesn't fit fails with a
+    // BufferError, after which the buffers can be grown.
+    pub fn new(keyframe_interval: usize, buffer_size: usize) -> Self {
+        let n_words = buffer_size.div_ceil(WORD_SIZE);
+        StateDeltaEncoder {
+            keyframe_interval,
+            words: vec![0_u64; n_words],
+            prev_words: vec![0_u64; n_words],
+            prev_len_option: None,
+            n_deltas_since_keyframe: 0,
+            runs: Vec::new(),
+            pending_option: None,
+        }
+    }
+
+    // Grows the buffers states are serialized into to buffer_size, keeping the previous state
+    pub fn grow(&mut self, buffer_size: usize) {
+        let n_words = buffer_size.div_ceil(WORD_SIZE);
+        if n_words > self.words.len() {
+            self.words.resize(n_words, 0);
+            self.prev_words.resize(n_words, 0);
+        }
+    }
+
+    // Finds the runs of words which changed since the previous state, and returns the number of bytes the delta would take
+    fn find_changed_runs(&mut self, len: usize) -> usize {
+        let n_words = len.div_ceil(WORD_SIZE);
+        self.runs.clear();
+        for (word_idx, (word, prev_word)) in self.words[..n_words]
+            .iter()
+            .zip(self.prev_words[..n_words].iter())
+            .enumerate()
+        {
+            if word == prev_word {
+                continue;
+            }
+            match self.runs.last_mut() {
+                Some((_, end)) if word_idx - *end <= RUN_MERGE_GAP_WORDS => *end = word_idx + 1,
+                _ => self.runs.push((word_idx, word_idx + 1)),
+            }
+        }
+        size_of::<usize>()
+            + self
+                .runs
+                .iter()
+                .map(|(start, end)| {
+                    2 * size_of::<usize>() + (end * WORD_SIZE).min(len) - start * WORD_SIZE
+                })
+                .sum::<usize>()
+    }
+
+    // Serializes state and appends it to buf as a keyframe or as a delta from the previous state. Returns the new offset.
+    // Appending again before commit replaces the pending state, and is still encoded against the previous state.
+    pub fn append<'py>(
+        &mut self,
+        buf: &mut [u8],
+        offset: usize,
+        state: &Bound<'py, PyAny>,
+        type_serde_option: &Option<&Bound<'py, PyAny>>,
+        pyany_serde_option: &mut Option<Box<dyn PyAnySerde>>,
+    ) -> PyResult<usize> {
+        let (len, new_pyany_serde_option) = append_python(
+            bytemuck::cast_slice_mut::<u64, u8>(&mut self.words[..]),
+            0,
+            state,
+            type_serde_option,
+            pyany_serde_option,
+        )?;
+        if new_pyany_serde_option.is_some() {
+            *pyany_serde_option = new_pyany_serde_option;
+        }
+        let is_keyframe = self.prev_len_option != Some(len)
+            || self.n_deltas_since_keyframe + 1 >= self.keyframe_interval
+            || self.find_changed_runs(len) >= len;
+        let bytes = &bytemuck::cast_slice::<u64, u8>(&self.words[..])[..len];
+        self.pending_option = None;
+        let mut offset = append_bool(buf, offset, is_keyframe)?;
+        if is_keyframe {
+            offset = insert_bytes(buf, offset, bytes)?;
+        } else {
+            offset = append_usize(buf, offset, self.runs.len())?;
+            for &(start, end) in self.runs.iter() {
+                let start = start * WORD_SIZE;
+                offset = append_usize(buf, offset, start)?;
+                offset = append_bytes(buf, offset, &bytes[start..(end * WORD_SIZE).min(len)])?;
+            }
+        }
+        self.pending_option = Some((len, is_keyframe));
+        Ok(offset)
+    }
+
+    // Makes the state appended last the previous state, once the response containing it is complete
+    pub fn commit(&mut self) {
+        if let Some((len, is_keyframe)) = self.pending_option.take() {
+            if is_keyframe {
+                self.n_deltas_since_keyframe = 0;
+            } else {
+                self.n_deltas_since_keyframe += 1;
+            }
+            swap(&mut self.words, &mut self.prev_words);
+            self.prev_len_option = Some(len);
+        }
+    }
+}
+
+// Rebuilds the states of one env from the keyframes and deltas written by its StateDeltaEncoder
+pub struct StateDeltaDecoder {
+    words: Vec<u64>,
+    len_option: Option<usize>,
+}
+
+impl StateDeltaDecoder {
+    pub fn new() -> Self {
+        StateDeltaDecoder {
+            words: Vec::new(),
+            len_option: None,
+        }
+    }
+
+    // Applies a keyframe or delta written by StateDeltaEncoder::append, and returns the full serialized state
+    pub fn apply(&mut self, buf: &[u8]) -> PyResult<&[u8]> {
+        let (is_keyframe, mut offset) = retrieve_bool(buf, 0)?;
+        if is_keyframe {
+            let len = buf.len() - offset;
+            self.words.resize(len.div_ceil(WORD_SIZE), 0);
+            bytemuck::cast_slice_mut::<u64, u8>(&mut self.words[..])[..len]
+                .copy_from_slice(&buf[offset..]);
+            self.len_option = Some(len);
+            return Ok(&bytemuck::cast_slice::<u64, u8>(&self.words[..])[..len]);
+        }
+        let len = self.len_option.ok_or_else(|| {
+            InvalidStateError::new_err("Received a state delta before receiving a keyframe")
+        })?;
+        let bytes = &mut bytemuck::cast_slice_mut::<u64, u8>(&mut self.words[..])[..len];
+        let n_runs;
+        (n_runs, offset) = retrieve_usize(buf, offset)?;
+        for _ in 0..n_runs {
+            let (start, run_bytes);
+            (start, offset) = retrieve_usize(buf, offset)?;
+            (run_bytes, offset) = retrieve_bytes(buf, offset)?;
+            let end = start + run_bytes.len();
+            if end > len {
+                return Err(InvalidStateError::new_err(format!(
+                    "State delta changes bytes {}..{}, but the state is only {} bytes",
+                    start, end, len
+                )));
+            }
+            bytes[start..end].copy_from_slice(run_bytes);
+        }
+        Ok(&bytemuck::cast_slice::<u64, u8>(&self.words[..])[..len])
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use pyo3::ffi::c_str;
+    use pyo3::prelude::*;
+    use pyo3::types::IntoPyDict;
+
+    use crate::common::numpy_dtype_enum::NumpyDtype;
+    use crate::communication::{append_python, is_buffer_overflow, retrieve_python};
+    use crate::serdes::pyany_serde::get_pyany_serde;
+    use crate::serdes::serde_enum::Serde;
+
+    use super::{StateDeltaDecoder, StateDeltaEncoder};
+
+    const BUFFER_SIZE: usize = 1 << 16;
+
+    // Sends the states through a StateDeltaEncoder and a StateDeltaDecoder, and checks that the decoder rebuilds the
+    // bytes of each state and that they deserialize to the state. Returns whether each state was sent as a keyframe.
+    fn send_states<'py>(
+        py: Python<'py>,
+        serde: Serde,
+        keyframe_interval: usize,
+        states: &Vec<Bound<'py, PyAny>>,
+    ) -> PyResult<Vec<bool>> {
+        let mut encoder = StateDeltaEncoder::new(keyframe_interval, BUFFER_SIZE);
+        let mut decoder = StateDeltaDecoder::new();
+        let mut pyany_serde_option = Some(get_pyany_serde(serde)?);
+        let mut buf = vec![0_u8; BUFFER_SIZE + 64];
+        // Serialized into u64 words like the encoder does, so that the alignment padding is the same
+        let mut expected_words = vec![0_u64; BUFFER_SIZE / 8];
+        let mut reserialized_words = vec![0_u64; BUFFER_SIZE / 8];
+        let mut keyframe_list = Vec::with_capacity(states.len());
+        for state in states.iter() {
+            let end = encoder.append(&mut buf[..], 0, state, &None, &mut pyany_serde_option)?;
+            encoder.commit();
+            keyframe_list.push(buf[0] != 0);
+            let (expected_len, _) = append_python(
+                bytemuck::cast_slice_mut::<u64, u8>(&mut expected_words[..]),
+                0,
+                state,
+                &None,
+                &mut pyany_serde_option,
+            )?;
+            let expected_bytes =
+                &bytemuck::cast_slice::<u64, u8>(&expected_words[..])[..expected_len];
+            let rebuilt_bytes = decoder.apply(&buf[..end])?;
+            assert_eq!(rebuilt_bytes, expected_bytes);
+            // Serializing the rebuilt state again gives the same bytes, which also holds for numpy states
+            let (rebuilt_state, _, _) =
+                retrieve_python(py, rebuilt_bytes, 0, &None, &mut pyany_serde_option)?;
+            let (reserialized_len, _) = append_python(
+                bytemuck::cast_slice_mut::<u64, u8>(&mut reserialized_words[..]),
+                0,
+                &rebuilt_state,
+                &None,
+                &mut pyany_serde_option,
+            )?;
+            assert_eq!(
+                &bytemuck::cast_slice::<u64, u8>(&reserialized_words[..])[..reserialized_len],
+                expected_bytes
+            );
+        }
+        Ok(keyframe_list)
+    }
+
+    fn get_tuple_serde() -> Serde {
+        Serde::TUPLE {
+            items: vec![
+                Serde::LIST {
+                    items: Box::new(Serde::FLOAT),
+                },
+                Serde::INT,
+                Serde::STRING,
+            ],
+        }
+    }
+
+    #[test]
+    fn test_deltas_rebuild_states() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let states = py
+                .eval(
+                    c_str!("[([float(i == step) for i in range(64)], step, 'abc') for step in range(8)]"),
+                    None,
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let keyframe_list = send_states(py, get_tuple_serde(), 100, &states)?;
+            assert_eq!(
+                keyframe_list,
+                vec![true, false, false, false, false, false, false, false]
+            );
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_keyframe_interval() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let states = py
+                .eval(
+                    c_str!("[([float(i == step) for i in range(64)], step, 'abc') for step in range(7)]"),
+                    None,
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let keyframe_list = send_states(py, get_tuple_serde(), 3, &states)?;
+            assert_eq!(
+                keyframe_list,
+                vec![true, false, false, true, false, false, true]
+            );
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_keyframe_when_length_changes() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let states = py
+                .eval(
+                    c_str!("[([0.0] * 64, 0, label) for label in ['a', 'a', 'ab', 'ab', 'a']]"),
+                    None,
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let keyframe_list = send_states(py, get_tuple_serde(), 100, &states)?;
+            assert_eq!(keyframe_list, vec![true, false, true, false, true]);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_deltas_rebuild_numpy_states() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let numpy = py.import("numpy")?;
+            let states = py
+                .eval(
+                    c_str!("[numpy.where(numpy.arange(256) == step, -1.0, numpy.arange(256)).astype(numpy.float32) for step in range(5)]"),
+                    Some(&[("numpy", numpy)].into_py_dict(py)?),
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let keyframe_list = send_states(
+                py,
+                Serde::NUMPY {
+                    dtype: NumpyDtype::FLOAT32,
+                },
+                100,
+                &states,
+            )?;
+            assert_eq!(keyframe_list, vec![true, false, false, false, false]);
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_delta_before_keyframe_is_rejected() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let states = py
+                .eval(
+                    c_str!("[([0.0] * 64, step, 'abc') for step in range(2)]"),
+                    None,
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let mut encoder = StateDeltaEncoder::new(100, BUFFER_SIZE);
+            let mut pyany_serde_option = Some(get_pyany_serde(get_tuple_serde())?);
+            let mut buf = vec![0_u8; BUFFER_SIZE + 64];
+            encoder.append(&mut buf[..], 0, &states[0], &None, &mut pyany_serde_option)?;
+            encoder.commit();
+            let end =
+                encoder.append(&mut buf[..], 0, &states[1], &None, &mut pyany_serde_option)?;
+            assert_eq!(buf[0], 0);
+            assert!(StateDeltaDecoder::new().apply(&buf[..end]).is_err());
+            Ok(())
+        })
+    }
+
+    #[test]
+    fn test_append_can_be_retried_after_growing() -> PyResult<()> {
+        Python::with_gil(|py| {
+            let states = py
+                .eval(
+                    c_str!("[([float(i == step) for i in range(64)], step, 'abc') for step in range(2)]"),
+                    None,
+                    None,
+                )?
+                .extract::<Vec<Bound<'_, PyAny>>>()?;
+            let mut encoder = StateDeltaEncoder::new(100, 64);
+            let mut decoder = StateDeltaDecoder::new();
+            let mut pyany_serde_option = Some(get_pyany_serde(get_tuple_serde())?);
+            let mut buf = vec![0_u8; BUFFER_SIZE];
+            // The state doesn't fit in the buffers of the encoder
+            let err = encoder
+                .append(&mut buf[..], 0, &states[0], &None, &mut pyany_serde_option)
+                .unwrap_err();
+            assert!(is_buffer_overflow(py, &err));
+            encoder.grow(BUFFER_SIZE);
+            let end =
+                encoder.append(&mut buf[..], 0, &states[0], &None, &mut pyany_serde_option)?;
+            encoder.commit();
+            decoder.apply(&buf[..end])?;
+            // The delta doesn't fit in the response buffer, and is appended again to a larger one
+            assert!(encoder
+                .append(&mut buf[..8], 0, &states[1], &None, &mut pyany_serde_option)
+                .is_err());
+            let end =
+                encoder.append(&mut buf[..], 0, &states[1], &None, &mut pyany_serde_option)?;
+            encoder.commit();
+            // Retrying sends a delta from the first state, which was committed, rather than from the failed append
+            assert_eq!(buf[0], 0);
+            let mut expected_words = vec![0_u64; BUFFER_SIZE / 8];
+            let (expected_len, _) = append_python(
+                bytemuck::cast_slice_mut::<u64, u8>(&mut expected_words[..]),
+                0,
+                &states[1],
+                &None,
+                &mut pyany_serde_option,
+            )?;
+            assert_eq!(
+                decoder.apply(&buf[..end])?,
+                &bytemuck::cast_slice::<u64, u8>(&expected_words[..])[..expected_len]
+            );
+            Ok(())
+        })
+    }
+}